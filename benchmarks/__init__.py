@@ -0,0 +1,12 @@
+"""Performance benchmarks for GeoSnap.
+
+Generate a synthetic corpus once, then time the core operations on it::
+
+    python -m benchmarks.corpus /tmp/geosnap-corpus --count 100000
+    python -m benchmarks.run /tmp/geosnap-corpus --out before.json
+    python -m benchmarks.run /tmp/geosnap-corpus --out after.json --compare before.json
+
+Start-up time of the PyQt6 front-ends (eager vs lazy optional imports)::
+
+    python -m benchmarks.startup --out startup.json
+"""
@@ -0,0 +1,208 @@
+"""Reproducible synthetic corpus of geotagged photos.
+
+Every file is generated from ``random.Random(seed * 1_000_003 + index)``, so
+the same seed always gives the same names, pixels and EXIF (make/model, lens,
+DateTimeOriginal/Digitized, ISO, exposure and GPS for most files) whatever
+the number of workers. Files go into folders of ``FOLDER_SIZE`` so that the
+first N files of the manifest are also whole folders for the folder-scan
+benchmark. ``manifest.json`` records what was written to each file.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from geosnap.exif import gps_from_tags, read_tags
+from geosnap.exifwrite import zero_exif_base
+from geosnap.pool import default_workers, imap_bounded
+
+try:
+    from PIL import Image, ImageDraw
+    from PIL.TiffImagePlugin import IFDRational
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+    HEIF_AVAILABLE = True
+except ImportError:
+    HEIF_AVAILABLE = False
+
+FOLDER_SIZE = 500
+MANIFEST = 'manifest.json'
+
+# make, model, lens, file name prefix
+CAMERAS = [
+    ('SONY', 'ILCE-7M3', 'FE 24-70mm F2.8 GM', 'DSC'),
+    ('Canon', 'Canon EOS R5', 'RF24-105mm F4 L IS USM', 'IMG_'),
+    ('Apple', 'iPhone 14 Pro', 'iPhone 14 Pro back triple camera 6.86mm f/1.78', 'IMG_'),
+    ('FUJIFILM', 'X-T4', 'XF16-55mmF2.8 R LM WR', 'DSCF'),
+    ('NIKON CORPORATION', 'NIKON Z 6_2', 'NIKKOR Z 24-70mm f/4 S', 'DSC_'),
+    ('Google', 'Pixel 7', '', 'PXL_'),
+]
+# Photos cluster around a few trips
+PLACES = [(10.7769, 106.7009), (21.0285, 105.8542), (16.0544, 108.2022),
+          (48.8566, 2.3522), (35.6762, 139.6503), (40.7128, -74.0060)]
+ISOS = (100, 200, 400, 800, 1600, 3200, 6400)
+EXPOSURES = ((1, 4000), (1, 1000), (1, 250), (1, 60), (1, 15), (1, 2))
+START = 1420070400   # 2015-01-01
+SPAN = 10 * 365 * 86400
+
+
+def _dms(value):
+    value = abs(value)
+    d = int(value)
+    m = int((value - d) * 60)
+    s = (value - d - m / 60) * 3600
+    return IFDRational(d, 1), IFDRational(m, 1), IFDRational(int(s * 1000), 1000)
+
+
+def describe(index, seed, formats, max_side):
+    """What file number index of the corpus contains"""
+    r = random.Random(seed * 1_000_003 + index)
+    make, model, lens, prefix = r.choice(CAMERAS)
+    ext = r.choices(formats, weights=[8 if f == 'jpg' else 1 for f in formats])[0]
+    taken = START + r.randrange(SPAN)
+    rec = {
+        'path': os.path.join(f"{index // FOLDER_SIZE:04d}", f"{prefix}{index:06d}.{ext}"),
+        'make': make, 'model': model, 'lens': lens,
+        'taken': time.strftime('%Y:%m:%d %H:%M:%S', time.gmtime(taken)),
+        'iso': r.choice(ISOS), 'exposure': r.choice(EXPOSURES),
+        'width': r.randint(64, max_side), 'height': r.randint(64, max_side),
+        'color': [r.randrange(256) for _ in range(3)],
+        'shapes': r.randint(1, 6),
+    }
+    if r.random() < 0.8:
+        lat, lon = r.choice(PLACES)
+        rec['lat'] = round(lat + r.gauss(0, 0.05), 6)
+        rec['lon'] = round(lon + r.gauss(0, 0.05), 6)
+        rec['alt'] = round(r.uniform(0, 300), 1)
+    return rec
+
+
+def _exif(rec):
+    ex = Image.Exif()
+    ex[0x010F] = rec['make']
+    ex[0x0110] = rec['model']
+    exif_ifd = {
+        0x9003: rec['taken'], 0x9004: rec['taken'],
+        0x8827: rec['iso'], 0x829A: IFDRational(*rec['exposure']),
+    }
+    if rec['lens']:
+        exif_ifd[0xA434] = rec['lens']
+    ex[0x8769] = exif_ifd
+    if 'lat' in rec:
+        ex[0x8825] = {
+            1: 'N' if rec['lat'] >= 0 else 'S', 2: _dms(rec['lat']),
+            3: 'E' if rec['lon'] >= 0 else 'W', 4: _dms(rec['lon']),
+            5: b'\x00', 6: IFDRational(int(rec['alt'] * 10), 10),
+        }
+    return ex
+
+
+def _write(job):
+    """Worker entry point: render and save one file"""
+    root, rec = job
+    path = os.path.join(root, rec['path'])
+    r = random.Random(rec['path'])
+    img = Image.new('RGB', (rec['width'], rec['height']), tuple(rec['color']))
+    draw = ImageDraw.Draw(img)
+    for _ in range(rec['shapes']):
+        x, y = r.randrange(rec['width']), r.randrange(rec['height'])
+        draw.rectangle([x, y, x + r.randint(8, 64), y + r.randint(8, 64)],
+                       fill=tuple(r.randrange(256) for _ in range(3)))
+    ext = os.path.splitext(path)[1]
+    if ext == '.jpg':
+        img.save(path, quality=85, exif=_exif(rec))
+    elif ext == '.png':
+        img.save(path, exif=_exif(rec))
+    else:
+        out = io.BytesIO()
+        img.save(out, format='HEIF', quality=60, exif=_exif(rec).tobytes())
+        with open(path, 'wb') as f:
+            f.write(zero_exif_base(bytearray(out.getvalue())))
+    return path
+
+
+def check(root, records):
+    """Raise RuntimeError unless a geotagged file of every format reads back
+    with the make and position of its manifest entry"""
+    samples = {}
+    for rec in records:
+        if 'lat' in rec:
+            samples.setdefault(os.path.splitext(rec['path'])[1], rec)
+    for rec in samples.values():
+        path = os.path.join(root, rec['path'])
+        try:
+            tags = read_tags(path)
+        except Exception as e:
+            raise RuntimeError(f"{path}: EXIF cannot be read back ({type(e).__name__}: {e})")
+        gps = gps_from_tags(tags)
+        if str(tags.get('Image Make')) != rec['make'] or not gps or abs(gps['lat'] - rec['lat']) > 1e-4:
+            raise RuntimeError(f"{path}: EXIF read back does not match the manifest")
+
+
+def load_manifest(root):
+    with open(os.path.join(root, MANIFEST), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def generate(root, count, seed=0, formats=('jpg', 'png', 'heic'), max_side=320, workers=None,
+             progress=None):
+    """Write (or reuse) a corpus of count files under root; returns the manifest"""
+    if not PIL_AVAILABLE:
+        raise RuntimeError("Pillow is required to generate the corpus")
+    formats = tuple(f for f in formats if f != 'heic' or HEIF_AVAILABLE)
+    settings = {'seed': seed, 'formats': list(formats), 'max_side': max_side}
+    try:
+        manifest = load_manifest(root)
+        if manifest['settings'] == settings and len(manifest['files']) >= count:
+            check(root, manifest['files'][:count])
+            return manifest
+    except (OSError, ValueError, KeyError):
+        pass   # missing or different: write it again
+    except RuntimeError as e:
+        print(f"Stale corpus in {root}, writing it again: {e}", flush=True)
+
+    records = [describe(i, seed, formats, max_side) for i in range(count)]
+    for folder in sorted({os.path.dirname(rec['path']) for rec in records}):
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+    workers = workers or default_workers()
+    with ProcessPoolExecutor(workers) as pool:
+        jobs = ((root, rec) for rec in records)
+        for done, _ in enumerate(imap_bounded(pool, _write, jobs, workers), 1):
+            if progress and done % 1000 == 0:
+                progress(done, count)
+    check(root, records)
+
+    manifest = {'settings': settings, 'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'files': records}
+    with open(os.path.join(root, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic geotagged photo corpus")
+    parser.add_argument('root')
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--formats', default='jpg,png,heic')
+    parser.add_argument('--max-side', type=int, default=320)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    manifest = generate(args.root, args.count, args.seed, tuple(args.formats.split(',')),
+                        args.max_side, args.workers,
+                        progress=lambda done, total: print(f"{done}/{total}", flush=True))
+    print(f"{len(manifest['files'])} files in {args.root} "
+          f"({time.perf_counter() - started:.1f}s, formats: {', '.join(manifest['settings']['formats'])})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""Time GeoSnap's core operations on a synthetic corpus and write JSON.
+
+Each operation runs at every scale (the first N files of the corpus) and is
+repeated; the best and median wall times are reported. Per-file operations
+that touch the disk or decode images (EXIF, GPS, image load, map) run on at
+most ``SAMPLE[op]`` files per scale unless ``--full`` is given, and report
+the per-item time so that scales stay comparable. Table-level operations
+(sort, filter, search) run on a ``MetadataTable`` filled from the corpus
+manifest, so they measure the engines and not EXIF parsing.
+
+``--compare old.json`` prints the ratio new/old for every (op, scale).
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.corpus import FOLDER_SIZE, generate
+from geosnap.exif import read_exif, read_gps
+from geosnap.facets import FacetIndex
+from geosnap.fileattrs import scan_folder
+from geosnap.maps import FOLIUM_AVAILABLE, route_map
+from geosnap.metadata import HAS_EXIF, NUMPY_AVAILABLE, MetadataTable, mask_not, parse_exif_datetime
+from geosnap.query import Query, QueryEngine
+from geosnap.sorting import SORT_MODES, Sorter
+
+SCALES = (1000, 10000, 100000)
+SAMPLE = {'exif': 2000, 'gps': 2000, 'load': 200, 'map': 5000}
+QUERIES = {
+    'has_gps': 'has:gps',
+    'no_gps': '-has:gps',
+    'camera': 'camera:sony',
+    'date': 'date:2019..2020',
+    'combined': 'has:gps iso>=1600 -ext:png',
+}
+KEYSTROKES = 'dsc_01'
+VIEWPORT = (1280, 800)
+
+
+def timed(func, repeat):
+    """(result of the last run, [seconds per run])"""
+    runs = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        runs.append(time.perf_counter() - started)
+    return result, runs
+
+
+def record_of(rec):
+    """MetadataTable record for a manifest entry (what record_from_tags would give)"""
+    taken = parse_exif_datetime(rec['taken'])
+    out = {
+        'camera': f"{rec['make']} {rec['model']}", 'lens': rec['lens'],
+        'taken': taken, 'digitized': taken, 'iso': rec['iso'],
+        'exposure': rec['exposure'][0] / rec['exposure'][1],
+    }
+    if 'lat' in rec:
+        out.update(lat=rec['lat'], lon=rec['lon'], alt=rec['alt'])
+    return out
+
+
+def build_table(root, records):
+    """MetadataTable of the records, with real file stats"""
+    table = MetadataTable()
+    paths = []
+    for rec in records:
+        path = os.path.join(root, rec['path'])
+        row = table.add(path)
+        table.loaded[row] |= HAS_EXIF
+        table.set(row, record_of(rec))
+        paths.append(path)
+    table.load_stat(paths)
+    return table
+
+
+class Bench:
+    def __init__(self, root, manifest, repeat, full, only):
+        self.root = root
+        self.manifest = manifest
+        self.repeat = repeat
+        self.full = full
+        self.only = only
+        self.results = []
+
+    def wanted(self, op):
+        return not self.only or any(op == o or op.startswith(o + ':') for o in self.only)
+
+    def sample(self, op, paths):
+        return paths if self.full else paths[:SAMPLE[op]]
+
+    def add(self, op, scale, items, runs, **extra):
+        best = min(runs)
+        entry = {'op': op, 'scale': scale, 'items': items, 'best_s': round(best, 6),
+                 'median_s': round(statistics.median(runs), 6),
+                 'per_item_us': round(best / items * 1e6, 3) if items else None}
+        entry.update(extra)
+        self.results.append(entry)
+        print(f"{op:<24} {scale:>7} {items:>7} items  best {best * 1000:10.2f} ms"
+              + (f"  {entry['per_item_us']:9.1f} us/item" if items else ""), flush=True)
+
+    def run_scale(self, scale):
+        records = self.manifest['files'][:scale]
+        paths = [os.path.join(self.root, rec['path']) for rec in records]
+
+        if self.wanted('scan'):
+            folders = sorted({os.path.join(self.root, os.path.dirname(rec['path'])) for rec in records})
+            found, runs = timed(lambda: sum(1 for f in folders for _ in scan_folder(f)), self.repeat)
+            self.add('scan', scale, found, runs)
+
+        if self.wanted('exif'):
+            todo = self.sample('exif', paths)
+            tags, runs = timed(lambda: [read_exif(p) for p in todo], 1)
+            self.add('exif', scale, len(todo), runs, parsed=sum(1 for t in tags if t))
+
+        if self.wanted('gps'):
+            todo = self.sample('gps', paths)
+            gps, runs = timed(lambda: [read_gps(p) for p in todo], 1)
+            self.add('gps', scale, len(todo), runs, geotagged=sum(1 for g in gps if g))
+
+        if self.wanted('load'):
+            self.bench_load(scale, self.sample('load', paths))
+
+        table, runs = timed(lambda: build_table(self.root, records), 1)
+        if self.wanted('ingest'):
+            self.add('ingest', scale, scale, runs)
+
+        for mode in SORT_MODES:
+            if self.wanted(f'sort:{mode}'):
+                # A fresh Sorter each run: the permutation cache would hide the work
+                _, runs = timed(lambda: Sorter(table).sort(paths, mode), self.repeat)
+                self.add(f'sort:{mode}', scale, scale, runs)
+
+        if self.wanted('filter:gps_mask'):
+            _, runs = timed(lambda: (table.select(paths, table.mask_has_gps()),
+                                     table.select(paths, mask_not(table.mask_has_gps()))), self.repeat)
+            self.add('filter:gps_mask', scale, scale, runs)
+        if self.wanted('filter:facets'):
+            facets, runs = timed(lambda: FacetIndex(table), 1)
+            self.add('facets:build', scale, scale, runs)
+            camera = max(facets.totals['camera'], key=facets.totals['camera'].get)
+            _, runs = timed(lambda: table.select(paths, facets.mask({'camera': {camera}})), self.repeat)
+            self.add('filter:facets', scale, scale, runs)
+            facets.detach()
+        for name, text in QUERIES.items():
+            if self.wanted(f'filter:{name}'):
+                query = Query(text)
+                hits, runs = timed(lambda: query.execute(table, paths), self.repeat)
+                self.add(f'filter:{name}', scale, scale, runs, matches=len(hits))
+
+        if self.wanted('search'):
+            self.bench_search(scale, table, paths)
+
+        if self.wanted('map'):
+            if FOLIUM_AVAILABLE:
+                points = [(os.path.join(self.root, rec['path']),
+                           {'lat': rec['lat'], 'lon': rec['lon'], 'alt': f"{rec['alt']:.1f} m",
+                            'time': rec['taken']})
+                          for rec in records if 'lat' in rec]
+                points = self.sample('map', points)
+                _, runs = timed(lambda: route_map(points).get_root().render(), 1)
+                self.add('map', scale, len(points), runs)
+            else:
+                print("map: skipped (folium is not installed)")
+
+    def bench_search(self, scale, table, paths):
+        """Type KEYSTROKES one character at a time, like the debounced search box"""
+        index = QueryEngine(table).index
+        _, index_runs = timed(index.build, 1)
+        self.add('search:index', scale, scale, index_runs)
+
+        def typing():
+            engine = QueryEngine(table)
+            engine.index = index
+            times = []
+            for i in range(1, len(KEYSTROKES) + 1):
+                started = time.perf_counter()
+                engine.run(KEYSTROKES[:i], paths)
+                times.append(time.perf_counter() - started)
+            return times
+
+        per_key, runs = timed(typing, self.repeat)
+        self.add('search:keystrokes', scale, len(KEYSTROKES), runs,
+                 worst_keystroke_ms=round(max(per_key) * 1000, 3))
+
+    def bench_load(self, scale, todo):
+        """Decode and fit photos with the viewer widget of the PyQt6 front-end"""
+        try:
+            os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+            from PyQt6.QtWidgets import QApplication
+            import gps_photo_viewer_pyqt6_Fix as app_module
+        except ImportError as e:
+            print(f"load: skipped ({e})")
+            return
+        self.qt_app = QApplication.instance() or QApplication([])
+        viewer = app_module.ImageViewer()
+        viewer.resize(*VIEWPORT)
+        loaded, runs = timed(lambda: sum(1 for p in todo if viewer.load_image(p)), 1)
+        self.add('load', scale, len(todo), runs, loaded=loaded)
+
+
+def git_revision():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, old_path):
+    with open(old_path, encoding='utf-8') as f:
+        old = {(r['op'], r['scale']): r for r in json.load(f)['results']}
+    print(f"\n{'op':<24} {'scale':>7} {'old ms':>10} {'new ms':>10} {'new/old':>8}")
+    for r in results:
+        before = old.get((r['op'], r['scale']))
+        if not before or not before['best_s']:
+            continue
+        # Per-item times when the sample sizes differ between the runs
+        if before['items'] != r['items'] and before.get('per_item_us') and r.get('per_item_us'):
+            ratio = r['per_item_us'] / before['per_item_us']
+        else:
+            ratio = r['best_s'] / before['best_s']
+        flag = '  slower' if ratio > 1.1 else ('  faster' if ratio < 0.9 else '')
+        print(f"{r['op']:<24} {r['scale']:>7} {before['best_s'] * 1000:10.2f} "
+              f"{r['best_s'] * 1000:10.2f} {ratio:8.2f}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark GeoSnap on a synthetic corpus")
+    parser.add_argument('corpus', help="corpus directory (generated when missing)")
+    parser.add_argument('--scales', default=','.join(map(str, SCALES)))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--full', action='store_true', help="no sampling of per-file operations")
+    parser.add_argument('--only', default='', help="comma-separated ops, e.g. sort,search,filter:camera")
+    parser.add_argument('--out', default='benchmark.json')
+    parser.add_argument('--compare', help="earlier results to compare against")
+    args = parser.parse_args(argv)
+
+    scales = sorted(int(s) for s in args.scales.split(','))
+    # Reuses a corpus with the same settings once a sample of it reads back
+    manifest = generate(args.corpus, scales[-1], seed=args.seed,
+                        progress=lambda done, count: print(f"Generated {done}/{count} files", flush=True))
+
+    bench = Bench(args.corpus, manifest, args.repeat, args.full,
+                  [o for o in args.only.split(',') if o])
+    for scale in scales:
+        bench.run_scale(scale)
+
+    report = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'git': git_revision(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'numpy': NUMPY_AVAILABLE,
+        'corpus': dict(manifest['settings'], files=len(manifest['files']), folder_size=FOLDER_SIZE),
+        'repeat': args.repeat,
+        'results': bench.results,
+    }
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    print(f"Results written to {args.out}")
+    if args.compare:
+        compare(bench.results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Time-to-window of the PyQt6 front-ends, with optional modules eager vs lazy.
+
+Every run is a fresh interpreter (``python -m benchmarks.startup --child``)
+under ``QT_QPA_PLATFORM=offscreen``. The child records when its main window
+first paints. The reported times are measured from the moment the parent
+spawns the process:
+
+    import   the front-end module imported
+    window   GeoSnap() constructed
+    paint    first Paint event of the window (time-to-window)
+
+``eager`` imports folium, geopy, pillow_heif (registering the HEIF opener)
+and exifread before the front-end, as every front-end did at import time
+before ``geosnap.lazy``; ``lazy`` is the current start-up. The Tk front-end
+needs a display and is not covered.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APPS = {'fix': 'gps_photo_viewer_pyqt6_Fix', 'v70': 'gps_photo_viewer_pyqt6_v70'}
+MODES = ('eager', 'lazy')
+HEAVY = ('folium', 'geopy', 'pillow_heif', 'exifread', 'jinja2', 'branca', 'requests')
+
+
+def child(app, mode, spawned):
+    """Start one front-end, print a JSON line of millisecond timestamps since spawned"""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    os.environ['GEOSNAP_WARM_IMPORTS'] = '0'
+    if mode == 'eager':
+        from geosnap.lazy import CAPABILITIES
+        for cap in CAPABILITIES:
+            cap.load()
+
+    import importlib
+    module = importlib.import_module(APPS[app])
+    imported = time.time()
+
+    from PyQt6.QtCore import QEvent, QObject, QSettings
+    from PyQt6.QtWidgets import QApplication
+
+    class FirstPaint(QObject):
+        at = None
+
+        def eventFilter(self, obj, event):
+            if self.at is None and event.type() == QEvent.Type.Paint:
+                self.at = time.time()
+            return False
+
+    qt_app = QApplication.instance() or QApplication([])
+    # Saved settings (last folder, theme...) would change what startup does
+    for fmt in (QSettings.Format.NativeFormat, QSettings.Format.IniFormat):
+        QSettings.setPath(fmt, QSettings.Scope.UserScope, os.environ['GEOSNAP_HOME'])
+    probe = FirstPaint()
+    window = module.GeoSnap()
+    built = time.time()
+    window.installEventFilter(probe)
+    window.show()
+    deadline = time.time() + 30
+    while probe.at is None and time.time() < deadline:
+        qt_app.processEvents()
+    print(json.dumps({
+        'import_ms': (imported - spawned) * 1000,
+        'window_ms': (built - spawned) * 1000,
+        'paint_ms': ((probe.at or time.time()) - spawned) * 1000,
+        'heavy_loaded': [m for m in HEAVY if m in sys.modules],
+    }), flush=True)
+    window.close()
+
+
+def run_once(app, mode, env):
+    spawned = time.time()
+    out = subprocess.run([sys.executable, '-m', 'benchmarks.startup', '--child', app, mode, repr(spawned)],
+                         capture_output=True, text=True, env=env,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    for line in reversed(out.stdout.splitlines()):
+        if line.startswith('{'):
+            return json.loads(line)
+    raise RuntimeError(f"{app}/{mode} did not report:\n{out.stderr[-2000:]}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure GeoSnap time-to-window")
+    parser.add_argument('--apps', default='fix,v70')
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--out', default='startup.json')
+    parser.add_argument('--compare', help="earlier results to compare against")
+    parser.add_argument('--home', help="settings and index dir (default: a new temporary one, never GEOSNAP_HOME)")
+    parser.add_argument('--child', nargs=3, metavar=('APP', 'MODE', 'SPAWNED'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        app, mode, spawned = args.child
+        child(app, mode, float(spawned))
+        return
+
+    from benchmarks.run import compare, git_revision
+
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen',
+               GEOSNAP_HOME=args.home or tempfile.mkdtemp(prefix='geosnap-bench-'))
+    results = []
+    for app in args.apps.split(','):
+        for mode in args.modes.split(','):
+            run_once(app, mode, env)   # warm the OS file cache
+            runs = [run_once(app, mode, env) for _ in range(args.repeat)]
+            paint = [r['paint_ms'] / 1000 for r in runs]
+            entry = {'op': f'startup:{app}:{mode}', 'scale': 0, 'items': 1,
+                     'best_s': round(min(paint), 6), 'median_s': round(statistics.median(paint), 6),
+                     'per_item_us': None,
+                     'import_ms': round(statistics.median(r['import_ms'] for r in runs), 1),
+                     'window_ms': round(statistics.median(r['window_ms'] for r in runs), 1),
+                     'heavy_loaded': runs[-1]['heavy_loaded']}
+            results.append(entry)
+            print(f"{app:<4} {mode:<6} import {entry['import_ms']:7.1f} ms  window {entry['window_ms']:7.1f} ms"
+                  f"  paint {entry['median_s'] * 1000:7.1f} ms (best {entry['best_s'] * 1000:.1f})"
+                  f"  loaded: {', '.join(entry['heavy_loaded']) or '-'}", flush=True)
+
+    report = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'git': git_revision(),
+        'python': sys.version.split()[0],
+        'repeat': args.repeat,
+        'results': results,
+    }
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    print(f"Results written to {args.out}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
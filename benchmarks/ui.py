@@ -0,0 +1,289 @@
+"""Event-to-paint latency of scripted interactions with a real GeoSnap window.
+
+The PyQt6 front-end runs under ``QT_QPA_PLATFORM=offscreen``. An application
+event filter records the first Paint event of the widget that shows each
+interaction's result, and the latency is measured from just before the
+input event is sent to that paint:
+
+    load      open the corpus folder            -> file list painted with every photo
+    next      Right arrow (``--presses`` times) -> photo viewer painted
+    type      one character in the search box   -> search box (echo) and file list (results)
+    sort      next entry of ``sort_combo``      -> file list painted
+    filter    "Có GPS" button, then reset       -> file list painted
+    relist    refill the list with every photo  -> file list painted
+    theme     toggle light/dark theme           -> window painted
+
+``type_results`` includes the search box's debounce delay, which is part of
+what the user waits for. Address lookups go to an offline gazetteer of the
+corpus cities, so nothing touches the network. Results (p50/p95/p99 per
+interaction) go to JSON in the same layout as ``benchmarks.run``, and
+``--compare`` reports p95 ratios.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt6.QtCore import QEvent, QObject, QSettings, Qt  # noqa: E402
+from PyQt6.QtTest import QTest  # noqa: E402
+from PyQt6.QtWidgets import QApplication, QWidget  # noqa: E402
+
+from benchmarks.corpus import PLACES, generate  # noqa: E402
+from benchmarks.run import git_revision  # noqa: E402
+
+QUERY = 'dsc_01'
+TIMEOUT = 10.0
+WINDOW_SIZE = (1400, 900)
+PLACE_NAMES = ('Ho Chi Minh City', 'Hanoi', 'Da Nang', 'Paris', 'Tokyo', 'New York')
+
+
+class PaintProbe(QObject):
+    """Application event filter: when did each watched widget first paint?"""
+
+    def __init__(self):
+        super().__init__()
+        self.targets = {}
+        self.first = {}
+
+    def watch(self, **targets):
+        self.targets = targets
+        self.first = {}
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Paint and self.targets and isinstance(obj, QWidget):
+            now = time.perf_counter()
+            for name, widget in self.targets.items():
+                if name not in self.first and (obj is widget or widget.isAncestorOf(obj)):
+                    self.first[name] = now
+        return False
+
+
+def percentile(values, q):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+class UIBench:
+    def __init__(self, window, app):
+        self.w = window
+        self.app = app
+        self.probe = PaintProbe()
+        app.installEventFilter(self.probe)
+        self.samples = {}
+        self.timeouts = {}
+
+    def pump(self, seconds):
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            self.app.processEvents()
+            time.sleep(0.001)
+
+    def wait_until(self, condition, timeout=TIMEOUT):
+        end = time.perf_counter() + timeout
+        while not condition():
+            if time.perf_counter() > end:
+                return False
+            self.app.processEvents()
+            time.sleep(0.0005)
+        return True
+
+    def measure(self, action, timeout=TIMEOUT, **targets):
+        """Run action and record input-to-first-paint for each named target"""
+        self.probe.watch(**targets)
+        started = time.perf_counter()
+        action()
+        self.wait_until(lambda: len(self.probe.first) == len(targets), timeout)
+        for name in targets:
+            if name in self.probe.first:
+                self.samples.setdefault(name, []).append(self.probe.first[name] - started)
+            else:
+                self.timeouts[name] = self.timeouts.get(name, 0) + 1
+        self.probe.watch()
+
+    def settle(self, timeout=300):
+        """Let background indexing finish so every interaction sees a steady state"""
+        w = self.w
+
+        def busy():
+            return any(t and t.isRunning() for t in (w.metadata_indexer, w.stat_loader))
+        self.wait_until(lambda: not busy(), timeout)
+        self.pump(0.2)
+
+    # ---------- interactions ----------
+
+    def load(self, root, count):
+        w = self.w
+        listing = w.listbox.viewport()
+        started = time.perf_counter()
+        w.open_folder(root)
+        if not self.wait_until(lambda: len(w.display_list) >= count, 600):
+            self.timeouts['load'] = 1
+            return
+        # The list is filled: the next paint of the list shows it
+        self.probe.watch(load=listing)
+        listing.update()
+        self.wait_until(lambda: 'load' in self.probe.first)
+        self.samples['load'] = [self.probe.first.get('load', time.perf_counter()) - started]
+        self.probe.watch()
+
+    def next_photos(self, presses):
+        w = self.w
+        w.listbox.setCurrentRow(0)
+        self.pump(0.1)
+        for _ in range(presses):
+            if w.listbox.currentRow() >= len(w.display_list) - 1:
+                w.listbox.setCurrentRow(0)
+                self.pump(0.05)
+            self.measure(lambda: QTest.keyClick(w, Qt.Key.Key_Right), next=w.image_viewer)
+
+    def typing(self, rounds):
+        w = self.w
+        for _ in range(rounds):
+            w.search_box.clear()
+            self.pump(0.3)
+            for ch in QUERY:
+                self.measure(lambda: QTest.keyClick(w.search_box, ch),
+                             type_echo=w.search_box, type_results=w.listbox.viewport())
+        w.search_box.clear()
+        self.pump(0.3)
+
+    def sorting(self, rounds):
+        combo = self.w.sort_combo
+        for _ in range(rounds):
+            for _ in range(combo.count()):
+                index = (combo.currentIndex() + 1) % combo.count()
+                self.measure(lambda: combo.setCurrentIndex(index), sort=self.w.listbox.viewport())
+
+    def filtering(self, rounds):
+        w = self.w
+        for _ in range(rounds):
+            self.measure(lambda: w.gps_btn.click(), filter=w.listbox.viewport())
+            self.measure(w.clear_filter, filter=w.listbox.viewport())
+
+    def relist(self, rounds):
+        w = self.w
+        for _ in range(rounds):
+            self.measure(lambda: w.update_listbox(w.image_list), relist=w.listbox.viewport())
+
+    def theme(self, rounds):
+        for _ in range(rounds * 2):
+            self.measure(self.w.toggle_theme, theme=self.w)
+
+    def report(self):
+        results = []
+        for name, values in self.samples.items():
+            ms = [v * 1000 for v in values]
+            entry = {'interaction': name, 'n': len(ms),
+                     'p50_ms': round(percentile(ms, 50), 3), 'p95_ms': round(percentile(ms, 95), 3),
+                     'p99_ms': round(percentile(ms, 99), 3), 'max_ms': round(max(ms), 3),
+                     'timeouts': self.timeouts.get(name, 0)}
+            results.append(entry)
+            print(f"{name:<14} n={entry['n']:<5} p50 {entry['p50_ms']:9.2f} ms  p95 {entry['p95_ms']:9.2f} ms"
+                  f"  p99 {entry['p99_ms']:9.2f} ms  max {entry['max_ms']:9.2f} ms"
+                  + (f"  ({entry['timeouts']} timeouts)" if entry['timeouts'] else ""), flush=True)
+        for name, missed in self.timeouts.items():
+            if name not in self.samples:
+                results.append({'interaction': name, 'n': 0, 'timeouts': missed})
+                print(f"{name:<14} no paint within {TIMEOUT:.0f}s ({missed} timeouts)")
+        return results
+
+
+def write_gazetteer(root):
+    path = os.path.join(root, 'places.csv')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('lat,lon,name\n')
+        for (lat, lon), name in zip(PLACES, PLACE_NAMES):
+            f.write(f'{lat},{lon},{name}\n')
+    return path
+
+
+def compare(results, old_path):
+    with open(old_path, encoding='utf-8') as f:
+        old = {r['interaction']: r for r in json.load(f)['results']}
+    print(f"\n{'interaction':<14} {'old p95':>10} {'new p95':>10} {'new/old':>8}")
+    for r in results:
+        before = old.get(r['interaction'])
+        if not before or not before.get('p95_ms') or not r.get('p95_ms'):
+            continue
+        ratio = r['p95_ms'] / before['p95_ms']
+        flag = '  slower' if ratio > 1.1 else ('  faster' if ratio < 0.9 else '')
+        print(f"{r['interaction']:<14} {before['p95_ms']:10.2f} {r['p95_ms']:10.2f} {ratio:8.2f}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offscreen UI latency benchmark for GeoSnap")
+    parser.add_argument('corpus', help="corpus directory (generated when missing)")
+    parser.add_argument('--count', type=int, default=10000, help="photos to load")
+    parser.add_argument('--presses', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=5, help="repeats of typing/sort/filter/relist/theme")
+    parser.add_argument('--no-settle', action='store_true', help="do not wait for background indexing")
+    parser.add_argument('--out', default='ui-benchmark.json')
+    parser.add_argument('--compare', help="earlier results to compare against")
+    parser.add_argument('--home', help="settings and index dir (default: a new temporary one, never GEOSNAP_HOME)")
+    args = parser.parse_args(argv)
+
+    # Keep the benchmark's settings and indexes away from the user's data dir
+    os.environ['GEOSNAP_HOME'] = args.home or tempfile.mkdtemp(prefix='geosnap-bench-')
+    manifest = generate(args.corpus, args.count)
+    # Load exactly the first count files: one folder of hard links to them
+    root = os.path.join(args.corpus, f'ui-{args.count}')
+    if not os.path.isdir(root):
+        os.makedirs(root)
+        for rec in manifest['files'][:args.count]:
+            source = os.path.join(args.corpus, rec['path'])
+            target = os.path.join(root, os.path.basename(rec['path']))
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copyfile(source, target)
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    # GeoSnap opens QSettings("GeoSnap", "GeoSnap"): point the user scope there too
+    for fmt in (QSettings.Format.NativeFormat, QSettings.Format.IniFormat):
+        QSettings.setPath(fmt, QSettings.Scope.UserScope, os.environ['GEOSNAP_HOME'])
+    import gps_photo_viewer_pyqt6_Fix as app_module
+    from geosnap.geocoder import create_geocoder
+    window = app_module.GeoSnap()
+    window.geocoder = create_geocoder('offline', write_gazetteer(args.corpus))
+    window.resize(*WINDOW_SIZE)
+    window.show()
+
+    bench = UIBench(window, app)
+    bench.pump(0.2)
+    bench.load(root, args.count)
+    if not args.no_settle:
+        bench.settle()
+    bench.next_photos(args.presses)
+    bench.typing(args.rounds)
+    bench.sorting(args.rounds)
+    bench.filtering(args.rounds)
+    bench.relist(args.rounds)
+    bench.theme(args.rounds)
+    results = bench.report()
+    window.close()
+
+    report = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'git': git_revision(),
+        'python': sys.version.split()[0],
+        'qt_platform': QApplication.platformName(),
+        'photos': args.count,
+        'corpus': manifest['settings'],
+        'results': results,
+    }
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    print(f"Results written to {args.out}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+"""GUI-free building blocks shared by the GeoSnap front-ends."""
@@ -0,0 +1,7 @@
+import sys
+
+from .cli import main
+
+# Guarded: process-pool workers re-import the main module under spawn
+if __name__ == '__main__':
+    sys.exit(main())
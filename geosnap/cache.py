@@ -0,0 +1,289 @@
+"""Bounded in-memory caches for the engine and the front-ends.
+
+``Cache`` is a ``MutableMapping`` bounded by entry count, with an eviction
+policy (``'lru'`` or ``'lfu'``), an optional time-to-live and a byte cost per
+entry. It takes part in the memory budget (``nbytes``, ``shrink`` and
+``budget``, see memory.py) and counts hits, misses, evictions and
+expirations for the diagnostics panel.
+
+A lookup that is known to fail (an unreadable file, a geocoder error) can
+be cached as a ``Failed`` value. It is falsy, keeps its error, and lives
+only ``negative_ttl`` seconds, so a file that was still being copied is
+tried again later. ``get_or_load`` does this for loaders that raise.
+
+Every operation holds the cache's lock, so worker threads can share a
+cache with the UI thread. Byte costs are computed and the budget is
+enforced outside the lock, so caches never wait on each other.
+"""
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from .memory import object_nbytes
+
+POLICIES = ('lru', 'lfu')
+NEGATIVE_TTL = 60.0   # seconds a Failed entry is kept by default
+
+_MISSING = object()
+
+
+class Failed:
+    """A cached failure; falsy, with the error that caused it"""
+    __slots__ = ('error',)
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return f"Failed({self.error!r})"
+
+
+class _LRU:
+    """Recency order: the least recently used key is evicted first"""
+
+    def __init__(self):
+        self.order = OrderedDict()
+
+    def add(self, key):
+        self.order[key] = None
+
+    def touch(self, key):
+        self.order.move_to_end(key)
+
+    def remove(self, key):
+        del self.order[key]
+
+    def victim(self):
+        return next(iter(self.order))
+
+    def clear(self):
+        self.order.clear()
+
+
+class _LFU:
+    """Use counts in buckets: the least used key is evicted first, the oldest among equals"""
+
+    def __init__(self):
+        self.count = {}
+        self.buckets = {}   # use count -> OrderedDict of keys
+        self.min = 0
+
+    def add(self, key):
+        self.count[key] = 1
+        self.buckets.setdefault(1, OrderedDict())[key] = None
+        self.min = 1
+
+    def _unlink(self, key):
+        n = self.count[key]
+        bucket = self.buckets[n]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[n]
+        return n
+
+    def touch(self, key):
+        n = self._unlink(key)
+        if self.min == n and n not in self.buckets:
+            self.min = n + 1
+        self.count[key] = n + 1
+        self.buckets.setdefault(n + 1, OrderedDict())[key] = None
+
+    def remove(self, key):
+        self._unlink(key)
+        del self.count[key]
+
+    def victim(self):
+        if self.min not in self.buckets:
+            self.min = min(self.buckets)
+        return next(iter(self.buckets[self.min]))
+
+    def clear(self):
+        self.count.clear()
+        self.buckets.clear()
+        self.min = 0
+
+
+class CacheStats:
+    __slots__ = ('hits', 'misses', 'evictions', 'expirations', 'failures')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.hits = self.misses = self.evictions = self.expirations = self.failures = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Cache(MutableMapping):
+    def __init__(self, max_size=500, policy='lru', ttl=None, negative_ttl=NEGATIVE_TTL, sizeof=None):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown cache policy {policy!r} (expected one of {', '.join(POLICIES)})")
+        self.max_size = max_size
+        self.policy = policy
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.sizeof = sizeof or object_nbytes
+        self.stats = CacheStats()
+        self.nbytes = 0
+        self.budget = None   # set by MemoryBudget.register
+        self._entries = {}   # key -> (value, cost, expiry time or None)
+        self._order = _LFU() if policy == 'lfu' else _LRU()
+        self._lock = threading.RLock()
+
+    # ---------- internals (lock held) ----------
+
+    def _live(self, key):
+        """The entry for key, or None when absent or expired (then dropped)"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+            self._drop(key)
+            self.stats.expirations += 1
+            return None
+        return entry
+
+    def _drop(self, key):
+        _, cost, _ = self._entries.pop(key)
+        self._order.remove(key)
+        self.nbytes -= cost
+        return cost
+
+    def _evict(self):
+        self.stats.evictions += 1
+        return self._drop(self._order.victim())
+
+    def _expire(self):
+        now = time.monotonic()
+        stale = [key for key, (_, _, expiry) in self._entries.items() if expiry is not None and expiry <= now]
+        for key in stale:
+            self._drop(key)
+        self.stats.expirations += len(stale)
+
+    # ---------- mapping protocol ----------
+
+    def __getitem__(self, key):
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                self.stats.misses += 1
+                raise KeyError(key)
+            self._order.touch(key)
+            self.stats.hits += 1
+            return entry[0]
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            if self._live(key) is None:
+                raise KeyError(key)
+            self._drop(key)
+
+    def __contains__(self, key):
+        """Membership without touching the entry or the counters"""
+        with self._lock:
+            return self._live(key) is not None
+
+    def __iter__(self):
+        with self._lock:
+            self._expire()
+            return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                self.stats.misses += 1
+                return default
+            self._order.touch(key)
+            self.stats.hits += 1
+            return entry[0]
+
+    def peek(self, key, default=None):
+        """A value without counting a lookup or refreshing its place"""
+        with self._lock:
+            entry = self._live(key)
+            return default if entry is None else entry[0]
+
+    def pop(self, key, default=_MISSING):
+        """Remove and return a value, without counting a lookup"""
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                if default is _MISSING:
+                    raise KeyError(key)
+                return default
+            self._drop(key)
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._order.clear()
+            self.nbytes = 0
+
+    # ---------- cache operations ----------
+
+    def put(self, key, value, ttl=None):
+        """Store a value; ttl overrides the cache's (Failed values use negative_ttl)"""
+        cost = self.sizeof(value)
+        if ttl is None:
+            ttl = self.negative_ttl if isinstance(value, Failed) else self.ttl
+        expiry = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            elif len(self._entries) >= self.max_size:
+                self._expire()
+                while self._entries and len(self._entries) >= self.max_size:
+                    self._evict()
+            self._entries[key] = (value, cost, expiry)
+            self._order.add(key)
+            self.nbytes += cost
+        if self.budget and self.budget.used() > self.budget.limit:
+            self.budget.enforce()
+
+    def get_or_load(self, key, load, default=None, errors=(OSError,)):
+        """The cached value, else load(key) (cached); when load raises one of
+        errors the failure is cached and default returned, now and until it expires"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            try:
+                value = load(key)
+            except errors as e:
+                value = Failed(e)
+            self.put(key, value)
+        if isinstance(value, Failed):
+            with self._lock:
+                self.stats.failures += 1
+            return default
+        return value
+
+    def shrink(self, max_bytes):
+        """Drop expired entries, then evict until at most max_bytes remain; returns bytes freed"""
+        with self._lock:
+            before = self.nbytes
+            self._expire()
+            while self._entries and self.nbytes > max_bytes:
+                self._evict()
+            return before - self.nbytes
+
+    def report(self):
+        """Counters and size for the diagnostics panel"""
+        with self._lock:
+            return dict(self.stats.as_dict(), entries=len(self._entries), bytes=self.nbytes,
+                        hit_rate=self.stats.hit_rate, policy=self.policy)
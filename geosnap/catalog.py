@@ -0,0 +1,177 @@
+"""Library catalog in the shared index: bulk scans and streamed queries.
+
+``ScanJob`` walks folders with ``scan_folder``, parses the EXIF of new or
+changed files in a process pool and writes typed metadata rows to the
+``IndexStore`` as it goes. Only one chunk of paths and a bounded number of
+in-flight jobs are held at a time, so memory does not grow with the library.
+``tables()`` reads the catalog back in path order as ``MetadataTable``
+chunks, which ``query()``, the map and the exporters run over.
+"""
+import array
+import itertools
+import os
+import time
+
+from .exif import read_exif
+from .fileattrs import scan_folder
+from .metadata import (CATEGORICAL, COLUMNS, DEFAULTS, HAS_EXIF, HAS_STAT, NO_TIME, NP_TYPES, NUMPY_AVAILABLE,
+                       MetadataTable, np, record_from_tags)
+from .pool import imap_bounded, process_pool
+from .query import Query
+from .store import METADATA_COLUMNS, IndexStore
+
+CHUNK = 1000          # scanned files looked up and written together
+TABLE_CHUNK = 50000   # catalog rows per MetadataTable from tables()
+
+_POSITION = {name: i + 1 for i, name in enumerate(METADATA_COLUMNS)}   # in rows with the path first
+
+
+def _metadata_job(path):
+    """Worker entry point: path -> (path, typed record)"""
+    try:
+        return path, record_from_tags(read_exif(path))
+    except Exception as e:
+        print(f"Metadata error for {path}: {e}")
+        return path, {}
+
+
+def store_row(path, st, rec, scanned_at):
+    """IndexStore row for a file's stat_result and typed record"""
+    taken = rec.get('taken', NO_TIME)
+    digitized = rec.get('digitized', NO_TIME)
+    return (path, st.st_size, st.st_mtime, st.st_ctime, st.st_ino,
+            rec.get('lat'), rec.get('lon'), rec.get('alt'),
+            None if taken == NO_TIME else taken, None if digitized == NO_TIME else digitized,
+            rec.get('iso'), rec.get('exposure'), rec.get('camera', ''), rec.get('lens', ''), scanned_at)
+
+
+def record_of(values):
+    """Typed record (as record_from_tags gives it) from a stored row without its path"""
+    rec = {'camera': values[_POSITION['camera'] - 1], 'lens': values[_POSITION['lens'] - 1]}
+    for name in ('lat', 'lon', 'alt', 'iso', 'exposure'):
+        value = values[_POSITION[name] - 1]
+        if value is not None:
+            rec[name] = value
+    for name in ('taken', 'digitized'):
+        value = values[_POSITION[name] - 1]
+        rec[name] = NO_TIME if value is None else value
+    return rec
+
+
+def is_current(values, st):
+    """Does a stored row (without its path) still describe the file?"""
+    return values is not None and values[0] == st.st_size and values[1] == st.st_mtime
+
+
+def table_from_rows(rows):
+    """MetadataTable (stat'ed and parsed) over stored rows with the path first"""
+    columns = list(zip(*rows)) or [()] * (len(METADATA_COLUMNS) + 1)
+    cols, categories = {}, {}
+    for name, code in COLUMNS.items():
+        values = columns[_POSITION[name]]
+        if name in CATEGORICAL:
+            labels = list(dict.fromkeys(itertools.chain(('',), values)))
+            codes = dict(zip(labels, range(len(labels))))
+            cols[name] = array.array(code, map(codes.__getitem__, values))
+            categories[name] = labels
+            continue
+        if None in values:
+            if NUMPY_AVAILABLE and code in 'fd':
+                # NULL -> NaN in C
+                cols[name] = array.array(code, np.array(values, dtype=NP_TYPES[code]).tobytes())
+                continue
+            default = DEFAULTS[name]
+            values = [default if v is None else v for v in values]
+        cols[name] = array.array(code, values)
+    loaded = bytearray([HAS_STAT | HAS_EXIF]) * len(rows)
+    return MetadataTable.from_columns(columns[0], cols, loaded, categories)
+
+
+def tables(store, root=None, chunk=TABLE_CHUNK):
+    """Yield the catalog (under root) as MetadataTable chunks in path order"""
+    for rows in store.iter_photo_metadata(root, chunk):
+        yield table_from_rows(rows)
+
+
+def all_rows(table):
+    return np.arange(len(table)) if NUMPY_AVAILABLE else list(range(len(table)))
+
+
+def select(chunks, text=''):
+    """Yield the (table, rows) chunks narrowed to the photos matching a query"""
+    q = text if isinstance(text, Query) else Query(text or '')
+    for table, rows in chunks:
+        if q.terms:
+            rows = q.execute_rows(table, rows)
+        if len(rows):
+            yield table, rows
+
+
+def query(store, text='', root=None, chunk=TABLE_CHUNK):
+    """Yield (table, rows) per chunk for the photos matching a query (all when empty)"""
+    return select(((table, all_rows(table)) for table in tables(store, root, chunk)), text)
+
+
+def row_list(rows):
+    return rows.tolist() if NUMPY_AVAILABLE and not isinstance(rows, list) else list(rows)
+
+
+class ScanJob:
+    """Catalog every photo under some folders, parsing only new or changed files"""
+
+    def __init__(self, store_path=None, workers=None, should_stop=None, progress=None):
+        self.store_path = store_path
+        self.workers = workers or os.cpu_count() or 1
+        self.should_stop = should_stop or (lambda: False)
+        self.progress = progress or (lambda counts: None)
+        self.counts = {'files': 0, 'parsed': 0, 'unchanged': 0, 'pruned': 0}
+
+    def run(self, roots, prune=False):
+        """Yield (path, record) for every photo as it is catalogued
+
+        prune: also drop catalog entries under the roots that no longer exist.
+        """
+        started = time.time()
+        store = IndexStore(self.store_path)
+        try:
+            with process_pool(self.workers) as pool:
+                for root in roots:
+                    root = os.path.abspath(root)
+                    chunk = []
+                    for entry in scan_folder(root, should_stop=self.should_stop):
+                        chunk.append(entry)
+                        if len(chunk) >= CHUNK:
+                            yield from self._catalog(pool, store, chunk, started)
+                            chunk = []
+                    if chunk:
+                        yield from self._catalog(pool, store, chunk, started)
+                    if prune and not self.should_stop():
+                        self.counts['pruned'] += store.prune_photo_metadata(root, started)
+        finally:
+            store.close()
+
+    def _catalog(self, pool, store, entries, scanned_at):
+        stats = dict(entries)
+        known = store.photo_metadata(stats)
+        todo = []
+        unchanged = []
+        for path, st in entries:
+            if is_current(known.get(path), st):
+                unchanged.append(path)
+            else:
+                todo.append(path)
+        store.touch_photo_metadata(unchanged, scanned_at)
+        for path in unchanged:
+            yield path, record_of(known[path])
+
+        rows = []
+        for path, rec in imap_bounded(pool, _metadata_job, todo, self.workers, self.should_stop):
+            rows.append(store_row(path, stats[path], rec, scanned_at))
+            yield path, rec
+        store.put_photo_metadata(rows)
+
+        counts = self.counts
+        counts['files'] += len(unchanged) + len(rows)
+        counts['unchanged'] += len(unchanged)
+        counts['parsed'] += len(rows)
+        self.progress(counts)
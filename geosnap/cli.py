@@ -0,0 +1,238 @@
+"""Command line access to the library catalog, without any GUI.
+
+    python -m geosnap scan DIR [DIR ...] [--prune] [--workers N] [--list]
+    python -m geosnap query [EXPR] [--root DIR] [--format paths|FORMAT] [--count]
+    python -m geosnap map OUT.html [EXPR] [--root DIR] [--limit N]
+    python -m geosnap export OUT [EXPR] [--root DIR] [--format FORMAT]
+    python -m geosnap geotag TRACK [TRACK ...] [--where EXPR] [--zone H] [--drift S] [--dry-run]
+    python -m geosnap serve [--host HOST] [--port PORT] [--root DIR]
+
+FORMAT is csv, jsonl, geojson, gpx, kml, parquet or arrow (the last two need
+pyarrow); export takes it from OUT's extension by default.
+
+Everything goes through the shared ``IndexStore`` (``--db``, by default the
+desktop app's ``library.db``): ``scan`` parses EXIF in a process pool across
+all cores and writes as it goes, the other commands stream the catalog in
+chunks, so memory stays bounded on libraries of millions of files. EXPR is
+the search-box query language (``camera:sony has:gps date:2024``).
+
+``geotag`` places the catalogued photos matching ``--where`` (by default
+``no:gps``) on GPX/NMEA logs by capture time and writes the positions into
+the files in a process pool, updating the catalog as it goes. ``serve``
+exposes the catalog, thumbnails and files over HTTP (see ``geosnap.server``).
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from . import catalog
+from .export import WRITERS, export
+from .geotag import MAX_GAP, Track, TrackError
+from .maps import FOLIUM_AVAILABLE, route_map
+from .metadata import gps_of
+from .query import Query
+from .server import HOST, PORT, LibraryServer
+from .store import IndexStore
+from .writeback import WriteJob, track_edits
+
+
+def _query(args):
+    q = Query(args.expr or '')
+    for error in q.errors:
+        print(f"warning: {error}", file=sys.stderr)
+    return q
+
+
+def _progress(counts):
+    if sys.stderr.isatty():
+        print(f"\r{counts['files']} files, {counts['parsed']} parsed", end='', file=sys.stderr, flush=True)
+
+
+def cmd_scan(args):
+    job = catalog.ScanJob(args.db, workers=args.workers, progress=_progress)
+    started = time.perf_counter()
+    out = sys.stdout
+    for path, _ in job.run(args.dirs, prune=args.prune):
+        if args.list:
+            out.write(path + '\n')
+    counts = job.counts
+    elapsed = time.perf_counter() - started
+    if sys.stderr.isatty():
+        print(file=sys.stderr)
+    print(f"{counts['files']} photos catalogued ({counts['parsed']} parsed, {counts['unchanged']} unchanged, "
+          f"{counts['pruned']} removed) in {elapsed:.1f}s", file=sys.stderr)
+
+
+def cmd_query(args):
+    q = _query(args)
+    with IndexStore(args.db) as store:
+        chunks = catalog.query(store, q, args.root)
+        if args.count:
+            print(sum(len(rows) for _, rows in chunks))
+        elif args.format == 'paths':
+            out = sys.stdout
+            for table, rows in chunks:
+                out.write('\n'.join(table.paths_of(rows)) + '\n')
+        else:
+            export(chunks, '-', args.format)
+
+
+def cmd_map(args):
+    if not FOLIUM_AVAILABLE:
+        print("error: the map needs folium (pip install folium)", file=sys.stderr)
+        return 1
+    q = _query(args)
+    gps_images, skipped = [], 0
+    with IndexStore(args.db) as store:
+        for table, rows in catalog.query(store, q, args.root):
+            for row in catalog.row_list(rows):
+                gps = gps_of(table, row)
+                if gps is None:
+                    continue
+                if len(gps_images) >= args.limit:
+                    skipped += 1
+                    continue
+                gps_images.append((table.paths[row], gps))
+    if not gps_images:
+        print("No photos with GPS", file=sys.stderr)
+        return 1
+    if skipped:
+        print(f"warning: only the first {args.limit} of {args.limit + skipped} photos are on the map "
+              f"(--limit)", file=sys.stderr)
+    gps_images.sort(key=lambda item: item[1]['time'])
+    route_map(gps_images).save(args.out)
+    print(f"{len(gps_images)} photos -> {args.out}", file=sys.stderr)
+
+
+def cmd_export(args):
+    q = _query(args)
+    started = time.perf_counter()
+    with IndexStore(args.db) as store:
+        count = export(catalog.query(store, q, args.root), args.out, args.format)
+    print(f"{count} photos -> {args.out} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+def _write_progress(counts):
+    if sys.stderr.isatty():
+        print(f"\r{counts['files']} files, {counts['written']} tagged", end='', file=sys.stderr, flush=True)
+
+
+def cmd_geotag(args):
+    try:
+        track = Track.load(args.tracks)
+    except TrackError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    q = Query(args.where)
+    for error in q.errors:
+        print(f"warning: {error}", file=sys.stderr)
+    edits, candidates = [], 0
+    with IndexStore(args.db) as store:
+        for table, rows in catalog.query(store, q, args.root):
+            candidates += len(rows)
+            edits += track_edits(table, rows, track, round(args.zone * 3600), args.drift, args.max_gap,
+                                 args.fix_time)
+    print(f"{len(edits)} of {candidates} photos placed on {len(track)} track points", file=sys.stderr)
+
+    job = WriteJob(args.db, workers=args.workers, progress=_write_progress, dry_run=args.dry_run)
+    started = time.perf_counter()
+    for path, _, _, error in job.run(edits):
+        if error:
+            print(f"{path}: {error}", file=sys.stderr)
+        elif args.list:
+            print(path)
+    counts = job.counts
+    elapsed = time.perf_counter() - started
+    if sys.stderr.isatty():
+        print(file=sys.stderr)
+    rate = counts['files'] / elapsed if elapsed else 0
+    verb = "would be tagged" if args.dry_run else "tagged"
+    print(f"{counts['written']} photos {verb} ({counts['failed']} failed) in {elapsed:.1f}s: "
+          f"{rate:.0f} files/s, {counts['bytes'] / elapsed / 1e6 if elapsed else 0:.1f} MB/s", file=sys.stderr)
+    return 1 if counts['failed'] else 0
+
+
+def cmd_serve(args):
+    server = LibraryServer(args.db, args.root, args.host, args.port, args.workers)
+    ready = lambda s: print(f"Serving the catalog at {s.url} (Ctrl+C to stop)", file=sys.stderr)
+    try:
+        asyncio.run(server.serve(ready))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='geosnap', description="GeoSnap photo catalog without a GUI")
+    parser.add_argument('--db', help="index file (default: the desktop app's library.db)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('scan', help="catalog the photos under folders")
+    p.add_argument('dirs', nargs='+', metavar='DIR')
+    p.add_argument('--prune', action='store_true', help="forget catalogued files that no longer exist")
+    p.add_argument('--workers', type=int, help="parser processes (default: every core)")
+    p.add_argument('--list', action='store_true', help="print every catalogued path")
+    p.set_defaults(func=cmd_scan)
+
+    p = sub.add_parser('query', help="print the catalogued photos matching EXPR")
+    p.add_argument('expr', nargs='?', default='')
+    p.add_argument('--root', help="only photos under this folder")
+    p.add_argument('--format', choices=('paths',) + tuple(WRITERS), default='paths')
+    p.add_argument('--count', action='store_true', help="print the number of matches only")
+    p.set_defaults(func=cmd_query)
+
+    p = sub.add_parser('map', help="write an HTML map of the matching photos")
+    p.add_argument('out', metavar='OUT.html')
+    p.add_argument('expr', nargs='?', default='')
+    p.add_argument('--root')
+    p.add_argument('--limit', type=int, default=10000, help="most markers to draw")
+    p.set_defaults(func=cmd_map)
+
+    p = sub.add_parser('export', help="write the matching photos' metadata to a file ('-': stdout)")
+    p.add_argument('out', metavar='OUT')
+    p.add_argument('expr', nargs='?', default='')
+    p.add_argument('--root')
+    p.add_argument('--format', choices=tuple(WRITERS), help="default: from the file extension")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser('geotag', help="write positions from GPS logs into the photos taken along them")
+    p.add_argument('tracks', nargs='+', metavar='TRACK', help="GPX or NMEA file")
+    p.add_argument('--where', default='no:gps', metavar='EXPR', help="photos to tag (default: no:gps)")
+    p.add_argument('--root')
+    p.add_argument('--zone', type=float, default=0.0, metavar='H',
+                   help="the camera clock's time zone, hours ahead of UTC")
+    p.add_argument('--drift', type=int, default=0, metavar='S', help="seconds the camera clock runs fast")
+    p.add_argument('--max-gap', type=int, default=MAX_GAP, metavar='S',
+                   help="longest gap between fixes to interpolate across")
+    p.add_argument('--fix-time', action='store_true', help="also correct DateTimeOriginal by --drift")
+    p.add_argument('--dry-run', action='store_true', help="build the tagged files in memory only")
+    p.add_argument('--workers', type=int, help="writer processes (default: up to 8 cores)")
+    p.add_argument('--list', action='store_true', help="print every tagged path")
+    p.set_defaults(func=cmd_geotag)
+
+    p = sub.add_parser('serve', help="serve the catalog, thumbnails and photos over HTTP")
+    p.add_argument('--host', default=HOST, help=f"address to listen on (default: {HOST}, this machine only)")
+    p.add_argument('--port', type=int, default=PORT, help=f"default: {PORT}; 0 picks a free port")
+    p.add_argument('--root', help="only serve photos under this folder")
+    p.add_argument('--workers', type=int, help="threads for queries and thumbnails")
+    p.set_defaults(func=cmd_serve)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if getattr(args, 'root', None):
+        args.root = os.path.abspath(args.root)
+    try:
+        return args.func(args) or 0
+    except BrokenPipeError:
+        # Output piped into head & co.: stop quietly
+        sys.stderr.close()
+        return 0
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
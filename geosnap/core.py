@@ -0,0 +1,173 @@
+"""The photo engine every front-end drives (no GUI dependency).
+
+A ``Library`` owns what is known about the photos a window has open: the
+typed metadata table with the sort, facet and query indexes built on it, and
+bounded caches (see cache.py) of EXIF tags and GPS fixes. The front-end keeps its photo
+list (the order is its own) and its widgets; extraction, sorting, filtering,
+search and the overview map are calls on the library that take and return
+lists of paths, so each of them is implemented, and tuned, once.
+"""
+import os
+import tempfile
+
+from .cache import Cache
+from .exif import gps_from_tags, read_exif, read_tags
+from .facets import FacetIndex
+from .maps import route_map
+from .metadata import HAS_EXIF, HAS_STAT, MetadataTable, gps_of, mask_not
+from .query import Query, QueryEngine
+from .sorting import SORT_MODES, Sorter
+
+CACHE_SIZE = 500
+PROGRESS_EVERY = 50   # photos between progress callbacks while reading EXIF
+
+_UNCACHED = object()
+
+
+def _read_tags(path):
+    try:
+        return read_tags(path)
+    except Exception as e:
+        print(f"EXIF read error for {os.path.basename(path)}: {e}")
+        raise
+
+
+def save_map(m):
+    """Write a folium map to a temp HTML file and return its path"""
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.html', mode='w', encoding='utf-8')
+    m.save(temp_file.name)
+    temp_file.close()
+    return os.path.abspath(temp_file.name)
+
+
+class Library:
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.exif_cache = Cache(max_size=cache_size)
+        self.gps_cache = Cache(max_size=cache_size)
+        self.facets = None
+        self.set_table(MetadataTable())
+
+    def set_table(self, meta):
+        """Swap in a new metadata table and the indexes built on it"""
+        if self.facets is not None:
+            self.facets.detach()
+        self.meta = meta
+        self.query_engine = QueryEngine(meta)
+        self.sorter = Sorter(meta)
+        self.facets = FacetIndex(meta)
+
+    # ---------- photos ----------
+
+    def add(self, paths, stats=None):
+        """Give every path a row; stats maps path -> stat_result when known"""
+        meta = self.meta
+        for p in paths:
+            row = meta.add(p)
+            if stats and p in stats:
+                meta.set_stat(row, stats[p])
+
+    def remove(self, path):
+        self.meta.remove(path)
+        self.forget(path)
+
+    def forget(self, path, new_path=None):
+        """Drop (or move to new_path) the cached tags and GPS of a file"""
+        for cache in (self.gps_cache, self.exif_cache):
+            value = cache.pop(path, _UNCACHED)
+            if new_path is not None and value is not _UNCACHED:
+                cache[new_path] = value
+
+    def clear(self):
+        self.gps_cache.clear()
+        self.exif_cache.clear()
+        self.set_table(MetadataTable())
+
+    # ---------- metadata ----------
+
+    def exif(self, path):
+        """exifread tags of a photo ({} when unreadable, which is remembered for a while)"""
+        return self.exif_cache.get_or_load(path, _read_tags, {}, errors=(Exception,))
+
+    def gps(self, path):
+        """{'lat', 'lon', 'alt', 'time'} of a photo, or None without GPS"""
+        data = self.gps_cache.get(path, _UNCACHED)
+        if data is not _UNCACHED:
+            return data
+        row = self.meta.row_of.get(path)
+        if row is not None and self.meta.loaded[row] & HAS_EXIF:
+            data = gps_of(self.meta, row)   # indexed: no need to parse the file again
+        else:
+            try:
+                data = gps_from_tags(self.exif(path))
+            except Exception as e:
+                print(f"GPS parsing error for {os.path.basename(path)}: {e}")
+                data = None
+        self.gps_cache[path] = data
+        return data
+
+    def ensure_metadata(self, paths, progress=None):
+        """Parse EXIF into the table for the photos not indexed yet;
+        progress(done, total) is called every PROGRESS_EVERY photos"""
+        pending = self.meta.unloaded(paths)
+
+        def read(p):
+            # Reuse tags already cached for display, without filling the cache
+            tags = self.exif_cache.peek(p)
+            return read_exif(p) if tags is None else tags or {}
+
+        for start in range(0, len(pending), PROGRESS_EVERY):
+            if progress:
+                progress(start, len(pending))
+            self.meta.load_exif(pending[start:start + PROGRESS_EVERY], read)
+        return len(pending)
+
+    # ---------- sort, filter, search ----------
+
+    def sort(self, paths, mode, progress=None):
+        """paths reordered by a SORT_MODES name"""
+        if mode not in SORT_MODES:
+            return list(paths)
+        needs = self.sorter.needs(mode)
+        if needs & HAS_EXIF:
+            self.ensure_metadata(paths, progress)
+        if needs & HAS_STAT:
+            self.meta.load_stat(paths)
+        return self.sorter.sort(paths, mode)
+
+    def filter_gps(self, paths, has_gps=True, progress=None):
+        """The photos with (or without) coordinates, keeping their order"""
+        self.ensure_metadata(paths, progress)
+        mask = self.meta.mask_has_gps()
+        return self.meta.select(paths, mask if has_gps else mask_not(mask))
+
+    def cameras(self, paths, progress=None):
+        """{camera name: photo count} among paths"""
+        self.ensure_metadata(paths, progress)
+        counts = self.meta.category_counts('camera', paths)
+        counts.pop('', None)
+        return counts
+
+    def filter_camera(self, paths, camera, progress=None):
+        self.ensure_metadata(paths, progress)
+        return self.meta.select(paths, self.facets.mask({'camera': {camera}}))
+
+    def search(self, paths, text):
+        """(query, matching paths in order); query.errors lists bad terms"""
+        query = text if isinstance(text, Query) else Query(text)
+        if query.needs & HAS_EXIF:
+            self.ensure_metadata(paths)
+        if query.needs & HAS_STAT:
+            self.meta.load_stat(paths)
+        return self.query_engine.run(query, paths)
+
+    # ---------- maps ----------
+
+    def gps_photos(self, paths, progress=None):
+        """[(path, gps)] for the photos with coordinates, in order"""
+        return [(p, self.gps(p)) for p in self.filter_gps(paths, True, progress)]
+
+    def route_map(self, paths, progress=None):
+        """folium map of the photos with GPS and the route between them,
+        or None when none has coordinates (needs FOLIUM_AVAILABLE)"""
+        gps_images = self.gps_photos(paths, progress)
+        return route_map(gps_images) if gps_images else None
@@ -0,0 +1,160 @@
+"""Byte-identical duplicate detection over a photo library.
+
+Candidates are narrowed in three passes so that most files are never read
+in full: files are grouped by size, same-size files by a quick hash of
+their size, first and last ``EDGE`` bytes, and only files still colliding
+get a full content hash. Hashing runs in a process pool with a bounded
+number of jobs in flight, so memory stays flat however large the library,
+while several reads are kept queued to keep the disk busy. Jobs are issued
+in directory order to keep reads close together on disk.
+
+Both hashes are stored in the ``IndexStore`` with the size and mtime they
+were computed for, so a rescan only hashes new or changed files.
+"""
+import hashlib
+import os
+
+from .fileattrs import stat_many
+from .pool import default_workers, imap_bounded, process_pool
+from .store import IndexStore
+
+EDGE = 64 * 1024          # bytes hashed at each end of a file by the quick pass
+CHUNK = 1024 * 1024       # read size of the full pass
+
+
+def _digest():
+    return hashlib.blake2b(digest_size=16)
+
+
+def quick_hash(path, size):
+    """Hash of the size and both ends; the full hash when the file is that small"""
+    h = _digest()
+    h.update(size.to_bytes(8, 'little'))
+    with open(path, 'rb') as f:
+        if size <= 2 * EDGE:
+            h.update(f.read())
+        else:
+            h.update(f.read(EDGE))
+            f.seek(-EDGE, os.SEEK_END)
+            h.update(f.read(EDGE))
+    return h.digest()
+
+
+def full_hash(path):
+    h = _digest()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK), b''):
+            h.update(block)
+    return h.digest()
+
+
+def _hash_job(job):
+    """Worker entry point: (path, size, kind) -> (path, digest or None)"""
+    path, size, kind = job
+    try:
+        return path, quick_hash(path, size) if kind == 'quick' else full_hash(path)
+    except OSError as e:
+        print(f"Hash error for {path}: {e}")
+        return path, None
+
+
+class DuplicateJob:
+    """Find groups of byte-identical files among a list of paths"""
+
+    def __init__(self, store_path=None, workers=None, should_stop=None, progress=None):
+        self.store_path = store_path
+        self.workers = workers or default_workers()
+        self.should_stop = should_stop or (lambda: False)
+        self.progress = progress or (lambda stage, done, total: None)
+
+    def _hash_all(self, pool, jobs, stage):
+        """Yield (path, digest) for jobs, keeping a bounded number queued"""
+        jobs = sorted(jobs, key=lambda job: os.path.split(job[0]))
+        for done, result in enumerate(imap_bounded(pool, _hash_job, jobs, self.workers,
+                                                   self.should_stop), 1):
+            yield result
+            if done % 50 == 0 or done == len(jobs):
+                self.progress(stage, done, len(jobs))
+
+    def _pass(self, pool, store, stats, known, kind):
+        """{path: digest} for one pass, reusing digests stored for the same file"""
+        column = 0 if kind == 'quick' else 1
+        digests, todo = {}, []
+        for p in stats:
+            size, mtime = stats[p]
+            hit = known.get(p)
+            if hit and hit[0] == size and hit[1] == mtime and hit[2 + column]:
+                digests[p] = hit[2 + column]
+            else:
+                todo.append((p, size, kind))
+        rows = []
+        for p, digest in self._hash_all(pool, todo, kind):
+            if digest is None:
+                continue
+            digests[p] = digest
+            size, mtime = stats[p]
+            hit = known.get(p)
+            if hit and hit[0] == size and hit[1] == mtime:
+                hit = list(hit)
+            else:
+                hit = [size, mtime, None, None]
+            hit[2 + column] = digest
+            known[p] = tuple(hit)
+            rows.append((p,) + known[p])
+            if len(rows) >= 500:
+                store.put_content_hashes(rows)
+                rows = []
+        if rows:
+            store.put_content_hashes(rows)
+        return digests
+
+    def run(self, paths):
+        """Return duplicate groups: lists of paths (sorted) with identical content"""
+        stats = {}
+        for p, st in stat_many(list(dict.fromkeys(paths))).items():
+            if st is not None and st.st_size:
+                stats[p] = (st.st_size, st.st_mtime)
+
+        by_size = {}
+        for p, (size, _) in stats.items():
+            by_size.setdefault(size, []).append(p)
+        stats = {p: stats[p] for group in by_size.values() if len(group) > 1 for p in group}
+        if not stats:
+            return []
+
+        store = IndexStore(self.store_path)
+        try:
+            known = store.content_hashes(stats)
+            with process_pool(self.workers) as pool:
+                quick = self._pass(pool, store, stats, known, 'quick')
+                by_quick = {}
+                for p, digest in quick.items():
+                    by_quick.setdefault((stats[p][0], digest), []).append(p)
+
+                # Small files were hashed whole by the quick pass
+                groups, colliding = [], {}
+                for (size, _), group in by_quick.items():
+                    if len(group) < 2:
+                        continue
+                    if size <= 2 * EDGE:
+                        groups.append(group)
+                    else:
+                        colliding.update((p, stats[p]) for p in group)
+                if self.should_stop():
+                    return []
+
+                full = self._pass(pool, store, colliding, known, 'full')
+                by_full = {}
+                for p, digest in full.items():
+                    by_full.setdefault((stats[p][0], digest), []).append(p)
+                groups.extend(group for group in by_full.values() if len(group) > 1)
+        finally:
+            store.close()
+        if self.should_stop():
+            return []
+        return sorted(sorted(group) for group in groups)
+
+
+def wasted_bytes(groups, sizes):
+    """Bytes taken by every copy but one; sizes maps path -> size"""
+    return sum(sizes[group[0]] * (len(group) - 1) for group in groups if group[0] in sizes)
@@ -0,0 +1,67 @@
+"""EXIF reading helpers that do not depend on any GUI toolkit."""
+from pathlib import Path
+
+from .lazy import EXIFREAD
+
+EXIFREAD_AVAILABLE = EXIFREAD.available
+exifread = EXIFREAD   # imported on first use
+
+
+def read_tags(path, stop_tag=None):
+    """Return the exifread tag dict for a file; raises when it is unreadable"""
+    if not EXIFREAD.available:
+        return {}
+    with open(path, 'rb') as f:
+        if stop_tag:
+            return exifread.process_file(f, details=False, stop_tag=stop_tag)
+        return exifread.process_file(f, details=False)
+
+
+def read_exif(path, stop_tag=None):
+    """Return the exifread tag dict for a file, or {} when unreadable"""
+    try:
+        return read_tags(path, stop_tag)
+    except Exception as e:
+        print(f"EXIF read error for {Path(path).name}: {e}")
+        return {}
+
+
+def ratio(val):
+    return float(val.num) / float(val.den)
+
+
+def to_deg(val):
+    d = ratio(val.values[0])
+    m = ratio(val.values[1])
+    s = ratio(val.values[2])
+    return d + m/60 + s/3600
+
+
+def gps_from_tags(tags):
+    """Build the {'lat', 'lon', 'alt', 'time'} dict, or None without GPS"""
+    if 'GPS GPSLatitude' not in tags or 'GPS GPSLongitude' not in tags:
+        return None
+
+    lat = to_deg(tags['GPS GPSLatitude'])
+    if str(tags.get('GPS GPSLatitudeRef', '')) == 'S':
+        lat = -lat
+
+    lon = to_deg(tags['GPS GPSLongitude'])
+    if str(tags.get('GPS GPSLongitudeRef', '')) == 'W':
+        lon = -lon
+
+    alt = 'N/A'
+    if 'GPS GPSAltitude' in tags:
+        alt = f"{ratio(tags['GPS GPSAltitude'].values[0]):.1f} m"
+
+    dt = str(tags.get('EXIF DateTimeOriginal', 'N/A'))
+    return {'lat': lat, 'lon': lon, 'alt': alt, 'time': dt}
+
+
+def read_gps(path):
+    tags = read_exif(path)
+    try:
+        return gps_from_tags(tags)
+    except Exception as e:
+        print(f"GPS parsing error for {Path(path).name}: {e}")
+        return None
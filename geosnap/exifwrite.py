@@ -0,0 +1,376 @@
+"""Lossless GPS tagging of JPEG, PNG and HEIC files.
+
+Only the EXIF block is rewritten: Pillow re-serialises the existing tags
+together with the new GPS IFD, and every other byte of the file, the
+compressed image data included, is copied unchanged. The new file replaces
+the old one atomically. Vendor MakerNotes that rely on absolute offsets may
+not survive the re-serialisation; the standard tags always do.
+
+- JPEG: the Exif APP1 segment is replaced (or inserted after JFIF).
+- PNG: the eXIf chunk is replaced (or inserted before the image data).
+- HEIC/HEIF: the new Exif item is appended in its own ``mdat`` box and the
+  item's ``iloc`` extent is patched in place, so no other offset moves. The
+  file must already have an Exif item, as camera and phone files do.
+
+A splicer reads only the metadata it edits and describes the new file as
+pieces: new bytes, or (start, stop) ranges of the old file, which are copied
+with ``copy_file_range`` so the image data never passes through Python.
+"""
+import os
+import shutil
+import struct
+import time
+import zlib
+
+from PIL import Image
+from PIL.TiffImagePlugin import IFDRational
+
+WRITABLE_EXTS = ('.jpg', '.jpeg', '.png', '.heic', '.heif')
+
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+DATE_TIME_ORIGINAL = 0x9003
+EXIF_HEADER = b'Exif\x00\x00'
+SOI, SOS, APP0, APP1 = 0xD8, 0xDA, 0xE0, 0xE1
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+HEAD = 1 << 16          # JPEG bytes read first; more only if the metadata runs on
+COPY_BLOCK = 1 << 20
+
+
+class WriteError(Exception):
+    pass
+
+
+class _Truncated(WriteError):
+    pass
+
+
+def _segments(data):
+    """(marker, start, end) of the JPEG segments before the image data"""
+    if data[:2] != b'\xff\xd8':
+        raise WriteError("not a JPEG file")
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise WriteError("corrupt JPEG segment")
+        marker = data[pos + 1]
+        if marker == 0xFF:   # fill byte
+            pos += 1
+            continue
+        if marker == SOS:
+            return
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        yield marker, pos, pos + 2 + length
+        pos += 2 + length
+    raise _Truncated("truncated JPEG file")
+
+
+def _dms(value):
+    """Degrees -> (degrees, minutes, seconds) rationals"""
+    value = abs(value)
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = round((value - degrees - minutes / 60) * 3600 * 10000)
+    return IFDRational(degrees), IFDRational(minutes), IFDRational(seconds, 10000)
+
+
+def gps_tags(lat, lon, alt=None, when=None):
+    """GPS IFD for a position; alt in metres, when in UTC seconds since the epoch"""
+    tags = {
+        0: b'\x02\x03\x00\x00',             # GPSVersionID
+        1: 'N' if lat >= 0 else 'S',
+        2: _dms(lat),
+        3: 'E' if lon >= 0 else 'W',
+        4: _dms(lon),
+    }
+    if alt is not None and alt == alt:
+        tags[5] = b'\x00' if alt >= 0 else b'\x01'
+        tags[6] = IFDRational(round(abs(alt) * 100), 100)
+    if when is not None:
+        t = time.gmtime(when)
+        tags[7] = (IFDRational(t.tm_hour), IFDRational(t.tm_min), IFDRational(t.tm_sec))
+        tags[29] = time.strftime('%Y:%m:%d', t)
+    return tags
+
+
+def exif_with_gps(payload, lat, lon, alt=None, when=None, taken=None):
+    """EXIF block (b'Exif\\0\\0' + TIFF) with its GPS IFD replaced
+
+    taken: also set DateTimeOriginal (wall-clock seconds, as in the metadata table).
+    """
+    exif = Image.Exif()
+    if payload:
+        exif.load(payload)
+    gps = exif.get_ifd(GPS_IFD)
+    gps.clear()
+    gps.update(gps_tags(lat, lon, alt, when))
+    if taken is not None:
+        exif.get_ifd(EXIF_IFD)[DATE_TIME_ORIGINAL] = time.strftime('%Y:%m:%d %H:%M:%S', time.gmtime(taken))
+    return exif.tobytes()
+
+
+def _jpeg_splice(src, lat, lon, alt=None, when=None, taken=None):
+    head = src.read(0, HEAD)
+    while True:
+        try:
+            segments = list(_segments(head))
+            break
+        except _Truncated:
+            if len(head) >= src.size:
+                raise
+            head = src.read(0, 2 * len(head))
+    insert_at, exif_segment = 2, None
+    for marker, start, end in segments:
+        if marker == APP1 and head[start + 4:start + 10] == EXIF_HEADER:
+            exif_segment = (start, end)
+            break
+        if marker == APP0 and insert_at == start:
+            insert_at = end   # keep JFIF first
+    if exif_segment:
+        start, end = exif_segment
+        payload = head[start + 4:end]
+    else:
+        start = end = insert_at
+        payload = b''
+    app1 = exif_with_gps(payload, lat, lon, alt, when, taken)
+    if len(app1) > 0xFFFF - 2:
+        raise WriteError("EXIF block too large for a JPEG segment")
+    return [b''.join((head[:start], b'\xff\xe1', struct.pack('>H', len(app1) + 2), app1)), (end, src.size)]
+
+
+def _png_chunk(kind, payload):
+    return b''.join((struct.pack('>I', len(payload)), kind, payload,
+                     struct.pack('>I', zlib.crc32(kind + payload))))
+
+
+def _png_splice(src, lat, lon, alt=None, when=None, taken=None):
+    if src.read(0, 8) != PNG_SIGNATURE:
+        raise WriteError("not a PNG file")
+    pos = 8
+    while pos + 8 <= src.size:
+        length, kind = struct.unpack('>I4s', src.read(pos, 8))
+        if kind == b'eXIf':
+            payload, start, end = src.read(pos + 8, length), pos, pos + 12 + length
+            break
+        if kind in (b'IDAT', b'IEND'):
+            payload, start, end = b'', pos, pos
+            break
+        pos += 12 + length
+    else:
+        raise WriteError("truncated PNG file")
+    tiff = exif_with_gps(payload, lat, lon, alt, when, taken)[len(EXIF_HEADER):]
+    return [src.read(0, start) + _png_chunk(b'eXIf', tiff), (end, src.size)]
+
+
+def _boxes(read, start, end):
+    """(type, start, payload start, end) of the ISO BMFF boxes between start and end"""
+    pos = start
+    while pos + 8 <= end:
+        header = read(pos, 16)
+        size, kind = struct.unpack('>I4s', header[:8])
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', header[8:16])[0]
+            header_size = 16
+        elif size == 0:   # up to the end of the file
+            size = end - pos
+        if size < header_size or pos + size > end:
+            raise WriteError("corrupt HEIF box")
+        yield kind, pos, pos + header_size, pos + size
+        pos += size
+
+
+def _child(data, parent, kind):
+    _, _, start, end = parent
+    for box in _boxes(lambda pos, n: data[pos:pos + n], start, end):
+        if box[0] == kind:
+            return box
+    raise WriteError(f"HEIF file without a {kind.decode()} box")
+
+
+def _uint(data, pos, size):
+    return int.from_bytes(data[pos:pos + size], 'big')
+
+
+def _exif_item(data, meta):
+    """Item ID of the Exif item listed in the meta box's iinf"""
+    _, _, pos, end = _child(data, meta, b'iinf')
+    version = data[pos]
+    pos += 4 + (2 if version == 0 else 4)
+    for kind, _, start, _ in _boxes(lambda pos, n: data[pos:pos + n], pos, end):
+        version = data[start]
+        if kind != b'infe' or version < 2:
+            continue
+        id_size = 2 if version == 2 else 4
+        if data[start + 6 + id_size:start + 10 + id_size] == b'Exif':
+            return _uint(data, start + 4, id_size)
+    raise WriteError("HEIF file without an Exif block")
+
+
+def _item_extent(data, meta, item):
+    """Field positions of an item's single extent: ((base, size), (offset, size), (length, size))"""
+    _, _, pos, _ = _child(data, meta, b'iloc')
+    version = data[pos]
+    offset_size, length_size = data[pos + 4] >> 4, data[pos + 4] & 15
+    base_size = data[pos + 5] >> 4
+    index_size = data[pos + 5] & 15 if version in (1, 2) else 0
+    id_size = 2 if version < 2 else 4
+    count = _uint(data, pos + 6, id_size)
+    pos += 6 + id_size
+    for _ in range(count):
+        item_id = _uint(data, pos, id_size)
+        pos += id_size
+        method = 0
+        if version in (1, 2):
+            method = _uint(data, pos, 2) & 15
+            pos += 2
+        reference = _uint(data, pos, 2)
+        extents = _uint(data, pos + 2 + base_size, 2)
+        pos += 4 + base_size
+        if item_id == item:
+            if method != 0 or reference != 0 or extents != 1 or offset_size not in (4, 8) \
+                    or length_size not in (4, 8):
+                raise WriteError("unsupported HEIF Exif item layout")
+            base_at = pos - 2 - base_size
+            pos += index_size
+            return (base_at, base_size), (pos, offset_size), (pos + offset_size, length_size)
+        pos += extents * (index_size + offset_size + length_size)
+    raise WriteError("HEIF Exif item has no location")
+
+
+def zero_exif_base(data):
+    """Fold the HEIF Exif item's iloc base_offset into its offset, in place
+
+    libheif writes the location as base + 0, and readers that ignore
+    base_offset (exifread) then miss the block. Raises WriteError.
+    """
+    meta = next((box for box in _boxes(lambda pos, n: data[pos:pos + n], 0, len(data))
+                 if box[0] == b'meta'), None)
+    if meta is None:
+        raise WriteError("not a HEIF file")
+    # meta is a full box: skip its version and flags
+    meta = (meta[0], meta[1], meta[2] + 4, meta[3])
+    (base_at, base_size), (offset_at, offset_size), _ = _item_extent(data, meta, _exif_item(data, meta))
+    location = _uint(data, base_at, base_size) + _uint(data, offset_at, offset_size)
+    if location >= 1 << (8 * offset_size):
+        raise WriteError("unsupported HEIF layout")
+    data[base_at:base_at + base_size] = bytes(base_size)
+    data[offset_at:offset_at + offset_size] = location.to_bytes(offset_size, 'big')
+    return data
+
+
+def _heic_splice(src, lat, lon, alt=None, when=None, taken=None):
+    """Pieces of the tagged HEIF file
+
+    The new Exif item goes into an mdat box appended at the end; only the
+    item's iloc offset and length change. An Exif box appended by an earlier
+    write is replaced rather than kept as dead data.
+    """
+    top = list(_boxes(src.read, 0, src.size))
+    meta = next((box for box in top if box[0] == b'meta'), None)
+    if meta is None:
+        raise WriteError("not a HEIF file")
+    head = bytearray(src.read(0, meta[3]))
+    # meta is a full box: skip its version and flags
+    meta = (meta[0], meta[1], meta[2] + 4, meta[3])
+    (base_at, base_size), (offset_at, offset_size), (length_at, length_size) = \
+        _item_extent(head, meta, _exif_item(head, meta))
+    start = _uint(head, base_at, base_size) + _uint(head, offset_at, offset_size)
+    end = start + _uint(head, length_at, length_size)
+    block = src.read(start, end - start)
+    header = _uint(block, 0, 4)
+    payload = block[4 + header:] if 4 + header <= len(block) else b''
+    new_block = struct.pack('>I', len(EXIF_HEADER)) + exif_with_gps(payload, lat, lon, alt, when, taken)
+
+    kind, last, body, _ = top[-1]
+    if last < len(head):
+        raise WriteError("unsupported HEIF layout")
+    pieces = [head, (len(head), src.size)]
+    if kind == b'mdat' and (body, src.size) == (start, end):
+        pieces[1] = (len(head), last)      # our own Exif box from an earlier write
+    elif struct.unpack('>I', src.read(last, 4))[0] == 0:
+        if src.size - last > 0xFFFFFFFF:
+            raise WriteError("unsupported HEIF layout")
+        pieces[1:] = [(len(head), last), struct.pack('>I', src.size - last), (last + 4, src.size)]
+    # An absolute offset with a zero base: some readers (exifread) ignore base_offset
+    location = _spliced_size(pieces) + 8
+    if location >= 1 << (8 * offset_size) or len(new_block) >= 1 << (8 * length_size):
+        raise WriteError("unsupported HEIF layout")
+    head[base_at:base_at + base_size] = bytes(base_size)
+    head[offset_at:offset_at + offset_size] = location.to_bytes(offset_size, 'big')
+    head[length_at:length_at + length_size] = len(new_block).to_bytes(length_size, 'big')
+    pieces[0] = bytes(head)
+    pieces.append(struct.pack('>I4s', len(new_block) + 8, b'mdat') + new_block)
+    return pieces
+
+
+SPLICERS = {'.jpg': _jpeg_splice, '.jpeg': _jpeg_splice, '.png': _png_splice,
+            '.heic': _heic_splice, '.heif': _heic_splice}
+
+
+class _Source:
+    """Positioned reads from an open file"""
+
+    def __init__(self, f):
+        self.f = f
+        self.size = os.fstat(f.fileno()).st_size
+
+    def read(self, pos, n):
+        self.f.seek(pos)
+        return self.f.read(n)
+
+
+def _spliced_size(pieces):
+    return sum(len(p) if isinstance(p, (bytes, bytearray)) else p[1] - p[0] for p in pieces)
+
+
+def _copy_range(src, dst, start, stop):
+    """Copy src[start:stop] to the end of the unbuffered dst, in the kernel when possible"""
+    while start < stop:
+        if hasattr(os, 'copy_file_range'):
+            try:
+                n = os.copy_file_range(src.fileno(), dst.fileno(), stop - start, start)
+            except OSError:
+                n = 0   # e.g. across file systems on older kernels
+            if n:
+                start += n
+                continue
+        src.seek(start)
+        data = src.read(min(COPY_BLOCK, stop - start))
+        if not data:
+            raise WriteError("file shrank while it was being tagged")
+        dst.write(data)
+        start += len(data)
+
+
+def write_gps(path, lat, lon, alt=None, when=None, taken=None, dry_run=False):
+    """Tag a photo in place with a position; raises WriteError or OSError
+
+    Returns the size of the new file. Only the metadata at the start (and,
+    for HEIC, the end) of the file is read; the image data is copied by
+    the kernel. dry_run: build the new metadata only, leaving the disk
+    untouched.
+    """
+    splice = SPLICERS.get(os.path.splitext(path)[1].lower())
+    if splice is None:
+        raise WriteError("only JPEG, PNG and HEIC files can be tagged")
+    with open(path, 'rb') as f:
+        pieces = splice(_Source(f), lat, lon, alt, when, taken)
+        if dry_run:
+            return _spliced_size(pieces)
+        tmp = f"{path}.geosnap-tmp"
+        try:
+            with open(tmp, 'wb', buffering=0) as out:
+                for piece in pieces:
+                    if isinstance(piece, (bytes, bytearray)):
+                        out.write(piece)
+                    else:
+                        _copy_range(f, out, *piece)
+                os.fsync(out.fileno())
+            shutil.copymode(path, tmp)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    return _spliced_size(pieces)
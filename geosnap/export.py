@@ -0,0 +1,359 @@
+"""Streaming export of photo metadata: CSV, JSON lines, GeoJSON, GPX, KML,
+Parquet and Arrow.
+
+``photo_batches`` turns (table, rows) chunks into one batch of columns (plain
+lists, built with vectorised NumPy where available) per chunk, and the
+writers consume the batches as they come, so an export holds a single chunk
+in memory however many photos it covers. The GPX track is the exception: its
+points are kept in compact arrays until the end because they must be sorted
+by time. The geographic formats only contain photos with GPS.
+
+Parquet and Arrow need ``pyarrow``, imported on first use.
+"""
+import array
+import csv
+import json
+import os
+import re
+import sys
+import time
+from xml.sax.saxutils import escape
+
+from .lazy import Capability
+from .metadata import NO_TIME, NUMPY_AVAILABLE, np
+
+ARROW = Capability('arrow', 'pyarrow')
+
+FIELDS = ('path', 'name', 'size', 'mtime', 'taken', 'lat', 'lon', 'alt',
+          'camera', 'lens', 'iso', 'exposure')
+PROPERTIES = tuple(name for name in FIELDS if name not in ('lat', 'lon', 'alt'))   # GeoJSON
+GPX_TRACK_CHUNK = 50000
+PRECISION = {'alt': 2, 'exposure': 6}   # float32 columns, rounded to drop single-precision noise
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def _values(table, name, rows):
+    if NUMPY_AVAILABLE and not isinstance(rows, list):
+        return table.column(name)[rows]   # fancy indexing copies
+    col = table.cols[name]
+    return [col[r] for r in rows]
+
+
+def _with_none(values, missing):
+    """values.tolist() with None where missing is set"""
+    if not missing.any():
+        return values.tolist()
+    out = values.astype(object)
+    out[missing] = None
+    return out.tolist()
+
+
+def _floats(values, digits=None):
+    """NaN -> None"""
+    if isinstance(values, list):
+        return [None if v != v else v if digits is None else round(v, digits) for v in values]
+    if digits is not None:
+        values = values.astype('f8').round(digits)
+    return _with_none(values, np.isnan(values))
+
+
+def _seconds(values):
+    """NO_TIME -> None"""
+    if isinstance(values, list):
+        return [None if v == NO_TIME else v for v in values]
+    return _with_none(values, values == NO_TIME)
+
+
+def iso_times(seconds):
+    """Seconds since the epoch -> 'YYYY-MM-DDTHH:MM:SS' text (NO_TIME -> None)"""
+    if NUMPY_AVAILABLE:
+        values = np.asarray(seconds, dtype='i8')
+        return _with_none(values.astype('datetime64[s]').astype(str), values == NO_TIME)
+    return [None if s == NO_TIME else time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(s)) for s in seconds]
+
+
+def _labels(table, name, rows):
+    """Categorical codes -> values ('' -> None)"""
+    labels = [None] + table.categories[name].values[1:]
+    codes = _values(table, name, rows)
+    if isinstance(codes, list):
+        return [labels[c] for c in codes]
+    return np.array(labels, dtype=object)[codes].tolist()
+
+
+def _basenames(paths):
+    if os.altsep is None:
+        sep = os.sep
+        return [p[p.rfind(sep) + 1:] for p in paths]
+    return list(map(os.path.basename, paths))
+
+
+def photo_batches(chunks):
+    """Yield {field: list} per (table, rows) chunk for FIELDS plus 'timestamp'
+    (taken as int seconds); missing values are None"""
+    for table, rows in chunks:
+        paths = table.paths_of(rows)
+        iso = _values(table, 'iso', rows)
+        taken = _values(table, 'taken', rows)
+        batch = {
+            'path': paths,
+            'name': _basenames(paths),
+            'size': _values(table, 'size', rows),
+            'mtime': _values(table, 'mtime', rows),
+            'timestamp': _seconds(taken),
+            'taken': iso_times(taken),
+            'camera': _labels(table, 'camera', rows),
+            'lens': _labels(table, 'lens', rows),
+            'iso': [v or None for v in iso] if isinstance(iso, list) else _with_none(iso, iso == 0),
+        }
+        for name in ('lat', 'lon', 'alt', 'exposure'):
+            batch[name] = _floats(_values(table, name, rows), PRECISION.get(name))
+        for name in ('size', 'mtime'):
+            if not isinstance(batch[name], list):
+                batch[name] = batch[name].tolist()
+        yield batch
+
+
+def _gps_rows(batch):
+    """Indices of the photos with GPS in a batch"""
+    return [i for i, lat in enumerate(batch['lat']) if lat is not None]
+
+
+# ---------- writers: (batches, file) -> number of photos written ----------
+
+TEXT_FIELDS = ('path', 'name', 'taken', 'camera', 'lens')   # str or None; the rest are numbers
+_CSV_SPECIAL = re.compile(r'[",\r\n]')
+
+# Text formats are assembled a column at a time from C-level conversions
+# (str, the JSON string encoder): csv.writer and json.dumps per record spent
+# most of a large export inspecting every field of every row.
+
+
+def _csv_column(name, values):
+    """Field texts quoted like csv.QUOTE_MINIMAL"""
+    if None in values:
+        values = ['' if v is None else v for v in values]
+    if name not in TEXT_FIELDS:
+        return list(map(str, values))
+    # One scan per column: paths that need quoting are rare
+    if _CSV_SPECIAL.search('\0'.join(values)):
+        special = _CSV_SPECIAL.search
+        return ['"%s"' % v.replace('"', '""') if special(v) else v for v in values]
+    return values
+
+
+def _json_column(name, values):
+    """JSON texts of a column's values, as json.dumps(..., ensure_ascii=False) writes them"""
+    encode = json.encoder.encode_basestring if name in TEXT_FIELDS else str
+    if None in values:
+        return ['null' if v is None else encode(v) for v in values]
+    return list(map(encode, values))
+
+
+def _json_template(names):
+    return '{' + ', '.join(f'"{name}": %s' for name in names) + '}'
+
+
+def _take(values, index):
+    return [values[i] for i in index]
+
+
+def write_csv(batches, f):
+    csv.writer(f).writerow(FIELDS)
+    count = 0
+    for batch in batches:
+        columns = [_csv_column(name, batch[name]) for name in FIELDS]
+        if columns[0]:
+            f.write('\r\n'.join(map(','.join, zip(*columns))) + '\r\n')
+        count += len(batch['path'])
+    return count
+
+
+def write_jsonl(batches, f):
+    line = _json_template(FIELDS).__mod__
+    count = 0
+    for batch in batches:
+        columns = [_json_column(name, batch[name]) for name in FIELDS]
+        if columns[0]:
+            f.write('\n'.join(map(line, zip(*columns))) + '\n')
+        count += len(batch['path'])
+    return count
+
+
+def write_geojson(batches, f):
+    feature = ('{"type": "Feature", "geometry": {"type": "Point", "coordinates": [%s]}, '
+               '"properties": ' + _json_template(PROPERTIES) + '}').__mod__
+    f.write('{"type": "FeatureCollection", "features": [\n')
+    count = 0
+    for batch in batches:
+        index = _gps_rows(batch)
+        if not index:
+            continue
+        lat, lon, alt = (_take(batch[name], index) for name in ('lat', 'lon', 'alt'))
+        coords = [f'{x}, {y}' if z is None else f'{x}, {y}, {z}' for x, y, z in zip(lon, lat, alt)]
+        columns = [coords] + [_json_column(name, _take(batch[name], index)) for name in PROPERTIES]
+        f.write((',\n' if count else '') + ',\n'.join(map(feature, zip(*columns))))
+        count += len(index)
+    f.write('\n]}\n')
+    return count
+
+
+def write_gpx(batches, f):
+    """Waypoints in list order, then a track through the dated ones by time"""
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<gpx version="1.1" creator="GeoSnap" xmlns="http://www.topografix.com/GPX/1/1">\n')
+    stamps, lats, lons, alts = array.array('q'), array.array('d'), array.array('d'), array.array('d')
+    count = 0
+    for batch in batches:
+        lat, lon, alt, taken = batch['lat'], batch['lon'], batch['alt'], batch['taken']
+        out = []
+        for i in _gps_rows(batch):
+            out.append(f'<wpt lat="{lat[i]}" lon="{lon[i]}">')
+            if alt[i] is not None:
+                out.append(f'<ele>{alt[i]}</ele>')
+            if taken[i] is not None:
+                out.append(f'<time>{taken[i]}</time>')
+                stamps.append(batch['timestamp'][i])
+                lats.append(lat[i])
+                lons.append(lon[i])
+                alts.append(float('nan') if alt[i] is None else alt[i])
+            out.append(f'<name>{escape(batch["name"][i])}</name><desc>{escape(batch["path"][i])}</desc></wpt>\n')
+            count += 1
+        f.write(''.join(out))
+
+    if stamps:
+        if NUMPY_AVAILABLE:
+            order = np.argsort(np.frombuffer(stamps, dtype='i8'), kind='stable').tolist()
+        else:
+            order = sorted(range(len(stamps)), key=stamps.__getitem__)
+        f.write('<trk><name>GeoSnap</name><trkseg>\n')
+        for start in range(0, len(order), GPX_TRACK_CHUNK):
+            part = order[start:start + GPX_TRACK_CHUNK]
+            out = []
+            for i, when in zip(part, iso_times([stamps[i] for i in part])):
+                ele = '' if alts[i] != alts[i] else f'<ele>{alts[i]}</ele>'
+                out.append(f'<trkpt lat="{lats[i]}" lon="{lons[i]}">{ele}<time>{when}</time></trkpt>\n')
+            f.write(''.join(out))
+        f.write('</trkseg></trk>\n')
+    f.write('</gpx>\n')
+    return count
+
+
+def write_kml(batches, f):
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<kml xmlns="http://www.opengis.net/kml/2.2"><Document><name>GeoSnap</name>\n')
+    count = 0
+    for batch in batches:
+        lat, lon, alt, taken = batch['lat'], batch['lon'], batch['alt'], batch['taken']
+        out = []
+        for i in _gps_rows(batch):
+            coords = f'{lon[i]},{lat[i]}' if alt[i] is None else f'{lon[i]},{lat[i]},{alt[i]}'
+            when = '' if taken[i] is None else f'<TimeStamp><when>{taken[i]}</when></TimeStamp>'
+            out.append(f'<Placemark><name>{escape(batch["name"][i])}</name>'
+                       f'<description>{escape(batch["path"][i])}</description>{when}'
+                       f'<Point><coordinates>{coords}</coordinates></Point></Placemark>\n')
+        f.write(''.join(out))
+        count += len(out)
+    f.write('</Document></kml>\n')
+    return count
+
+
+def _arrow_schema(pa):
+    return pa.schema([
+        ('path', pa.string()), ('name', pa.string()), ('size', pa.int64()), ('mtime', pa.float64()),
+        ('taken', pa.timestamp('s')), ('lat', pa.float64()), ('lon', pa.float64()), ('alt', pa.float64()),
+        ('camera', pa.string()), ('lens', pa.string()), ('iso', pa.int32()), ('exposure', pa.float64()),
+    ])
+
+
+def _arrow_batches(batches, schema, pa):
+    for batch in batches:
+        columns = dict(batch, taken=batch['timestamp'])
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(columns[field.name], type=field.type) for field in schema], schema=schema)
+
+
+def write_parquet(batches, f):
+    pa = ARROW.load()
+    import pyarrow.parquet as pq
+    schema = _arrow_schema(pa)
+    count = 0
+    with pq.ParquetWriter(f, schema) as writer:
+        for record_batch in _arrow_batches(batches, schema, pa):
+            writer.write_batch(record_batch)
+            count += record_batch.num_rows
+    return count
+
+
+def write_arrow(batches, f):
+    pa = ARROW.load()
+    schema = _arrow_schema(pa)
+    count = 0
+    with pa.ipc.new_file(f, schema) as writer:
+        for record_batch in _arrow_batches(batches, schema, pa):
+            writer.write_batch(record_batch)
+            count += record_batch.num_rows
+    return count
+
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl, 'geojson': write_geojson, 'gpx': write_gpx,
+           'kml': write_kml, 'parquet': write_parquet, 'arrow': write_arrow}
+BINARY = ('parquet', 'arrow')
+EXTENSIONS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.geojson': 'geojson', '.gpx': 'gpx',
+              '.kml': 'kml', '.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow'}
+GEOGRAPHIC = ('geojson', 'gpx', 'kml')
+
+
+def format_of(path, fmt=None):
+    """Export format named explicitly or implied by the file extension"""
+    fmt = fmt or EXTENSIONS.get(os.path.splitext(path)[1].lower()) or ('csv' if path == '-' else None)
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown export format for {path}: choose one of {', '.join(WRITERS)}")
+    if fmt in BINARY and not ARROW.available:
+        raise ValueError(f"{fmt} export needs pyarrow (pip install pyarrow)")
+    return fmt
+
+
+def _watched(batches, progress, should_stop):
+    done = 0
+    for batch in batches:
+        if should_stop and should_stop():
+            raise ExportCancelled()
+        yield batch
+        done += len(batch['path'])
+        if progress:
+            progress(done)
+
+
+def export(chunks, path, fmt=None, progress=None, should_stop=None):
+    """Write the photos of (table, rows) chunks to path ('-' for stdout)
+
+    Returns the number of photos written, or None when should_stop() asked
+    to stop (an existing file at path is then left untouched). progress(n)
+    is called with the number of photos processed after every chunk.
+    """
+    fmt = format_of(path, fmt)
+    writer = WRITERS[fmt]
+    batches = _watched(photo_batches(chunks), progress, should_stop)
+    if path == '-':
+        return writer(batches, sys.stdout.buffer if fmt in BINARY else sys.stdout)
+    tmp = path + '.tmp'
+    try:
+        if fmt in BINARY:
+            with open(tmp, 'wb') as f:
+                count = writer(batches, f)
+        else:
+            with open(tmp, 'w', encoding='utf-8', newline='') as f:
+                count = writer(batches, f)
+    except ExportCancelled:
+        os.remove(tmp)
+        return None
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+    return count
@@ -0,0 +1,222 @@
+"""Facet counts (camera, lens, year, month, file type, GPS) over the library.
+
+``FacetIndex`` listens to a ``MetadataTable`` and keeps, for every facet
+value, a posting bitmap with one bit per table row plus its photo count. Rows
+are moved between bitmaps as they are added or their EXIF gets parsed, so
+nothing is ever rescanned. A selection ``{facet: {values}}`` ORs the values
+inside a facet and intersects across facets with plain integer bit ops.
+
+EXIF-derived facets only include rows whose EXIF has been parsed; the file
+type facet is known as soon as a path is added. Removed rows leave every
+posting list.
+"""
+import os
+import time
+
+from .metadata import HAS_EXIF, NUMPY_AVAILABLE, NO_TIME, REMOVED, np
+
+FACETS = ('camera', 'lens', 'year', 'month', 'ext', 'gps')
+EXIF_FACETS = ('camera', 'lens', 'year', 'month', 'gps')
+
+_UNKNOWN = dict.fromkeys(EXIF_FACETS)
+_GONE = dict.fromkeys(FACETS)
+_popcount = getattr(int, 'bit_count', None) or (lambda x: bin(x).count('1'))
+
+
+def bitmap_to_mask(bits, n):
+    """Integer bitmap -> mask accepted by MetadataTable.select"""
+    raw = bits.to_bytes((n + 7) // 8, 'little')
+    if NUMPY_AVAILABLE:
+        return np.unpackbits(np.frombuffer(raw, dtype=np.uint8), count=n, bitorder='little').astype(bool)
+    mask = bytearray(n)
+    for i, byte in enumerate(raw):
+        if byte:
+            base = i * 8
+            for k in range(8):
+                if byte >> k & 1:
+                    mask[base + k] = 1
+    return mask
+
+
+def row_facets(table, row):
+    """{facet: value} for a row; EXIF facets are None until EXIF is parsed"""
+    if table.loaded[row] & REMOVED:
+        return _GONE
+    ext = os.path.splitext(table.names[row])[1].lstrip('.')
+    values = {'ext': ext.upper() or None}
+    if not table.loaded[row] & HAS_EXIF:
+        values.update(_UNKNOWN)
+        return values
+    taken = table.cols['taken'][row]
+    if taken != NO_TIME:
+        t = time.gmtime(taken)
+        values['year'] = f"{t.tm_year:04d}"
+        values['month'] = f"{t.tm_year:04d}-{t.tm_mon:02d}"
+    else:
+        values['year'] = values['month'] = ''
+    values['camera'] = table.value('camera', row)
+    values['lens'] = table.value('lens', row)
+    lat = table.cols['lat'][row]
+    values['gps'] = 'no' if lat != lat else 'yes'
+    return values
+
+
+def facet_codes(table, n):
+    """{facet: (codes, labels)} for rows 0..n-1 with NumPy: codes index into
+    labels, -1 where row_facets() would give None"""
+    loaded = np.frombuffer(table.loaded, dtype=np.uint8, count=n)
+    removed = (loaded & REMOVED) != 0
+    parsed = ((loaded & HAS_EXIF) != 0) & ~removed
+    out = {}
+
+    splitext = os.path.splitext
+    exts = {}
+    codes = np.fromiter(((exts.setdefault(ext, len(exts)) if ext else -1) for ext in
+                         (splitext(name)[1].lstrip('.').upper() for name in table.names[:n])),
+                        dtype=np.int64, count=n)
+    out['ext'] = (np.where(removed, -1, codes), list(exts))
+
+    for name in ('camera', 'lens'):
+        out[name] = (np.where(parsed, table.column(name)[:n], -1), table.categories[name].values)
+
+    # Dates as months since 1970 (UTC wall clock, like time.gmtime); '' when undated
+    taken = table.column('taken')[:n]
+    dated = taken != NO_TIME
+    months = np.where(dated, taken, 0).astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+    for facet, keys, label in (
+            ('month', months, lambda m: f"{1970 + m // 12:04d}-{m % 12 + 1:02d}"),
+            ('year', months // 12, lambda y: f"{1970 + y:04d}")):
+        unique, inverse = np.unique(keys, return_inverse=True)
+        labels = [label(k) for k in unique.tolist()] + ['']
+        codes = np.where(dated, inverse.reshape(-1), len(labels) - 1)
+        out[facet] = (np.where(parsed, codes, -1), labels)
+
+    out['gps'] = (np.where(parsed, np.isnan(table.column('lat')[:n]).astype(np.int64), -1), ['yes', 'no'])
+    return out
+
+
+class FacetIndex:
+    """Incrementally maintained posting bitmaps and counts per facet value"""
+
+    def __init__(self, table):
+        self.table = table
+        self.bitmaps = {f: {} for f in FACETS}  # facet -> value -> bytearray
+        self.totals = {f: {} for f in FACETS}   # facet -> value -> photo count
+        self.current = {f: [] for f in FACETS}  # facet -> value per row
+        self._ints = {}                         # (facet, value) -> int bitmap cache
+        self.version = 0
+        self._index_existing()
+        table.listeners.append(self.update)
+
+    def _index_existing(self):
+        """File the rows already in the table in one pass per facet
+        (update() would grow every bitmap a byte at a time)"""
+        table = self.table
+        n = len(table)
+        if not n:
+            return
+        if NUMPY_AVAILABLE:
+            for facet, (codes, labels) in facet_codes(table, n).items():
+                self.current[facet] = [labels[c] if c >= 0 else None for c in codes.tolist()]
+                for c, label in enumerate(labels):
+                    hit = codes == c
+                    count = int(hit.sum())
+                    if count:
+                        self.bitmaps[facet][label] = bytearray(np.packbits(hit, bitorder='little').tobytes())
+                        self.totals[facet][label] = count
+        else:
+            per_row = [row_facets(table, row) for row in range(n)]
+            size = (n + 7) // 8
+            for facet in FACETS:
+                current = self.current[facet] = [values[facet] for values in per_row]
+                bitmaps, totals = self.bitmaps[facet], self.totals[facet]
+                for row, value in enumerate(current):
+                    if value is None:
+                        continue
+                    bm = bitmaps.get(value)
+                    if bm is None:
+                        bm = bitmaps[value] = bytearray(size)
+                        totals[value] = 0
+                    bm[row >> 3] |= 1 << (row & 7)
+                    totals[value] += 1
+        self.version += 1
+
+    def detach(self):
+        if self.update in self.table.listeners:
+            self.table.listeners.remove(self.update)
+
+    def update(self, row):
+        """Re-file a row after it was added or changed"""
+        values = row_facets(self.table, row)
+        byte, bit = row >> 3, 1 << (row & 7)
+        changed = False
+        for facet, new in values.items():
+            current = self.current[facet]
+            if row < len(current):
+                old = current[row]
+                if old == new:
+                    continue
+                current[row] = new
+            else:
+                # New rows arrive in order, so this is normally a plain append
+                current.extend([None] * (row - len(current)))
+                current.append(new)
+                old = None
+                if new is None:
+                    continue
+            bitmaps, totals = self.bitmaps[facet], self.totals[facet]
+            if old is not None:
+                bitmaps[old][byte] &= ~bit & 0xFF
+                totals[old] -= 1
+                if not totals[old]:
+                    del totals[old], bitmaps[old]
+                self._ints.pop((facet, old), None)
+            if new is not None:
+                bm = bitmaps.get(new)
+                if bm is None:
+                    bm = bitmaps[new] = bytearray()
+                if len(bm) <= byte:
+                    bm.extend(bytes(byte + 1 - len(bm)))
+                bm[byte] |= bit
+                totals[new] = totals.get(new, 0) + 1
+                self._ints.pop((facet, new), None)
+            changed = True
+        if changed:
+            self.version += 1
+
+    def bits(self, facet, value):
+        """Posting bitmap of one value as an int"""
+        key = (facet, value)
+        bits = self._ints.get(key)
+        if bits is None:
+            bm = self.bitmaps[facet].get(value)
+            bits = int.from_bytes(bm, 'little') if bm else 0
+            self._ints[key] = bits
+        return bits
+
+    def select_bits(self, selected, skip=None):
+        """Bitmap of rows matching a selection, or None when nothing is selected"""
+        result = None
+        for facet, values in selected.items():
+            if facet == skip or not values:
+                continue
+            union = 0
+            for value in values:
+                union |= self.bits(facet, value)
+            result = union if result is None else result & union
+        return result
+
+    def counts(self, facet, selected=None):
+        """{value: count}, restricted by the selection on the other facets"""
+        within = self.select_bits(selected or {}, skip=facet)
+        if within is None:
+            return dict(self.totals[facet])
+        return {v: _popcount(self.bits(facet, v) & within) for v in self.totals[facet]}
+
+    def mask(self, selected):
+        """Row mask for a selection (all rows when nothing is selected)"""
+        n = len(self.table)
+        bits = self.select_bits(selected)
+        if bits is None:
+            bits = (1 << n) - 1
+        return bitmap_to_mask(bits, n)
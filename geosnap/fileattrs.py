@@ -0,0 +1,79 @@
+"""Bulk file attributes (size, mtime, ctime, inode) from directory scans.
+
+Folder ingestion walks the tree with ``os.scandir`` and keeps the stat result
+of every image entry, so adding a folder needs no extra call per file (on
+Windows the directory listing already carries the attributes). Refreshing
+known paths groups them by directory and rescans each directory once instead
+of stat'ing file by file, which matters on SMB/NFS where every call is a
+network round trip.
+"""
+import os
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.heic', '.heif')
+
+# Below this many wanted files in one directory, plain os.stat is cheaper
+SCANDIR_MIN = 8
+
+
+def scan_folder(folder, exts=IMAGE_EXTS, should_stop=None):
+    """Yield (path, stat_result) for every image under folder, recursively"""
+    stack = [os.path.normpath(folder)]
+    while stack:
+        if should_stop and should_stop():
+            return
+        directory = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif os.path.splitext(entry.name)[1].lower() in exts and entry.is_file():
+                            yield entry.path, entry.stat()
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"Scan error for {directory}: {e}")
+            continue
+        # Visit subfolders in name order
+        stack.extend(sorted(subdirs, reverse=True))
+
+
+def stat_many(paths):
+    """Return {path: stat_result or None if missing}, one scandir per busy directory"""
+    by_dir = {}
+    for p in paths:
+        by_dir.setdefault(os.path.dirname(p), []).append(p)
+
+    result = {}
+    for directory, group in by_dir.items():
+        if len(group) >= SCANDIR_MIN:
+            wanted = {os.path.basename(p): p for p in group}
+            try:
+                with os.scandir(directory or '.') as it:
+                    for entry in it:
+                        p = wanted.get(entry.name)
+                        if p is not None:
+                            try:
+                                result[p] = entry.stat()
+                            except OSError:
+                                result[p] = None
+            except OSError:
+                pass
+            for p in group:
+                result.setdefault(p, None)
+            continue
+        for p in group:
+            try:
+                result[p] = os.stat(p)
+            except OSError:
+                result[p] = None
+    return result
+
+
+def batches(paths, size=500):
+    """Split paths into lists of at most size, keeping directories together"""
+    ordered = sorted(paths, key=os.path.dirname)
+    for i in range(0, len(ordered), size):
+        yield ordered[i:i + size]
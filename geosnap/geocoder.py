@@ -0,0 +1,380 @@
+"""Reverse geocoding backends: online Nominatim and an offline gazetteer.
+
+The offline backend loads a GeoNames dump (``cities500.txt`` and friends) or a
+CSV with ``lat``/``lon``/``name`` columns, builds a 3-D KD-tree over unit
+vectors once and stores it as a flat binary index next to the gazetteer.
+Later runs memory-map that index, so start-up costs no parsing at all.
+"""
+import array
+import csv
+import hashlib
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+from .lazy import GEOPY
+from .paths import data_path
+
+GEOPY_AVAILABLE = GEOPY.available
+
+EARTH_RADIUS_KM = 6371.0088
+
+INDEX_MAGIC = b'GSKD'
+INDEX_VERSION = 1
+# magic, version, byte order, count, text blob size
+INDEX_HEADER = struct.Struct('<4sIIIQ')
+
+CSV_LAT = ('lat', 'latitude')
+CSV_LON = ('lon', 'lng', 'long', 'longitude')
+CSV_NAME = ('name', 'city', 'place', 'town')
+CSV_REGION = ('region', 'admin1', 'state', 'province')
+CSV_COUNTRY = ('country', 'country_code', 'countrycode', 'cc')
+
+
+class GeocoderError(Exception):
+    pass
+
+
+def to_xyz(lat, lon):
+    """Project lat/lon (degrees) to a point on the unit sphere"""
+    la = math.radians(lat)
+    lo = math.radians(lon)
+    c = math.cos(la)
+    return c * math.cos(lo), c * math.sin(lo), math.sin(la)
+
+
+def chord_to_km(d2):
+    """Convert a squared chord length on the unit sphere to great-circle km"""
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(d2) / 2))
+
+
+def format_place(place):
+    parts = [p for p in (place.get('city'), place.get('region'), place.get('country')) if p]
+    text = ", ".join(dict.fromkeys(parts))
+    if place.get('distance_km') is not None:
+        text += f" (~{place['distance_km']:.1f} km)"
+    return text
+
+
+def _pick(header, names):
+    for i, col in enumerate(header):
+        if col.strip().lower() in names:
+            return i
+    return None
+
+
+def read_gazetteer(path):
+    """Yield (lat, lon, name, region, country) from a GeoNames dump or CSV"""
+    with open(path, encoding='utf-8', newline='') as f:
+        first = f.readline()
+        f.seek(0)
+        if first.count('\t') >= 10:
+            # GeoNames: id, name, ascii, alt names, lat, lon, class, code, cc, cc2, admin1, ...
+            for line in f:
+                cols = line.rstrip('\n').split('\t')
+                if len(cols) < 11:
+                    continue
+                try:
+                    yield float(cols[4]), float(cols[5]), cols[1], cols[10], cols[8]
+                except ValueError:
+                    continue
+            return
+
+        dialect = csv.Sniffer().sniff(first, delimiters=',;\t') if first else csv.excel
+        reader = csv.reader(f, dialect)
+        header = next(reader, [])
+        i_lat, i_lon = _pick(header, CSV_LAT), _pick(header, CSV_LON)
+        i_name = _pick(header, CSV_NAME)
+        if i_lat is None or i_lon is None or i_name is None:
+            raise GeocoderError(f"CSV cần cột lat, lon, name: {os.path.basename(path)}")
+        i_region, i_country = _pick(header, CSV_REGION), _pick(header, CSV_COUNTRY)
+        for row in reader:
+            try:
+                lat, lon = float(row[i_lat]), float(row[i_lon])
+            except (ValueError, IndexError):
+                continue
+            region = row[i_region] if i_region is not None and i_region < len(row) else ''
+            country = row[i_country] if i_country is not None and i_country < len(row) else ''
+            yield lat, lon, row[i_name], region, country
+
+
+def build_index(gazetteer_path, index_path):
+    """Parse a gazetteer and write its KD-tree index file"""
+    xs, ys, zs = array.array('d'), array.array('d'), array.array('d')
+    texts = []
+    for lat, lon, name, region, country in read_gazetteer(gazetteer_path):
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            continue
+        x, y, z = to_xyz(lat, lon)
+        xs.append(x)
+        ys.append(y)
+        zs.append(z)
+        texts.append(f"{name}\t{region}\t{country}".replace('\n', ' '))
+    if not texts:
+        raise GeocoderError(f"Gazetteer rỗng: {os.path.basename(gazetteer_path)}")
+
+    # Implicit balanced tree: the median of every range [lo, hi) sits at
+    # (lo + hi) // 2, split on x/y/z by depth, so no node objects are stored.
+    coords = (xs, ys, zs)
+    order = list(range(len(texts)))
+    stack = [(0, len(order), 0)]
+    while stack:
+        lo, hi, axis = stack.pop()
+        if hi - lo <= 1:
+            continue
+        key = coords[axis].__getitem__
+        order[lo:hi] = sorted(order[lo:hi], key=key)
+        mid = (lo + hi) // 2
+        nxt = (axis + 1) % 3
+        stack.append((lo, mid, nxt))
+        stack.append((mid + 1, hi, nxt))
+
+    blob = bytearray()
+    offsets = array.array('I', [0])
+    for i in order:
+        blob += texts[i].encode('utf-8')
+        offsets.append(len(blob))
+
+    # A closed geocoder may still be building the same index: never share the temp file
+    tmp = f"{index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, sys.byteorder == 'little',
+                                  len(order), len(blob)))
+        for col in coords:
+            f.write(array.array('f', (col[i] for i in order)).tobytes())
+        f.write(offsets.tobytes())
+        f.write(blob)
+    os.replace(tmp, index_path)
+
+
+def default_index_path(gazetteer_path):
+    """Index lives beside the gazetteer, or in the data dir if that is read-only"""
+    beside = gazetteer_path + '.gsidx'
+    if os.access(os.path.dirname(os.path.abspath(gazetteer_path)), os.W_OK):
+        return beside
+    digest = hashlib.sha1(os.path.abspath(gazetteer_path).encode('utf-8')).hexdigest()[:16]
+    return data_path(f"gazetteer-{digest}.gsidx")
+
+
+class GazetteerIndex:
+    """Memory-mapped KD-tree over gazetteer places"""
+
+    def __init__(self, index_path):
+        self._file = open(index_path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise GeocoderError("File index rỗng")
+        magic, version, little, count, blob_len = INDEX_HEADER.unpack_from(self._mm, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION or bool(little) != (sys.byteorder == 'little'):
+            self.close()
+            raise GeocoderError("File index không tương thích")
+
+        view = memoryview(self._mm)
+        pos = INDEX_HEADER.size
+        cols = []
+        for _ in range(3):
+            cols.append(view[pos:pos + 4 * count].cast('f'))
+            pos += 4 * count
+        self.xs, self.ys, self.zs = cols
+        self.offsets = view[pos:pos + 4 * (count + 1)].cast('I')
+        pos += 4 * (count + 1)
+        self._blob_start = pos
+        self.count = count
+
+    def close(self):
+        for name in ('xs', 'ys', 'zs', 'offsets'):
+            view = self.__dict__.pop(name, None)
+            if view is not None:
+                view.release()
+        self._mm.close()
+        self._file.close()
+
+    def record(self, i):
+        start = self._blob_start + self.offsets[i]
+        end = self._blob_start + self.offsets[i + 1]
+        name, region, country = self._mm[start:end].decode('utf-8').split('\t')
+        return name, region, country
+
+    def nearest(self, lat, lon):
+        """Return (row, squared chord distance) of the closest place"""
+        qx, qy, qz = to_xyz(lat, lon)
+        xs, ys, zs = self.xs, self.ys, self.zs
+        best, best_d = -1, float('inf')
+        # (lo, hi, axis, squared distance from query to the splitting plane)
+        stack = [(0, self.count, 0, 0.0)]
+        while stack:
+            lo, hi, axis, plane = stack.pop()
+            if lo >= hi or plane >= best_d:
+                continue
+            mid = (lo + hi) // 2
+            dx, dy, dz = qx - xs[mid], qy - ys[mid], qz - zs[mid]
+            d = dx * dx + dy * dy + dz * dz
+            if d < best_d:
+                best, best_d = mid, d
+            diff = dx if axis == 0 else (dy if axis == 1 else dz)
+            nxt = (axis + 1) % 3
+            if diff < 0:
+                near, far = (lo, mid), (mid + 1, hi)
+            else:
+                near, far = (mid + 1, hi), (lo, mid)
+            stack.append((far[0], far[1], nxt, diff * diff))
+            stack.append((near[0], near[1], nxt, 0.0))
+        return best, best_d
+
+
+class RateLimiter:
+    """Spaces calls at least interval seconds apart, across threads"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        # Reserve the next slot under the lock, sleep outside it
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class OfflineGeocoder:
+    """Nearest-place lookup against a local gazetteer file"""
+
+    name = 'offline'
+
+    def __init__(self, gazetteer_path, max_distance_km=50.0):
+        self.gazetteer_path = gazetteer_path
+        self.index_path = default_index_path(gazetteer_path)
+        self.max_distance_km = max_distance_km
+        self._index = None
+        self._closed = False
+        self._users = 0                       # lookups using self._index right now
+        self._lock = threading.Lock()         # state only, never held while building
+        self._build_lock = threading.Lock()   # one thread builds or opens the index
+
+    def _stale(self):
+        try:
+            return os.path.getmtime(self.index_path) < os.path.getmtime(self.gazetteer_path)
+        except OSError:
+            return True
+
+    def _open(self):
+        if self._stale():
+            build_index(self.gazetteer_path, self.index_path)
+        try:
+            return GazetteerIndex(self.index_path)
+        except GeocoderError:
+            build_index(self.gazetteer_path, self.index_path)
+            return GazetteerIndex(self.index_path)
+
+    def _use(self):
+        """The open index, counted as in use until _done(); builds it if needed"""
+        with self._lock:
+            if self._closed:
+                raise GeocoderError("Geocoder đã đóng")
+            if self._index is not None:
+                self._users += 1
+                return self._index
+        with self._build_lock:
+            with self._lock:
+                if self._closed:
+                    raise GeocoderError("Geocoder đã đóng")
+                if self._index is not None:
+                    self._users += 1
+                    return self._index
+            index = self._open()
+            with self._lock:
+                if self._closed:   # closed while building
+                    index.close()
+                    raise GeocoderError("Geocoder đã đóng")
+                self._index = index
+                self._users += 1
+                return index
+
+    def _done(self):
+        with self._lock:
+            self._users -= 1
+            if self._closed and not self._users and self._index is not None:
+                self._index.close()
+                self._index = None
+
+    def load(self):
+        """Open the index, building it first if missing or out of date"""
+        index = self._use()
+        self._done()
+        return index
+
+    def close(self):
+        """Never waits: the index is unmapped now, or when the last running lookup ends"""
+        with self._lock:
+            self._closed = True
+            if not self._users and self._index is not None:
+                self._index.close()
+                self._index = None
+
+    def reverse(self, lat, lon):
+        index = self._use()
+        try:
+            row, d2 = index.nearest(lat, lon)
+            if row < 0:
+                return None
+            distance = chord_to_km(d2)
+            if self.max_distance_km and distance > self.max_distance_km:
+                return None
+            city, region, country = index.record(row)
+        finally:
+            self._done()
+        place = {'city': city, 'region': region, 'country': country, 'distance_km': distance}
+        place['address'] = format_place(place)
+        return place
+
+
+class NominatimGeocoder:
+    """Online reverse geocoding through OpenStreetMap Nominatim"""
+
+    name = 'nominatim'
+    # Nominatim usage policy: at most one request per second. Shared by every
+    # instance, so address lookups and the place indexer queue behind each other
+    limiter = RateLimiter(1.0)
+
+    def __init__(self, user_agent="geosnap_v2", language='vi', timeout=10):
+        if GEOPY.load() is None:
+            raise GeocoderError("⚠️ Chưa cài thư viện geopy")
+        self._geo = GEOPY.Nominatim(user_agent=user_agent, timeout=timeout)
+        self.language = language
+
+    def close(self):
+        pass
+
+    def reverse(self, lat, lon):
+        self.limiter.wait()
+        loc = self._geo.reverse(f"{lat}, {lon}", language=self.language)
+        if not loc:
+            return None
+        addr = loc.raw.get('address', {})
+        return {
+            'city': (addr.get('city') or addr.get('town') or addr.get('village')
+                     or addr.get('municipality') or addr.get('county') or ''),
+            'region': addr.get('state') or addr.get('region') or '',
+            'country': addr.get('country') or '',
+            'distance_km': None,
+            'address': loc.address,
+        }
+
+
+def create_geocoder(backend='nominatim', gazetteer_path=None):
+    """Build the reverse geocoder selected in the settings"""
+    if backend == 'offline':
+        if not gazetteer_path or not os.path.isfile(gazetteer_path):
+            raise GeocoderError("⚠️ Chưa chọn file gazetteer")
+        return OfflineGeocoder(gazetteer_path)
+    return NominatimGeocoder()
@@ -0,0 +1,336 @@
+"""Time-based geotagging of photos from GPS logs (GPX tracks, NMEA sentences).
+
+Every fix of the loaded logs goes into one ``Track``: time-sorted parallel
+arrays of UTC seconds, latitude, longitude and elevation. ``Track.match``
+places a whole batch of photo times at once: ``searchsorted`` finds the fixes
+on either side of each photo and the position is interpolated linearly
+between them. Photos in a logging gap longer than ``MAX_GAP`` only take the
+nearest fix, and only when it is within ``TOLERANCE``; photos outside the
+track stay unmatched. Without NumPy the same is done per photo with bisect.
+
+Photo times are EXIF DateTimeOriginal wall-clock seconds (see
+``metadata.parse_exif_datetime``); ``offset`` is how far the camera clock is
+ahead of UTC: its time zone plus any drift.
+"""
+import array
+import bisect
+import math
+import os
+import re
+import warnings
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+
+from .metadata import NO_TIME, NUMPY_AVAILABLE, np
+
+MAX_GAP = 300      # seconds between two fixes that are still interpolated
+TOLERANCE = 60     # seconds to the nearest fix when interpolation is not possible
+
+NMEA_EXTS = ('.nmea', '.nma', '.log', '.txt')
+TRACK_EXTS = ('.gpx',) + NMEA_EXTS
+
+
+class TrackError(Exception):
+    pass
+
+
+def parse_time(text):
+    """ISO 8601 time ('Z', an offset or none for UTC) -> seconds since the epoch, or None"""
+    try:
+        t = datetime.fromisoformat(text.strip())
+    except (ValueError, AttributeError):
+        return None
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return t.timestamp()
+
+
+def parse_times(texts):
+    """parse_time over many texts -> list of seconds (NaN when unreadable)"""
+    if NUMPY_AVAILABLE:
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')   # time zone offsets: parse one by one
+                stamps = np.array([t[:-1] if t.endswith('Z') else t for t in texts], dtype='datetime64[ms]')
+            return (stamps.astype('i8') / 1000.0).tolist()
+        except (ValueError, Warning):
+            pass
+    return [math.nan if t is None else t for t in map(parse_time, texts)]
+
+
+def _read_gpx_xml(path):
+    """read_gpx through ElementTree: any valid GPX layout"""
+    stamps, lats, lons, eles = [], array.array('d'), array.array('d'), array.array('d')
+    try:
+        # Streamed: elements are dropped as soon as they are read
+        for _, elem in ET.iterparse(path):
+            tag = elem.tag.rpartition('}')[2]
+            if tag not in ('trkpt', 'rtept'):
+                if tag in ('trkseg', 'trk', 'rte'):
+                    elem.clear()
+                continue
+            when = ele = None
+            for child in elem:
+                name = child.tag.rpartition('}')[2]
+                if name == 'time':
+                    when = child.text
+                elif name == 'ele':
+                    ele = child.text
+            lat, lon = elem.get('lat'), elem.get('lon')
+            elem.clear()
+            if not when:
+                continue
+            try:
+                lat, lon = float(lat), float(lon)
+                ele = float(ele) if ele else math.nan
+            except (TypeError, ValueError):
+                continue
+            stamps.append(when)
+            lats.append(lat)
+            lons.append(lon)
+            eles.append(ele)
+    except ET.ParseError as e:
+        raise TrackError(f"{os.path.basename(path)}: {e}") from e
+    return array.array('d', parse_times(stamps)), lats, lons, eles
+
+
+# The layout nearly every logger writes, matched by one findall per block of
+# text: a million-point log loads several times faster than through
+# ElementTree, which is still used for any file that deviates from it
+_GPX_POINT = re.compile(r'<(trkpt|rtept) lat="([^"]*)" lon="([^"]*)">\s*'
+                        r'(?:<ele>([^<]*)</ele>\s*)?<time>([^<]*)</time>.*?</\1>', re.S)
+_GPX_OPEN = re.compile(r'<(?:[\w.-]+:)?(?:trkpt|rtept)\b')
+GPX_BLOCK = 1 << 22
+
+
+def _floats(texts):
+    if NUMPY_AVAILABLE:
+        return np.array(texts, dtype='f8').tolist()
+    return [float(t) for t in texts]
+
+
+def _read_gpx_fast(path):
+    """read_gpx for the common layout, or None when the file deviates from it"""
+    stamps, lats, lons, eles = [], array.array('d'), array.array('d'), array.array('d')
+    with open(path, encoding='utf-8', errors='replace') as f:
+        tail = ''
+        while True:
+            block = f.read(GPX_BLOCK)
+            text = tail + block
+            # Up to the end of the last complete point; the rest waits for the next block
+            cut = max(text.rfind('</trkpt>'), text.rfind('</rtept>'))
+            cut = len(text) if not block else cut + 8 if cut >= 0 else 0
+            points = _GPX_POINT.findall(text, 0, cut)
+            if len(points) != len(_GPX_OPEN.findall(text, 0, cut)):
+                return None
+            if points:
+                _, lat, lon, ele, when = zip(*points)
+                try:
+                    lats.extend(_floats(lat))
+                    lons.extend(_floats(lon))
+                    eles.extend(_floats([e.strip() or 'nan' for e in ele]))
+                except ValueError:
+                    return None
+                stamps.extend(when)
+            if not block:
+                break
+            tail = text[cut:]
+    return array.array('d', parse_times(stamps)), lats, lons, eles
+
+
+def read_gpx(path):
+    """(times, lats, lons, eles) arrays of every timed track and route point"""
+    fixes = _read_gpx_fast(path) or _read_gpx_xml(path)
+    times = fixes[0]
+    if any(t != t for t in times):
+        keep = [i for i, t in enumerate(times) if t == t]
+        return tuple(array.array('d', (values[i] for i in keep)) for values in fixes)
+    return fixes
+
+
+def _nmea_degrees(value, hemisphere):
+    """'ddmm.mmmm' / 'dddmm.mmmm' and N/S/E/W -> signed degrees"""
+    head, _, _ = value.partition('.')
+    degrees = float(value[:len(head) - 2]) + float(value[len(head) - 2:]) / 60
+    return -degrees if hemisphere in ('S', 'W') else degrees
+
+
+def _nmea_valid(line):
+    body, star, checksum = line.partition('*')
+    if not star:
+        return True
+    total = 0
+    for c in body[1:].encode('ascii', 'replace'):
+        total ^= c
+    try:
+        return total == int(checksum[:2], 16)
+    except ValueError:
+        return False
+
+
+def read_nmea(path):
+    """(times, lats, lons, eles) arrays from the RMC fixes of an NMEA log,
+    with the altitude of the GGA sentence of the same second"""
+    times, lats, lons, eles = array.array('d'), array.array('d'), array.array('d'), array.array('d')
+    last_clock = None       # hhmmss of the last RMC fix
+    altitudes = {}          # hhmmss -> altitude from GGA
+    with open(path, encoding='ascii', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            start = line.find('$')
+            if start < 0:
+                continue
+            line = line[start:]
+            kind = line[3:6]
+            if kind not in ('RMC', 'GGA') or not _nmea_valid(line):
+                continue
+            fields = line.partition('*')[0].split(',')
+            try:
+                if kind == 'GGA':
+                    if len(fields) > 9 and fields[6] not in ('', '0') and fields[9]:
+                        clock = fields[1][:6]
+                        altitudes[clock] = float(fields[9])
+                        if clock == last_clock and eles and math.isnan(eles[-1]):
+                            eles[-1] = altitudes[clock]   # GGA after the RMC of its second
+                    continue
+                if len(fields) < 10 or fields[2] != 'A':
+                    continue
+                clock, date = fields[1], fields[9]
+                lat = _nmea_degrees(fields[3], fields[4])
+                lon = _nmea_degrees(fields[5], fields[6])
+                year = int(date[4:6])
+                year += 2000 if year < 80 else 1900   # two-digit RMC year
+                when = datetime(year, int(date[2:4]), int(date[0:2]),
+                                int(clock[0:2]), int(clock[2:4]), int(clock[4:6]),
+                                tzinfo=timezone.utc).timestamp() + float('0' + clock[6:])
+            except (ValueError, IndexError):
+                continue
+            last_clock = clock[:6]
+            times.append(when)
+            lats.append(lat)
+            lons.append(lon)
+            eles.append(altitudes.pop(last_clock, math.nan))
+            if len(altitudes) > 8:
+                altitudes.clear()
+    return times, lats, lons, eles
+
+
+def read_track(path):
+    """Fixes of one log file, by extension (GPX or NMEA)"""
+    if os.path.splitext(path)[1].lower() == '.gpx':
+        return read_gpx(path)
+    return read_nmea(path)
+
+
+class Track:
+    """Time-sorted GPS fixes of one or more logs"""
+
+    def __init__(self, times, lats, lons, eles):
+        if NUMPY_AVAILABLE:
+            times = np.asarray(times, dtype='f8')
+            order = np.argsort(times, kind='stable')
+            self.times = times[order]
+            self.lats = np.asarray(lats, dtype='f8')[order]
+            self.lons = np.asarray(lons, dtype='f8')[order]
+            self.eles = np.asarray(eles, dtype='f8')[order]
+        else:
+            order = sorted(range(len(times)), key=times.__getitem__)
+            self.times = array.array('d', (times[i] for i in order))
+            self.lats = array.array('d', (lats[i] for i in order))
+            self.lons = array.array('d', (lons[i] for i in order))
+            self.eles = array.array('d', (eles[i] for i in order))
+
+    @classmethod
+    def load(cls, paths):
+        """One track from several log files; raises TrackError when none has fixes"""
+        parts = [array.array('d') for _ in range(4)]
+        for path in paths:
+            try:
+                fixes = read_track(path)
+            except OSError as e:
+                raise TrackError(f"{os.path.basename(path)}: {e}") from e
+            for part, values in zip(parts, fixes):
+                part.extend(values)
+        if not parts[0]:
+            raise TrackError("No timed GPS fixes in the selected files")
+        return cls(*parts)
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def start(self):
+        return self.times[0]
+
+    @property
+    def end(self):
+        return self.times[-1]
+
+    def points(self, limit=None):
+        """[(lat, lon)] in time order, thinned to about limit points (for drawing)"""
+        step = max(1, len(self) // limit) if limit else 1
+        if NUMPY_AVAILABLE:
+            return list(zip(self.lats[::step].tolist(), self.lons[::step].tolist()))
+        return list(zip(self.lats[::step], self.lons[::step]))
+
+    def match(self, taken, offset=0, max_gap=MAX_GAP, tolerance=TOLERANCE):
+        """Positions for photo times (wall-clock seconds, NO_TIME for unknown)
+
+        Returns (lats, lons, eles) aligned with taken; NaN where a photo
+        could not be placed (NumPy arrays, or lists without NumPy).
+        """
+        if not NUMPY_AVAILABLE:
+            return self._match_python(taken, offset, max_gap, tolerance)
+        taken = np.asarray(taken, dtype='i8')
+        t = taken.astype('f8') - offset
+        t[taken == NO_TIME] = np.nan
+        times, last = self.times, len(self.times) - 1
+        after = np.searchsorted(times, t)   # first fix at or after t (NaN sorts last)
+        lo = np.clip(after - 1, 0, last)
+        hi = np.clip(after, 0, last)
+        t0, t1 = times[lo], times[hi]
+        span = t1 - t0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            w = np.where(span > 0, (t - t0) / span, 0.0)
+            inside = (t >= t0) & (t <= t1) & (span <= max_gap)
+            nearest = np.where(np.abs(t - t0) <= np.abs(t1 - t), lo, hi)
+            close = np.abs(times[nearest] - t) <= tolerance
+        w = np.clip(w, 0.0, 1.0)
+
+        lats, lons, eles = self.lats, self.lons, self.eles
+        dlon = (lons[hi] - lons[lo] + 180.0) % 360.0 - 180.0   # the short way across the antimeridian
+        lat = np.where(inside, lats[lo] + w * (lats[hi] - lats[lo]), lats[nearest])
+        lon = np.where(inside, (lons[lo] + w * dlon + 180.0) % 360.0 - 180.0, lons[nearest])
+        ele = np.where(inside, eles[lo] + w * (eles[hi] - eles[lo]), eles[nearest])
+        ele = np.where(inside & np.isnan(ele), np.fmax(eles[lo], eles[hi]), ele)
+        matched = inside | close
+        return (np.where(matched, lat, np.nan), np.where(matched, lon, np.nan),
+                np.where(matched, ele, np.nan))
+
+    def _match_python(self, taken, offset, max_gap, tolerance):
+        times, last = self.times, len(self.times) - 1
+        lats, lons, eles = self.lats, self.lons, self.eles
+        out_lat, out_lon, out_ele = [], [], []
+        for stamp in taken:
+            lat = lon = ele = math.nan
+            if stamp != NO_TIME:
+                t = stamp - offset
+                after = bisect.bisect_left(times, t)
+                lo, hi = max(after - 1, 0), min(after, last)
+                t0, t1 = times[lo], times[hi]
+                if t0 <= t <= t1 and t1 - t0 <= max_gap:
+                    w = (t - t0) / (t1 - t0) if t1 > t0 else 0.0
+                    dlon = (lons[hi] - lons[lo] + 180.0) % 360.0 - 180.0
+                    lat = lats[lo] + w * (lats[hi] - lats[lo])
+                    lon = (lons[lo] + w * dlon + 180.0) % 360.0 - 180.0
+                    ele = eles[lo] + w * (eles[hi] - eles[lo])
+                    if ele != ele:
+                        ele = eles[lo] if eles[lo] == eles[lo] else eles[hi]
+                else:
+                    near = lo if abs(t - t0) <= abs(t1 - t) else hi
+                    if abs(times[near] - t) <= tolerance:
+                        lat, lon, ele = lats[near], lons[near], eles[near]
+            out_lat.append(lat)
+            out_lon.append(lon)
+            out_ele.append(ele)
+        return out_lat, out_lon, out_ele
@@ -0,0 +1,96 @@
+"""Optional dependencies, probed at start-up and imported on first use.
+
+``folium`` alone pulls in jinja2, branca and requests; importing it and
+geopy up front is most of the time before the window appears. A
+``Capability`` only looks for the module with ``importlib.util.find_spec``
+(no import) so the status bar can show what is installed, and imports it the
+first time an attribute is used. ``folium = FOLIUM`` therefore works as a
+drop-in module name. ``warm()`` imports them on a background thread once the
+window is up.
+"""
+import importlib
+import importlib.util
+import os
+import threading
+
+HEIF_EXTS = ('.heic', '.heif')
+
+
+class Capability:
+    def __init__(self, label, module, setup=None):
+        self.label = label
+        self.module_name = module
+        self.setup = setup
+        self._module = None
+        self._failed = False
+        self._lock = threading.Lock()
+        try:
+            top = module.split('.')[0]
+            self._found = importlib.util.find_spec(top) is not None
+        except (ImportError, ValueError):
+            self._found = False
+
+    @property
+    def available(self):
+        """Installed (and, once imported, importable)"""
+        return self._found and not self._failed
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def load(self):
+        """The module (imported and set up on first call), or None when unavailable"""
+        if self._module is not None or not self.available:
+            return self._module
+        with self._lock:
+            if self._module is None and not self._failed:
+                try:
+                    module = importlib.import_module(self.module_name)
+                    if self.setup:
+                        self.setup(module)
+                    self._module = module
+                except Exception as e:
+                    print(f"Optional module {self.module_name} unusable: {e}")
+                    self._failed = True
+        return self._module
+
+    def __getattr__(self, name):
+        # Only reached for attributes the Capability itself does not have
+        if name.startswith('__'):
+            raise AttributeError(name)
+        module = self.load()
+        if module is None:
+            raise ImportError(f"{self.module_name} is not installed")
+        return getattr(module, name)
+
+
+def _register_heif(module):
+    module.register_heif_opener()
+
+
+EXIFREAD = Capability('exif', 'exifread')
+HEIF = Capability('heic', 'pillow_heif', setup=_register_heif)
+FOLIUM = Capability('map', 'folium')
+GEOPY = Capability('geo', 'geopy.geocoders')
+CAPABILITIES = (EXIFREAD, HEIF, FOLIUM, GEOPY)
+
+
+def ensure_opener(path):
+    """Register the HEIF opener with Pillow before a HEIC/HEIF file is opened"""
+    if not HEIF.loaded and os.path.splitext(path)[1].lower() in HEIF_EXTS:
+        HEIF.load()
+
+
+def warm(capabilities=CAPABILITIES):
+    """Import the available modules on a daemon thread; returns the thread,
+    or None when GEOSNAP_WARM_IMPORTS=0"""
+    if os.environ.get('GEOSNAP_WARM_IMPORTS', '1') == '0':
+        return None
+
+    def run():
+        for cap in capabilities:
+            cap.load()
+    thread = threading.Thread(target=run, name='warm-imports', daemon=True)
+    thread.start()
+    return thread
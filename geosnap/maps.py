@@ -0,0 +1,110 @@
+"""Folium map builders shared by the front-ends (no GUI dependency)."""
+from pathlib import Path
+
+from .lazy import FOLIUM
+
+FOLIUM_AVAILABLE = FOLIUM.available
+folium = FOLIUM   # imported on first use
+
+
+def route_map(gps_images):
+    """folium.Map with a marker per (path, gps) photo and the route between them"""
+    lats = [g['lat'] for _, g in gps_images]
+    lons = [g['lon'] for _, g in gps_images]
+    center_lat = sum(lats) / len(lats)
+    center_lon = sum(lons) / len(lons)
+
+    m = folium.Map(location=[center_lat, center_lon], zoom_start=12)
+
+    for i, (path, gps) in enumerate(gps_images, 1):
+        popup_html = f"""
+        <div style='font-family: Segoe UI; width: 250px; padding: 10px;'>
+            <h4 style='margin: 0 0 8px 0; color: #0067C0;'>#{i} - {Path(path).name[:30]}</h4>
+            <p style='margin: 4px 0;'><b>Tọa độ:</b> {gps['lat']:.6f}, {gps['lon']:.6f}</p>
+            <p style='margin: 4px 0;'><b>Độ cao:</b> {gps['alt']}</p>
+            <p style='margin: 4px 0;'><b>Thời gian:</b> {gps['time'][:19]}</p>
+        </div>
+        """
+
+        color = 'red' if i == 1 else ('green' if i == len(gps_images) else 'blue')
+
+        folium.Marker(
+            [gps['lat'], gps['lon']],
+            popup=folium.Popup(popup_html, max_width=280),
+            tooltip=f"#{i} - {Path(path).name[:28]}",
+            icon=folium.Icon(color=color, icon='camera', prefix='fa')
+        ).add_to(m)
+
+    if len(gps_images) > 1:
+        coordinates = [[g['lat'], g['lon']] for _, g in gps_images]
+        folium.PolyLine(
+            coordinates,
+            color='#0067C0',
+            weight=3,
+            opacity=0.7,
+            popup=f"Tuyến đường: {len(gps_images)} ảnh"
+        ).add_to(m)
+
+    legend_html = f"""
+    <div style="position: fixed; bottom: 50px; left: 50px; width: 240px;
+                background: linear-gradient(135deg, white 0%, #f8f9fa 100%);
+                border: 3px solid #0067C0; z-index: 9999;
+                border-radius: 12px; padding: 20px; font-family: 'Segoe UI';
+                box-shadow: 0 8px 24px rgba(0,103,192,0.3);">
+        <h3 style="margin: 0 0 14px 0; color: #0067C0; font-size: 18px; font-weight: 600;">
+            📍 GeoSnap Map
+        </h3>
+        <p style="margin: 8px 0; font-size: 11pt; color: #333;">🔴 Ảnh đầu tiên</p>
+        <p style="margin: 8px 0; font-size: 11pt; color: #333;">🔵 Ảnh ở giữa</p>
+        <p style="margin: 8px 0; font-size: 11pt; color: #333;">🟢 Ảnh cuối cùng</p>
+        <hr style="margin: 14px 0; border: 1px solid #e0e0e0;">
+        <p style="margin: 8px 0; font-weight: 600; font-size: 12pt; color: #0067C0;">
+            📊 Tổng: {len(gps_images)} ảnh
+        </p>
+    </div>
+    """
+    m.get_root().html.add_child(folium.Element(legend_html))
+    return m
+
+
+def geotag_map(track_points, photos):
+    """folium.Map of a GPS log and the photos placed on it
+
+    track_points: [(lat, lon)] in time order; photos: [(path, lat, lon, time text)].
+    """
+    lats = [lat for lat, _ in track_points]
+    lons = [lon for _, lon in track_points]
+    m = folium.Map(location=[sum(lats) / len(lats), sum(lons) / len(lons)], zoom_start=12)
+    m.fit_bounds([[min(lats), min(lons)], [max(lats), max(lons)]])
+
+    folium.PolyLine(
+        track_points,
+        color='#FF6B00',
+        weight=3,
+        opacity=0.8,
+        popup=f"Nhật ký GPS: {len(track_points)} điểm"
+    ).add_to(m)
+
+    for path, lat, lon, when in photos:
+        folium.CircleMarker(
+            [lat, lon],
+            radius=6,
+            color='#0067C0',
+            fill=True,
+            fillOpacity=0.8,
+            popup=folium.Popup(f"<b>{Path(path).name[:40]}</b><br>{lat:.6f}, {lon:.6f}<br>{when}", max_width=280),
+            tooltip=Path(path).name[:28]
+        ).add_to(m)
+
+    legend_html = f"""
+    <div style="position: fixed; bottom: 50px; left: 50px; width: 240px;
+                background: white; border: 3px solid #0067C0; z-index: 9999;
+                border-radius: 12px; padding: 16px; font-family: 'Segoe UI';
+                box-shadow: 0 8px 24px rgba(0,103,192,0.3);">
+        <h3 style="margin: 0 0 10px 0; color: #0067C0; font-size: 16px;">🛰️ Xem trước gắn GPS</h3>
+        <p style="margin: 6px 0; font-size: 11pt;">🟠 Nhật ký GPS</p>
+        <p style="margin: 6px 0; font-size: 11pt;">🔵 Vị trí ảnh: {len(photos)}</p>
+    </div>
+    """
+    m.get_root().html.add_child(folium.Element(legend_html))
+    return m
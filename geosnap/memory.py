@@ -0,0 +1,186 @@
+"""One memory budget shared by every in-memory cache.
+
+A cache takes part by exposing ``nbytes`` (its current cost), ``shrink(max_bytes)``
+(evict until it costs at most that much, return the bytes freed) and a
+``budget`` attribute. When the registered caches together go over the limit,
+``MemoryBudget.enforce`` evicts from the lowest priority first. Pools
+registered with priority ``None`` are counted but never evicted (the photo on
+screen). ``relieve()`` halves the caches when the system is short of memory.
+
+Costs are estimates of the Python objects and pixel buffers involved, not
+allocator-exact numbers.
+"""
+import os
+import sys
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+MiB = 1024 * 1024
+MIN_LIMIT = 128 * MiB
+MAX_LIMIT = 1024 * MiB
+LOW_MEMORY_BYTES = 512 * MiB     # system memory available below this is "pressure"
+LOW_MEMORY_FRACTION = 0.10       # ... or below this share of the total
+PRESSURE_SHRINK = 0.5            # caches keep this share of their bytes under pressure
+
+
+def system_memory():
+    """(available, total) bytes of physical memory, or (None, None) if unknown"""
+    if PSUTIL_AVAILABLE:
+        vm = psutil.virtual_memory()
+        return vm.available, vm.total
+    if sys.platform == 'win32':
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(status)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys, status.ullTotalPhys
+        return None, None
+    try:
+        with open('/proc/meminfo') as f:
+            info = dict(line.split(':', 1) for line in f)
+        return (int(info['MemAvailable'].split()[0]) * 1024,
+                int(info['MemTotal'].split()[0]) * 1024)
+    except (OSError, KeyError, ValueError):
+        pass
+    try:
+        page = os.sysconf('SC_PAGE_SIZE')
+        return os.sysconf('SC_AVPHYS_PAGES') * page, os.sysconf('SC_PHYS_PAGES') * page
+    except (AttributeError, ValueError, OSError):
+        return None, None
+
+
+def process_rss():
+    """Resident memory of this process in bytes, or None if unknown"""
+    if PSUTIL_AVAILABLE:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024   # peak, not current
+    except ImportError:
+        return None
+
+
+def default_limit():
+    """An eighth of physical memory, between MIN_LIMIT and MAX_LIMIT"""
+    total = system_memory()[1]
+    if not total:
+        return 512 * MiB
+    return max(MIN_LIMIT, min(MAX_LIMIT, total // 8))
+
+
+def object_nbytes(value, depth=4):
+    """Rough deep size of plain data: containers, strings, numbers and
+    objects with a __dict__ (exifread tags)"""
+    size = sys.getsizeof(value)
+    if depth == 0 or isinstance(value, (str, bytes, bytearray, int, float, bool)) or value is None:
+        return size
+    if isinstance(value, dict):
+        return size + sum(object_nbytes(k, depth - 1) + object_nbytes(v, depth - 1) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        if len(value) > 64:
+            # Long value arrays (MakerNotes): extrapolate from a sample
+            sample = list(value[:64]) if isinstance(value, (list, tuple)) else list(value)[:64]
+            return size + sum(object_nbytes(v, depth - 1) for v in sample) * len(value) // 64
+        return size + sum(object_nbytes(v, depth - 1) for v in value)
+    attrs = getattr(value, '__dict__', None)
+    if attrs is not None:
+        return size + object_nbytes(attrs, depth - 1)
+    return size
+
+
+class Gauge:
+    """Memory that is counted in the budget but cannot be evicted"""
+
+    budget = None
+
+    def __init__(self, measure):
+        self.measure = measure
+
+    @property
+    def nbytes(self):
+        return self.measure()
+
+    def __len__(self):
+        return 1 if self.measure() else 0
+
+    def shrink(self, max_bytes):
+        return 0
+
+
+class MemoryBudget:
+    def __init__(self, limit=None):
+        self.limit = limit or default_limit()
+        self.pools = []          # [(priority, name, pool)], lowest priority first
+        self.evicted = 0         # bytes freed by enforce() since start
+        self.pressure_events = 0
+
+    def register(self, name, pool, priority):
+        """Put pool under the budget; lower priority is evicted first, None never"""
+        pool.budget = self
+        self.pools.append((priority, name, pool))
+        self.pools.sort(key=lambda p: (p[0] is None, p[0] or 0))
+
+    def used(self):
+        return sum(pool.nbytes for _, _, pool in self.pools)
+
+    def enforce(self, limit=None):
+        """Evict until the pools fit in limit (the budget by default); returns bytes freed"""
+        limit = self.limit if limit is None else limit
+        excess = self.used() - limit
+        freed = 0
+        for priority, _, pool in self.pools:
+            if excess <= freed or priority is None:
+                break
+            freed += pool.shrink(max(0, pool.nbytes - (excess - freed)))
+        self.evicted += freed
+        return freed
+
+    def under_pressure(self):
+        available, total = system_memory()
+        if available is None:
+            return False
+        return available < LOW_MEMORY_BYTES or available < total * LOW_MEMORY_FRACTION
+
+    def relieve(self):
+        """Shrink the evictable pools when the system is low on memory"""
+        if not self.under_pressure():
+            return 0
+        self.pressure_events += 1
+        freed = 0
+        for priority, _, pool in self.pools:
+            if priority is not None:
+                freed += pool.shrink(int(pool.nbytes * PRESSURE_SHRINK))
+        self.evicted += freed
+        return freed
+
+    def release(self):
+        """Empty every evictable pool; returns bytes freed"""
+        freed = sum(pool.shrink(0) for priority, _, pool in self.pools if priority is not None)
+        self.evicted += freed
+        return freed
+
+    def report(self):
+        """[{name, entries, bytes, priority, stats}] for every pool, biggest first
+        (stats: the pool's CacheStats, None for gauges)"""
+        rows = [{'name': name, 'entries': len(pool), 'bytes': pool.nbytes, 'priority': priority,
+                 'stats': getattr(pool, 'stats', None)}
+                for priority, name, pool in self.pools]
+        rows.sort(key=lambda r: -r['bytes'])
+        return rows
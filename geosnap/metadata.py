@@ -0,0 +1,429 @@
+"""Columnar in-memory photo metadata.
+
+Every photo is one row. Columns are compact ``array.array`` buffers (about 85
+bytes per row), categorical strings such as the camera are stored as integer
+codes. When NumPy is installed the columns are viewed zero-copy as ndarrays so
+filters become boolean masks and sorts become argsorts; without it the same
+API falls back to plain Python loops over the arrays.
+
+Masks are NumPy bool arrays when NumPy is available, ``bytearray`` otherwise.
+Views returned by ``column()`` must not be kept across ``add()``: an array
+cannot grow while a buffer export is alive.
+"""
+import array
+import calendar
+import itertools
+import os
+import time
+
+from .exif import ratio, gps_from_tags
+from .fileattrs import stat_many
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+NAN = float('nan')
+NO_TIME = -(2 ** 63)  # missing timestamp sentinel in int64 columns
+
+# column name -> array typecode
+COLUMNS = {
+    'lat': 'd',
+    'lon': 'd',
+    'alt': 'f',
+    'taken': 'q',      # DateTimeOriginal, seconds since epoch (wall clock)
+    'digitized': 'q',  # DateTimeDigitized, same encoding
+    'mtime': 'd',
+    'ctime': 'd',
+    'size': 'q',
+    'inode': 'q',
+    'iso': 'i',
+    'exposure': 'f',   # seconds
+    'camera': 'i',     # code into table.categories['camera']
+    'lens': 'i',
+}
+CATEGORICAL = ('camera', 'lens')
+DEFAULTS = {
+    'lat': NAN, 'lon': NAN, 'alt': NAN, 'taken': NO_TIME, 'digitized': NO_TIME, 'mtime': 0.0,
+    'ctime': 0.0, 'size': 0, 'inode': 0, 'iso': 0, 'exposure': NAN, 'camera': 0, 'lens': 0,
+}
+NP_TYPES = {'d': 'f8', 'f': 'f4', 'q': 'i8', 'i': 'i4', 'B': 'u1'}
+
+# bits in MetadataTable.loaded
+HAS_STAT = 1
+HAS_EXIF = 2
+MISSING = 4   # the file was gone at its last stat
+REMOVED = 8   # tombstone: the path left the library (rows are never reused)
+
+
+def parse_exif_datetime(value):
+    """'YYYY:MM:DD HH:MM:SS' -> int seconds, treating the wall clock as UTC"""
+    s = str(value).strip()
+    if len(s) < 19:
+        return NO_TIME
+    try:
+        t = time.strptime(s[:19], '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return NO_TIME
+    return calendar.timegm(t)
+
+
+def camera_name(tags):
+    make = str(tags.get('Image Make', '')).strip()
+    model = str(tags.get('Image Model', '')).strip()
+    return f"{make} {model}".strip()
+
+
+def record_from_tags(tags):
+    """Typed metadata values from an exifread tag dict"""
+    rec = {
+        'camera': camera_name(tags),
+        'lens': str(tags.get('EXIF LensModel', '')).strip(),
+        'taken': parse_exif_datetime(tags.get('EXIF DateTimeOriginal', '')),
+        'digitized': parse_exif_datetime(tags.get('EXIF DateTimeDigitized', '')),
+    }
+    try:
+        gps = gps_from_tags(tags)
+    except Exception:
+        gps = None
+    if gps:
+        rec['lat'] = gps['lat']
+        rec['lon'] = gps['lon']
+        if 'GPS GPSAltitude' in tags:
+            alt = ratio(tags['GPS GPSAltitude'].values[0])
+            if str(tags.get('GPS GPSAltitudeRef', '0')) == '1':
+                alt = -alt
+            rec['alt'] = alt
+    try:
+        iso = tags.get('EXIF ISOSpeedRatings')
+        if iso is not None:
+            rec['iso'] = int(iso.values[0])
+    except (ValueError, TypeError, IndexError, AttributeError):
+        pass
+    try:
+        exposure = tags.get('EXIF ExposureTime')
+        if exposure is not None:
+            rec['exposure'] = ratio(exposure.values[0])
+    except (ZeroDivisionError, IndexError, AttributeError):
+        pass
+    return rec
+
+
+def gps_of(table, row):
+    """{'lat', 'lon', 'alt', 'time'} like gps_from_tags, or None without GPS"""
+    lat = table.cols['lat'][row]
+    if lat != lat:
+        return None
+    alt = table.cols['alt'][row]
+    taken = table.cols['taken'][row]
+    return {'lat': lat, 'lon': table.cols['lon'][row],
+            'alt': 'N/A' if alt != alt else f"{alt:.1f} m",
+            'time': 'N/A' if taken == NO_TIME else time.strftime('%Y:%m:%d %H:%M:%S', time.gmtime(taken))}
+
+
+def _new_mask(n, value=False):
+    if NUMPY_AVAILABLE:
+        return np.full(n, value, dtype=bool)
+    return bytearray([1 if value else 0]) * n
+
+
+def mask_and(a, b):
+    if NUMPY_AVAILABLE:
+        return a & b
+    return bytearray(x & y for x, y in zip(a, b))
+
+
+def mask_or(a, b):
+    if NUMPY_AVAILABLE:
+        return a | b
+    return bytearray(x | y for x, y in zip(a, b))
+
+
+def mask_not(a):
+    if NUMPY_AVAILABLE:
+        return ~a
+    return bytearray(1 - x for x in a)
+
+
+def mask_count(a):
+    if NUMPY_AVAILABLE:
+        return int(a.sum())
+    return sum(a)
+
+
+class Categorical:
+    """String <-> int code dictionary; code 0 is the empty string"""
+
+    def __init__(self):
+        self.values = ['']
+        self.codes = {'': 0}
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def decode(self, code):
+        return self.values[code]
+
+
+class MetadataTable:
+    """Photo metadata as typed columns, one row per path"""
+
+    def __init__(self):
+        self.paths = []
+        self._names = []  # lower-cased basenames, for search (see names)
+        self.row_of = {}
+        self.cols = {name: array.array(code) for name, code in COLUMNS.items()}
+        self.categories = {name: Categorical() for name in CATEGORICAL}
+        self.loaded = bytearray()  # HAS_STAT | HAS_EXIF | MISSING | REMOVED bits per row
+        self.version = 0           # bumped on every change, for caches
+        self.layout = 0            # bumped when rows are added, removed or renamed
+        self.listeners = []        # callables(row) run after a row is added or changed
+
+    @classmethod
+    def from_columns(cls, paths, cols, loaded, categories):
+        """Table over existing data: cols {name: array}, loaded flags and the
+        categorical values lists, all row-aligned with paths"""
+        table = cls()
+        table.paths = list(paths)
+        table._names = None
+        table.row_of = dict(zip(table.paths, range(len(table.paths))))
+        for name, col in cols.items():
+            table.cols[name] = col
+        table.loaded = bytearray(loaded)
+        for name, values in categories.items():
+            cat = table.categories[name]
+            cat.values = list(values)
+            cat.codes = {v: i for i, v in enumerate(cat.values)}
+        return table
+
+    @property
+    def names(self):
+        """Lower-cased basenames, for search; built on first use for tables
+        made from_columns (exports never need them)"""
+        if self._names is None:
+            self._names = [name.lower() for name in map(os.path.basename, self.paths)]
+        return self._names
+
+    def _changed(self, row):
+        self.version += 1
+        for listener in self.listeners:
+            listener(row)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        return path in self.row_of
+
+    def add(self, path):
+        """Append a row for a path (no metadata yet) and return its index"""
+        row = self.row_of.get(path)
+        if row is not None:
+            return row
+        row = len(self.paths)
+        self.layout += 1
+        self.paths.append(path)
+        if self._names is not None:
+            self._names.append(os.path.basename(path).lower())
+        self.row_of[path] = row
+        for name, col in self.cols.items():
+            col.append(DEFAULTS[name])
+        self.loaded.append(0)
+        self._changed(row)
+        return row
+
+    def remove(self, path):
+        """Tombstone a path's row; adding the path again creates a fresh row"""
+        row = self.row_of.pop(path, None)
+        if row is not None:
+            self.layout += 1
+            self.loaded[row] |= REMOVED
+            self._changed(row)
+        return row
+
+    def rename(self, old, new):
+        """Move a row's metadata to a new path (a new row), tombstoning the old one"""
+        row = self.row_of.get(old)
+        if row is None:
+            return self.add(new)
+        new_row = self.add(new)
+        for col in self.cols.values():
+            col[new_row] = col[row]
+        self.loaded[new_row] = self.loaded[row]
+        self.remove(old)
+        self._changed(new_row)
+        return new_row
+
+    def invalidate(self, row, flag=HAS_EXIF):
+        """Forget that a row was loaded (e.g. the file changed on disk)"""
+        self.loaded[row] &= ~flag
+        self._changed(row)
+
+    def set(self, row, rec):
+        """Store typed values (see record_from_tags) for a row"""
+        for name, value in rec.items():
+            if name in self.categories:
+                value = self.categories[name].encode(value)
+            self.cols[name][row] = value
+        self._changed(row)
+
+    def set_stat(self, row, st):
+        """Store file attributes (st=None: missing); False if nothing changed"""
+        cols, loaded = self.cols, self.loaded
+        if st is None:
+            if loaded[row] & MISSING:
+                return False
+            loaded[row] |= HAS_STAT | MISSING
+        else:
+            if (loaded[row] & (HAS_STAT | MISSING) == HAS_STAT and cols['mtime'][row] == st.st_mtime
+                    and cols['size'][row] == st.st_size and cols['inode'][row] == st.st_ino):
+                return False
+            cols['size'][row] = st.st_size
+            cols['mtime'][row] = st.st_mtime
+            cols['ctime'][row] = st.st_ctime
+            cols['inode'][row] = st.st_ino
+            loaded[row] = (loaded[row] | HAS_STAT) & ~MISSING
+        self._changed(row)
+        return True
+
+    def value(self, name, row):
+        v = self.cols[name][row]
+        if name in self.categories:
+            return self.categories[name].decode(v)
+        return v
+
+    def unloaded(self, paths, flag=HAS_EXIF):
+        """Paths whose row is missing the given HAS_* bit"""
+        loaded, row_of = self.loaded, self.row_of
+        return [p for p in paths if not loaded[row_of[p]] & flag]
+
+    def load_stat(self, paths):
+        """Fill file attributes for rows that have not been stat'ed yet"""
+        for p, st in stat_many(self.unloaded(paths, HAS_STAT)).items():
+            self.set_stat(self.row_of[p], st)
+
+    def load_exif(self, paths, read_tags):
+        """Parse metadata for rows not loaded yet using read_tags(path)"""
+        for p in self.unloaded(paths, HAS_EXIF):
+            row = self.row_of[p]
+            self.loaded[row] |= HAS_EXIF
+            self.set(row, record_from_tags(read_tags(p)))
+
+    # ---------- vector access ----------
+
+    def column(self, name):
+        """NumPy view of a column (zero-copy), or the raw array without NumPy"""
+        col = self.cols[name]
+        if NUMPY_AVAILABLE:
+            return np.frombuffer(col, dtype=NP_TYPES[col.typecode], count=len(col))
+        return col
+
+    def rows(self, paths):
+        """Row indices for paths, keeping their order"""
+        if NUMPY_AVAILABLE:
+            return np.fromiter(map(self.row_of.__getitem__, paths), dtype=np.int64, count=len(paths))
+        return [self.row_of[p] for p in paths]
+
+    def select(self, paths, mask):
+        """Paths (in the given order) whose row is set in mask"""
+        rows = self.rows(paths)
+        if NUMPY_AVAILABLE:
+            return list(itertools.compress(paths, mask[rows].tolist()))
+        return [p for p, r in zip(paths, rows) if mask[r]]
+
+    def select_rows(self, rows, mask):
+        """Subset of rows (keeping order) whose bit is set in mask"""
+        if NUMPY_AVAILABLE:
+            return rows[mask[rows]]
+        return [r for r in rows if mask[r]]
+
+    def paths_of(self, rows):
+        paths = self.paths
+        if NUMPY_AVAILABLE and not isinstance(rows, list):
+            rows = rows.tolist()
+        return [paths[r] for r in rows]
+
+    def take(self, rows):
+        """Independent table of some rows (in that order), e.g. for a reader
+        on another thread while this one keeps growing"""
+        if NUMPY_AVAILABLE:
+            rows = np.asarray(rows, dtype=np.int64)
+            cols = {name: array.array(col.typecode, self.column(name)[rows].tobytes())
+                    for name, col in self.cols.items()}
+            loaded = np.frombuffer(self.loaded, dtype=np.uint8)[rows].tobytes()
+        else:
+            cols = {name: array.array(col.typecode, [col[r] for r in rows]) for name, col in self.cols.items()}
+            loaded = bytes(self.loaded[r] for r in rows)
+        categories = {name: cat.values for name, cat in self.categories.items()}
+        return MetadataTable.from_columns(self.paths_of(rows), cols, loaded, categories)
+
+    def argsort(self, paths, name, reverse=False):
+        """Paths reordered by a column, stable for equal keys"""
+        rows = self.rows(paths)
+        if NUMPY_AVAILABLE:
+            keys = self.column(name)[rows]
+            if reverse:
+                keys = -keys if keys.dtype.kind == 'f' else ~keys
+            order = np.argsort(keys, kind='stable')
+            return [paths[i] for i in order.tolist()]
+        col = self.cols[name]
+        return sorted(paths, key=lambda p: col[self.row_of[p]], reverse=reverse)
+
+    # ---------- masks ----------
+
+    def mask_all(self):
+        return _new_mask(len(self))
+
+    def mask_has_gps(self):
+        if NUMPY_AVAILABLE:
+            return ~np.isnan(self.column('lat'))
+        lat = self.cols['lat']
+        return bytearray(0 if v != v else 1 for v in lat)
+
+    def mask_equals(self, name, value):
+        """Rows whose categorical column equals value"""
+        code = self.categories[name].codes.get(value)
+        if code is None:
+            return _new_mask(len(self))
+        if NUMPY_AVAILABLE:
+            return self.column(name) == code
+        return bytearray(1 if v == code else 0 for v in self.cols[name])
+
+    def mask_range(self, name, lo=None, hi=None):
+        """Rows with lo <= value <= hi (missing values never match)"""
+        if NUMPY_AVAILABLE:
+            col = self.column(name)
+            mask = ~np.isnan(col) if col.dtype.kind == 'f' else col != NO_TIME
+            if lo is not None:
+                mask &= col >= lo
+            if hi is not None:
+                mask &= col <= hi
+            return mask
+        lo = float('-inf') if lo is None else lo
+        hi = float('inf') if hi is None else hi
+        return bytearray(1 if lo <= v <= hi and v != NO_TIME else 0 for v in self.cols[name])
+
+    def category_counts(self, name, paths=None):
+        """{value: count} for a categorical column, optionally within paths"""
+        cat = self.categories[name]
+        if NUMPY_AVAILABLE:
+            codes = self.column(name)
+            if paths is not None:
+                codes = codes[self.rows(paths)]
+            counts = np.bincount(codes, minlength=len(cat.values)).tolist()
+        else:
+            counts = [0] * len(cat.values)
+            codes = self.cols[name]
+            for r in (self.rows(paths) if paths is not None else range(len(codes))):
+                counts[codes[r]] += 1
+        return {cat.values[c]: n for c, n in enumerate(counts) if n and c}
+
+    def nbytes(self):
+        return sum(col.itemsize * len(col) for col in self.cols.values()) + len(self.loaded)
@@ -0,0 +1,13 @@
+"""Locations of GeoSnap's per-user data files."""
+import os
+
+
+def data_dir():
+    """Return (and create) the directory holding indexes and caches"""
+    path = os.environ.get('GEOSNAP_HOME') or os.path.join(os.path.expanduser('~'), '.geosnap')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def data_path(name):
+    return os.path.join(data_dir(), name)
@@ -0,0 +1,111 @@
+"""Bulk reverse geocoding of a photo library into country/region/city facets.
+
+Photos are bucketed into grid cells (``CELL_DEG`` degrees, ~1 km), and each
+unique cell is geocoded once at its centre. Both the photo -> cell mapping
+and every resolved cell are written to the ``IndexStore`` as soon as they are
+known, so a cancelled job resumes where it stopped.
+"""
+import math
+import os
+
+from .exif import read_gps
+from .store import IndexStore
+
+CELL_DEG = 0.01
+PLACE_LEVELS = ('country', 'region', 'city')
+
+
+def cell_key(lat, lon, size=CELL_DEG):
+    return f"{math.floor(lat / size)}:{math.floor(lon / size)}"
+
+
+def cell_center(cell, size=CELL_DEG):
+    i, j = (int(v) for v in cell.split(':'))
+    return (i + 0.5) * size, (j + 0.5) * size
+
+
+class PlaceJob:
+    """Resolve country/region/city for a list of photo paths"""
+
+    def __init__(self, geocoder, store_path=None, should_stop=None, progress=None):
+        self.geocoder = geocoder
+        self.store_path = store_path
+        self.should_stop = should_stop or (lambda: False)
+        self.progress = progress or (lambda stage, done, total: None)
+
+    def _locate(self, store, paths):
+        """Map each path to its cell, reading EXIF only for new/changed files"""
+        known = store.photo_cells(paths)
+        cells, pending = {}, []
+        total = len(paths)
+        for i, p in enumerate(paths):
+            if self.should_stop():
+                break
+            try:
+                mtime = os.path.getmtime(p)
+            except OSError:
+                continue
+            hit = known.get(p)
+            if hit and hit[0] == mtime:
+                cell = hit[1]
+            else:
+                gps = read_gps(p)
+                cell = cell_key(gps['lat'], gps['lon']) if gps else None
+                pending.append((p, mtime, cell))
+                if len(pending) >= 200:
+                    store.put_photo_cells(pending)
+                    pending = []
+            if cell:
+                cells[p] = cell
+            if i % 50 == 0:
+                self.progress('scan', i, total)
+        if pending:
+            store.put_photo_cells(pending)
+        return cells
+
+    def _resolve(self, store, cells):
+        """Geocode unique cells that are not in the store yet"""
+        backend = getattr(self.geocoder, 'name', 'unknown')
+        places = store.places(set(cells), backend)
+        todo = sorted(set(cells) - set(places))
+        # Online backends rate-limit themselves (see NominatimGeocoder.limiter)
+        for i, cell in enumerate(todo):
+            if self.should_stop():
+                break
+            lat, lon = cell_center(cell)
+            try:
+                place = self.geocoder.reverse(lat, lon)
+            except Exception as e:
+                # Network errors are retried on the next run
+                print(f"Geocoding error for cell {cell}: {e}")
+                continue
+            store.put_place(cell, place, backend)
+            places[cell] = place or {'city': '', 'region': '', 'country': ''}
+            self.progress('geocode', i + 1, len(todo))
+        return places
+
+    def run(self, paths):
+        """Return {path: {'country', 'region', 'city'}} for geotagged paths"""
+        store = IndexStore(self.store_path)
+        try:
+            cells = self._locate(store, list(paths))
+            places = self._resolve(store, cells.values())
+        finally:
+            store.close()
+        result = {}
+        for p, cell in cells.items():
+            place = places.get(cell)
+            if place:
+                result[p] = {level: place.get(level) or '' for level in PLACE_LEVELS}
+        return result
+
+
+def place_counts(places):
+    """Count photos per place prefix: {(country,), (country, region), ...}"""
+    counts = {}
+    for place in places.values():
+        key = ()
+        for level in PLACE_LEVELS:
+            key += (place.get(level) or '?',)
+            counts[key] = counts.get(key, 0) + 1
+    return counts
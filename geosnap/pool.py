@@ -0,0 +1,48 @@
+"""Process-pool helpers for per-file jobs (hashing, thumbnails)."""
+import multiprocessing
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+IN_FLIGHT_PER_WORKER = 4
+
+
+def default_workers():
+    return max(1, min(8, os.cpu_count() or 1))
+
+
+def quiet_worker():
+    """Pool initializer: keep worker diagnostics (EXIF read errors) off the parent's stdout"""
+    sys.stdout = sys.stderr
+
+
+def process_pool(workers):
+    """ProcessPoolExecutor with quiet workers, safe to start from a thread
+
+    Forking a process whose other threads (Qt, SQLite, executors) hold locks
+    can deadlock the children, so workers come from a fork server, or are
+    spawned where there is none.
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(method), initializer=quiet_worker)
+
+
+def imap_bounded(pool, func, jobs, workers, should_stop=None):
+    """Yield func(job) results as they finish, with at most a few jobs queued per worker
+
+    Keeping the queue short bounds memory on huge libraries while still
+    giving every worker its next file to read.
+    """
+    limit = workers * IN_FLIGHT_PER_WORKER
+    pending, it = set(), iter(jobs)
+    while True:
+        while len(pending) < limit and not (should_stop and should_stop()):
+            job = next(it, None)
+            if job is None:
+                break
+            pending.add(pool.submit(func, job))
+        if not pending:
+            return
+        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            yield future.result()
@@ -0,0 +1,450 @@
+"""Search-box query language over the metadata table.
+
+Examples::
+
+    beach                                   filename contains "beach"
+    dsc_01*  ~sunset                        prefix match, fuzzy (trigram) match
+    camera:"SONY ILCE-7M3" iso>=3200
+    date:2024-05..2024-06 has:gps
+    near:10.77,106.70,2km -ext:png size>5MB
+
+Terms are ANDed; a leading ``-`` negates a term. A query compiles to a plan
+that evaluates all column predicates as vectorized masks first and only runs
+per-name checks on the rows that survive, through the trigram ``NameIndex``
+when there are many of them.
+"""
+import calendar
+import math
+import re
+import shlex
+
+from .metadata import HAS_EXIF, HAS_STAT, NUMPY_AVAILABLE, mask_and, mask_not, np
+from .search import NameIndex, fuzzy_matcher
+
+EARTH_RADIUS_KM = 6371.0088
+
+NUMERIC_FIELDS = ('iso', 'size', 'alt', 'exposure', 'lat', 'lon', 'date')
+TEXT_FIELDS = ('camera', 'lens')
+NAME_FIELDS = ('name', 'file', 'ext', 'type')
+HAS_FIELDS = {'gps': 'lat', 'date': 'taken', 'camera': 'camera', 'lens': 'lens'}
+COLUMN_OF = {'iso': 'iso', 'size': 'size', 'alt': 'alt', 'exposure': 'exposure',
+             'lat': 'lat', 'lon': 'lon', 'date': 'taken'}
+
+SIZE_UNITS = {'': 1, 'b': 1, 'kb': 1024, 'k': 1024, 'mb': 1024 ** 2, 'm': 1024 ** 2,
+              'gb': 1024 ** 3, 'g': 1024 ** 3}
+TERM_RE = re.compile(r'^(-?)([a-z]+)(:|>=|<=|>|<|=)(.*)$', re.S)
+
+
+class QueryError(ValueError):
+    pass
+
+
+def parse_size(text):
+    m = re.fullmatch(r'([\d.]+)\s*([a-z]*)', text.lower())
+    if not m or m.group(2) not in SIZE_UNITS:
+        raise QueryError(f"Kích thước không hợp lệ: {text}")
+    return float(m.group(1)) * SIZE_UNITS[m.group(2)]
+
+
+def parse_number(field, text):
+    if field == 'size':
+        return parse_size(text)
+    if field == 'exposure' and '/' in text:
+        num, den = text.split('/', 1)
+        try:
+            return float(num) / float(den)
+        except (ValueError, ZeroDivisionError):
+            raise QueryError(f"Tốc độ không hợp lệ: {text}")
+    try:
+        return float(text)
+    except ValueError:
+        raise QueryError(f"Số không hợp lệ: {field}={text}")
+
+
+def parse_date_range(text):
+    """'2024', '2024-05' or '2024-05-17' -> [start, end) in epoch seconds"""
+    parts = re.split(r'[-:/.]', text.strip())
+    try:
+        nums = [int(p) for p in parts if p]
+    except ValueError:
+        raise QueryError(f"Ngày không hợp lệ: {text}")
+    if not 1 <= len(nums) <= 3:
+        raise QueryError(f"Ngày không hợp lệ: {text}")
+    y, mo, d = (nums + [1, 1])[:3]
+    if not (1 <= mo <= 12 and 1 <= d <= 31):
+        raise QueryError(f"Ngày không hợp lệ: {text}")
+    try:
+        start = calendar.timegm((y, mo, d, 0, 0, 0))
+        if len(nums) == 1:
+            end = calendar.timegm((y + 1, 1, 1, 0, 0, 0))
+        elif len(nums) == 2:
+            end = calendar.timegm((y + mo // 12, mo % 12 + 1, 1, 0, 0, 0))
+        else:
+            end = start + 86400
+    except (ValueError, OverflowError):
+        raise QueryError(f"Ngày không hợp lệ: {text}")
+    return start, end
+
+
+def parse_near(text):
+    """'lat,lon[,radius]' with radius like 500m / 2km (default 1 km)"""
+    parts = [p.strip() for p in text.split(',')]
+    if len(parts) not in (2, 3):
+        raise QueryError(f"near cần lat,lon[,bán kính]: {text}")
+    try:
+        lat, lon = float(parts[0]), float(parts[1])
+    except ValueError:
+        raise QueryError(f"Tọa độ không hợp lệ: {text}")
+    radius = 1.0
+    if len(parts) == 3:
+        m = re.fullmatch(r'([\d.]+)\s*(km|m)?', parts[2].lower())
+        if not m:
+            raise QueryError(f"Bán kính không hợp lệ: {parts[2]}")
+        radius = float(m.group(1)) / (1000 if m.group(2) == 'm' else 1)
+    return lat, lon, radius
+
+
+class Term:
+    """One compiled predicate; kind is 'mask' (vectorized) or 'name'
+
+    Mask terms carry build(table) -> mask and the HAS_* bits its rows need
+    loaded. Name terms carry the lower-cased word and match ('contains',
+    'prefix', 'fuzzy' or 'endswith') checked against basenames.
+    """
+
+    def __init__(self, text, kind, negate, build=None, word='', match='contains', needs=HAS_EXIF):
+        self.text = text
+        self.kind = kind
+        self.negate = negate
+        self.build = build
+        self.word = word
+        self.match = match
+        self.needs = needs if kind == 'mask' else 0
+
+    def __eq__(self, other):
+        return isinstance(other, Term) and self.text == other.text
+
+    def __hash__(self):
+        return hash(self.text)
+
+    def implies(self, other):
+        """True if every name matching self also matches other"""
+        if self.kind != 'name' or other.kind != 'name' or self.negate or other.negate:
+            return False
+        if other.match == 'contains':
+            return self.match in ('contains', 'prefix') and other.word in self.word
+        if other.match == 'prefix':
+            return self.match == 'prefix' and self.word.startswith(other.word)
+        return False
+
+
+def _range_mask(column, lo, hi):
+    if column == 'iso' and (lo is None or lo < 1):
+        lo = 1  # ISO 0 means the tag is missing
+    return lambda t: t.mask_range(column, lo, hi)
+
+
+def _compare(field, op, value):
+    """Compile field OP value into a mask builder"""
+    column = COLUMN_OF[field]
+    if field == 'date':
+        if '..' in value:
+            a, b = value.split('..', 1)
+            lo = parse_date_range(a)[0] if a else None
+            hi = parse_date_range(b)[1] - 1 if b else None
+            return _range_mask(column, lo, hi)
+        start, end = parse_date_range(value)
+        bounds = {':': (start, end - 1), '=': (start, end - 1), '>=': (start, None),
+                  '>': (end, None), '<=': (None, end - 1), '<': (None, start - 1)}
+        return _range_mask(column, *bounds[op])
+
+    if '..' in value and op in (':', '='):
+        a, b = value.split('..', 1)
+        lo = parse_number(field, a) if a else None
+        hi = parse_number(field, b) if b else None
+        return _range_mask(column, lo, hi)
+    num = parse_number(field, value)
+    if op in (':', '='):
+        if field in ('lat', 'lon', 'exposure', 'alt'):
+            # Floats never compare equal reliably; allow a small tolerance
+            eps = abs(num) * 1e-3 + 1e-9
+            return _range_mask(column, num - eps, num + eps)
+        return _range_mask(column, num, num)
+    if op == '>=':
+        return _range_mask(column, num, None)
+    if op == '<=':
+        return _range_mask(column, None, num)
+    step = 1 if field in ('iso', 'size') else 1e-9
+    if op == '>':
+        return _range_mask(column, num + step, None)
+    return _range_mask(column, None, num - step)
+
+
+def _text_mask(field, value):
+    needle = value.lower()
+
+    def build(table):
+        cat = table.categories[field]
+        codes = [c for c, v in enumerate(cat.values) if c and needle in v.lower()]
+        if NUMPY_AVAILABLE:
+            wanted = np.zeros(len(cat.values), dtype=bool)
+            wanted[codes] = True
+            return wanted[table.column(field)]
+        wanted = set(codes)
+        return bytearray(1 if v in wanted else 0 for v in table.cols[field])
+    return build
+
+
+def _has_mask(what):
+    column = HAS_FIELDS.get(what)
+    if column is None:
+        raise QueryError(f"has: chỉ hỗ trợ {', '.join(HAS_FIELDS)}")
+
+    def build(table):
+        if column == 'lat':
+            return table.mask_has_gps()
+        if column == 'taken':
+            return table.mask_range('taken')
+        if NUMPY_AVAILABLE:
+            return table.column(column) != 0
+        return bytearray(1 if v else 0 for v in table.cols[column])
+    return build
+
+
+def _near_mask(lat, lon, radius_km):
+    # Points within radius_km differ by at most this much in latitude, so
+    # the haversine only runs on that band
+    band = math.degrees(radius_km / EARTH_RADIUS_KM)
+
+    def build(table):
+        if NUMPY_AVAILABLE:
+            lats = table.column('lat')
+            with np.errstate(invalid='ignore'):
+                rows = np.flatnonzero(np.abs(lats - lat) <= band)
+            la = np.radians(lats[rows])
+            lo = np.radians(table.column('lon')[rows])
+            qa, qo = math.radians(lat), math.radians(lon)
+            h = (np.sin((la - qa) / 2) ** 2 +
+                 math.cos(qa) * np.cos(la) * np.sin((lo - qo) / 2) ** 2)
+            d = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+            out = np.zeros(len(lats), dtype=bool)
+            out[rows[d <= radius_km]] = True
+            return out
+        qa, qo = math.radians(lat), math.radians(lon)
+        cq = math.cos(qa)
+        out = bytearray(len(table))
+        for i, (a, o) in enumerate(zip(table.cols['lat'], table.cols['lon'])):
+            if not abs(a - lat) <= band:   # also skips NaN (no GPS)
+                continue
+            a, o = math.radians(a), math.radians(o)
+            h = math.sin((a - qa) / 2) ** 2 + cq * math.cos(a) * math.sin((o - qo) / 2) ** 2
+            if 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(h, 1.0))) <= radius_km:
+                out[i] = 1
+        return out
+    return build
+
+
+def _name_term(text, negate, word):
+    """Plain words match anywhere; 'word*' matches a prefix, '~word' is fuzzy"""
+    if word.startswith('~') and len(word) > 1:
+        return Term(text, 'name', negate, word=word[1:], match='fuzzy')
+    stem = word.rstrip('*')
+    if stem and stem != word:
+        return Term(text, 'name', negate, word=stem, match='prefix')
+    return Term(text, 'name', negate, word=word)
+
+
+def compile_term(raw):
+    """Turn one token into a Term, raising QueryError when invalid"""
+    negate = raw.startswith('-') and len(raw) > 1
+    m = TERM_RE.match(raw.lower())
+    if not m:
+        return _name_term(raw.lower(), negate, (raw[1:] if negate else raw).lower())
+
+    _, field, op, value = m.groups()
+    value = raw[len(raw) - len(value):] if value else ''
+    if not value:
+        raise QueryError(f"Thiếu giá trị cho {field}")
+
+    if field == 'has' or field == 'no':
+        build = _has_mask(value.lower())
+        return Term(raw.lower(), 'mask', negate != (field == 'no'), build)
+    if field == 'near':
+        return Term(raw.lower(), 'mask', negate, _near_mask(*parse_near(value)))
+    if field in TEXT_FIELDS:
+        if op not in (':', '='):
+            raise QueryError(f"{field} chỉ dùng ':'")
+        return Term(raw.lower(), 'mask', negate, _text_mask(field, value))
+    if field in NUMERIC_FIELDS:
+        return Term(raw.lower(), 'mask', negate, _compare(field, op, value),
+                    needs=HAS_STAT if field == 'size' else HAS_EXIF)
+    if field in NAME_FIELDS:
+        word = value.lower()
+        if field in ('ext', 'type'):
+            return Term(raw.lower(), 'name', negate, word='.' + word.lstrip('.'), match='endswith')
+        return _name_term(raw.lower(), negate, word)
+    raise QueryError(f"Trường không hỗ trợ: {field}")
+
+
+def _split(text):
+    lexer = shlex.shlex(text, posix=True)
+    lexer.whitespace_split = True
+    lexer.commenters = ''
+    lexer.escape = ''
+    return list(lexer)
+
+
+def tokenize(text):
+    """Split on whitespace, keeping quoted values together"""
+    # An unterminated quote is normal while typing: close it implicitly
+    for suffix in ('', '"', "'"):
+        try:
+            return _split(text + suffix)
+        except ValueError:
+            pass
+    return text.split()
+
+
+# Below this many candidate rows a plain scan beats an index lookup
+SCAN_LIMIT = 2000
+
+
+def _keep_members(rows, matches, n, negate=False):
+    """Rows (in order) that are in matches (or not in them when negated)"""
+    if NUMPY_AVAILABLE:
+        member = np.zeros(n, dtype=bool)
+        member[matches] = True
+        if negate:
+            member = ~member
+        return rows[member[rows]]
+    matches = set(matches)
+    if negate:
+        return [r for r in rows if r not in matches]
+    return [r for r in rows if r in matches]
+
+
+def _scan_names(lower, rows, t):
+    """Check one name term against every row"""
+    numpy_rows = NUMPY_AVAILABLE and not isinstance(rows, list)
+    if numpy_rows:
+        rows = rows.tolist()
+    w = t.word
+    # One tight comprehension per match type beats a generic predicate call
+    if t.match == 'endswith':
+        rows = [r for r in rows if lower[r].endswith(w) != t.negate]
+    elif t.match == 'prefix':
+        rows = [r for r in rows if lower[r].startswith(w) != t.negate]
+    elif t.match == 'fuzzy':
+        match = fuzzy_matcher(w)
+        rows = [r for r in rows if match(lower[r]) != t.negate]
+    elif t.negate:
+        rows = [r for r in rows if w not in lower[r]]
+    else:
+        rows = [r for r in rows if w in lower[r]]
+    if numpy_rows:
+        rows = np.array(rows, dtype=np.int64)
+    return rows
+
+
+class Query:
+    def __init__(self, text):
+        self.text = text
+        self.terms = []
+        self.errors = []
+        for tok in tokenize(text):
+            try:
+                self.terms.append(compile_term(tok))
+            except QueryError as e:
+                self.errors.append(str(e))
+
+    @property
+    def needs(self):
+        """HAS_* bits the rows must have loaded before the query runs"""
+        flags = 0
+        for t in self.terms:
+            flags |= t.needs
+        return flags
+
+    def narrows(self, previous):
+        """True if every result of self is also a result of previous"""
+        if previous is None or previous.errors or self.errors:
+            return False
+        for old in previous.terms:
+            if old in self.terms:
+                continue
+            # e.g. a longer positive word only matches a subset of names
+            if not any(t.implies(old) for t in self.terms):
+                return False
+        return True
+
+    def execute_rows(self, table, rows, index=None):
+        """Rows (in order) matching every term
+
+        With a NameIndex, name terms over many rows are answered from its
+        trigram postings; small (narrowed) row sets are scanned directly.
+        """
+        masks = [t for t in self.terms if t.kind == 'mask']
+        names = [t for t in self.terms if t.kind == 'name']
+
+        if masks:
+            combined = None
+            for term in masks:
+                m = term.build(table)
+                if term.negate:
+                    m = mask_not(m)
+                combined = m if combined is None else mask_and(combined, m)
+            rows = table.select_rows(rows, combined)
+
+        for t in names:
+            matches = None
+            if index is not None and t.match != 'endswith' and (
+                    t.match == 'fuzzy' or len(rows) > SCAN_LIMIT):
+                matches = index.lookup(t.word, t.match)
+            if matches is not None:
+                rows = _keep_members(rows, matches, len(table), t.negate)
+            else:
+                rows = _scan_names(table.names, rows, t)
+        return rows
+
+    def execute(self, table, paths):
+        """Paths (in order) matching every term"""
+        return table.paths_of(self.execute_rows(table, table.rows(paths)))
+
+
+class QueryEngine:
+    """Runs queries, narrowing from the previous result while typing"""
+
+    def __init__(self, table):
+        self.table = table
+        self.index = NameIndex(table)
+        self._source = None
+        self._source_len = 0
+        self._source_rows = None
+        self._layout = -1
+        self._version = -1
+        self._query = None
+        self._result = None
+
+    def run(self, text, paths):
+        """Return (query, matching paths in source order); text may be a Query"""
+        query = text if isinstance(text, Query) else Query(text)
+        table = self.table
+        # Row numbers only move when rows are added or removed; metadata
+        # arriving from the indexer just invalidates the narrowed result
+        same_source = (paths is self._source and len(paths) == self._source_len
+                       and table.layout == self._layout)
+        if not same_source:
+            self._source, self._source_len, self._layout = paths, len(paths), table.layout
+            self._source_rows = table.rows(paths)
+            self._query = self._result = None
+        if table.version != self._version:
+            self._version = table.version
+            self._query = self._result = None
+
+        if query.narrows(self._query):
+            candidates = self._result
+        else:
+            candidates = self._source_rows
+        result = query.execute_rows(table, candidates, self.index)
+        self._query, self._result = query, result
+        return query, table.paths_of(result)
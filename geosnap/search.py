@@ -0,0 +1,229 @@
+"""Trigram index over lower-cased file names for substring search.
+
+Names are indexed as UTF-8 bytes prefixed with two ``PAD`` bytes, so every
+name yields the trigrams of its text plus two start-of-name trigrams that
+serve prefix queries. Each word of a name (a run of letters and digits) also
+adds two start-of-word trigrams made with ``WORD``; fuzzy queries are padded
+the same way, so ``~sunet`` finds ``img_sunset_beach.jpg``. With NumPy the index is built in one vectorized pass
+into CSR form (sorted trigram codes, offsets, row ids); without it, into a
+dict of ``array('I')`` posting lists.
+
+Rows added after a build are kept as an unindexed tail that is scanned
+directly, and the index is rebuilt once that tail grows past
+``REBUILD_FRACTION`` of the library. Builds and lookups hold the index's
+lock, so ``ensure`` can run on a worker thread ahead of the first query.
+"""
+import array
+import math
+import threading
+
+from .metadata import NUMPY_AVAILABLE, np
+
+PAD = b'\x02\x02'
+WORD = 3                  # marks the start of a word, in fuzzy trigrams only
+MODES = ('contains', 'prefix', 'fuzzy')
+FUZZY_THRESHOLD = 0.5     # share of query trigrams a fuzzy match must contain
+VERIFY_LIMIT = 4096       # intersect postings until at most this many candidates
+REBUILD_FRACTION = 0.1
+
+
+def trigram_codes(data):
+    """Distinct trigrams of a byte string as 24-bit integers"""
+    return {data[i] << 16 | data[i + 1] << 8 | data[i + 2] for i in range(len(data) - 2)}
+
+
+def _is_word_byte(b):
+    return b >= 0x80 or 0x30 <= b <= 0x39 or 0x61 <= b <= 0x7a
+
+
+def name_codes(name):
+    """Trigrams indexed for a lower-cased name (see the module docstring)"""
+    data = PAD + name.encode('utf-8')
+    codes = trigram_codes(data)
+    prev = False
+    for i, b in enumerate(data):
+        word = _is_word_byte(b)
+        if word and not prev:
+            nxt = data[i + 1] if i + 1 < len(data) else PAD[0]
+            codes.add(WORD << 16 | WORD << 8 | b)
+            codes.add(WORD << 16 | b << 8 | nxt)
+        prev = word
+    return codes
+
+
+def fuzzy_codes(word):
+    """Trigrams of a fuzzy query: the word padded as the start of a word"""
+    return trigram_codes(bytes((WORD, WORD)) + word.encode('utf-8'))
+
+
+def fuzzy_matcher(word):
+    """Predicate: does a name share FUZZY_THRESHOLD of word's trigrams?
+
+    >>> match = fuzzy_matcher('sunet')
+    >>> match('img_sunset_beach.jpg'), match('sunset.jpg'), match('beach.jpg')
+    (True, True, False)
+    """
+    codes = fuzzy_codes(word)
+    need = max(1, math.ceil(FUZZY_THRESHOLD * len(codes)))
+    return lambda name: len(codes & name_codes(name)) >= need
+
+
+class NameIndex:
+    """Trigram postings over ``table.names`` (which only ever grows)"""
+
+    def __init__(self, table):
+        self.table = table
+        self.indexed = 0      # rows covered by the postings
+        self._codes = None    # CSR: sorted codes, offsets into _rows, row ids
+        self._offsets = None
+        self._rows = None
+        self._postings = {}   # fallback without NumPy: code -> array('I')
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.indexed
+
+    def stale(self):
+        tail = len(self.table.names) - self.indexed
+        return tail > max(1000, REBUILD_FRACTION * self.indexed)
+
+    def build(self):
+        """Index every name in the table not covered yet"""
+        names = self.table.names
+        n = len(names)
+        if NUMPY_AVAILABLE:
+            self._build_numpy(names, n)
+        else:
+            # Rows only ever grow, so appending keeps every posting sorted
+            postings = self._postings
+            get = postings.get
+            for row in range(self.indexed, n):
+                for code in name_codes(names[row]):
+                    posting = get(code)
+                    if posting is None:
+                        posting = postings[code] = array.array('I')
+                    posting.append(row)
+        self.indexed = n
+
+    def _build_numpy(self, names, n):
+        encoded = [PAD + name.encode('utf-8') for name in names[:n]]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=n)
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint32)
+        owner = np.repeat(np.arange(n, dtype=np.uint32), lengths)
+        if len(data) < 3:
+            self._codes = np.zeros(0, dtype=np.uint32)
+            self._offsets = np.zeros(1, dtype=np.int64)
+            self._rows = np.zeros(0, dtype=np.uint32)
+            return
+        codes = data[:-2] << 16 | data[1:-1] << 8 | data[2:]
+        # Drop trigrams that straddle two names
+        inside = owner[:-2] == owner[2:]
+        keys = codes[inside].astype(np.uint64) << np.uint64(32) | owner[:-2][inside]
+        # Start-of-word trigrams; names begin with PAD, so no word spans two
+        word = (data >= 0x80) | ((data >= 0x30) & (data <= 0x39)) | ((data >= 0x61) & (data <= 0x7a))
+        starts = np.flatnonzero(word[1:] & ~word[:-1]) + 1
+        nxt = np.append(data[1:], PAD[0])[starts]
+        first = np.uint32(WORD << 16 | WORD << 8) | data[starts]
+        second = np.uint32(WORD << 16) | data[starts] << 8 | nxt
+        starts_owner = owner[starts].astype(np.uint64)
+        keys = np.concatenate([keys, first.astype(np.uint64) << np.uint64(32) | starts_owner,
+                               second.astype(np.uint64) << np.uint64(32) | starts_owner])
+        # Sort by (code, row) and drop trigrams repeated within one name
+        keys.sort()
+        keys = keys[np.append(True, keys[1:] != keys[:-1])]
+        codes = (keys >> np.uint64(32)).astype(np.uint32)
+        self._rows = (keys & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+        starts = np.flatnonzero(np.append(True, codes[1:] != codes[:-1]))
+        self._codes = codes[starts]
+        self._offsets = np.append(starts, len(codes))
+
+    def posting(self, code):
+        """Sorted rows whose name contains a trigram"""
+        if NUMPY_AVAILABLE and self._codes is not None:
+            i = int(np.searchsorted(self._codes, code))
+            if i < len(self._codes) and self._codes[i] == code:
+                return self._rows[self._offsets[i]:self._offsets[i + 1]]
+            return self._rows[:0]
+        return self._postings.get(code, ())
+
+    def ensure(self):
+        """Build the postings if missing or stale"""
+        with self._lock:
+            self._ensure()
+
+    def _ensure(self):
+        if self.indexed == 0 or self.stale():
+            self.build()
+
+    def lookup(self, word, mode='contains'):
+        """Rows (ascending) whose name matches word, or None if the index cannot help
+
+        Substring queries shorter than a trigram return None; the caller
+        scans its (usually already narrowed) candidate rows instead.
+        """
+        data = word.encode('utf-8')
+        if mode == 'contains' and len(data) < 3:
+            return None
+        with self._lock:
+            self._ensure()
+            if mode == 'fuzzy':
+                rows = self._fuzzy(fuzzy_codes(word))
+            else:
+                rows = self._exact(word, data, mode)
+            tail = self._scan_tail(word, mode)
+        if tail:
+            rows = np.concatenate([rows, np.array(tail, dtype=rows.dtype)]) if NUMPY_AVAILABLE else rows + tail
+        return rows
+
+    def _exact(self, word, data, mode):
+        query = PAD + data if mode == 'prefix' else data
+        postings = sorted((self.posting(c) for c in trigram_codes(query)), key=len)
+        if not postings or not len(postings[0]):
+            return np.zeros(0, dtype=np.uint32) if NUMPY_AVAILABLE else []
+        rows = postings[0]
+        for posting in postings[1:]:
+            if len(rows) <= VERIFY_LIMIT:
+                break
+            if NUMPY_AVAILABLE:
+                member = np.zeros(self.indexed, dtype=bool)
+                member[posting] = True
+                rows = rows[member[rows]]
+            else:
+                keep = set(posting)
+                rows = [r for r in rows if r in keep]
+        if len(postings) == 1 and len(query) == 3:
+            return rows if NUMPY_AVAILABLE else list(rows)  # the trigram is the whole query
+        names = self.table.names
+        if NUMPY_AVAILABLE:
+            rows = rows.tolist()
+        if mode == 'prefix':
+            rows = [r for r in rows if names[r].startswith(word)]
+        else:
+            rows = [r for r in rows if word in names[r]]
+        return np.array(rows, dtype=np.uint32) if NUMPY_AVAILABLE else rows
+
+    def _fuzzy(self, codes):
+        """Rows sharing at least FUZZY_THRESHOLD of the query trigrams"""
+        need = max(1, math.ceil(FUZZY_THRESHOLD * len(codes)))
+        postings = [self.posting(c) for c in codes]
+        if NUMPY_AVAILABLE:
+            postings = [p for p in postings if len(p)]
+            if not postings:
+                return np.zeros(0, dtype=np.uint32)
+            hits = np.bincount(np.concatenate(postings), minlength=self.indexed)
+            return np.flatnonzero(hits >= need).astype(np.uint32)
+        hits = {}
+        for posting in postings:
+            for r in posting:
+                hits[r] = hits.get(r, 0) + 1
+        return sorted(r for r, k in hits.items() if k >= need)
+
+    def _scan_tail(self, word, mode):
+        names = self.table.names
+        start, end = self.indexed, len(names)
+        if mode == 'fuzzy':
+            match = fuzzy_matcher(word)
+            return [r for r in range(start, end) if match(names[r])]
+        if mode == 'prefix':
+            return [r for r in range(start, end) if names[r].startswith(word)]
+        return [r for r in range(start, end) if word in names[r]]
@@ -0,0 +1,566 @@
+"""Read-only HTTP API over the library index, on asyncio streams.
+
+    GET /api/photos?q=EXPR&root=DIR&offset=0&limit=100   a JSON page of photos
+    GET /api/photos?q=EXPR&format=FORMAT                 every match, as ``geosnap export`` writes it
+    GET /api/photo?path=PATH                             one photo's metadata
+    GET /api/geojson?bbox=W,S,E,N&q=EXPR&limit=N         the photos in a map viewport
+    GET /tiles/Z/X/Y.geojson?q=EXPR&limit=N              the same for a slippy-map tile
+    GET /thumb?path=PATH&size=256                        JPEG from the thumbnail cache
+    GET /image?path=PATH                                 the file itself, with Range requests
+
+Only catalogued photos (under the server's root, when it has one) are ever
+read. Every response carries an ETag: for files their size and mtime, for
+API results the version of the index file, so ``If-None-Match`` is answered
+with 304 before any query runs. Viewports with more photos than ``limit``
+are thinned evenly, keeping at most twice the limit in memory while the
+catalog streams past. The catalog itself is loaded once per index version
+and kept in memory (up to ``SNAPSHOT_ROWS`` photos; larger catalogs are
+streamed from SQLite on every query).
+
+Queries, thumbnails and metadata reads run on a thread pool, each request
+with its own ``IndexStore`` connection; file bodies go out through
+``loop.sendfile``, exports too: the writer fills an anonymous temporary
+file, so a full-catalog export never sits in memory. Connections are kept
+alive between requests. The server
+binds to localhost unless told otherwise and has no authentication: only
+expose it on a trusted network.
+"""
+import asyncio
+import bisect
+import email.utils
+import hashlib
+import http
+import io
+import json
+import math
+import mimetypes
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from . import catalog
+from .export import BINARY, format_of, photo_batches, write_geojson, write_jsonl, WRITERS
+from .metadata import NUMPY_AVAILABLE, mask_and, mask_or, np
+from .pool import default_workers
+from .query import Query
+from .store import IndexStore, default_store_path, path_range
+from .thumbs import ThumbnailCache, thumbnail_size
+
+HOST = '127.0.0.1'
+PORT = 8765
+PAGE = 100
+MAX_PAGE = 10000
+VIEWPORT_LIMIT = 5000
+MAX_VIEWPORT_LIMIT = 100000
+MAX_ZOOM = 24
+SNAPSHOT_ROWS = 2_000_000   # larger catalogs are not kept in memory
+KEEP_ALIVE = 15          # seconds an idle connection stays open
+MAX_HEADERS = 100
+MAX_BODY = 1 << 16       # request bodies are read and ignored
+
+JSON = 'application/json'
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson', 'geojson': 'application/geo+json',
+                 'gpx': 'application/gpx+xml', 'kml': 'application/vnd.google-earth.kml+xml',
+                 'parquet': 'application/vnd.apache.parquet', 'arrow': 'application/vnd.apache.arrow.file'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Request:
+    def __init__(self, method, target, version, headers):
+        parts = urlsplit(target)
+        self.method = method
+        self.target = target
+        self.path = parts.path
+        self.headers = headers
+        self.query = {k: v[-1] for k, v in parse_qs(parts.query, keep_blank_values=True).items()}
+        connection = headers.get('connection', '').lower()
+        self.keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+
+    def int_arg(self, name, default, lo=None, hi=None):
+        value = self.query.get(name)
+        if value in (None, ''):
+            return default
+        try:
+            value = int(value)
+        except ValueError:
+            raise HTTPError(400, f"{name} must be an integer")
+        if (lo is not None and value < lo) or (hi is not None and value > hi):
+            raise HTTPError(400, f"{name} must be between {lo} and {hi}")
+        return value
+
+    def fresh(self, etag, mtime=None):
+        """Does the client's cached copy still match (If-None-Match / If-Modified-Since)?"""
+        tags = self.headers.get('if-none-match')
+        if tags is not None:
+            return tags.strip() == '*' or etag in (t.strip().removeprefix('W/') for t in tags.split(','))
+        since = self.headers.get('if-modified-since')
+        if since and mtime is not None:
+            try:
+                return int(mtime) <= email.utils.parsedate_to_datetime(since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+class Response:
+    def __init__(self, status=200, body=b'', content_type=JSON, etag=None, mtime=None, headers=None, file=None):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.etag = etag
+        self.mtime = mtime
+        self.headers = headers or {}
+        self.file = file   # (path or open binary file, start, length) sent from disk instead of body
+
+    @property
+    def length(self):
+        return self.file[2] if self.file else len(self.body)
+
+
+def _error(status, message):
+    return Response(status, json.dumps({'error': message}, ensure_ascii=False).encode() + b'\n')
+
+
+def byte_range(header, size):
+    """(first, last) byte of a single 'bytes=' range; None to send the whole file"""
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None   # multiple ranges: answered with the full body
+    first, sep, last = spec.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0 or size == 0:
+                raise HTTPError(416, "unsatisfiable range")
+            return max(size - suffix, 0), size - 1
+        start = int(first)
+        end = int(last) if last else None
+    except ValueError:
+        return None
+    if end is not None and end < start:
+        return None
+    if start >= size:
+        raise HTTPError(416, "unsatisfiable range")
+    return start, size - 1 if end is None else min(end, size - 1)
+
+
+def tile_bbox(z, x, y):
+    """(west, south, east, north) of a slippy-map tile"""
+    n = 2 ** z
+    lat = lambda t: math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * t / n))))
+    return x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)
+
+
+def _thin(kept, step):
+    """Keep the photos whose position among the matches is a multiple of step"""
+    out = []
+    for table, positions in kept:
+        if NUMPY_AVAILABLE:
+            index = np.nonzero(positions % step == 0)[0]
+            positions = positions[index]
+        else:
+            index = [i for i, p in enumerate(positions) if p % step == 0]
+            positions = [positions[i] for i in index]
+        if len(index):
+            out.append((table.take(index), positions))
+    return out
+
+
+class LibraryServer:
+    def __init__(self, store_path=None, root=None, host=HOST, port=PORT, workers=None, thumbs=None):
+        self.store_path = store_path or default_store_path()
+        self.root = os.path.abspath(root) if root else None
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(workers or default_workers(), thread_name_prefix='geosnap-http')
+        self.thumbs = thumbs or ThumbnailCache()
+        self.server = None
+        self.clients = set()
+        self._snapshot = None     # (index version, tables) of the whole catalog under self.root
+        self._snapshot_lock = threading.Lock()
+        self.routes = {'/': self.index, '/api/photos': self.photos, '/api/photo': self.photo,
+                       '/api/geojson': self.viewport, '/thumb': self.thumb, '/image': self.image}
+
+    @property
+    def url(self):
+        host = f"[{self.host}]" if ':' in self.host else self.host
+        return f"http://{host}:{self.port}/"
+
+    async def start(self):
+        """Listen (port 0 picks a free one); returns the bound port"""
+        self.server = await asyncio.start_server(self._client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        asyncio.get_running_loop().run_in_executor(self.executor, self.thumbs.prune)
+        return self.port
+
+    async def serve(self, ready=None):
+        await self.start()
+        if ready:
+            ready(self)
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            for writer in list(self.clients):
+                writer.close()
+            await self.server.wait_closed()
+            self.server = None
+        self.executor.shutdown(wait=False)
+
+    # ---------- protocol ----------
+
+    async def _client(self, reader, writer):
+        self.clients.add(writer)
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE)
+                except asyncio.TimeoutError:
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue   # stray CRLF between requests
+                try:
+                    request = await self._read_request(reader, line)
+                except HTTPError as e:
+                    await self._send(writer, None, _error(e.status, str(e)), False)
+                    break
+                response = await self._respond(request)
+                await self._send(writer, request, response, request.keep_alive)
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass   # client went away, or a line longer than the stream limit
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def _read_request(self, reader, line):
+        parts = line.decode('latin-1').split()
+        if len(parts) != 3 or parts[2] not in ('HTTP/1.0', 'HTTP/1.1'):
+            raise HTTPError(400, "malformed request line")
+        headers = {}
+        for _ in range(MAX_HEADERS):
+            header = await reader.readline()
+            if not header.strip():
+                break
+            name, sep, value = header.decode('latin-1').partition(':')
+            if not sep:
+                raise HTTPError(400, "malformed header")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise HTTPError(431, "too many headers")
+        if 'transfer-encoding' in headers:
+            raise HTTPError(400, "request bodies are not supported")
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HTTPError(400, "bad Content-Length")
+        if not 0 <= length <= MAX_BODY:
+            raise HTTPError(413, "request body too large")
+        if length:
+            await reader.readexactly(length)
+        return Request(parts[0], parts[1], parts[2], headers)
+
+    async def _respond(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            response = _error(405, "only GET and HEAD are supported")
+            response.headers['Allow'] = 'GET, HEAD'
+            return response
+        handler = self.routes.get(request.path)
+        if handler is None and request.path.startswith('/tiles/'):
+            handler = self.tile
+        if handler is None:
+            return _error(404, "no such endpoint")
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, handler, request)
+        except HTTPError as e:
+            return _error(e.status, str(e))
+        except Exception as e:
+            print(f"HTTP error for {request.target}: {e}", file=sys.stderr)
+            return _error(500, "internal error")
+
+    async def _send(self, writer, request, response, keep_alive):
+        status = response.status
+        head = [f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}",
+                f"Date: {email.utils.formatdate(usegmt=True)}",
+                "Server: geosnap",
+                f"Connection: {'keep-alive' if keep_alive else 'close'}",
+                "Cache-Control: no-cache"]
+        if status != 304:
+            head.append(f"Content-Type: {response.content_type}")
+            head.append(f"Content-Length: {response.length}")
+        if response.etag:
+            head.append(f"ETag: {response.etag}")
+        if response.mtime is not None:
+            head.append(f"Last-Modified: {email.utils.formatdate(response.mtime, usegmt=True)}")
+        head.extend(f"{name}: {value}" for name, value in response.headers.items())
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        if status == 304 or (request is not None and request.method == 'HEAD'):
+            if response.file and not isinstance(response.file[0], str):
+                response.file[0].close()
+            await writer.drain()
+            return
+        if response.file:
+            path, start, length = response.file
+            with open(path, 'rb') if isinstance(path, str) else path as f:
+                await writer.drain()
+                await asyncio.get_running_loop().sendfile(writer.transport, f, start, length)
+        else:
+            writer.write(response.body)
+            await writer.drain()
+
+    # ---------- helpers (on executor threads) ----------
+
+    def _version(self):
+        """Changes whenever any process commits to the index"""
+        parts = []
+        for suffix in ('', '-wal'):
+            try:
+                st = os.stat(self.store_path + suffix)
+            except OSError:
+                st = None
+            # opening a connection creates an empty WAL and closing the last one removes it
+            parts.append(f"{st.st_mtime_ns}.{st.st_size}" if st and st.st_size else '-')
+        return ':'.join(parts)
+
+    def _etag(self, request):
+        key = f"{self._version()}\0{request.path}\0{sorted(request.query.items())}"
+        return '"' + hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()[:24] + '"'
+
+    def _under_root(self, path):
+        return self.root is None or path == self.root or path.startswith(self.root.rstrip(os.sep) + os.sep)
+
+    def _root(self, request):
+        root = request.query.get('root')
+        if not root:
+            return self.root
+        root = os.path.abspath(root)
+        if not self._under_root(root):
+            raise HTTPError(403, "root is outside the served folder")
+        return root
+
+    def _tables(self, store):
+        """The catalog under self.root as in-memory tables, reloaded when the index changes"""
+        version = self._version()
+        with self._snapshot_lock:   # one thread loads, the others wait for it
+            if self._snapshot is None or self._snapshot[0] != version:
+                self._snapshot = None
+                if store.count_photo_metadata() > SNAPSHOT_ROWS:
+                    return None
+                self._snapshot = (version, list(catalog.tables(store, self.root)))
+            return self._snapshot[1]
+
+    def _select(self, store, q, root):
+        """(table, rows) chunks of the photos under root matching q"""
+        tables = self._tables(store)
+        if tables is None:
+            return catalog.query(store, q, root)
+        if root == self.root:
+            return catalog.select(((table, catalog.all_rows(table)) for table in tables), q)
+        low, high = path_range(root)
+        chunks = []
+        for table in tables:   # path ordered, so a root is one slice of each chunk
+            lo, hi = bisect.bisect_left(table.paths, low), bisect.bisect_left(table.paths, high)
+            if lo < hi:
+                chunks.append((table, np.arange(lo, hi) if NUMPY_AVAILABLE else list(range(lo, hi))))
+        return catalog.select(chunks, q)
+
+    def _query(self, request):
+        q = Query(request.query.get('q', ''))
+        if q.errors:
+            raise HTTPError(400, '; '.join(map(str, q.errors)))
+        return q
+
+    def _catalogued(self, request, store):
+        """(path, stored row) of the photo named by ?path=, or a 404"""
+        path = request.query.get('path')
+        if not path:
+            raise HTTPError(400, "path is required")
+        row = store.photo_metadata([path]).get(path) if self._under_root(path) else None
+        if row is None:
+            raise HTTPError(404, "not a catalogued photo")
+        return path, row
+
+    def _file(self, request):
+        with IndexStore(self.store_path) as store:
+            path, _ = self._catalogued(request, store)
+        try:
+            return path, os.stat(path)
+        except OSError:
+            raise HTTPError(404, "the photo is no longer on disk")
+
+    # ---------- endpoints (on executor threads) ----------
+
+    def index(self, request):
+        body = {'endpoints': ['/api/photos', '/api/photo', '/api/geojson', '/tiles/{z}/{x}/{y}.geojson',
+                              '/thumb', '/image'], 'root': self.root}
+        return Response(body=json.dumps(body).encode() + b'\n')
+
+    def photos(self, request):
+        q = self._query(request)
+        fmt = request.query.get('format') or 'json'
+        if fmt != 'json':
+            try:
+                format_of('-', fmt)
+            except ValueError as e:
+                raise HTTPError(400, str(e))
+        offset = request.int_arg('offset', 0, 0)
+        limit = request.int_arg('limit', PAGE, 0, MAX_PAGE)
+        root = self._root(request)
+        etag = self._etag(request)
+        if request.fresh(etag):
+            return Response(304, etag=etag)
+        with IndexStore(self.store_path) as store:
+            chunks = self._select(store, q, root)
+            if fmt != 'json':
+                out = tempfile.TemporaryFile()   # closed once sent
+                try:
+                    if fmt in BINARY:
+                        count = WRITERS[fmt](photo_batches(chunks), out)
+                    else:
+                        text = io.TextIOWrapper(out, encoding='utf-8', newline='')
+                        count = WRITERS[fmt](photo_batches(chunks), text)
+                        text.detach()   # flushes, and leaves out open
+                    length = out.seek(0, os.SEEK_END)
+                except BaseException:
+                    out.close()
+                    raise
+                return Response(content_type=CONTENT_TYPES[fmt], etag=etag, headers={'X-Total-Count': count},
+                                file=(out, 0, length))
+            total, page = 0, []
+            for table, rows in chunks:
+                lo, hi = max(offset - total, 0), min(offset + limit - total, len(rows))
+                if lo < hi:
+                    page.append((table, rows[lo:hi]))
+                total += len(rows)
+        out = io.StringIO()
+        write_jsonl(photo_batches(page), out)
+        body = '{"total": %d, "offset": %d, "limit": %d, "photos": [%s]}\n' % (
+            total, offset, limit, ',\n'.join(out.getvalue().splitlines()))
+        return Response(body=body.encode(), etag=etag, headers={'X-Total-Count': total})
+
+    def photo(self, request):
+        etag = self._etag(request)
+        if request.fresh(etag):
+            return Response(304, etag=etag)
+        with IndexStore(self.store_path) as store:
+            path, row = self._catalogued(request, store)
+        table = catalog.table_from_rows([(path,) + tuple(row)])
+        out = io.StringIO()
+        write_jsonl(photo_batches([(table, [0])]), out)
+        return Response(body=out.getvalue().encode(), etag=etag)
+
+    def viewport(self, request):
+        try:
+            west, south, east, north = map(float, request.query.get('bbox', '').split(','))
+        except ValueError:
+            raise HTTPError(400, "bbox must be west,south,east,north")
+        if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+            raise HTTPError(400, "bbox is out of range")
+        return self._features(request, west, south, east, north)
+
+    def tile(self, request):
+        parts = request.path.split('/')
+        try:
+            if len(parts) != 5 or not parts[4].endswith('.geojson'):
+                raise ValueError
+            z, x, y = int(parts[2]), int(parts[3]), int(parts[4][:-len('.geojson')])
+        except ValueError:
+            raise HTTPError(404, "tiles are /tiles/{z}/{x}/{y}.geojson")
+        if not (0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise HTTPError(404, "no such tile")
+        return self._features(request, *tile_bbox(z, x, y))
+
+    def _features(self, request, west, south, east, north):
+        q = self._query(request)
+        limit = request.int_arg('limit', VIEWPORT_LIMIT, 1, MAX_VIEWPORT_LIMIT)
+        root = self._root(request)
+        etag = self._etag(request)
+        if request.fresh(etag):
+            return Response(304, etag=etag)
+        kept, count, total, step = [], 0, 0, 1
+        with IndexStore(self.store_path) as store:
+            for table, rows in self._select(store, q, root):
+                lon = (table.mask_range('lon', west, east) if west <= east else   # across the antimeridian
+                       mask_or(table.mask_range('lon', west), table.mask_range('lon', None, east)))
+                rows = table.select_rows(rows, mask_and(table.mask_range('lat', south, north), lon))
+                if not len(rows):
+                    continue
+                first = -total % step
+                positions = (np.arange(total + first, total + len(rows), step) if NUMPY_AVAILABLE
+                             else list(range(total + first, total + len(rows), step)))
+                kept.append((table.take(rows[first::step]), positions))
+                total += len(rows)
+                count += len(positions)
+                while count > 2 * limit:
+                    step *= 2
+                    kept = _thin(kept, step)
+                    count = sum(len(positions) for _, positions in kept)
+        while count > limit:
+            step *= 2
+            kept = _thin(kept, step)
+            count = sum(len(positions) for _, positions in kept)
+        out = io.StringIO()
+        chunks = [(table, np.arange(len(table)) if NUMPY_AVAILABLE else list(range(len(table))))
+                  for table, _ in kept]
+        write_geojson(photo_batches(chunks), out)
+        return Response(body=out.getvalue().encode(), content_type=CONTENT_TYPES['geojson'], etag=etag,
+                        headers={'X-Total-Count': total, 'X-Sample-Step': step})
+
+    def thumb(self, request):
+        size = thumbnail_size(request.int_arg('size', 256, 16, 4096))
+        path, st = self._file(request)
+        etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}-{size}"'
+        if request.fresh(etag, st.st_mtime):
+            return Response(304, etag=etag, mtime=st.st_mtime)
+        try:
+            thumb = self.thumbs.get(path, size, st)
+            length = os.path.getsize(thumb)
+        except OSError as e:   # also Pillow's UnidentifiedImageError
+            raise HTTPError(415, f"no thumbnail: {e}")
+        return Response(content_type='image/jpeg', etag=etag, mtime=st.st_mtime, file=(thumb, 0, length))
+
+    def image(self, request):
+        path, st = self._file(request)
+        etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+        headers = {'Accept-Ranges': 'bytes'}
+        if request.fresh(etag, st.st_mtime):
+            return Response(304, etag=etag, mtime=st.st_mtime, headers=headers)
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        wanted = request.headers.get('range')
+        if_range = request.headers.get('if-range')
+        if wanted and (if_range is None or if_range == etag):
+            try:
+                span = byte_range(wanted, st.st_size)
+            except HTTPError:
+                headers['Content-Range'] = f"bytes */{st.st_size}"
+                response = _error(416, "unsatisfiable range")
+                response.headers.update(headers)
+                return response
+            if span:
+                first, last = span
+                headers['Content-Range'] = f"bytes {first}-{last}/{st.st_size}"
+                return Response(206, content_type=content_type, etag=etag, mtime=st.st_mtime, headers=headers,
+                                file=(path, first, last - first + 1))
+        return Response(content_type=content_type, etag=etag, mtime=st.st_mtime, headers=headers,
+                        file=(path, 0, st.st_size))
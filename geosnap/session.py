@@ -0,0 +1,187 @@
+"""Snapshot of the open library, so the next start shows it straight away.
+
+The file holds a small JSON state (sort mode, current photo, filters, watched
+folders, categorical dictionaries) followed by raw binary sections: every
+metadata column as stored in ``MetadataTable``, the per-row loaded flags and
+the NUL-separated paths, all in library order. Sections are 8-byte aligned
+and read back through ``mmap``, so loading is one copy per column with no
+parsing; rows come back marked as stat'ed and parsed as they were, and the
+caller revalidates them against the disk in the background.
+"""
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+from .metadata import COLUMNS, HAS_STAT, MetadataTable, NUMPY_AVAILABLE, np
+from .paths import data_path
+from .watcher import Changes
+
+SESSION_MAGIC = b'GSSN'
+SESSION_VERSION = 1
+# magic, version, byte order, state JSON size
+SESSION_HEADER = struct.Struct('<4sIII')
+ALIGN = 8
+
+
+class SessionError(Exception):
+    pass
+
+
+def default_session_path():
+    return data_path('session.gssn')
+
+
+def _encode_paths(paths):
+    encoding, errors = sys.getfilesystemencoding(), sys.getfilesystemencodeerrors()
+    return '\0'.join(paths).encode(encoding, errors)
+
+
+def _decode_paths(blob):
+    if not blob:
+        return []
+    encoding, errors = sys.getfilesystemencoding(), sys.getfilesystemencodeerrors()
+    return bytes(blob).decode(encoding, errors).split('\0')
+
+
+def write_session(path, state, sections):
+    """Write state (JSON-able dict) and sections {name: array.array or bytes}"""
+    layout, pos = {}, 0
+    for name, data in sections.items():
+        code = data.typecode if isinstance(data, array.array) else 'B'
+        size = len(data) * (data.itemsize if isinstance(data, array.array) else 1)
+        layout[name] = [pos, size, code]
+        pos += -(-size // ALIGN) * ALIGN
+    state = dict(state, sections=layout)
+    text = json.dumps(state, ensure_ascii=False).encode('utf-8')
+    start = -(-(SESSION_HEADER.size + len(text)) // ALIGN) * ALIGN
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(SESSION_HEADER.pack(SESSION_MAGIC, SESSION_VERSION, sys.byteorder == 'little', len(text)))
+        f.write(text)
+        for name, data in sections.items():
+            offset, size, _ = layout[name]
+            f.write(bytes(start + offset - f.tell()))
+            f.write(data)
+    os.replace(tmp, path)
+
+
+class SessionFile:
+    """Memory-mapped session snapshot"""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise SessionError("empty session file")
+        try:
+            magic, version, little, state_len = SESSION_HEADER.unpack_from(self._mm, 0)
+            if magic != SESSION_MAGIC or version != SESSION_VERSION or bool(little) != (sys.byteorder == 'little'):
+                raise SessionError("incompatible session file")
+            end = SESSION_HEADER.size + state_len
+            self.state = json.loads(self._mm[SESSION_HEADER.size:end].decode('utf-8'))
+        except (struct.error, ValueError) as e:
+            self.close()
+            raise SessionError(f"corrupt session file: {e}")
+        except SessionError:
+            self.close()
+            raise
+        self._start = -(-end // ALIGN) * ALIGN
+        self.sections = self.state.pop('sections', {})
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def raw(self, name):
+        """Bytes of a section (a copy)"""
+        offset, size, _ = self.sections[name]
+        start = self._start + offset
+        if start + size > len(self._mm):
+            raise SessionError(f"truncated section {name}")
+        return self._mm[start:start + size]
+
+    def array(self, name):
+        """A section as a fresh, growable array.array"""
+        _, _, code = self.sections[name]
+        values = array.array(code)
+        values.frombytes(self.raw(name))
+        return values
+
+
+def save_session(path, meta, library, state, filtered=None):
+    """Snapshot library (paths in display order) and the GUI state dict.
+
+    filtered: the filtered list (a subset of library), or None.
+    """
+    rows = meta.rows(library)
+    sections = {}
+    for name, code in COLUMNS.items():
+        if NUMPY_AVAILABLE:
+            sections[name] = array.array(code, meta.column(name)[rows].tobytes())
+        else:
+            col = meta.cols[name]
+            sections[name] = array.array(code, [col[r] for r in rows])
+    if NUMPY_AVAILABLE:
+        sections['loaded'] = np.frombuffer(meta.loaded, dtype='u1')[rows].tobytes()
+    else:
+        sections['loaded'] = bytes(meta.loaded[r] for r in rows)
+    sections['paths'] = _encode_paths(library)
+    if filtered is not None:
+        position = {p: i for i, p in enumerate(library)}
+        sections['filtered'] = array.array('I', [position[p] for p in filtered if p in position])
+    state = dict(state, rows=len(library), saved_at=time.time(), columns=list(COLUMNS),
+                 categories={name: cat.values for name, cat in meta.categories.items()})
+    write_session(path, state, sections)
+
+
+def load_session(path):
+    """(meta, library, state, filtered-or-None) from a snapshot; raises SessionError"""
+    with SessionFile(path) as snap:
+        state = snap.state
+        if state.get('columns') != list(COLUMNS):
+            raise SessionError("session columns do not match")
+        library = _decode_paths(snap.raw('paths'))
+        rows = state.get('rows', 0)
+        cols = {name: snap.array(name) for name in COLUMNS}
+        loaded = bytearray(snap.raw('loaded'))
+        if len(library) != rows or len(loaded) != rows or any(len(c) != rows for c in cols.values()):
+            raise SessionError("session sections do not match")
+        filtered = None
+        if 'filtered' in snap.sections:
+            filtered = [library[i] for i in snap.array('filtered') if i < rows]
+    meta = MetadataTable.from_columns(library, cols, loaded, state.get('categories', {}))
+    return meta, library, state, filtered
+
+
+def revalidate(meta, root, found):
+    """Changes that bring the restored rows under root in line with a fresh
+    scan (found: {path: stat_result}), in the form the folder watcher emits"""
+    changes = Changes()
+    prefix = root.rstrip(os.sep) + os.sep
+    row_of, loaded, cols = meta.row_of, meta.loaded, meta.cols
+    mtime, size, inode = cols['mtime'], cols['size'], cols['inode']
+    for path, row in row_of.items():
+        if path.startswith(prefix) and path not in found:
+            changes.removed[path] = inode[row]
+    for path, st in found.items():
+        row = row_of.get(path)
+        if row is None:
+            changes.added[path] = st
+        elif not (loaded[row] & HAS_STAT and mtime[row] == st.st_mtime
+                  and size[row] == st.st_size and inode[row] == st.st_ino):
+            changes.modified[path] = st
+    changes.pair_renames()
+    return changes
@@ -0,0 +1,214 @@
+"""Perceptual hashes, Hamming-radius search and burst grouping.
+
+Every photo gets three 64-bit hashes from one 32x32 grayscale thumbnail
+(decoded at reduced size through ``Image.draft`` where the format allows):
+aHash (8x8 mean), dHash (horizontal gradients) and pHash (signs of the low
+DCT frequencies). They are computed in a process pool and stored in the
+``IndexStore`` with the mtime they were computed for.
+
+``BKTree`` indexes pHashes by Hamming distance, so "similar to this photo"
+only visits the branches within the query radius. Bursts are runs of shots
+taken within ``BURST_GAP`` seconds of each other whose pHashes stay within
+``BURST_RADIUS`` of the previous frame.
+"""
+import math
+import os
+
+from .lazy import ensure_opener
+from .pool import default_workers, imap_bounded, process_pool
+from .store import IndexStore
+
+THUMB = 32
+SIMILAR_RADIUS = 10     # pHash bits that may differ for "similar"
+BURST_RADIUS = 12
+BURST_GAP = 3           # seconds between consecutive burst frames
+
+_popcount = getattr(int, 'bit_count', None) or (lambda x: bin(x).count('1'))
+
+
+def hamming(a, b):
+    return _popcount(a ^ b)
+
+
+def thumbnail(path, size=THUMB):
+    """Upright grayscale size x size thumbnail as a list of rows of 0-255 values"""
+    from PIL import Image, ImageOps
+    ensure_opener(path)   # pool workers do not inherit the HEIF registration on spawn
+    with Image.open(path) as img:
+        # JPEG decodes straight at 1/2..1/8 scale; other formats ignore the hint
+        img.draft('L', (size * 4, size * 4))
+        img = ImageOps.exif_transpose(img).convert('L').resize((size, size), Image.Resampling.BOX)
+        data = list(img.getdata())
+    return [data[i:i + size] for i in range(0, size * size, size)]
+
+
+def _bits(values):
+    h = 0
+    for v in values:
+        h = h << 1 | bool(v)
+    return h
+
+
+def _shrink(pixels, n):
+    """Average square blocks down to n x n"""
+    step = len(pixels) // n
+    return [[sum(pixels[y * step + j][x * step + i] for j in range(step) for i in range(step)) / (step * step)
+             for x in range(n)] for y in range(n)]
+
+
+_DCT = [[math.cos(math.pi * (2 * x + 1) * u / (2 * THUMB)) for x in range(THUMB)] for u in range(8)]
+
+
+def ahash(pixels):
+    small = [v for row in _shrink(pixels, 8) for v in row]
+    mean = sum(small) / len(small)
+    return _bits(v > mean for v in small)
+
+
+def dhash(pixels):
+    # 9 columns x 8 rows, each pixel compared with its right neighbour
+    n = len(pixels)
+    rows = [[sum(pixels[y * n // 8 + j][min(n - 1, x * n // 9 + i)] for j in range(n // 8) for i in range(n // 9))
+             for x in range(9)] for y in range(8)]
+    return _bits(row[x] < row[x + 1] for row in rows for x in range(8))
+
+
+def phash(pixels):
+    # Low 8x8 block of the 2D DCT-II, DC term excluded from the median
+    partial = [[sum(c * pixels[x][y] for x, c in enumerate(cu)) for y in range(THUMB)] for cu in _DCT]
+    coeffs = [sum(c * row[y] for y, c in enumerate(cv)) for row in partial for cv in _DCT]
+    ac = sorted(coeffs[1:])
+    median = (ac[31] + ac[32]) / 2
+    return _bits(v > median for v in coeffs)
+
+
+def image_hashes(path):
+    """(aHash, dHash, pHash) of a photo"""
+    pixels = thumbnail(path)
+    return ahash(pixels), dhash(pixels), phash(pixels)
+
+
+def _hash_job(path):
+    try:
+        return path, image_hashes(path)
+    except Exception as e:
+        print(f"Perceptual hash error for {path}: {e}")
+        return path, None
+
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes under Hamming distance"""
+
+    def __init__(self):
+        self.root = None   # [hash, [items], {distance: child}]
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, h, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [h, [item], {}]
+            return
+        node = self.root
+        while True:
+            d = _popcount(h ^ node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, [item], {}]
+                return
+            node = child
+
+    def remove(self, h, item):
+        node = self.root
+        while node is not None:
+            d = _popcount(h ^ node[0])
+            if d == 0:
+                if item in node[1]:
+                    node[1].remove(item)  # the node stays as a routing point
+                    self.size -= 1
+                return
+            node = node[2].get(d)
+
+    def query(self, h, radius):
+        """[(distance, item)] within radius, nearest first"""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            d = _popcount(h ^ node[0])
+            if d <= radius:
+                found.extend((d, item) for item in node[1])
+            # Triangle inequality: only children at distance d +- radius can match
+            for k, child in node[2].items():
+                if d - radius <= k <= d + radius:
+                    stack.append(child)
+        found.sort(key=lambda hit: hit[0])
+        return found
+
+
+def find_bursts(shots, radius=BURST_RADIUS, gap=BURST_GAP):
+    """Group (path, epoch seconds, pHash) shots into bursts of 2+ frames, in time order"""
+    bursts, run, prev = [], [], None
+    for path, when, h in sorted(shots, key=lambda s: (s[1], s[0])):
+        if prev is not None and when - prev[1] <= gap and hamming(h, prev[2]) <= radius:
+            run.append(path)
+        else:
+            if len(run) > 1:
+                bursts.append(run)
+            run = [path]
+        prev = (path, when, h)
+    if len(run) > 1:
+        bursts.append(run)
+    return bursts
+
+
+class HashJob:
+    """Compute (or load) perceptual hashes for a list of photo paths"""
+
+    def __init__(self, store_path=None, workers=None, should_stop=None, progress=None):
+        self.store_path = store_path
+        self.workers = workers or default_workers()
+        self.should_stop = should_stop or (lambda: False)
+        self.progress = progress or (lambda done, total: None)
+
+    def run(self, paths):
+        """Return {path: (aHash, dHash, pHash)} for every readable photo"""
+        store = IndexStore(self.store_path)
+        try:
+            known = store.perceptual_hashes(paths)
+            hashes, todo, mtimes = {}, [], {}
+            for p in paths:
+                try:
+                    mtime = os.path.getmtime(p)
+                except OSError:
+                    continue
+                hit = known.get(p)
+                if hit and hit[0] == mtime:
+                    hashes[p] = hit[1:]
+                else:
+                    mtimes[p] = mtime
+                    todo.append(p)
+            if todo:
+                todo.sort(key=os.path.split)
+                rows = []
+                with process_pool(self.workers) as pool:
+                    results = imap_bounded(pool, _hash_job, todo, self.workers, self.should_stop)
+                    for done, (p, h) in enumerate(results, 1):
+                        if h is not None:
+                            hashes[p] = h
+                            rows.append((p, mtimes[p]) + h)
+                        if len(rows) >= 200:
+                            store.put_perceptual_hashes(rows)
+                            rows = []
+                        if done % 20 == 0 or done == len(todo):
+                            self.progress(done, len(todo))
+                if rows:
+                    store.put_perceptual_hashes(rows)
+        finally:
+            store.close()
+        return hashes
@@ -0,0 +1,190 @@
+"""Sort engine over typed key columns of the metadata table.
+
+Every sort key is an int64 per row: epoch seconds for the date (with the
+fallback chain DateTimeOriginal -> DateTimeDigitized -> file mtime), bytes
+for the size, and ranks for text keys (name, type, camera, lens) so that
+strings are compared only once. A sort mode is a tuple of (key, reverse)
+pairs; its permutation of all rows is computed with one stable lexsort and
+cached until the table changes, so switching between modes is a lookup.
+"""
+import os
+
+from .metadata import HAS_EXIF, HAS_STAT, NUMPY_AVAILABLE, NO_TIME, np, parse_exif_datetime
+
+SORT_MODES = {
+    'name': (('name', False),),
+    'date_desc': (('date', True), ('name', False)),
+    'date_asc': (('date', False), ('name', False)),
+    'size': (('size', True), ('name', False)),
+    'type': (('type', False), ('name', False)),
+    'camera_date': (('camera', False), ('date', False), ('name', False)),
+}
+
+# What each key is computed from: MetadataTable.loaded bits to fill first
+KEY_NEEDS = {
+    'name': 0,
+    'type': 0,
+    'size': HAS_STAT,
+    'date': HAS_EXIF | HAS_STAT,
+    'camera': HAS_EXIF,
+    'lens': HAS_EXIF,
+}
+
+
+def date_key(tags, mtime):
+    """Epoch seconds from DateTimeOriginal, then DateTimeDigitized, then mtime"""
+    for tag in ('EXIF DateTimeOriginal', 'EXIF DateTimeDigitized'):
+        value = parse_exif_datetime(tags.get(tag, ''))
+        if value != NO_TIME:
+            return value
+    return int(mtime)
+
+
+class _Desc:
+    """Inverts the ordering of a wrapped value (for descending text keys)"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def _ranks(values):
+    """Rank of each value among the distinct values (equal values share a rank)"""
+    order = {v: i for i, v in enumerate(sorted(set(values)))}
+    return [order[v] for v in values]
+
+
+class Sorter:
+    """Cached multi-key sort permutations for one MetadataTable"""
+
+    def __init__(self, table):
+        self.table = table
+        self._keys = {}    # key -> (version, column)
+        self._perms = {}   # spec -> (version, permutation of all rows)
+
+    def needs(self, mode):
+        """HAS_* bits the rows must have before sorting by mode"""
+        bits = 0
+        for key, _ in SORT_MODES.get(mode, mode):
+            bits |= KEY_NEEDS[key]
+        return bits
+
+    def key(self, name):
+        """Sort key column (int64 per row) for one key"""
+        table = self.table
+        # Names never change once added, so their ranks only depend on the row count
+        stamp = len(table) if name in ('name', 'type') else table.version
+        hit = self._keys.get(name)
+        if hit and hit[0] == stamp:
+            return hit[1]
+        column = self._compute(name)
+        if NUMPY_AVAILABLE:
+            column = np.asarray(column, dtype=np.int64)
+        self._keys[name] = (stamp, column)
+        return column
+
+    def _compute(self, name):
+        table = self.table
+        if name == 'name':
+            return _ranks(table.names)
+        if name == 'type':
+            return _ranks([os.path.splitext(n)[1] for n in table.names])
+        if name in ('camera', 'lens'):
+            rank_of_code = _ranks(table.categories[name].values)
+            if NUMPY_AVAILABLE:
+                return np.asarray(rank_of_code, dtype=np.int64)[table.column(name)]
+            return [rank_of_code[c] for c in table.cols[name]]
+        if name == 'size':
+            return table.column('size').copy() if NUMPY_AVAILABLE else list(table.cols['size'])
+        if name == 'date':
+            if NUMPY_AVAILABLE:
+                taken = table.column('taken')
+                digitized = table.column('digitized')
+                mtime = table.column('mtime').astype(np.int64)
+                return np.where(taken != NO_TIME, taken,
+                                np.where(digitized != NO_TIME, digitized, mtime))
+            return [t if t != NO_TIME else (d if d != NO_TIME else int(m))
+                    for t, d, m in zip(table.cols['taken'], table.cols['digitized'], table.cols['mtime'])]
+        raise KeyError(name)
+
+    def permutation(self, mode):
+        """All table rows in sort order for a mode name or (key, reverse) tuple"""
+        spec = SORT_MODES.get(mode, mode)
+        version = self.table.version
+        hit = self._perms.get(spec)
+        if hit and hit[0] == version:
+            return hit[1]
+        # Inverting an int64 key reverses its order without overflow
+        keys = [(~self.key(name) if NUMPY_AVAILABLE else [~v for v in self.key(name)])
+                if reverse else self.key(name) for name, reverse in spec]
+        if NUMPY_AVAILABLE:
+            # lexsort is stable and treats the last key as the primary one
+            perm = np.lexsort(keys[::-1]) if keys else np.arange(len(self.table))
+        else:
+            perm = sorted(range(len(self.table)), key=lambda r: tuple(k[r] for k in keys))
+        self._perms[spec] = (version, perm)
+        return perm
+
+    def row_key(self, mode):
+        """key(row) -> tuple ordering rows exactly like permutation(mode)"""
+        table = self.table
+        names, cols = table.names, table.cols
+
+        def date(r):
+            t = cols['taken'][r]
+            if t != NO_TIME:
+                return t
+            d = cols['digitized'][r]
+            return d if d != NO_TIME else int(cols['mtime'][r])
+
+        getters = {
+            'name': names.__getitem__,
+            'type': lambda r: os.path.splitext(names[r])[1],
+            'camera': lambda r: table.value('camera', r),
+            'lens': lambda r: table.value('lens', r),
+            'size': cols['size'].__getitem__,
+            'date': date,
+        }
+        parts = []
+        for name, reverse in SORT_MODES.get(mode, mode):
+            get = getters[name]
+            if reverse:
+                get = (lambda g: lambda r: -g(r))(get) if name in ('size', 'date') else \
+                      (lambda g: lambda r: _Desc(g(r)))(get)
+            parts.append(get)
+        # Equal keys keep row order, like the stable lexsort
+        return lambda r: tuple(get(r) for get in parts) + (r,)
+
+    def insert(self, paths, new_paths, mode):
+        """Insert new_paths into paths (already sorted by mode) in place"""
+        key = self.row_key(mode)
+        row_of = self.table.row_of
+        for p in new_paths:
+            k = key(row_of[p])
+            lo, hi = 0, len(paths)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if key(row_of[paths[mid]]) < k:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            paths.insert(lo, p)
+
+    def sort(self, paths, mode):
+        """paths reordered by mode (distinct paths, all rows of the table)"""
+        table = self.table
+        perm = self.permutation(mode)
+        if len(paths) == len(table):
+            return table.paths_of(perm)  # the whole library: no membership test
+        if NUMPY_AVAILABLE:
+            member = np.zeros(len(table), dtype=bool)
+            member[table.rows(paths)] = True
+            return table.paths_of(perm[member[perm]])
+        wanted = set(table.rows(paths))
+        return table.paths_of([r for r in perm if r in wanted])
@@ -0,0 +1,226 @@
+"""Persistent library index kept in a SQLite file in the data dir.
+
+Each thread should open its own ``IndexStore``; SQLite connections are not
+shared across threads. The desktop app and the ``geosnap`` command line share
+the same file, so a library scanned on the command line opens without
+parsing its EXIF again.
+"""
+import os
+import sqlite3
+import time
+
+from .paths import data_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS photo_cells (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    cell TEXT
+);
+CREATE TABLE IF NOT EXISTS place_cells (
+    cell TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    city TEXT NOT NULL DEFAULT '',
+    region TEXT NOT NULL DEFAULT '',
+    country TEXT NOT NULL DEFAULT '',
+    resolved_at REAL NOT NULL,
+    PRIMARY KEY (cell, backend)
+);
+CREATE TABLE IF NOT EXISTS content_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    quick BLOB,
+    full BLOB
+);
+CREATE TABLE IF NOT EXISTS photo_metadata (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    ctime REAL NOT NULL,
+    inode INTEGER NOT NULL,
+    lat REAL,
+    lon REAL,
+    alt REAL,
+    taken INTEGER,
+    digitized INTEGER,
+    iso INTEGER,
+    exposure REAL,
+    camera TEXT NOT NULL DEFAULT '',
+    lens TEXT NOT NULL DEFAULT '',
+    scanned_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS perceptual_hashes (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    ahash INTEGER NOT NULL,
+    dhash INTEGER NOT NULL,
+    phash INTEGER NOT NULL
+);
+"""
+
+# SQLite caps the number of bound parameters per statement
+BATCH = 500
+
+# photo_metadata columns after path, in table order
+METADATA_COLUMNS = ('size', 'mtime', 'ctime', 'inode', 'lat', 'lon', 'alt', 'taken', 'digitized',
+                    'iso', 'exposure', 'camera', 'lens', 'scanned_at')
+
+
+def _signed64(h):
+    """SQLite integers are signed: store 64-bit hashes two's-complement"""
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+
+def path_range(root):
+    """(low, high) bounds of the paths under root, for a primary key range scan"""
+    root = root.rstrip(os.sep)
+    return root + os.sep, root + chr(ord(os.sep) + 1)
+
+
+def default_store_path():
+    return data_path('library.db')
+
+
+class IndexStore:
+    def __init__(self, path=None):
+        self.path = path or default_store_path()
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _select_in(self, sql, keys):
+        keys = list(keys)
+        for i in range(0, len(keys), BATCH):
+            chunk = keys[i:i + BATCH]
+            marks = ",".join("?" * len(chunk))
+            yield from self.conn.execute(sql.format(marks=marks), chunk)
+
+    # ---------- photo -> cell ----------
+
+    def photo_cells(self, paths):
+        """Return {path: (mtime, cell)} for the paths already scanned"""
+        return {p: (m, c) for p, m, c in
+                self._select_in("SELECT path, mtime, cell FROM photo_cells WHERE path IN ({marks})", paths)}
+
+    def put_photo_cells(self, rows):
+        """rows: iterable of (path, mtime, cell-or-None)"""
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO photo_cells VALUES (?, ?, ?)", rows)
+
+    # ---------- photo -> content hashes ----------
+
+    def content_hashes(self, paths):
+        """Return {path: (size, mtime, quick, full)}; either hash may be None"""
+        return {p: (size, mtime, quick, full) for p, size, mtime, quick, full in
+                self._select_in("SELECT path, size, mtime, quick, full FROM content_hashes "
+                                "WHERE path IN ({marks})", paths)}
+
+    def put_content_hashes(self, rows):
+        """rows: iterable of (path, size, mtime, quick, full)"""
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO content_hashes VALUES (?, ?, ?, ?, ?)", rows)
+
+    # ---------- photo -> perceptual hashes ----------
+
+    def perceptual_hashes(self, paths):
+        """Return {path: (mtime, ahash, dhash, phash)} as unsigned 64-bit ints"""
+        mask = (1 << 64) - 1
+        return {p: (m, a & mask, d & mask, h & mask) for p, m, a, d, h in
+                self._select_in("SELECT path, mtime, ahash, dhash, phash FROM perceptual_hashes "
+                                "WHERE path IN ({marks})", paths)}
+
+    def put_perceptual_hashes(self, rows):
+        """rows: iterable of (path, mtime, ahash, dhash, phash)"""
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO perceptual_hashes VALUES (?, ?, ?, ?, ?)",
+                                  [(p, m, _signed64(a), _signed64(d), _signed64(h)) for p, m, a, d, h in rows])
+
+    # ---------- photo -> metadata ----------
+
+    def photo_metadata(self, paths):
+        """Return {path: row tuple in METADATA_COLUMNS order} for known paths"""
+        sql = f"SELECT path, {', '.join(METADATA_COLUMNS)} FROM photo_metadata WHERE path IN ({{marks}})"
+        return {row[0]: row[1:] for row in self._select_in(sql, paths)}
+
+    def put_photo_metadata(self, rows):
+        """rows: iterable of (path, *METADATA_COLUMNS values)"""
+        marks = ",".join("?" * (len(METADATA_COLUMNS) + 1))
+        with self.conn:
+            self.conn.executemany(f"INSERT OR REPLACE INTO photo_metadata VALUES ({marks})", rows)
+
+    def put_rewritten_photos(self, rows, retimed):
+        """Catalog rows of files whose tags were rewritten, in one transaction
+
+        retimed: (path, old mtime, new mtime) of files whose pixels did not
+        change, so their perceptual hashes stay valid under the new mtime.
+        """
+        marks = ",".join("?" * (len(METADATA_COLUMNS) + 1))
+        with self.conn:
+            self.conn.executemany(f"INSERT OR REPLACE INTO photo_metadata VALUES ({marks})", rows)
+            self.conn.executemany("UPDATE perceptual_hashes SET mtime = ? WHERE path = ? AND mtime = ?",
+                                  [(new, p, old) for p, old, new in retimed])
+
+    def touch_photo_metadata(self, paths, scanned_at):
+        """Mark unchanged paths as seen by the scan started at scanned_at"""
+        paths = list(paths)
+        with self.conn:
+            for i in range(0, len(paths), BATCH):
+                chunk = paths[i:i + BATCH]
+                self.conn.execute(
+                    f"UPDATE photo_metadata SET scanned_at = ? WHERE path IN ({','.join('?' * len(chunk))})",
+                    [scanned_at] + chunk)
+
+    def prune_photo_metadata(self, root, scanned_at):
+        """Forget paths under root that the scan started at scanned_at did not see"""
+        low, high = path_range(root)
+        with self.conn:
+            return self.conn.execute(
+                "DELETE FROM photo_metadata WHERE path >= ? AND path < ? AND scanned_at < ?",
+                (low, high, scanned_at)).rowcount
+
+    def count_photo_metadata(self):
+        return self.conn.execute("SELECT count(*) FROM photo_metadata").fetchone()[0]
+
+    def iter_photo_metadata(self, root=None, batch=10000):
+        """Yield lists of (path, *METADATA_COLUMNS) in path order, batch rows at a time"""
+        low, high = path_range(root) if root else ('', None)
+        sql = f"SELECT path, {', '.join(METADATA_COLUMNS)} FROM photo_metadata WHERE path >= ?"
+        if high is not None:
+            sql += " AND path < ?"
+        sql += " AND path > ? ORDER BY path LIMIT ?"
+        after = ''
+        while True:
+            args = (low, high, after, batch) if high is not None else (low, after, batch)
+            rows = self.conn.execute(sql, args).fetchall()
+            if not rows:
+                return
+            yield rows
+            after = rows[-1][0]
+
+    # ---------- cell -> place ----------
+
+    def places(self, cells, backend):
+        """Return {cell: {'city', 'region', 'country'}} resolved by a backend"""
+        rows = self._select_in(
+            "SELECT cell, backend, city, region, country FROM place_cells WHERE cell IN ({marks})", cells)
+        return {cell: {'city': city, 'region': region, 'country': country}
+                for cell, b, city, region, country in rows if b == backend}
+
+    def put_place(self, cell, place, backend):
+        place = place or {}
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO place_cells VALUES (?, ?, ?, ?, ?, ?)",
+                (cell, backend, place.get('city', ''), place.get('region', ''),
+                 place.get('country', ''), time.time()))
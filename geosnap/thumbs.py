@@ -0,0 +1,86 @@
+"""On-disk JPEG thumbnail cache in the data dir.
+
+A thumbnail is keyed by the photo's path, size and mtime and by the
+thumbnail size, so an edited photo simply gets a new entry; ``prune`` drops
+the least recently written entries past a byte budget. Files are written to
+a temp name and renamed, so concurrent readers never see half a thumbnail.
+"""
+import hashlib
+import io
+import os
+
+from .lazy import ensure_opener
+from .paths import data_path
+
+SIZES = (128, 256, 512, 1024)   # other requested sizes are rounded up to one of these
+QUALITY = 85
+BUDGET = 512 * 1024 * 1024
+
+
+def thumbnail_size(size):
+    """The cached size used for a requested edge length"""
+    return next((s for s in SIZES if s >= size), SIZES[-1])
+
+
+def render(path, size):
+    """JPEG bytes of an upright thumbnail fitting in size x size"""
+    from PIL import Image, ImageOps
+    ensure_opener(path)
+    with Image.open(path) as img:
+        # JPEG decodes straight at 1/2..1/8 scale; other formats ignore the hint
+        img.draft('RGB', (size, size))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size), Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        img.convert('RGB').save(out, 'JPEG', quality=QUALITY)
+    return out.getvalue()
+
+
+class ThumbnailCache:
+    def __init__(self, root=None):
+        self.root = root or data_path('thumbs')
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, path, st, size):
+        key = hashlib.sha1(f"{path}\0{st.st_size}\0{st.st_mtime_ns}\0{size}".encode('utf-8',
+                                                                                   'surrogateescape')).hexdigest()
+        return os.path.join(self.root, key[:2], key + '.jpg')
+
+    def get(self, path, size, st=None):
+        """Path of the cached thumbnail, rendered first if needed; raises OSError"""
+        size = thumbnail_size(size)
+        st = st or os.stat(path)
+        thumb = self.path_for(path, st, size)
+        if not os.path.exists(thumb):
+            data = render(path, size)
+            os.makedirs(os.path.dirname(thumb), exist_ok=True)
+            tmp = f"{thumb}.{os.getpid()}.{id(data)}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, thumb)
+        return thumb
+
+    def prune(self, budget=BUDGET):
+        """Delete the oldest thumbnails until the cache fits in budget bytes; returns the count"""
+        entries, total = [], 0
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                full = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, full))
+                total += st.st_size
+        removed = 0
+        entries.sort()
+        for _, size, full in entries:
+            if total <= budget:
+                break
+            try:
+                os.remove(full)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
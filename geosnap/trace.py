@@ -0,0 +1,166 @@
+"""Spans on the hot paths, exported as Chrome trace JSON.
+
+Tracing is off unless ``GEOSNAP_TRACE`` is set (to an output file, or to 1
+for ``traces/geosnap-<time>.json`` in the data dir) or ``enable()`` is
+called. While it is off, ``span()`` hands back one shared no-op context
+manager, so an instrumented call costs a global lookup and a function call.
+
+Spans become complete ("X") events with microsecond timestamps, one track
+per thread, which chrome://tracing and https://ui.perfetto.dev open as is.
+``last`` keeps the duration of the latest run of every span name for live
+displays. Spans inside process-pool workers are not recorded; the thread
+that drives the pool is.
+"""
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+from .paths import data_path
+
+MAX_EVENTS = 500_000
+
+enabled = False
+output = None
+last = {}          # span name -> milliseconds of its latest run
+dropped = 0
+
+_events = []
+_threads = {}      # thread ident -> name
+_lock = threading.Lock()
+_epoch = time.perf_counter_ns()
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ('name', 'cat', 'args', 'start')
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        _record(self.name, self.cat, self.start, end - self.start, self.args)
+        return False
+
+
+def span(name, cat='app', **args):
+    """Context manager timing a block as one trace event"""
+    if not enabled:
+        return _NO_SPAN
+    return _Span(name, cat, args)
+
+
+def traced(name=None, cat='app'):
+    """Decorator: run the whole function inside a span
+
+    The wrapper takes any arguments, so Qt no longer drops surplus signal
+    arguments for it: connect a traced slot to signals of matching arity.
+    """
+    def wrap(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def inner(*a, **kw):
+            if not enabled:
+                return func(*a, **kw)
+            with _Span(label, cat, {}):
+                return func(*a, **kw)
+        return inner
+    return wrap
+
+
+def name_thread(name):
+    """Label the calling thread's track (Qt threads show up as Dummy-N otherwise)"""
+    with _lock:
+        _threads[threading.get_ident()] = name
+
+
+def _record(name, cat, start, duration, args):
+    global dropped
+    last[name] = duration / 1e6
+    tid = threading.get_ident()
+    event = {'name': name, 'cat': cat, 'ph': 'X', 'pid': os.getpid(), 'tid': tid,
+             'ts': (start - _epoch) / 1000, 'dur': duration / 1000}
+    if args:
+        event['args'] = args
+    with _lock:
+        if tid not in _threads:
+            _threads[tid] = threading.current_thread().name
+        if len(_events) < MAX_EVENTS:
+            _events.append(event)
+        else:
+            dropped += 1
+
+
+def default_output():
+    return data_path(os.path.join('traces', f"geosnap-{time.strftime('%Y%m%d-%H%M%S')}.json"))
+
+
+def enable(path=None):
+    """Start recording from scratch; save() writes to path unless given another"""
+    global enabled, output, dropped, _epoch
+    with _lock:
+        _events.clear()
+        dropped = 0
+    last.clear()
+    output = path or default_output()
+    _epoch = time.perf_counter_ns()
+    enabled = True
+
+
+def disable():
+    """Stop recording and save the trace; returns the file written (or None)"""
+    global enabled
+    if not enabled:
+        return None
+    enabled = False
+    return save()
+
+
+def save(path=None):
+    """Write the events recorded so far as Chrome trace JSON"""
+    path = path or output or default_output()
+    with _lock:
+        events = list(_events)
+        threads = dict(_threads)
+    pid = os.getpid()
+    meta = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': 'GeoSnap'}}]
+    meta.extend({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                for tid, name in threads.items())
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': meta + events, 'displayTimeUnit': 'ms',
+                   'otherData': {'dropped_events': dropped}}, f)
+    return path
+
+
+def _from_environment():
+    value = os.environ.get('GEOSNAP_TRACE', '').strip()
+    if not value or value == '0':
+        return
+    enable(None if value == '1' else value)
+    atexit.register(disable)
+
+
+_from_environment()
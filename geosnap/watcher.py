@@ -0,0 +1,183 @@
+"""Incremental change detection for watched photo folders.
+
+``FolderWatch`` keeps a snapshot of every directory under the watched roots
+(name -> size, mtime, inode) and re-lists only the directories it is told
+have changed, turning the difference into adds, removals, renames (same
+inode, new name) and modifications. It has no Qt dependency: the GUI feeds
+it directory-change notifications (inotify through QFileSystemWatcher) or
+polls it on network shares where such notifications never arrive.
+"""
+import os
+import sys
+
+from .fileattrs import IMAGE_EXTS
+
+NETWORK_FS = ('nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'sshfs', 'fuse.sshfs', 'afpfs', '9p', 'davfs')
+
+
+class Changes:
+    """Result of a rescan; all paths are full paths"""
+
+    def __init__(self):
+        self.added = {}       # path -> stat_result
+        self.removed = {}     # path -> inode it had
+        self.renamed = []     # (old path, new path, stat_result)
+        self.modified = {}    # path -> stat_result
+        self.dirs_added = []
+        self.dirs_removed = []
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.renamed or self.modified
+                    or self.dirs_added or self.dirs_removed)
+
+    def pair_renames(self):
+        """Turn a removal plus an add of the same inode into a rename"""
+        by_inode = {}
+        for path, st in self.added.items():
+            if st.st_ino:
+                by_inode.setdefault(st.st_ino, []).append(path)
+        for old, ino in list(self.removed.items()):
+            candidates = by_inode.get(ino) if ino else None
+            if candidates:
+                new = candidates.pop()
+                self.renamed.append((old, new, self.added.pop(new)))
+                del self.removed[old]
+
+
+def is_network_path(path):
+    """Best effort: does path live on a network share?"""
+    path = os.path.abspath(path)
+    if sys.platform == 'win32':
+        if path.startswith('\\\\'):
+            return True
+        try:
+            import ctypes
+            DRIVE_REMOTE = 4
+            return ctypes.windll.kernel32.GetDriveTypeW(os.path.splitdrive(path)[0] + '\\') == DRIVE_REMOTE
+        except (AttributeError, OSError):
+            return False
+    try:
+        with open('/proc/mounts', encoding='utf-8') as f:
+            mounts = [line.split()[1:3] for line in f if len(line.split()) >= 3]
+    except OSError:
+        return False
+    best, fstype = '', ''
+    for mount, kind in mounts:
+        mount = mount.replace('\\040', ' ')
+        if (path == mount or path.startswith(mount.rstrip('/') + '/')) and len(mount) > len(best):
+            best, fstype = mount, kind
+    return fstype in NETWORK_FS
+
+
+def _list_dir(directory, exts):
+    """({name: stat_result} of images, subdirectory paths), or None if gone"""
+    files, subdirs = {}, []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in exts and entry.is_file():
+                        files[entry.name] = entry.stat()
+                except OSError:
+                    continue
+    except OSError:
+        return None
+    return files, subdirs
+
+
+def _signature(st):
+    return st.st_size, st.st_mtime, st.st_ino
+
+
+class FolderWatch:
+    """Snapshots of watched directory trees, diffed one directory at a time"""
+
+    def __init__(self, exts=IMAGE_EXTS):
+        self.exts = exts
+        self.roots = []
+        self.dirs = {}       # directory -> {name: (size, mtime, inode)}
+        self.children = {}   # directory -> set of subdirectories
+
+    def add_root(self, root):
+        """Snapshot a new tree; returns {path: stat_result} of its images"""
+        root = os.path.normpath(root)
+        found = {}
+        if root in self.roots:
+            return found
+        self.roots.append(root)
+        self._take(root, found)
+        return found
+
+    def _take(self, top, found, new_dirs=None):
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            if directory in self.dirs:
+                continue
+            listing = _list_dir(directory, self.exts)
+            if listing is None:
+                continue
+            files, subdirs = listing
+            self.dirs[directory] = {name: _signature(st) for name, st in files.items()}
+            self.children[directory] = set(subdirs)
+            for name, st in files.items():
+                found[os.path.join(directory, name)] = st
+            if new_dirs is not None:
+                new_dirs.append(directory)
+            stack.extend(sorted(subdirs, reverse=True))
+
+    def _drop(self, top, changes):
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            files = self.dirs.pop(directory, None)
+            if files is None:
+                continue
+            for name, sig in files.items():
+                changes.removed[os.path.join(directory, name)] = sig[2]
+            stack.extend(self.children.pop(directory, ()))
+            changes.dirs_removed.append(directory)
+
+    def directories(self, root=None):
+        if root is None:
+            return list(self.dirs)
+        prefix = root.rstrip(os.sep) + os.sep
+        return [d for d in self.dirs if d == root or d.startswith(prefix)]
+
+    def rescan(self, directories):
+        """Re-list directories and return what changed"""
+        changes = Changes()
+        for directory in dict.fromkeys(directories):
+            if directory in self.dirs:
+                self._rescan_dir(directory, changes)
+        changes.pair_renames()
+        return changes
+
+    def _rescan_dir(self, directory, changes):
+        listing = _list_dir(directory, self.exts)
+        if listing is None:
+            self._drop(directory, changes)
+            return
+        files, subdirs = listing
+        old = self.dirs[directory]
+        self.dirs[directory] = {name: _signature(st) for name, st in files.items()}
+        for name, st in files.items():
+            path = os.path.join(directory, name)
+            before = old.get(name)
+            if before is None:
+                changes.added[path] = st
+            elif before != _signature(st):
+                changes.modified[path] = st
+        for name in old.keys() - files.keys():
+            changes.removed[os.path.join(directory, name)] = old[name][2]
+
+        subdirs = set(subdirs)
+        known = self.children.get(directory, set())
+        self.children[directory] = subdirs
+        for sub in known - subdirs:
+            self._drop(sub, changes)
+        for sub in sorted(subdirs - known):
+            # A folder created or moved in: take it whole
+            self._take(sub, changes.added, changes.dirs_added)
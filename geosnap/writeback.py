@@ -0,0 +1,122 @@
+"""Batch write-back of GPS (and capture time) tags, kept in step with the index.
+
+An edit is ``(path, lat, lon, alt, when, taken)``: the position, the UTC
+GPS time stamp and, when not None, a new DateTimeOriginal (wall-clock
+seconds). ``WriteJob`` tags the files in a process pool; every file is
+replaced atomically by ``exifwrite.write_gps`` and re-read in the same
+worker, so the catalog rows describe what is on disk. The rows of a chunk
+of files are committed to the ``IndexStore`` in one transaction, together
+with their perceptual hashes (the pixels are untouched). If the process dies
+between the rename and the commit, the size/mtime check of the next scan
+simply parses those files again.
+
+``dry_run`` builds every tagged file in memory and reports the sizes,
+without touching the disk or the index.
+"""
+import os
+import time
+
+from .catalog import store_row
+from .exif import read_exif
+from .exifwrite import WRITABLE_EXTS, WriteError, write_gps
+from .fileattrs import batches
+from .geotag import MAX_GAP
+from .metadata import NUMPY_AVAILABLE, record_from_tags
+from .pool import default_workers, imap_bounded, process_pool
+from .store import IndexStore
+
+CHUNK = 500            # files committed to the index together
+TOLERANCE_DEG = 1e-5   # read-back check (the DMS rationals keep 1e-4 arcsec)
+
+
+def _write_job(job):
+    """Worker entry point: edit + dry_run -> (path, record, (old mtime, stat), bytes, error)"""
+    path, lat, lon, alt, when, taken, dry_run = job
+    try:
+        old = os.stat(path)
+        size = write_gps(path, lat, lon, alt, when, taken, dry_run=dry_run)
+    except (OSError, WriteError, ValueError) as e:
+        return path, None, None, 0, str(e)
+    if dry_run:
+        return path, None, None, size, None
+    try:
+        st = os.stat(path)
+        rec = record_from_tags(read_exif(path))
+    except Exception as e:
+        return path, None, None, size, f"written but not readable: {e}"
+    error = None
+    if abs(rec.get('lat', 1e9) - lat) > TOLERANCE_DEG or abs(rec.get('lon', 1e9) - lon) > TOLERANCE_DEG:
+        error = "written but the GPS tags do not read back"
+    return path, rec, (old.st_mtime, st), size, error
+
+
+def track_edits(table, rows, track, zone=0, drift=0, max_gap=MAX_GAP, fix_time=False):
+    """Edits for the writable photos of table[rows] that the track places
+
+    zone: seconds the camera's time zone is ahead of UTC; drift: seconds its
+    clock runs fast. fix_time: also correct DateTimeOriginal by the drift.
+    """
+    paths = table.paths_of(rows)
+    taken = table.column('taken')[rows] if NUMPY_AVAILABLE else [table.cols['taken'][r] for r in rows]
+    offset = zone + drift
+    lats, lons, alts = track.match(taken, offset, max_gap=max_gap)
+    if NUMPY_AVAILABLE:
+        taken, lats, lons, alts = taken.tolist(), lats.tolist(), lons.tolist(), alts.tolist()
+    edits = []
+    for path, t, lat, lon, alt in zip(paths, taken, lats, lons, alts):
+        if lat != lat or os.path.splitext(path)[1].lower() not in WRITABLE_EXTS:
+            continue
+        edits.append((path, lat, lon, None if alt != alt else alt, t - offset,
+                      t - drift if fix_time and drift else None))
+    return edits
+
+
+class WriteJob:
+    """Tag many files in parallel, updating the catalog as chunks finish"""
+
+    def __init__(self, store_path=None, workers=None, should_stop=None, progress=None, dry_run=False):
+        self.store_path = store_path
+        self.workers = workers or default_workers()
+        self.should_stop = should_stop or (lambda: False)
+        self.progress = progress or (lambda counts: None)
+        self.dry_run = dry_run
+        self.counts = {'files': 0, 'written': 0, 'failed': 0, 'bytes': 0}
+
+    def run(self, edits):
+        """Yield (path, record, stat, error) for every edit as it finishes
+
+        record and stat are None for failed files and in a dry run; record
+        is the metadata re-read from the written file.
+        """
+        store = None if self.dry_run else IndexStore(self.store_path)
+        try:
+            by_path = {edit[0]: edit for edit in edits}
+            with process_pool(self.workers) as pool:
+                for chunk in batches(by_path, CHUNK):
+                    if self.should_stop():
+                        break
+                    jobs = [by_path[p] + (self.dry_run,) for p in chunk]
+                    yield from self._write(pool, store, jobs)
+        finally:
+            if store:
+                store.close()
+
+    def _write(self, pool, store, jobs):
+        counts = self.counts
+        rows, retimed, now = [], [], time.time()
+        for path, rec, stat, size, error in imap_bounded(pool, _write_job, jobs, self.workers, self.should_stop):
+            counts['files'] += 1
+            if error is None:
+                counts['written'] += 1
+                counts['bytes'] += size
+            else:
+                counts['failed'] += 1
+            st = None
+            if stat is not None:
+                old_mtime, st = stat
+                rows.append(store_row(path, st, rec, now))
+                retimed.append((path, old_mtime, st.st_mtime))
+            yield path, rec, st, error
+        if store and rows:
+            store.put_rewritten_photos(rows, retimed)
+        self.progress(counts)
@@ -1,6 +1,8 @@
 import sys
 import os
-import tempfile
+import queue
+import sqlite3
+import time
 import webbrowser
 from datetime import datetime
 from pathlib import Path
@@ -8,37 +10,96 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QH
                               QLabel, QPushButton, QListWidget, QFrame, QSplitter, QFileDialog,
                               QMessageBox, QLineEdit, QRadioButton, QButtonGroup, QScrollArea,
                               QGroupBox, QGridLayout, QSizePolicy, QGraphicsDropShadowEffect, 
-                              QComboBox, QInputDialog)
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QPoint, QPropertyAnimation, QEasingCurve, QSize
-from PyQt6.QtGui import QPixmap, QImage, QTransform, QFont, QPainter, QColor, QPalette, QIcon, QAction
-from collections import OrderedDict
+                              QComboBox, QInputDialog, QTreeWidget, QTreeWidgetItem, QDialog, QSpinBox,
+                              QDoubleSpinBox, QFormLayout, QCheckBox)
+from PyQt6.QtCore import (Qt, QThread, pyqtSignal, QPoint, QPropertyAnimation, QEasingCurve, QSize, QSettings,
+                          QTimer, QFileSystemWatcher)
+from PyQt6.QtGui import QPixmap, QImage, QTransform, QFont, QPainter, QColor, QPalette, QIcon, QAction, QActionGroup
+
+from geosnap import trace
+from geosnap.exif import read_exif
+from geosnap.lazy import EXIFREAD, HEIF, FOLIUM, GEOPY, ensure_opener, warm
+from geosnap.metadata import MetadataTable, mask_not, record_from_tags, HAS_EXIF, HAS_STAT, MISSING
+from geosnap.fileattrs import IMAGE_EXTS, stat_many, batches
+from geosnap.watcher import FolderWatch, is_network_path
+from geosnap.duplicates import DuplicateJob, wasted_bytes
+from geosnap.similar import HashJob, BKTree, find_bursts, SIMILAR_RADIUS
+from geosnap.maps import geotag_map
+from geosnap.cache import Cache, Failed
+from geosnap.memory import MemoryBudget, Gauge, MiB, process_rss, system_memory
+from geosnap.geocoder import create_geocoder, GeocoderError
+from geosnap.places import PlaceJob, place_counts, PLACE_LEVELS
+from geosnap.query import Query
+from geosnap.catalog import is_current, record_of, store_row
+from geosnap.core import Library, save_map
+from geosnap.export import ARROW, BINARY, EXTENSIONS, GEOGRAPHIC, export, format_of
+from geosnap.geotag import MAX_GAP, NMEA_EXTS, Track, TrackError
+from geosnap.writeback import WriteJob, track_edits
+from geosnap.store import IndexStore
+from geosnap.session import SessionError, default_session_path, load_session, revalidate, save_session
 
 # Import libraries
-try:
-    import exifread
-    EXIFREAD_AVAILABLE = True
-except ImportError:
-    EXIFREAD_AVAILABLE = False
-
-try:
-    from PIL import Image, ImageOps
-    from pillow_heif import register_heif_opener
-    register_heif_opener()
-    HEIC_SUPPORTED = True
-except ImportError:
-    HEIC_SUPPORTED = False
-
-try:
-    import folium
-    FOLIUM_AVAILABLE = True
-except ImportError:
-    FOLIUM_AVAILABLE = False
-
-try:
-    from geopy.geocoders import Nominatim
-    GEOPY_AVAILABLE = True
-except ImportError:
-    GEOPY_AVAILABLE = False
+from PIL import Image, ImageOps
+
+# Optional modules are only probed here; each is imported on first use
+exifread = EXIFREAD
+folium = FOLIUM
+EXIFREAD_AVAILABLE = EXIFREAD.available
+HEIC_SUPPORTED = HEIF.available
+FOLIUM_AVAILABLE = FOLIUM.available
+GEOPY_AVAILABLE = GEOPY.available
+
+
+# Seconds before file attributes are re-read when the window regains focus
+STAT_REFRESH_INTERVAL = 300
+
+_PALETTES = {}
+
+
+def theme_palette(dark):
+    """Application palette of the light or dark theme (built once)"""
+    if dark in _PALETTES:
+        return _PALETTES[dark]
+    palette = QPalette()
+    if dark:
+        colors = {
+            QPalette.ColorRole.Window: (30, 30, 30), QPalette.ColorRole.WindowText: (229, 229, 229),
+            QPalette.ColorRole.Base: (45, 45, 45), QPalette.ColorRole.AlternateBase: (53, 53, 53),
+            QPalette.ColorRole.ToolTipBase: (45, 45, 45), QPalette.ColorRole.ToolTipText: (229, 229, 229),
+            QPalette.ColorRole.Text: (229, 229, 229), QPalette.ColorRole.Button: (45, 45, 45),
+            QPalette.ColorRole.ButtonText: (229, 229, 229),
+        }
+        disabled = {QPalette.ColorRole.WindowText: (128, 128, 128), QPalette.ColorRole.Text: (128, 128, 128),
+                    QPalette.ColorRole.ButtonText: (128, 128, 128)}
+    else:
+        colors = {
+            QPalette.ColorRole.Window: (243, 243, 243), QPalette.ColorRole.WindowText: (26, 26, 26),
+            QPalette.ColorRole.Base: (255, 255, 255), QPalette.ColorRole.AlternateBase: (245, 245, 245),
+            QPalette.ColorRole.ToolTipBase: (255, 255, 255), QPalette.ColorRole.ToolTipText: (26, 26, 26),
+            QPalette.ColorRole.Text: (26, 26, 26), QPalette.ColorRole.Button: (243, 243, 243),
+            QPalette.ColorRole.ButtonText: (26, 26, 26), QPalette.ColorRole.BrightText: (255, 255, 255),
+        }
+        disabled = {QPalette.ColorRole.WindowText: (148, 148, 148), QPalette.ColorRole.Text: (148, 148, 148),
+                    QPalette.ColorRole.ButtonText: (148, 148, 148), QPalette.ColorRole.Base: (235, 235, 235)}
+    colors[QPalette.ColorRole.Link] = (0, 103, 192)
+    colors[QPalette.ColorRole.Highlight] = (0, 103, 192)
+    colors[QPalette.ColorRole.HighlightedText] = (255, 255, 255)
+    for role, rgb in colors.items():
+        palette.setColor(role, QColor(*rgb))
+    for role, rgb in disabled.items():
+        palette.setColor(QPalette.ColorGroup.Disabled, role, QColor(*rgb))
+    _PALETTES[dark] = palette
+    return palette
+
+
+def set_style_property(widget, name, value):
+    """Change a property used by stylesheet selectors and re-polish only that widget"""
+    if widget.property(name) == value:
+        return
+    widget.setProperty(name, value)
+    style = widget.style()
+    style.unpolish(widget)
+    style.polish(widget)
 
 
 # Windows 11 Fluent Design System QSS
@@ -50,15 +111,16 @@ FLUENT_STYLE = """
     outline: none;
 }
 
-QMainWindow {
-    background-color: #f3f3f3;
-}
-
 QWidget {
     color: #1a1a1a;
     background-color: transparent;
 }
 
+/* After QWidget, which would otherwise make the window transparent too */
+QMainWindow {
+    background-color: #f3f3f3;
+}
+
 /* ========== BUTTONS ========== */
 QPushButton {
     background-color: #0067C0;
@@ -118,14 +180,14 @@ QPushButton#filterButton:pressed {
 }
 
 /* Filter Button Active State */
-QPushButton#filterButtonActive {
+QPushButton#filterButton[active="true"] {
     background-color: #0067C0;
     color: white;
     border: 1px solid #0067C0;
     padding: 5px 8px;
 }
 
-QPushButton#filterButtonActive:hover {
+QPushButton#filterButton[active="true"]:hover {
     background-color: #0078D4;
     border-color: #0078D4;
 }
@@ -270,6 +332,23 @@ QListWidget::item:selected:hover {
     background-color: #0078D4;
 }
 
+/* ========== TREE WIDGET ========== */
+QTreeWidget {
+    background-color: white;
+    border: 1px solid #e0e0e0;
+    border-radius: 6px;
+    padding: 2px;
+    color: #1a1a1a;
+}
+
+QTreeWidget::item {
+    padding: 3px;
+}
+
+QTreeWidget::item:hover {
+    background-color: #f5f5f5;
+}
+
 /* ========== GROUP BOX ========== */
 QGroupBox {
     background-color: white;
@@ -435,29 +514,61 @@ QMessageBox QLabel {
 QMessageBox QPushButton {
     min-width: 80px;
 }
+
+/* List status: state property set by update_list_status */
+QLabel#listStatus {
+    background-color: #FFF4CE;
+    color: #6B5300;
+    border-radius: 4px;
+    padding: 8px;
+    font-weight: 600;
+    font-size: 8.5pt;
+}
+
+QLabel#listStatus[state="filtered"] {
+    background-color: #D4F4DD;
+    color: #0E5C2F;
+}
+
+/* Viewer toolbar buttons (same in both themes) */
+QPushButton#viewerTool {
+    background-color: #404040;
+    color: white;
+    border: none;
+    border-radius: 4px;
+    padding: 8px 14px;
+    font-weight: 500;
+}
+
+QPushButton#viewerTool:hover {
+    background-color: #505050;
+}
+
+QPushButton#viewerTool:pressed {
+    background-color: #353535;
+}
 """
 
 
 class AddressLoader(QThread):
     result = pyqtSignal(str)
     
-    def __init__(self, lat, lon):
+    def __init__(self, lat, lon, geocoder):
         super().__init__()
         self.lat = lat
         self.lon = lon
+        self.geocoder = geocoder
         self._is_running = True  # ✅ Thêm flag
     
     def run(self):
-        if not GEOPY_AVAILABLE:
-            self.result.emit("⚠️ Chưa cài thư viện geopy")
-            return
+        trace.name_thread('AddressLoader')
         try:
             if not self._is_running:  # ✅ Check trước khi chạy
                 return
-            geo = Nominatim(user_agent="geosnap_v2", timeout=10)
-            loc = geo.reverse(f"{self.lat}, {self.lon}", language='vi')
+            with trace.span('reverse_geocode', 'worker'):
+                place = self.geocoder.reverse(self.lat, self.lon)
             if self._is_running:  # ✅ Check trước khi emit
-                self.result.emit(loc.address if loc else "❌ Không tìm thấy địa chỉ")
+                self.result.emit(place['address'] if place else "❌ Không tìm thấy địa chỉ")
         except Exception as e:
             if self._is_running:
                 self.result.emit(f"❌ Lỗi: {str(e)[:40]}")
@@ -467,6 +578,343 @@ class AddressLoader(QThread):
         self._is_running = False
 
 
+class PlaceIndexer(QThread):
+    """Background reverse geocoding of the whole library"""
+    progress = pyqtSignal(str, int, int)
+    done = pyqtSignal(dict)
+    
+    def __init__(self, paths, geocoder):
+        super().__init__()
+        self.paths = list(paths)
+        self.geocoder = geocoder
+        self._is_running = True
+    
+    def run(self):
+        job = PlaceJob(self.geocoder,
+                       should_stop=lambda: not self._is_running,
+                       progress=self.progress.emit)
+        trace.name_thread('PlaceIndexer')
+        try:
+            with trace.span('place_index', 'worker', photos=len(self.paths)):
+                places = job.run(self.paths)
+        except Exception as e:
+            print(f"Place indexing error: {e}")
+            places = {}
+        self.done.emit(places)
+    
+    def stop(self):
+        self._is_running = False
+
+
+class DuplicateFinder(QThread):
+    """Hash the library in a process pool and report byte-identical groups"""
+    progress = pyqtSignal(str, int, int)
+    done = pyqtSignal(list)
+    
+    def __init__(self, paths):
+        super().__init__()
+        self.paths = list(paths)
+        self._is_running = True
+    
+    def run(self):
+        job = DuplicateJob(should_stop=lambda: not self._is_running,
+                           progress=self.progress.emit)
+        trace.name_thread('DuplicateFinder')
+        try:
+            with trace.span('duplicate_scan', 'worker', photos=len(self.paths)):
+                groups = job.run(self.paths)
+        except Exception as e:
+            print(f"Duplicate scan error: {e}")
+            groups = []
+        if self._is_running:
+            self.done.emit(groups)
+    
+    def stop(self):
+        self._is_running = False
+
+
+class SimilarityIndexer(QThread):
+    """Compute perceptual hashes of photos in a process pool"""
+    progress = pyqtSignal(int, int)
+    done = pyqtSignal(dict)
+    
+    def __init__(self, paths):
+        super().__init__()
+        self.paths = list(paths)
+        self._is_running = True
+    
+    def run(self):
+        job = HashJob(should_stop=lambda: not self._is_running,
+                      progress=self.progress.emit)
+        trace.name_thread('SimilarityIndexer')
+        try:
+            with trace.span('perceptual_hash', 'worker', photos=len(self.paths)):
+                hashes = job.run(self.paths)
+        except Exception as e:
+            print(f"Perceptual hashing error: {e}")
+            hashes = {}
+        if self._is_running:
+            self.done.emit(hashes)
+    
+    def stop(self):
+        self._is_running = False
+
+
+class ExportWorker(QThread):
+    """Write a snapshot of photo metadata to a file, a chunk at a time"""
+    progress = pyqtSignal(int, int)
+    done = pyqtSignal(str, int)
+    failed = pyqtSignal(str)
+    
+    CHUNK = 20000
+    
+    def __init__(self, table, path, fmt):
+        super().__init__()
+        self.table = table  # private copy (MetadataTable.take), safe to read here
+        self.path = path
+        self.fmt = fmt
+        self._is_running = True
+    
+    def run(self):
+        trace.name_thread('ExportWorker')
+        total = len(self.table)
+        rows = self.table.rows(self.table.paths)
+        chunks = ((self.table, rows[i:i + self.CHUNK]) for i in range(0, total, self.CHUNK))
+        try:
+            with trace.span('export', 'worker', photos=total, format=self.fmt):
+                count = export(chunks, self.path, self.fmt,
+                               progress=lambda n: self.progress.emit(n, total),
+                               should_stop=lambda: not self._is_running)
+        except Exception as e:
+            print(f"Export error: {e}")
+            self.failed.emit(str(e))
+            return
+        if count is not None:
+            self.done.emit(self.path, count)
+    
+    def stop(self):
+        self._is_running = False
+
+
+class GeotagWriter(QThread):
+    """Write GPS tags into photos in a process pool (see geosnap.writeback)"""
+    progress = pyqtSignal(int, int)
+    batch = pyqtSignal(list)
+    done = pyqtSignal(dict)
+    
+    BATCH_SIZE = 200
+    
+    def __init__(self, edits, dry_run=False):
+        super().__init__()
+        self.edits = list(edits)
+        self.dry_run = dry_run
+        self._is_running = True
+    
+    def run(self):
+        job = WriteJob(should_stop=lambda: not self._is_running, dry_run=self.dry_run,
+                       progress=lambda counts: self.progress.emit(counts['files'], len(self.edits)))
+        trace.name_thread('GeotagWriter')
+        written = []
+        try:
+            with trace.span('geotag_write', 'worker', photos=len(self.edits), dry_run=self.dry_run):
+                for path, rec, st, error in job.run(self.edits):
+                    if error:
+                        print(f"GPS write error for {path}: {error}")
+                    if rec is not None:
+                        written.append((path, rec, st))
+                    if len(written) >= self.BATCH_SIZE:
+                        self.batch.emit(written)
+                        written = []
+        except Exception as e:
+            print(f"GPS write error: {e}")
+        if written:
+            self.batch.emit(written)
+        self.done.emit(dict(job.counts))
+    
+    def stop(self):
+        self._is_running = False
+
+
+class NameIndexer(QThread):
+    """Build the file-name search index so the first keystroke does not"""
+    
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+    
+    def run(self):
+        trace.name_thread('NameIndexer')
+        with trace.span('name_index', 'worker'):
+            self.index.ensure()
+
+
+class MetadataIndexer(QThread):
+    """Parse EXIF of new photos in the background, in batches
+    
+    Records still current in the shared index (written by an earlier run or
+    by ``python -m geosnap scan``) are used as they are; new parses are
+    written back to it.
+    """
+    batch = pyqtSignal(list)
+    
+    BATCH_SIZE = 200
+    
+    def __init__(self, paths):
+        super().__init__()
+        self.paths = list(paths)
+        self._is_running = True
+    
+    def run(self):
+        trace.name_thread('MetadataIndexer')
+        try:
+            store = IndexStore()
+        except sqlite3.Error as e:
+            print(f"Metadata index unavailable: {e}")
+            store = None
+        try:
+            for chunk in batches(self.paths, self.BATCH_SIZE):
+                if not self._is_running:
+                    return
+                stats = stat_many(chunk)
+                known = store.photo_metadata(chunk) if store else {}
+                records, rows, now = [], [], time.time()
+                for p in chunk:
+                    st = stats.get(p)
+                    if st is not None and is_current(known.get(p), st):
+                        records.append((p, record_of(known[p])))
+                        continue
+                    try:
+                        with trace.span('read_exif', 'worker'):
+                            rec = record_from_tags(read_exif(p))
+                    except Exception as e:
+                        print(f"Metadata indexing error for {p}: {e}")
+                        rec = {}
+                    records.append((p, rec))
+                    if st is not None:
+                        rows.append(store_row(p, st, rec, now))
+                if store and rows:
+                    try:
+                        store.put_photo_metadata(rows)
+                    except sqlite3.Error as e:
+                        print(f"Metadata index write error: {e}")
+                self.batch.emit(records)
+        finally:
+            if store:
+                store.close()
+    
+    def stop(self):
+        self._is_running = False
+
+
+class FolderWatcher(QThread):
+    """Scan added folders, then turn change notifications into library changes
+    
+    Owns the FolderWatch snapshots. Directory notifications are debounced
+    until the folder has been quiet for DEBOUNCE seconds (at most MAX_DELAY
+    after the first one); roots on network shares are polled instead.
+    """
+    scanned = pyqtSignal(str, dict, list)  # root, {path: stat}, directories
+    changed = pyqtSignal(object)           # geosnap.watcher.Changes
+    
+    DEBOUNCE = 0.5
+    MAX_DELAY = 3.0
+    POLL_INTERVAL = 15.0
+    
+    def __init__(self):
+        super().__init__()
+        self.watch = FolderWatch()
+        self.requests = queue.Queue()
+        self.polled = []
+        self._is_running = True
+    
+    def add_root(self, root, poll=False):
+        self.requests.put(('root', root, poll))
+    
+    def notify(self, directory):
+        self.requests.put(('dir', directory, False))
+    
+    def poll(self, root):
+        self.requests.put(('poll', root, True))
+    
+    def run(self):
+        trace.name_thread('FolderWatcher')
+        pending, first, deadline = set(), 0.0, None
+        next_poll = time.monotonic() + self.POLL_INTERVAL
+        while self._is_running:
+            wake = next_poll if deadline is None else min(deadline, next_poll)
+            try:
+                item = self.requests.get(timeout=max(0.0, wake - time.monotonic()))
+            except queue.Empty:
+                item = False
+            if item is None:
+                break
+            now = time.monotonic()
+            if item:
+                kind, path, poll = item
+                if kind == 'root':
+                    root = os.path.normpath(path)
+                    with trace.span('scan_root', 'worker'):
+                        found = self.watch.add_root(root)
+                    if poll:
+                        self.polled.append(root)
+                    self.scanned.emit(root, found, self.watch.directories(root))
+                elif kind == 'poll':
+                    self.polled.append(os.path.normpath(path))
+                else:
+                    if not pending:
+                        first = now
+                    pending.add(path)
+                    deadline = min(now + self.DEBOUNCE, first + self.MAX_DELAY)
+                continue
+            try:
+                if deadline is not None and now >= deadline:
+                    dirs, pending, deadline = list(pending), set(), None
+                    with trace.span('rescan', 'worker', directories=len(dirs)):
+                        self.emit_changes(self.watch.rescan(dirs))
+                if now >= next_poll:
+                    next_poll = now + self.POLL_INTERVAL
+                    dirs = [d for root in self.polled for d in self.watch.directories(root)]
+                    if dirs:
+                        with trace.span('poll', 'worker', directories=len(dirs)):
+                            self.emit_changes(self.watch.rescan(dirs))
+            except Exception as e:
+                print(f"Folder watch error: {e}")
+    
+    def emit_changes(self, changes):
+        if changes:
+            self.changed.emit(changes)
+    
+    def stop(self):
+        self._is_running = False
+        self.requests.put(None)
+
+
+class StatLoader(QThread):
+    """Refresh file attributes in directory-grouped batches"""
+    batch = pyqtSignal(list)
+    
+    def __init__(self, paths):
+        super().__init__()
+        self.paths = list(paths)
+        self.wanted = set(self.paths)
+        self._is_running = True
+    
+    def covers(self, paths):
+        return self.wanted.issuperset(paths)
+    
+    def run(self):
+        trace.name_thread('StatLoader')
+        for chunk in batches(self.paths):
+            if not self._is_running:
+                return
+            with trace.span('stat_batch', 'worker', files=len(chunk)):
+                stats = stat_many(chunk)
+            self.batch.emit(list(stats.items()))
+    
+    def stop(self):
+        self._is_running = False
+
+
 class FluentButton(QPushButton):
     """Custom button with hover animation"""
     def __init__(self, text, parent=None):
@@ -491,6 +939,9 @@ class ImageViewer(QLabel):
         super().__init__()
         
         self.original_pixmap = None
+        self.current_path = None
+        # Decoded photos, so that going back and forth does not decode again
+        self.pixmap_cache = Cache(max_size=12, sizeof=lambda entry: pixmap_nbytes(entry[1]))
         self.scale = 1.0
         self.rotation = 0
         self.flip_h = False
@@ -517,17 +968,27 @@ class ImageViewer(QLabel):
         shadow.setOffset(0, 4)
         self.setGraphicsEffect(shadow)
     
+    @trace.traced('load_image')
     def load_image(self, path):
         try:
-            img = Image.open(path)
-            img = ImageOps.exif_transpose(img)
-            
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            data = img.tobytes('raw', 'RGB')
-            qimg = QImage(data, img.width, img.height, img.width * 3, QImage.Format.Format_RGB888)
-            self.original_pixmap = QPixmap.fromImage(qimg)
+            mtime = os.path.getmtime(path)
+            cached = self.pixmap_cache.get(path)
+            if cached and cached[0] == mtime:
+                pixmap = cached[1]
+            else:
+                ensure_opener(path)
+                img = Image.open(path)
+                img = ImageOps.exif_transpose(img)
+                
+                if img.mode != 'RGB':
+                    img = img.convert('RGB')
+                
+                data = img.tobytes('raw', 'RGB')
+                qimg = QImage(data, img.width, img.height, img.width * 3, QImage.Format.Format_RGB888)
+                pixmap = QPixmap.fromImage(qimg)
+                self.pixmap_cache[path] = (mtime, pixmap)
+            self.original_pixmap = pixmap
+            self.current_path = path
             
             self.rotation = 0
             self.flip_h = False
@@ -537,9 +998,17 @@ class ImageViewer(QLabel):
         except Exception as e:
             print(f"Error: {e}")
             self.original_pixmap = None
+            self.current_path = None
             self.update()
             return False
     
+    def shown_nbytes(self):
+        """Pixels held for the photo on screen and not already in the cache"""
+        shown = pixmap_nbytes(self.pixmap())
+        if self.original_pixmap is not None and self.current_path not in self.pixmap_cache:
+            shown += pixmap_nbytes(self.original_pixmap)
+        return shown
+    
     def get_transformed_pixmap(self):
         if not self.original_pixmap:
             return None
@@ -677,28 +1146,230 @@ class ImageViewer(QLabel):
         # Don't auto-fit on resize to prevent zoom reset
         pass
 
-class LimitedCache:
-    def __init__(self, max_size=500):
-        self.cache = OrderedDict()
-        self.max_size = max_size
+def pixmap_nbytes(pixmap):
+    if pixmap is None or pixmap.isNull():
+        return 0
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+
+class MemoryPanel(QDialog):
+    """Live view of the memory budget: cost of every cache, process and system memory"""
     
-    def get(self, key, default=None):
-        if key in self.cache:
-            self.cache.move_to_end(key)  # Move to end (most recent)
-            return self.cache[key]
-        return default
+    def __init__(self, window):
+        super().__init__(window)
+        self.app_window = window
+        self.budget = window.memory_budget
+        self.setWindowTitle("🩺 Chẩn đoán bộ nhớ")
+        self.resize(680, 380)
+        
+        layout = QVBoxLayout(self)
+        self.summary = QLabel()
+        layout.addWidget(self.summary)
+        
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(["Bộ nhớ đệm", "Mục", "Dung lượng", "Tỉ lệ trúng", "Đã loại", "Ưu tiên"])
+        self.tree.setRootIsDecorated(False)
+        self.tree.setColumnWidth(0, 220)
+        layout.addWidget(self.tree, stretch=1)
+        
+        controls = QHBoxLayout()
+        controls.addWidget(QLabel("Giới hạn:"))
+        self.limit_box = QSpinBox()
+        self.limit_box.setRange(32, 65536)
+        self.limit_box.setSuffix(" MB")
+        self.limit_box.setValue(self.budget.limit // MiB)
+        self.limit_box.valueChanged.connect(self.set_limit)
+        controls.addWidget(self.limit_box)
+        controls.addStretch()
+        release_btn = QPushButton("🧹 Giải phóng bộ nhớ đệm")
+        release_btn.clicked.connect(self.release)
+        controls.addWidget(release_btn)
+        layout.addLayout(controls)
+        
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start()
+        self.refresh()
     
-    def set(self, key, value):
-        if key in self.cache:
-            self.cache.move_to_end(key)
-        else:
-            if len(self.cache) >= self.max_size:
-                self.cache.popitem(last=False)  # Remove oldest
-        self.cache[key] = value
+    @staticmethod
+    def mb(n):
+        return f"{n / MiB:.1f} MB" if n is not None else "?"
+    
+    def refresh(self):
+        budget = self.budget
+        used = budget.used()
+        available, total = system_memory()
+        self.summary.setText(
+            f"Bộ nhớ đệm: <b>{self.mb(used)}</b> / {self.mb(budget.limit)}"
+            f" · Tiến trình: {self.mb(process_rss())}"
+            f" · Hệ thống còn trống: {self.mb(available)} / {self.mb(total)}<br>"
+            f"Đã giải phóng: {self.mb(budget.evicted)}"
+            f" · Lần thiếu bộ nhớ: {budget.pressure_events}")
+        self.tree.clear()
+        for row in budget.report():
+            priority = "giữ lại" if row['priority'] is None else str(row['priority'])
+            stats = row['stats']
+            rate = stats.hit_rate if stats else None
+            item = QTreeWidgetItem([row['name'], str(row['entries']), self.mb(row['bytes']),
+                                    "--" if rate is None else f"{rate:.0%}",
+                                    str(stats.evictions + stats.expirations) if stats else "--", priority])
+            if stats:
+                item.setToolTip(3, f"Trúng {stats.hits} · Trượt {stats.misses} · Lỗi đã nhớ {stats.failures}")
+                item.setToolTip(4, f"Vượt giới hạn {stats.evictions} · Hết hạn {stats.expirations}")
+            self.tree.addTopLevelItem(item)
+    
+    def set_limit(self, value):
+        self.budget.limit = value * MiB
+        self.app_window.settings.setValue("memory/limit_mb", value)
+        self.budget.enforce()
+        self.refresh()
+    
+    def release(self):
+        self.budget.release()
+        self.refresh()
+        
+class GeotagDialog(QDialog):
+    """Place photos without GPS on a GPX/NMEA log by their capture time"""
+    
+    MARKERS = 2000      # photos drawn on the preview map
+    TRACK_POINTS = 5000
     
-    def clear(self):
-        self.cache.clear()
+    def __init__(self, window, paths):
+        super().__init__(window)
+        self.app_window = window
+        self.settings = window.settings
+        self.meta = window.meta
+        self.paths = paths
+        self.rows = self.meta.rows(paths)
+        self.track = None
+        self.matched = []   # edits, see geosnap.writeback
+        self.setWindowTitle("🛰️ Gắn GPS từ nhật ký hành trình")
+        self.resize(520, 300)
+        
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel(f"{len(paths)} ảnh chưa có GPS trong danh sách hiện tại"))
+        
+        pick = QHBoxLayout()
+        pick_btn = QPushButton("📂 Chọn file GPX/NMEA...")
+        pick_btn.clicked.connect(self.choose_tracks)
+        pick.addWidget(pick_btn)
+        self.track_label = QLabel("Chưa chọn nhật ký")
+        pick.addWidget(self.track_label, stretch=1)
+        layout.addLayout(pick)
+        
+        form = QFormLayout()
+        self.zone_box = QDoubleSpinBox()
+        self.zone_box.setRange(-14, 14)
+        self.zone_box.setSingleStep(0.25)
+        self.zone_box.setPrefix("UTC ")
+        self.zone_box.setSuffix(" giờ")
+        local = datetime.now().astimezone().utcoffset().total_seconds() / 3600
+        self.zone_box.setValue(float(self.settings.value("geotag/zone", local)))
+        form.addRow("Múi giờ của đồng hồ máy ảnh:", self.zone_box)
+        self.drift_box = QSpinBox()
+        self.drift_box.setRange(-86400, 86400)
+        self.drift_box.setSuffix(" giây")
+        self.drift_box.setValue(int(self.settings.value("geotag/drift", 0)))
+        form.addRow("Đồng hồ máy ảnh chạy nhanh:", self.drift_box)
+        self.gap_box = QSpinBox()
+        self.gap_box.setRange(10, 86400)
+        self.gap_box.setSuffix(" giây")
+        self.gap_box.setValue(int(self.settings.value("geotag/max_gap", MAX_GAP)))
+        form.addRow("Nội suy qua khoảng mất tín hiệu tối đa:", self.gap_box)
+        layout.addLayout(form)
+        for box in (self.zone_box, self.drift_box, self.gap_box):
+            box.valueChanged.connect(self.rematch)
+        self.fix_time_check = QCheckBox("Sửa luôn giờ chụp theo độ lệch đồng hồ")
+        self.fix_time_check.setChecked(self.settings.value("geotag/fix_time", False, type=bool))
+        self.fix_time_check.toggled.connect(self.rematch)
+        layout.addWidget(self.fix_time_check)
+        self.dry_run_check = QCheckBox("🧪 Chạy thử (không sửa file)")
+        layout.addWidget(self.dry_run_check)
+        
+        self.result_label = QLabel()
+        layout.addWidget(self.result_label)
+        layout.addStretch()
         
+        buttons = QHBoxLayout()
+        self.preview_btn = QPushButton("🗺️ Xem trước trên bản đồ")
+        self.preview_btn.clicked.connect(self.preview)
+        buttons.addWidget(self.preview_btn)
+        self.write_btn = QPushButton("💾 Ghi GPS vào ảnh")
+        self.write_btn.clicked.connect(self.write)
+        buttons.addWidget(self.write_btn)
+        buttons.addStretch()
+        close_btn = QPushButton("Đóng")
+        close_btn.clicked.connect(self.reject)
+        buttons.addWidget(close_btn)
+        layout.addLayout(buttons)
+        self.rematch()
+    
+    def choose_tracks(self):
+        patterns = " ".join(f"*{ext}" for ext in ('.gpx',) + NMEA_EXTS)
+        files, _ = QFileDialog.getOpenFileNames(
+            self, "Chọn nhật ký GPS", self.settings.value("geotag/dir", ""),
+            f"Nhật ký GPS ({patterns});;Tất cả (*.*)"
+        )
+        if not files:
+            return
+        self.settings.setValue("geotag/dir", os.path.dirname(files[0]))
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            with trace.span('track_load', 'app', files=len(files)):
+                self.track = Track.load(files)
+        except TrackError as e:
+            self.track = None
+            QMessageBox.warning(self, "Lỗi", f"Không đọc được nhật ký GPS:\n{e}")
+        finally:
+            QApplication.restoreOverrideCursor()
+        if self.track is not None:
+            fmt = lambda t: datetime.utcfromtimestamp(t).strftime('%d/%m/%Y %H:%M')
+            self.track_label.setText(f"{len(self.track)} điểm, {fmt(self.track.start)} → {fmt(self.track.end)} UTC")
+        self.rematch()
+    
+    def offset(self):
+        """Seconds the camera clock is ahead of UTC"""
+        return round(self.zone_box.value() * 3600) + self.drift_box.value()
+    
+    @trace.traced('geotag_match')
+    def rematch(self, *_):
+        self.matched = []
+        if self.track is not None:
+            self.settings.setValue("geotag/zone", self.zone_box.value())
+            self.settings.setValue("geotag/drift", self.drift_box.value())
+            self.settings.setValue("geotag/max_gap", self.gap_box.value())
+            self.settings.setValue("geotag/fix_time", self.fix_time_check.isChecked())
+            self.matched = track_edits(self.meta, self.rows, self.track, round(self.zone_box.value() * 3600),
+                                       self.drift_box.value(), self.gap_box.value(),
+                                       self.fix_time_check.isChecked())
+        if self.track is None:
+            self.result_label.setText("")
+        else:
+            self.result_label.setText(f"📍 Khớp được <b>{len(self.matched)}</b>/{len(self.paths)} ảnh")
+        self.preview_btn.setEnabled(bool(self.matched) and FOLIUM_AVAILABLE)
+        self.write_btn.setEnabled(bool(self.matched))
+    
+    def preview(self):
+        photos = [(p, lat, lon, datetime.utcfromtimestamp(when + self.offset()).strftime('%Y:%m:%d %H:%M:%S'))
+                  for p, lat, lon, _, when, _ in self.matched[:self.MARKERS]]
+        try:
+            self.app_window.open_map(geotag_map(self.track.points(self.TRACK_POINTS), photos))
+        except Exception as e:
+            QMessageBox.warning(self, "Lỗi", f"Không thể tạo bản đồ:\n{str(e)}")
+    
+    def write(self):
+        dry_run = self.dry_run_check.isChecked()
+        if not dry_run and QMessageBox.question(
+                self, "Ghi GPS vào ảnh",
+                f"Ghi tọa độ vào {len(self.matched)} ảnh?\n\n"
+                f"Chỉ phần EXIF của file được sửa, dữ liệu ảnh giữ nguyên."
+        ) != QMessageBox.StandardButton.Yes:
+            return
+        if self.app_window.start_geotag_write(self.matched, dry_run):
+            self.accept()
+
+
 class GeoSnap(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -717,10 +1388,64 @@ class GeoSnap(QMainWindow):
         self.filtered_list = []
         self.current_index = -1
         self.is_filtered = False
-        self.gps_cache = LimitedCache(max_size=500)
-        self.exif_cache = LimitedCache(max_size=500)
+        # Metadata table, its sort/facet/query indexes and the EXIF/GPS caches
+        self.library = Library()
+        self.metadata_indexer = None
+        self.name_indexer = None
+        self.stat_loader = None
+        self.stat_refreshed_at = 0.0
+        self.stat_waiters = []  # [(paths still without attributes, action)]
+        self.metadata_waiters = []  # [[paths still without EXIF, key, action]]
+        self.unplaced = set()   # placed by file attributes only; moved when their EXIF arrives
+        self.restoring_roots = set()  # roots of the restored session not rescanned yet
+        
+        # Watched folders: inotify via QFileSystemWatcher, polling on network shares
+        self.fs_watcher = QFileSystemWatcher(self)
+        self.fs_watcher.directoryChanged.connect(self.on_watched_path_changed)
+        self.fs_watcher.fileChanged.connect(self.on_watched_path_changed)
+        self.start_folder_watcher()
+        
+        # Facet panel: posting bitmaps per camera/lens/date/type/GPS value
+        self.facet_selection = {}  # facet -> set of checked values
+        self.facet_timer = QTimer(self)
+        self.facet_timer.setSingleShot(True)
+        self.facet_timer.setInterval(300)
+        self.facet_timer.timeout.connect(self.refresh_facets)
         self.current_gps = None
         self.address_loader = None
+        self.stale_loaders = []  # stopped loaders still finishing a request
+        self.temp_files = []
+        
+        # Reverse geocoding backend (Nominatim or offline gazetteer)
+        self.settings = QSettings("GeoSnap", "GeoSnap")
+        self.geocoder = None
+        self.address_cache = Cache(max_size=2000)  # (backend, lat, lon) -> address, Failed(message)
+        
+        # One byte budget over every cache; halved when the system runs low
+        limit = int(self.settings.value("memory/limit_mb", 0) or 0)
+        self.memory_budget = MemoryBudget(limit * MiB if limit else None)
+        self.memory_panel = None
+        self.memory_timer = QTimer(self)
+        self.memory_timer.setInterval(5000)
+        self.memory_timer.timeout.connect(self.check_memory_pressure)
+        self.memory_timer.start()
+        
+        # Place facets: path -> {'country', 'region', 'city'}
+        self.places = {}
+        self.place_indexer = None
+        self.places_pending = False  # photos were added while the indexer ran
+        self.duplicate_finder = None
+        self.duplicate_groups = []
+        self.export_worker = None
+        self.geotag_writer = None
+        
+        # Perceptual hashes: path -> (aHash, dHash, pHash), pHashes in a BK-tree
+        self.similarity_indexer = None
+        self.phashes = {}
+        self.bk_tree = BKTree()
+        self.after_hashing = None
+        self.burst_hidden = set()   # frames folded under their burst's first shot
+        self.burst_sizes = {}       # first shot -> frames in the burst
         
         # Filter button tracking
         self.active_filter_btn = None
@@ -730,8 +1455,20 @@ class GeoSnap(QMainWindow):
         
         self.init_ui()
         
+        # Lower priority is evicted first: EXIF tags are the cheapest to re-read
+        budget = self.memory_budget
+        budget.register("🏷️ EXIF (thẻ đầy đủ)", self.exif_cache, 1)
+        budget.register("🖼️ Ảnh đã giải mã", self.image_viewer.pixmap_cache, 2)
+        budget.register("🏠 Địa chỉ", self.address_cache, 3)
+        budget.register("📍 GPS", self.gps_cache, 4)
+        budget.register("👁️ Ảnh đang hiển thị", Gauge(self.image_viewer.shown_nbytes), None)
+        
         # Apply initial theme AFTER UI is created
         self.apply_theme()
+        
+        # Reopen the last library once the window is up
+        if self.session_action.isChecked():
+            QTimer.singleShot(0, self.restore_last_session)
     
     def init_ui(self):
         # Create menu bar
@@ -783,6 +1520,12 @@ class GeoSnap(QMainWindow):
         self.status_right.setStyleSheet("color: #e5e5e5; font-size: 8pt; font-weight: 500;")
         status_layout.addWidget(self.status_right)
         
+        self.trace_label = QLabel()
+        self.trace_label.setObjectName("statusLabel")
+        self.trace_label.setStyleSheet("color: #ffb74d; font-size: 8pt; font-family: Consolas, monospace;")
+        self.trace_label.setVisible(trace.enabled)
+        status_layout.addWidget(self.trace_label)
+        
         main_layout.addWidget(status_frame)
         
         self.setAcceptDrops(True)
@@ -804,6 +1547,18 @@ class GeoSnap(QMainWindow):
         folder_action.triggered.connect(self.add_folder)
         file_menu.addAction(folder_action)
         
+        export_action = QAction("💾 Xuất dữ liệu ảnh...", self)
+        export_action.setShortcut("Ctrl+E")
+        export_action.triggered.connect(self.export_metadata)
+        file_menu.addAction(export_action)
+        
+        file_menu.addSeparator()
+        
+        self.session_action = QAction("🔁 Mở lại thư viện lần trước", self, checkable=True)
+        self.session_action.setChecked(self.settings.value("session/restore", True, type=bool))
+        self.session_action.toggled.connect(lambda on: self.settings.setValue("session/restore", on))
+        file_menu.addAction(self.session_action)
+        
         file_menu.addSeparator()
         
         exit_action = QAction("🚪 Thoát", self)
@@ -824,6 +1579,62 @@ class GeoSnap(QMainWindow):
         fullscreen_action.triggered.connect(self.toggle_fullscreen)
         view_menu.addAction(fullscreen_action)
         
+        self.burst_action = QAction("🎞️ Gộp ảnh chụp liên tiếp", self, checkable=True)
+        self.burst_action.triggered.connect(self.toggle_bursts)
+        view_menu.addAction(self.burst_action)
+        
+        self.trace_action = QAction("⏱️ Ghi trace hiệu năng", self, checkable=True)
+        self.trace_action.setChecked(trace.enabled)
+        self.trace_action.triggered.connect(self.toggle_tracing)
+        view_menu.addAction(self.trace_action)
+        
+        # Address backend submenu
+        geo_menu = view_menu.addMenu("🏠 Nguồn địa chỉ")
+        geo_group = QActionGroup(self)
+        backend = self.settings.value("geocoder/backend", "nominatim")
+        
+        self.online_geo_action = QAction("🌐 Nominatim (online)", self, checkable=True)
+        self.online_geo_action.setChecked(backend != "offline")
+        self.online_geo_action.triggered.connect(lambda: self.set_geocoder_backend("nominatim"))
+        geo_group.addAction(self.online_geo_action)
+        geo_menu.addAction(self.online_geo_action)
+        
+        self.offline_geo_action = QAction("💾 Gazetteer offline", self, checkable=True)
+        self.offline_geo_action.setChecked(backend == "offline")
+        self.offline_geo_action.triggered.connect(lambda: self.set_geocoder_backend("offline"))
+        geo_group.addAction(self.offline_geo_action)
+        geo_menu.addAction(self.offline_geo_action)
+        
+        geo_menu.addSeparator()
+        
+        gazetteer_action = QAction("📂 Chọn file gazetteer...", self)
+        gazetteer_action.triggered.connect(self.choose_gazetteer)
+        geo_menu.addAction(gazetteer_action)
+        
+        # Tools menu
+        tools_menu = menubar.addMenu("🛠️ Công cụ")
+        
+        places_action = QAction("🏙️ Lập chỉ mục địa điểm", self)
+        places_action.triggered.connect(self.start_place_indexing)
+        tools_menu.addAction(places_action)
+        
+        duplicates_action = QAction("🧬 Tìm ảnh trùng lặp", self)
+        duplicates_action.triggered.connect(self.find_duplicates)
+        tools_menu.addAction(duplicates_action)
+        
+        similar_action = QAction("🔎 Tìm ảnh tương tự ảnh hiện tại", self)
+        similar_action.setShortcut("Ctrl+Shift+F")
+        similar_action.triggered.connect(self.find_similar)
+        tools_menu.addAction(similar_action)
+        
+        geotag_action = QAction("🛰️ Gắn GPS từ file GPX/NMEA...", self)
+        geotag_action.triggered.connect(self.open_geotag_dialog)
+        tools_menu.addAction(geotag_action)
+        
+        memory_action = QAction("🩺 Chẩn đoán bộ nhớ", self)
+        memory_action.triggered.connect(self.show_memory_panel)
+        tools_menu.addAction(memory_action)
+        
         # Help menu
         help_menu = menubar.addMenu("❓ Help")
         
@@ -831,6 +1642,39 @@ class GeoSnap(QMainWindow):
         about_action.triggered.connect(self.show_about)
         help_menu.addAction(about_action)
     
+    def toggle_tracing(self, checked):
+        """Start recording spans, or stop and save them as Chrome trace JSON"""
+        if checked:
+            trace.enable()
+            self.trace_label.setText("⏱ đang ghi trace...")
+            self.trace_label.show()
+            return
+        
+        self.trace_label.hide()
+        try:
+            path = trace.disable()
+        except OSError as e:
+            QMessageBox.warning(self, "Lỗi", f"Không thể lưu trace:\n{e}")
+            return
+        if path:
+            QMessageBox.information(self, "Trace hiệu năng",
+                f"Đã lưu trace:\n{path}\n\nMở bằng chrome://tracing hoặc https://ui.perfetto.dev")
+    
+    TRACE_STAGES = (('load', 'load_image'), ('info', 'update_file_info'), ('gps', 'get_gps_data'),
+                    ('camera', 'display_camera_info'), ('addr', 'load_address_async'))
+    
+    def update_trace_overlay(self):
+        """Show the stage times of the last display_image in the status bar"""
+        if not trace.enabled:
+            return
+        last = trace.last
+        parts = [f"{label} {last[name]:.1f}" for label, name in self.TRACE_STAGES if name in last]
+        total = last.get('display_image')
+        text = "⏱ " + " · ".join(parts) + " ms"
+        if total is not None:
+            text += f"  (Σ {total:.1f} ms)"
+        self.trace_label.setText(text)
+    
     def toggle_theme(self):
         """Toggle between light and dark theme"""
         self.is_dark_theme = not self.is_dark_theme
@@ -841,71 +1685,17 @@ class GeoSnap(QMainWindow):
             self.theme_action.setText("☀️ Chế độ sáng")
         else:
             self.theme_action.setText("🌙 Chế độ tối")
-        
-        # Reapply filter button states if active
-        if self.active_filter_btn:
-            self.active_filter_btn.setObjectName("filterButtonActive")
-            self.active_filter_btn.setStyleSheet("")
-
-        self.update_list_status()
     
+    @trace.traced('apply_theme')
     def apply_theme(self):
-        """Apply current theme"""
-        if self.is_dark_theme:
-            self.setStyleSheet(self.get_dark_theme())
-            
-            # Dark palette
-            dark_palette = QPalette()
-            dark_palette.setColor(QPalette.ColorRole.Window, QColor(30, 30, 30))
-            dark_palette.setColor(QPalette.ColorRole.WindowText, QColor(229, 229, 229))
-            dark_palette.setColor(QPalette.ColorRole.Base, QColor(45, 45, 45))
-            dark_palette.setColor(QPalette.ColorRole.AlternateBase, QColor(53, 53, 53))
-            dark_palette.setColor(QPalette.ColorRole.ToolTipBase, QColor(45, 45, 45))
-            dark_palette.setColor(QPalette.ColorRole.ToolTipText, QColor(229, 229, 229))
-            dark_palette.setColor(QPalette.ColorRole.Text, QColor(229, 229, 229))
-            dark_palette.setColor(QPalette.ColorRole.Button, QColor(45, 45, 45))
-            dark_palette.setColor(QPalette.ColorRole.ButtonText, QColor(229, 229, 229))
-            dark_palette.setColor(QPalette.ColorRole.Link, QColor(0, 103, 192))
-            dark_palette.setColor(QPalette.ColorRole.Highlight, QColor(0, 103, 192))
-            dark_palette.setColor(QPalette.ColorRole.HighlightedText, QColor(255, 255, 255))
-            
-            # Disabled
-            dark_palette.setColor(QPalette.ColorGroup.Disabled, QPalette.ColorRole.WindowText, QColor(128, 128, 128))
-            dark_palette.setColor(QPalette.ColorGroup.Disabled, QPalette.ColorRole.Text, QColor(128, 128, 128))
-            dark_palette.setColor(QPalette.ColorGroup.Disabled, QPalette.ColorRole.ButtonText, QColor(128, 128, 128))
-            
-            self.setPalette(dark_palette)
-            QApplication.instance().setPalette(dark_palette)
-        else:
-            self.setStyleSheet(FLUENT_STYLE)
-            
-            # Light palette - force it completely
-            light_palette = QPalette()
-            light_palette.setColor(QPalette.ColorRole.Window, QColor(243, 243, 243))
-            light_palette.setColor(QPalette.ColorRole.WindowText, QColor(26, 26, 26))
-            light_palette.setColor(QPalette.ColorRole.Base, QColor(255, 255, 255))
-            light_palette.setColor(QPalette.ColorRole.AlternateBase, QColor(245, 245, 245))
-            light_palette.setColor(QPalette.ColorRole.ToolTipBase, QColor(255, 255, 255))
-            light_palette.setColor(QPalette.ColorRole.ToolTipText, QColor(26, 26, 26))
-            light_palette.setColor(QPalette.ColorRole.Text, QColor(26, 26, 26))
-            light_palette.setColor(QPalette.ColorRole.Button, QColor(243, 243, 243))
-            light_palette.setColor(QPalette.ColorRole.ButtonText, QColor(26, 26, 26))
-            light_palette.setColor(QPalette.ColorRole.Link, QColor(0, 103, 192))
-            light_palette.setColor(QPalette.ColorRole.Highlight, QColor(0, 103, 192))
-            light_palette.setColor(QPalette.ColorRole.HighlightedText, QColor(255, 255, 255))
-            
-            # Disabled
-            light_palette.setColor(QPalette.ColorGroup.Disabled, QPalette.ColorRole.WindowText, QColor(148, 148, 148))
-            light_palette.setColor(QPalette.ColorGroup.Disabled, QPalette.ColorRole.Text, QColor(148, 148, 148))
-            light_palette.setColor(QPalette.ColorGroup.Disabled, QPalette.ColorRole.ButtonText, QColor(148, 148, 148))
-            light_palette.setColor(QPalette.ColorGroup.Disabled, QPalette.ColorRole.Base, QColor(235, 235, 235))
-            
-            self.setPalette(light_palette)
-            QApplication.instance().setPalette(light_palette)
-        
-        # Force repaint
-        self.update()
-        QApplication.processEvents()
+        """Apply current theme: swap in its stylesheet and palette
+        
+        Status visuals follow from properties (set_style_property), so this
+        is the only place a stylesheet is set after start-up.
+        """
+        # Palette first, so that the one stylesheet polish below picks it up
+        QApplication.instance().setPalette(theme_palette(self.is_dark_theme))
+        self.setStyleSheet(self.get_dark_theme() if self.is_dark_theme else FLUENT_STYLE)
     
     def get_dark_theme(self):
         """Get dark theme stylesheet - matched with light theme structure"""
@@ -917,15 +1707,16 @@ class GeoSnap(QMainWindow):
     outline: none;
 }
 
-QMainWindow {
-    background-color: #1e1e1e;
-}
-
 QWidget {
     color: #e5e5e5;
     background-color: transparent;
 }
 
+/* After QWidget, which would otherwise make the window transparent too */
+QMainWindow {
+    background-color: #1e1e1e;
+}
+
 /* ========== BUTTONS ========== */
 QPushButton {
     background-color: #0067C0;
@@ -980,13 +1771,13 @@ QPushButton#filterButton:pressed {
     background-color: #353535;
 }
 
-QPushButton#filterButtonActive {
+QPushButton#filterButton[active="true"] {
     background-color: #0067C0;
     color: white;
     border: 1px solid #0067C0;
 }
 
-QPushButton#filterButtonActive:hover {
+QPushButton#filterButton[active="true"]:hover {
     background-color: #0078D4;
     border-color: #0078D4;
 }
@@ -1126,6 +1917,23 @@ QListWidget::item:selected:hover {
     background-color: #0078D4;
 }
 
+/* ========== TREE WIDGET ========== */
+QTreeWidget {
+    background-color: #2d2d2d;
+    border: 1px solid #3d3d3d;
+    border-radius: 6px;
+    padding: 2px;
+    color: #e5e5e5;
+}
+
+QTreeWidget::item {
+    padding: 3px;
+}
+
+QTreeWidget::item:hover {
+    background-color: #3d3d3d;
+}
+
 /* ========== GROUP BOX ========== */
 QGroupBox {
     background-color: #2d2d2d;
@@ -1291,23 +2099,116 @@ QMessageBox QLabel {
 QMessageBox QPushButton {
     min-width: 80px;
 }
-"""
-    
-    def toggle_fullscreen(self):
-        """Toggle fullscreen mode"""
-        if self.isFullScreen():
-            self.showNormal()
-        else:
-            self.showFullScreen()
-    
-    def show_about(self):
-        """Show about dialog"""
-        QMessageBox.about(self, "Về GeoSnap", 
-            "📍 <b>GeoSnap</b> v1.0<br><br>"
-            "GPS Photo Viewer & Location Analyzer<br><br>"
-            "Phát triển bởi PyQt6<br>"
-            "© 2025 GeoSnap")
-    
+
+/* ========== LIST STATUS DARK ========== */
+QLabel#listStatus {
+    background-color: #4a4000;
+    color: #ffeb3b;
+    border-radius: 4px;
+    padding: 8px;
+    font-weight: 600;
+    font-size: 8.5pt;
+}
+
+QLabel#listStatus[state="filtered"] {
+    background-color: #1a4d2e;
+    color: #90ee90;
+}
+
+/* Viewer toolbar buttons (same in both themes) */
+QPushButton#viewerTool {
+    background-color: #404040;
+    color: white;
+    border: none;
+    border-radius: 4px;
+    padding: 8px 14px;
+    font-weight: 500;
+}
+
+QPushButton#viewerTool:hover {
+    background-color: #505050;
+}
+
+QPushButton#viewerTool:pressed {
+    background-color: #353535;
+}
+"""
+    
+    def set_geocoder_backend(self, backend):
+        """Switch between online Nominatim and the offline gazetteer"""
+        if backend == "offline" and not self.settings.value("geocoder/gazetteer", ""):
+            if not self.choose_gazetteer():
+                self.online_geo_action.setChecked(True)
+            return   # choose_gazetteer switched the backend itself
+        self.settings.setValue("geocoder/backend", backend)
+        self.reload_geocoder()
+    
+    def choose_gazetteer(self):
+        """Pick a GeoNames dump or CSV used for offline addresses"""
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Chọn file gazetteer", "",
+            "Gazetteer (*.txt *.csv *.tsv);;Tất cả (*.*)"
+        )
+        if not path:
+            return False
+        self.settings.setValue("geocoder/gazetteer", path)
+        self.settings.setValue("geocoder/backend", "offline")
+        self.offline_geo_action.setChecked(True)
+        self.reload_geocoder()
+        return True
+    
+    def reload_geocoder(self):
+        """Close the geocoder after a settings change and look the current photo up again"""
+        if self.address_loader and self.address_loader.isRunning():
+            # Its answer (or "closed" error) belongs to the old geocoder
+            self.address_loader.stop()
+            self.stale_loaders.append(self.address_loader)
+            self.address_loader = None
+        self.close_geocoder()
+        if self.current_gps:
+            self.load_address_async(self.current_gps['lat'], self.current_gps['lon'])
+    
+    def close_geocoder(self):
+        """Drop the current geocoder, unmapping its gazetteer index"""
+        if self.geocoder is not None:
+            self.geocoder.close()
+            self.geocoder = None
+    
+    def get_geocoder(self):
+        if self.geocoder is None:
+            self.geocoder = create_geocoder(
+                self.settings.value("geocoder/backend", "nominatim"),
+                self.settings.value("geocoder/gazetteer", "")
+            )
+        return self.geocoder
+    
+    def show_memory_panel(self):
+        if self.memory_panel is None:
+            self.memory_panel = MemoryPanel(self)
+        self.memory_panel.show()
+        self.memory_panel.raise_()
+    
+    def check_memory_pressure(self):
+        freed = self.memory_budget.relieve()
+        if freed:
+            print(f"Low system memory: released {freed / MiB:.1f} MB of caches")
+            self.status_right.setText(f"🧹 Bộ nhớ thấp: đã giải phóng {freed / MiB:.1f} MB")
+    
+    def toggle_fullscreen(self):
+        """Toggle fullscreen mode"""
+        if self.isFullScreen():
+            self.showNormal()
+        else:
+            self.showFullScreen()
+    
+    def show_about(self):
+        """Show about dialog"""
+        QMessageBox.about(self, "Về GeoSnap", 
+            "📍 <b>GeoSnap</b> v1.0<br><br>"
+            "GPS Photo Viewer & Location Analyzer<br><br>"
+            "Phát triển bởi PyQt6<br>"
+            "© 2025 GeoSnap")
+    
     def create_left_panel(self):
         panel = QWidget()
         panel.setMinimumWidth(280)
@@ -1348,8 +2249,23 @@ QMessageBox QPushButton {
         search_group.setLayout(search_layout)
         
         self.search_box = QLineEdit()
-        self.search_box.setPlaceholderText("Nhập tên file...")
-        self.search_box.textChanged.connect(self.on_search_change)
+        self.search_box.setPlaceholderText("Tên file, camera:sony iso>=800 has:gps date:2024-05...")
+        self.search_box.setToolTip(
+            "Cú pháp tìm kiếm (các điều kiện được AND, dấu - để phủ định):\n"
+            "  beach                 tên file chứa 'beach'\n"
+            "  dsc_01*  ~sunset      bắt đầu bằng / gần đúng\n"
+            "  camera:\"ILCE-7M3\"    lens:24-70\n"
+            "  iso>=3200  size>5MB  exposure<1/60  alt:100..500\n"
+            "  date:2024-05..2024-06  has:gps  no:date\n"
+            "  near:10.77,106.70,2km  -ext:png"
+        )
+        # Debounced: search once typing pauses, or right away on Enter
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(150)
+        self.search_timer.timeout.connect(self.on_search_change)
+        self.search_box.textChanged.connect(self.search_timer.start)
+        self.search_box.returnPressed.connect(self.on_search_change)
         self.search_box.setMinimumHeight(32)
         search_layout.addWidget(self.search_box)
         
@@ -1380,14 +2296,36 @@ QMessageBox QPushButton {
         self.camera_btn.setMinimumHeight(34)
         filter_layout.addWidget(self.camera_btn, 1, 0)
         
+        self.place_btn = FluentButton("🏙️ Địa điểm")
+        self.place_btn.setObjectName("filterButton")
+        self.place_btn.clicked.connect(self.filter_by_place)
+        self.place_btn.setMinimumHeight(34)
+        filter_layout.addWidget(self.place_btn, 1, 1)
+        
         reset_btn = FluentButton("🔄 Đặt lại")
         reset_btn.setObjectName("secondaryButton")
         reset_btn.clicked.connect(self.clear_filter)
         reset_btn.setMinimumHeight(34)
-        filter_layout.addWidget(reset_btn, 1, 1)
+        filter_layout.addWidget(reset_btn, 2, 0, 1, 2)
         
         layout.addWidget(filter_group)
         
+        # Facet card: counts per camera / lens / date / type / GPS
+        facet_group = self.create_card("🧮 Phân loại")
+        facet_layout = QVBoxLayout()
+        facet_layout.setContentsMargins(8, 10, 8, 8)
+        facet_layout.setSpacing(0)
+        facet_group.setLayout(facet_layout)
+        
+        self.facet_tree = QTreeWidget()
+        self.facet_tree.setHeaderHidden(True)
+        self.facet_tree.setMinimumHeight(120)
+        self.facet_tree.setMaximumHeight(200)
+        self.facet_tree.itemChanged.connect(self.on_facet_changed)
+        facet_layout.addWidget(self.facet_tree)
+        
+        layout.addWidget(facet_group)
+        
         # Sort card with ComboBox
         sort_group = self.create_card("📊 Sắp xếp")
         sort_layout = QVBoxLayout()
@@ -1400,7 +2338,10 @@ QMessageBox QPushButton {
         self.sort_combo.addItem("📅 Ngày (mới → cũ)", "date_desc")
         self.sort_combo.addItem("📅 Ngày (cũ → mới)", "date_asc")
         self.sort_combo.addItem("💾 Kích thước", "size")
-        self.sort_combo.currentIndexChanged.connect(self.sort_images)
+        self.sort_combo.addItem("🗂️ Loại file", "type")
+        self.sort_combo.addItem("📷 Camera → ngày", "camera_date")
+        # Traced slot: PyQt only drops the index argument for plain methods
+        self.sort_combo.currentIndexChanged.connect(lambda _: self.sort_images())
         sort_layout.addWidget(self.sort_combo)
         
         layout.addWidget(sort_group)
@@ -1413,19 +2354,14 @@ QMessageBox QPushButton {
         list_group.setLayout(list_layout)
         
         self.listbox = QListWidget()
+        self.listbox.setUniformItemSizes(True)
         self.listbox.currentRowChanged.connect(self.on_select)
         self.listbox.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
         list_layout.addWidget(self.listbox)
         
         self.list_status = QLabel("0 ảnh")
-        self.list_status.setStyleSheet("""
-            background-color: #FFF4CE;
-            color: #6B5300;
-            border-radius: 4px;
-            padding: 8px;
-            font-weight: 600;
-            font-size: 8.5pt;
-        """)
+        self.list_status.setObjectName("listStatus")
+        self.list_status.setProperty("state", "total")
         self.list_status.setAlignment(Qt.AlignmentFlag.AlignCenter)
         list_layout.addWidget(self.list_status)
         
@@ -1483,22 +2419,7 @@ QMessageBox QPushButton {
         
         for text, func in tools:
             btn = QPushButton(text)
-            btn.setStyleSheet("""
-                QPushButton {
-                    background-color: #404040;
-                    color: white;
-                    border: none;
-                    border-radius: 4px;
-                    padding: 8px 14px;
-                    font-weight: 500;
-                }
-                QPushButton:hover {
-                    background-color: #505050;
-                }
-                QPushButton:pressed {
-                    background-color: #353535;
-                }
-            """)
+            btn.setObjectName("viewerTool")
             btn.clicked.connect(func)
             btn.setCursor(Qt.CursorShape.PointingHandCursor)
             toolbar_layout.addWidget(btn)
@@ -1719,8 +2640,8 @@ QMessageBox QPushButton {
         for url in event.mimeData().urls():
             path = url.toLocalFile()
             # ✅ Check file exists và readable
-            if os.path.exists(path) and os.path.isfile(path):
-                if Path(path).suffix.lower() in ['.jpg', '.jpeg', '.png', '.heic', '.heif']:
+            if os.path.isfile(path):
+                if Path(path).suffix.lower() in IMAGE_EXTS:
                     files.append(path)
         if files:
             self.load_images(files)
@@ -1738,28 +2659,209 @@ QMessageBox QPushButton {
     def add_folder(self):
         folder = QFileDialog.getExistingDirectory(self, "Chọn thư mục chứa ảnh")
         if folder:
-            files = []
-            for ext in ['.jpg', '.jpeg', '.png', '.heic', '.heif']:
-                files.extend(Path(folder).rglob(f'*{ext}'))
-                files.extend(Path(folder).rglob(f'*{ext.upper()}'))
-            if files:
-                self.load_images([str(f) for f in files])
+            self.open_folder(folder)
+    
+    def open_folder(self, folder):
+        """Scan a folder into the library and keep watching it"""
+        root = os.path.normpath(folder)
+        if root in self.watched_roots:
+            QMessageBox.information(self, "Thông báo", "Thư mục này đã được theo dõi")
+            return
+        
+        # One scandir pass in the background collects files, stats and the
+        # snapshot the watcher diffs against later
+        self.watched_roots[root] = is_network_path(root)
+        self.status_right.setText("📂 Đang quét thư mục...")
+        self.folder_watcher.add_root(root, poll=self.watched_roots[root])
+    
+    def start_folder_watcher(self):
+        self.watched_roots = {}  # root -> polled (network share)
+        if self.fs_watcher.directories():
+            self.fs_watcher.removePaths(self.fs_watcher.directories())
+        self.folder_watcher = FolderWatcher()
+        self.folder_watcher.scanned.connect(self.on_folder_scanned)
+        self.folder_watcher.changed.connect(self.on_folder_changed)
+        self.folder_watcher.start()
+    
+    def on_watched_path_changed(self, path):
+        # Directory watches miss in-place edits, so the photo on screen is
+        # watched as a file too; either way its folder gets re-listed
+        if path in self.fs_watcher.files():
+            path = os.path.dirname(path)
+        self.folder_watcher.notify(path)
+    
+    def watch_file(self, path):
+        if self.fs_watcher.files():
+            self.fs_watcher.removePaths(self.fs_watcher.files())
+        if self.watched_roots:
+            self.fs_watcher.addPath(path)
+    
+    @trace.traced('on_folder_scanned')
+    def on_folder_scanned(self, root, found, directories):
+        self.status_right.setText("")
+        if not self.watched_roots.get(root) and directories:
+            failed = self.fs_watcher.addPaths(directories)
+            if failed:
+                # Out of inotify watches (or unsupported): fall back to polling
+                print(f"Folder watch: polling {root} ({len(failed)} folders not watchable)")
+                self.watched_roots[root] = True
+                self.folder_watcher.poll(root)
+        if root in self.restoring_roots:
+            # Restored rows: apply what changed on disk since the last session
+            self.restoring_roots.discard(root)
+            self.on_folder_changed(revalidate(self.meta, root, found))
+        elif found:
+            self.load_images(list(found), found)
+        else:
+            QMessageBox.information(self, "Thông báo", "Không tìm thấy ảnh nào")
+    
+    @trace.traced('on_folder_changed')
+    def on_folder_changed(self, changes):
+        """Apply adds, removals, renames and edits from a watched folder"""
+        if changes.dirs_added:
+            polled = [r for r, poll in self.watched_roots.items() if poll]
+            watch = [d for d in changes.dirs_added
+                     if not any(d == r or d.startswith(r + os.sep) for r in polled)]
+            if watch:
+                self.fs_watcher.addPaths(watch)
+        if changes.dirs_removed:
+            gone = set(changes.dirs_removed) & set(self.fs_watcher.directories())
+            if gone:
+                self.fs_watcher.removePaths(list(gone))
+        
+        meta = self.meta
+        removed = [p for p in changes.removed if p in meta]
+        renamed = [(old, new, st) for old, new, st in changes.renamed if old in meta]
+        added = {p: st for p, st in changes.added.items() if p not in meta}
+        modified = {p: st for p, st in changes.modified.items() if p in meta}
+        if not (removed or renamed or added or modified):
+            return
+        
+        current = self.image_list[self.current_index] if self.current_index >= 0 else None
+        
+        # Removals and renames: tombstone rows, carry caches over to new names
+        gone = set(removed)
+        for path in removed:
+            meta.remove(path)
+            self.forget_path(path)
+        moved = {}
+        for old, new, st in renamed:
+            meta.set_stat(meta.rename(old, new), st)
+            self.forget_path(old, new)
+            gone.add(old)
+            moved[old] = new
+            added[new] = None
+        if gone:
+            self.image_list = [p for p in self.image_list if p not in gone]
+            self.filtered_list = [moved.get(p, p) for p in self.filtered_list
+                                  if p not in gone or p in moved]
+        
+        # Additions go straight to their sorted position
+        new_paths = []
+        for path, st in added.items():
+            if path not in meta:
+                row = meta.add(path)
+                if st is not None:
+                    meta.set_stat(row, st)
+            new_paths.append(path)
+        # (by the stats the watcher captured; EXIF keys are filled in later)
+        mode = self.sort_combo.currentData()
+        by_exif = self.sorter.needs(mode) & HAS_EXIF
+        if new_paths:
+            if len(new_paths) > 200:
+                self.image_list = self.sorter.sort(self.image_list + new_paths, mode)
             else:
-                QMessageBox.information(self, "Thông báo", "Không tìm thấy ảnh nào")
+                self.sorter.insert(self.image_list, new_paths, mode)
+            if by_exif:
+                self.unplaced.update(meta.unloaded(new_paths))
+        
+        # Edited files: new stats, EXIF parsed again in the background
+        for path, st in modified.items():
+            row = meta.row_of[path]
+            if meta.set_stat(row, st):
+                meta.invalidate(row, HAS_EXIF)
+                self.forget_path(path)
+                if by_exif:
+                    self.unplaced.add(path)
+        
+        self.refresh_after_library_change(moved.get(current, current),
+                                          reload=current in modified)
+        self.start_metadata_indexing()
     
-    def load_images(self, paths):
+    def forget_path(self, path, new_path=None):
+        """Drop (or move to new_path) everything cached about a file"""
+        self.library.forget(path, new_path)
+        pixmap = self.image_viewer.pixmap_cache.pop(path, None)
+        if new_path is not None and pixmap is not None:
+            self.image_viewer.pixmap_cache[new_path] = pixmap
+        place = self.places.pop(path, None)
+        if new_path is not None and place is not None:
+            self.places[new_path] = place
+        hashes = self.phashes.pop(path, None)
+        if hashes is not None:
+            self.bk_tree.remove(hashes[2], path)
+            if new_path is not None:
+                self.phashes[new_path] = hashes
+                self.bk_tree.add(hashes[2], new_path)
+    
+    def refresh_after_library_change(self, current, reload=False):
+        """Redisplay the list after the library changed, keeping the selection"""
+        if self.search_box.text().strip():
+            self.on_search_change()
+        else:
+            self.update_listbox(self.filtered_list if self.is_filtered else self.image_list)
+        self.schedule_facet_refresh()
+        
+        if current in self.meta:
+            self.current_index = self.image_list.index(current)
+            if current in self.display_list:
+                self.listbox.blockSignals(True)
+                self.listbox.setCurrentRow(self.display_list.index(current))
+                self.listbox.blockSignals(False)
+            if reload:
+                self.display_image(self.current_index)
+        elif self.display_list:
+            row = min(max(self.listbox.currentRow(), 0), len(self.display_list) - 1)
+            self.current_index = -1
+            self.listbox.setCurrentRow(row)
+            self.on_select(row)
+        else:
+            self.current_index = -1
+            self.current_gps = None
+            self.image_viewer.original_pixmap = None
+            self.image_viewer.update()
+        self.update_nav()
+    
+    @trace.traced('load_images')
+    def load_images(self, paths, stats=None):
+        """Add photos; stats maps path -> stat_result captured while scanning"""
         added = 0
+        known = set(self.image_list)
         for p in paths:
-            if p not in self.image_list:
+            if p not in known:
+                known.add(p)
+                row = self.meta.add(p)
+                if stats and p in stats:
+                    self.meta.set_stat(row, stats[p])
                 self.image_list.append(p)
                 added += 1
         
         if added > 0:
+            self.start_stat_loading(self.meta.unloaded(self.image_list, HAS_STAT))
             self.sort_images()
             if self.current_index == -1 and self.image_list:
                 self.listbox.setCurrentRow(0)
                 self.display_image(0)
+            
+            self.start_metadata_indexing()
+            self.start_name_indexing()
+            self.schedule_facet_refresh()
+            
+            # Offline lookups are free, so keep place facets current
+            if self.settings.value("geocoder/backend", "nominatim") == "offline":
+                self.start_place_indexing()
     
+    @trace.traced('sort_images')
     def sort_images(self):
         if not self.image_list:
             return
@@ -1767,29 +2869,31 @@ QMessageBox QPushButton {
         current = self.image_list[self.current_index] if self.current_index >= 0 else None
         sort_value = self.sort_combo.currentData()
         
-        # ✅ Always sort master list
-        if sort_value == "name":
-            self.image_list.sort(key=lambda x: Path(x).name.lower())
-        elif sort_value in ["date_desc", "date_asc"]:
-            def get_date(p):
-                tags = self.get_exif(p)
-                date_str = str(tags.get('EXIF DateTimeOriginal', ''))
-                if not date_str:
-                    return os.path.getmtime(p) if os.path.exists(p) else 0
-                return date_str
-            self.image_list.sort(key=get_date, reverse=(sort_value == "date_desc"))
-        elif sort_value == "size":
-            def get_size(p):
-                return os.path.getsize(p) if os.path.exists(p) else 0
-            self.image_list.sort(key=get_size, reverse=True)
+        # Size/date sorts wait for the StatLoader rather than stat'ing here
+        if self.sorter.needs(sort_value) & HAS_STAT and self.meta.unloaded(self.image_list, HAS_STAT):
+            self.after_stats(self.image_list, self.sort_images)
+            return
+        
+        # EXIF sorts wait for the MetadataIndexer; the list shows as it is meanwhile
+        if self.sorter.needs(sort_value) & HAS_EXIF and self.meta.unloaded(self.image_list):
+            self.update_listbox(self.filtered_list if self.is_filtered else self.image_list)
+            self.after_metadata(self.image_list, self.sort_images)
+            return
+        
+        # ✅ Always sort master list (cached permutation per sort mode)
+        self.image_list = self.library.sort(self.image_list, sort_value)
+        self.unplaced.clear()
         
         # ✅ Update display based on current filter state
         if self.is_filtered:
             # Rebuild filtered list maintaining filter criteria
-            self.filtered_list = [p for p in self.image_list if p in self.filtered_list]
-            self.update_listbox(self.filtered_list)
+            keep = set(self.filtered_list)
+            self.filtered_list = [p for p in self.image_list if p in keep]
+        # A sort that waited for metadata must not drop a search typed meanwhile
+        if self.search_box.text().strip():
+            self.on_search_change()
         else:
-            self.update_listbox(self.image_list)
+            self.update_listbox(self.filtered_list if self.is_filtered else self.image_list)
         
         # ✅ Restore current selection
         if current and current in self.display_list:
@@ -1803,25 +2907,17 @@ QMessageBox QPushButton {
             QMessageBox.information(self, "Thông báo", "Chưa có ảnh nào")
             return
         
-        # Reset all filter buttons
-        self.gps_btn.setObjectName("filterButton")
-        self.no_gps_btn.setObjectName("filterButton")
-        self.gps_btn.setStyleSheet("")
-        self.no_gps_btn.setStyleSheet("")
-        
-        # Highlight active button
-        button.setObjectName("filterButtonActive")
-        button.setStyleSheet("")
-        self.active_filter_btn = button
+        self.highlight_filter(button)
+        if self.meta.unloaded(self.image_list):
+            self.after_metadata(self.image_list, lambda: self.apply_filter_with_highlight(filter_type, button),
+                                key='filter')
+            return
         
         self.list_status.setText("⏳ Đang lọc...")
         QApplication.processEvents()
         
-        self.filtered_list = []
-        for p in self.image_list:
-            gps = self.get_gps_data(p)
-            if (filter_type == 'has_gps' and gps) or (filter_type == 'no_gps' and not gps):
-                self.filtered_list.append(p)
+        self.clear_facet_selection()
+        self.filtered_list = self.library.filter_gps(self.image_list, filter_type == 'has_gps')
         
         self.is_filtered = True
         self.update_listbox(self.filtered_list)
@@ -1829,66 +2925,58 @@ QMessageBox QPushButton {
         if self.filtered_list:
             self.listbox.setCurrentRow(0)
     
+    @trace.traced('update_listbox')
     def update_listbox(self, items):
         self.display_list = items
         self.listbox.clear()
-        for i, p in enumerate(items, 1):
-            self.listbox.addItem(f"[{i:03d}] {Path(p).name}")
+        if self.burst_hidden:
+            items = [p for p in items if p not in self.burst_hidden]
+            self.display_list = items
+        basename = os.path.basename
+        labels = [f"[{i:03d}] {basename(p)}" for i, p in enumerate(items, 1)]
+        if self.burst_sizes:
+            sizes = self.burst_sizes
+            labels = [f"{label}  🎞️ +{sizes[p] - 1}" if p in sizes else label
+                      for p, label in zip(items, labels)]
+        self.listbox.addItems(labels)
         self.update_list_status()
     
+    def highlight_filter(self, button):
+        """Mark button as the active quick filter (None: no quick filter)"""
+        for btn in (self.gps_btn, self.no_gps_btn, self.camera_btn, self.place_btn):
+            set_style_property(btn, "active", btn is button)
+        self.active_filter_btn = button
+    
     def update_list_status(self):
         if self.is_filtered:
             self.list_status.setText(f"🔍 Đã lọc: {len(self.filtered_list)}/{len(self.image_list)} ảnh")
-            if self.is_dark_theme:
-                self.list_status.setStyleSheet("""
-                    background-color: #1a4d2e;
-                    color: #90ee90;
-                    border-radius: 4px;
-                    padding: 8px;
-                    font-weight: 600;
-                    font-size: 8.5pt;
-                """)
-            else:
-                self.list_status.setStyleSheet("""
-                    background-color: #D4F4DD;
-                    color: #0E5C2F;
-                    border-radius: 4px;
-                    padding: 8px;
-                    font-weight: 600;
-                    font-size: 8.5pt;
-                """)
         else:
             self.list_status.setText(f"📊 Tổng: {len(self.image_list)} ảnh")
-            if self.is_dark_theme:
-                self.list_status.setStyleSheet("""
-                    background-color: #4a4000;
-                    color: #ffeb3b;
-                    border-radius: 4px;
-                    padding: 8px;
-                    font-weight: 600;
-                    font-size: 8.5pt;
-                """)
-            else:
-                self.list_status.setStyleSheet("""
-                    background-color: #FFF4CE;
-                    color: #6B5300;
-                    border-radius: 4px;
-                    padding: 8px;
-                    font-weight: 600;
-                    font-size: 8.5pt;
-                """)
+        set_style_property(self.list_status, "state", "filtered" if self.is_filtered else "total")
     
+    @trace.traced('on_search_change')
     def on_search_change(self):
-        query = self.search_box.text().lower().strip()
+        self.search_timer.stop()
+        text = self.search_box.text().strip()
         source = self.filtered_list if self.is_filtered else self.image_list
         
-        if not query:
+        if not text:
             self.update_listbox(source)
             return
         
-        results = [p for p in source if query in Path(p).name.lower()]
+        query = Query(text)
+        if query.needs & HAS_STAT and self.meta.unloaded(source, HAS_STAT):
+            self.after_stats(source, self.on_search_change)
+            return
+        if query.needs & HAS_EXIF and self.meta.unloaded(source):
+            self.after_metadata(source, self.on_search_change)
+            return
+        query, results = self.query_engine.run(query, source)
         self.update_listbox(results)
         
+        if query.errors:
+            self.list_status.setText("⚠️ " + "; ".join(query.errors))
+        
         if results:
             self.listbox.setCurrentRow(0)
     
@@ -1896,15 +2984,15 @@ QMessageBox QPushButton {
         if not self.image_list:
             QMessageBox.information(self, "Thông báo", "Chưa có ảnh nào trong danh sách")
             return
+        if self.meta.unloaded(self.image_list):
+            self.after_metadata(self.image_list, lambda: self.apply_filter(filter_type), key='filter')
+            return
         
         self.list_status.setText("⏳ Đang lọc...")
         QApplication.processEvents()
         
-        self.filtered_list = []
-        for p in self.image_list:
-            gps = self.get_gps_data(p)
-            if (filter_type == 'has_gps' and gps) or (filter_type == 'no_gps' and not gps):
-                self.filtered_list.append(p)
+        self.clear_facet_selection()
+        self.filtered_list = self.library.filter_gps(self.image_list, filter_type == 'has_gps')
         
         self.is_filtered = True
         self.update_listbox(self.filtered_list)
@@ -1916,49 +3004,30 @@ QMessageBox QPushButton {
         if not self.image_list:
             QMessageBox.information(self, "Thông báo", "Chưa có ảnh nào")
             return
+        if self.meta.unloaded(self.image_list):
+            self.after_metadata(self.image_list, self.filter_by_camera, key='filter')
+            return
         
-        self.list_status.setText("⏳ Đang quét...")
-        QApplication.processEvents()
-        
-        cameras = set()
-        for p in self.image_list:
-            tags = self.get_exif(p)
-            make = str(tags.get('Image Make', '')).strip()
-            model = str(tags.get('Image Model', '')).strip()
-            camera = f"{make} {model}".strip()
-            if camera:
-                cameras.add(camera)
-        
-        if not cameras:
+        counts = self.facets.counts('camera')
+        counts.pop('', None)
+        if not counts:
             QMessageBox.information(self, "Thông báo", "Không tìm thấy thông tin camera")
-            self.update_list_status()
             return
         
-        from PyQt6.QtWidgets import QInputDialog
-        camera, ok = QInputDialog.getItem(
+        cameras = sorted(counts)
+        labels = [f"{cam} ({counts[cam]})" for cam in cameras]
+        label, ok = QInputDialog.getItem(
             self, "Lọc theo Camera", "Chọn camera:", 
-            sorted(cameras), 0, False
+            labels, 0, False
         )
         
-        if ok and camera:
-            # Reset filter buttons
-            self.gps_btn.setObjectName("filterButton")
-            self.no_gps_btn.setObjectName("filterButton")
-            self.gps_btn.setStyleSheet("")
-            self.no_gps_btn.setStyleSheet("")
-            
-            # Highlight camera button
-            self.camera_btn.setObjectName("filterButtonActive")
-            self.camera_btn.setStyleSheet("")
-            self.active_filter_btn = self.camera_btn
+        if ok and label:
+            camera = cameras[labels.index(label)]
+
+            self.highlight_filter(self.camera_btn)
             
-            self.filtered_list = []
-            for p in self.image_list:
-                tags = self.get_exif(p)
-                make = str(tags.get('Image Make', '')).strip()
-                model = str(tags.get('Image Model', '')).strip()
-                if f"{make} {model}".strip() == camera:
-                    self.filtered_list.append(p)
+            self.clear_facet_selection()
+            self.filtered_list = self.library.filter_camera(self.image_list, camera)
             
             self.is_filtered = True
             self.update_listbox(self.filtered_list)
@@ -1967,28 +3036,612 @@ QMessageBox QPushButton {
                 self.listbox.setCurrentRow(0)
     
     def clear_filter(self):
+        # A quick filter still waiting for EXIF is cancelled too
+        self.metadata_waiters = [w for w in self.metadata_waiters if w[1] != 'filter']
         self.is_filtered = False
         self.filtered_list.clear()
         self.search_box.clear()
         
-        # Reset all filter button styles
-        if hasattr(self, 'gps_btn'):
-            self.gps_btn.setObjectName("filterButton")
-            self.no_gps_btn.setObjectName("filterButton")
-            self.camera_btn.setObjectName("filterButton")
-            self.gps_btn.setStyleSheet("")
-            self.no_gps_btn.setStyleSheet("")
-            self.camera_btn.setStyleSheet("")
-        
-        self.active_filter_btn = None
+        self.highlight_filter(None)
+        self.clear_facet_selection()
         self.update_listbox(self.image_list)
     
+    def start_stat_loading(self, paths):
+        """Fetch file attributes off the UI thread"""
+        if not paths:
+            return
+        if self.stat_loader and self.stat_loader.isRunning():
+            self.stat_loader.stop()
+            self.stale_loaders.append(self.stat_loader)
+        self.stat_refreshed_at = time.monotonic()
+        self.stat_loader = StatLoader(paths)
+        self.stat_loader.batch.connect(self.on_stat_batch)
+        self.stat_loader.start()
+    
+    def request_stats(self, paths):
+        """Make sure a StatLoader is fetching the attributes of paths"""
+        if self.stat_loader and self.stat_loader.isRunning() and self.stat_loader.covers(paths):
+            return
+        pending = self.meta.unloaded(self.image_list, HAS_STAT)
+        listed = set(pending)
+        wanted = set(paths).union(*(waiting for waiting, _ in self.stat_waiters))
+        self.start_stat_loading(pending + [p for p in wanted if p not in listed and p in self.meta])
+    
+    def after_stats(self, paths, action):
+        """Run action once every path has file attributes; until then the
+        StatLoader fetches them and the action waits (no stat on the UI thread)"""
+        meta = self.meta
+        missing = meta.unloaded([p for p in paths if p in meta], HAS_STAT)
+        if not missing:
+            action()
+            return
+        self.list_status.setText(f"⏳ Đang đọc thông tin {len(missing)} file...")
+        for waiting, queued in self.stat_waiters:
+            if queued == action:
+                waiting.update(missing)
+                break
+        else:
+            self.stat_waiters.append((set(missing), action))
+        self.request_stats(missing)
+    
+    def after_metadata(self, paths, action, key=None):
+        """Run action once every path has its EXIF in the table; until then the
+        MetadataIndexer parses them and the action waits (no EXIF on the UI thread).
+        A later action with the same key (default: the action) replaces it."""
+        meta = self.meta
+        missing = meta.unloaded([p for p in paths if p in meta])
+        indexing = self.metadata_indexer is not None and self.metadata_indexer.isRunning()
+        if not missing or not (indexing or meta.unloaded(self.image_list)):
+            action()   # nothing (more) the indexer would parse for it
+            return
+        key = action if key is None else key
+        waiting = set(missing)
+        for waiter in self.metadata_waiters:
+            if waiter[1] == key:
+                waiting.update(waiter[0])
+        # Latest request last, so deferred actions run in the order they were asked for
+        self.metadata_waiters = [w for w in self.metadata_waiters if w[1] != key]
+        self.metadata_waiters.append([waiting, key, action])
+        self.show_metadata_wait()
+        self.start_metadata_indexing()
+    
+    def show_metadata_wait(self):
+        left = max(len(waiting) for waiting, _, _ in self.metadata_waiters)
+        self.list_status.setText(f"⏳ Đang đọc EXIF {left} ảnh...")
+    
+    def run_metadata_waiters(self, everything=False):
+        """Run the actions whose photos all have EXIF now (every one: nothing more will come)"""
+        ready = [action for waiting, _, action in self.metadata_waiters if everything or not waiting]
+        self.metadata_waiters = [w for w in self.metadata_waiters if w[0] and not everything]
+        if self.metadata_waiters:
+            self.show_metadata_wait()
+        elif ready:
+            self.update_list_status()
+        for action in ready:
+            action()
+    
+    @trace.traced('on_stat_batch')
+    def on_stat_batch(self, results):
+        meta = self.meta
+        changed = stale = False
+        for path, st in results:
+            for waiting, _ in self.stat_waiters:
+                waiting.discard(path)
+            row = meta.row_of.get(path)
+            if row is None:
+                continue
+            known = meta.loaded[row] & HAS_STAT
+            if meta.set_stat(row, st):
+                changed = True
+                if known and st is not None and meta.loaded[row] & HAS_EXIF:
+                    # Edited since it was parsed: read its EXIF again
+                    meta.invalidate(row, HAS_EXIF)
+                    self.forget_path(path)
+                    stale = True
+        if stale:
+            self.start_metadata_indexing()
+        if changed and self.current_index >= 0:
+            current = self.image_list[self.current_index]
+            if any(path == current for path, _ in results):
+                self.update_file_info(current)
+        ready = [action for waiting, action in self.stat_waiters if not waiting]
+        if ready:
+            self.stat_waiters = [w for w in self.stat_waiters if w[0]]
+            for action in ready:
+                action()
+    
+    def changeEvent(self, event):
+        # Re-stat the library lazily when the window is focused again
+        if event.type() == event.Type.ActivationChange and self.isActiveWindow():
+            if self.image_list and time.monotonic() - self.stat_refreshed_at > STAT_REFRESH_INTERVAL:
+                self.start_stat_loading(self.image_list)
+        super().changeEvent(event)
+    
+    def start_metadata_indexing(self):
+        """Parse EXIF of photos not indexed yet; facets fill in as batches arrive"""
+        if self.metadata_indexer and self.metadata_indexer.isRunning():
+            return  # picked up again when the running indexer finishes
+        pending = self.meta.unloaded(self.image_list)
+        if not pending:
+            # Photos some action waited for were removed meanwhile
+            self.run_metadata_waiters(everything=True)
+            return
+        self.metadata_indexer = MetadataIndexer(pending)
+        self.metadata_indexer.batch.connect(self.on_metadata_batch)
+        self.metadata_indexer.finished.connect(self.start_metadata_indexing)
+        self.metadata_indexer.start()
+    
+    def start_name_indexing(self):
+        if self.name_indexer and self.name_indexer.isRunning():
+            return
+        self.name_indexer = NameIndexer(self.query_engine.index)
+        self.name_indexer.start()
+    
+    @trace.traced('on_metadata_batch')
+    def on_metadata_batch(self, records):
+        meta = self.meta
+        for path, rec in records:
+            for waiting, _, _ in self.metadata_waiters:
+                waiting.discard(path)
+            row = meta.row_of.get(path)
+            if row is None or meta.loaded[row] & HAS_EXIF:
+                continue  # removed, or already parsed on demand
+            meta.loaded[row] |= HAS_EXIF
+            meta.set(row, rec)
+        arrived = [path for path, _ in records if path in self.unplaced]
+        if arrived:
+            self.unplaced.difference_update(arrived)
+            self.place_again(arrived)
+        self.schedule_facet_refresh()
+        if self.metadata_waiters:
+            self.run_metadata_waiters()
+    
+    def place_again(self, paths):
+        """Move photos inserted before their EXIF was read to their sorted position"""
+        mode = self.sort_combo.currentData()
+        if not self.sorter.needs(mode) & HAS_EXIF:
+            return
+        current = self.image_list[self.current_index] if self.current_index >= 0 else None
+        moved = set(paths).intersection(self.image_list)
+        if len(moved) > 200:
+            self.image_list = self.sorter.sort(self.image_list, mode)
+        else:
+            self.image_list = [p for p in self.image_list if p not in moved]
+            self.sorter.insert(self.image_list, list(moved), mode)
+        if self.is_filtered and moved.intersection(self.filtered_list):
+            keep = set(self.filtered_list)
+            self.filtered_list = [p for p in self.image_list if p in keep]
+        self.refresh_after_library_change(current)
+    
+    def schedule_facet_refresh(self):
+        if not self.facet_timer.isActive():
+            self.facet_timer.start()
+    
+    @trace.traced('refresh_facets')
+    def refresh_facets(self):
+        """Rebuild the facet tree with counts under the current selection"""
+        tree = self.facet_tree
+        selected = self.facet_selection
+        expanded = {tree.topLevelItem(i).data(0, Qt.ItemDataRole.UserRole)
+                    for i in range(tree.topLevelItemCount())
+                    if tree.topLevelItem(i).isExpanded()}
+        
+        tree.blockSignals(True)
+        tree.clear()
+        
+        def add_item(parent, facet, value, label, count):
+            item = QTreeWidgetItem(parent, [f"{label} ({count})"])
+            item.setData(0, Qt.ItemDataRole.UserRole, (facet, value))
+            item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            checked = value in selected.get(facet, ())
+            item.setCheckState(0, Qt.CheckState.Checked if checked else Qt.CheckState.Unchecked)
+            return item
+        
+        groups = [
+            ('camera', "📷 Camera", lambda v: v or "(không rõ)"),
+            ('lens', "🔭 Ống kính", lambda v: v or "(không rõ)"),
+            ('year', "📅 Ngày chụp", lambda v: v or "(không có ngày)"),
+            ('ext', "🗂️ Loại file", lambda v: v),
+            ('gps', "🌍 GPS", lambda v: "Có GPS" if v == 'yes' else "Không GPS"),
+        ]
+        months = self.facets.counts('month', selected)
+        for facet, title, label in groups:
+            counts = self.facets.counts(facet, selected)
+            if not counts:
+                continue
+            top = QTreeWidgetItem(tree, [title])
+            top.setData(0, Qt.ItemDataRole.UserRole, facet)
+            top.setExpanded(facet in expanded or bool(selected.get(facet)))
+            for value in sorted(counts, reverse=(facet == 'year')):
+                item = add_item(top, facet, value, label(value), counts[value])
+                if facet == 'year' and value:
+                    for month in sorted(m for m in months if m.startswith(value + '-')):
+                        add_item(item, 'month', month, month, months[month])
+                    item.setExpanded(bool(selected.get('month')))
+        
+        tree.blockSignals(False)
+    
+    def on_facet_changed(self, item, column):
+        key = item.data(0, Qt.ItemDataRole.UserRole)
+        if not isinstance(key, tuple):
+            return
+        facet, value = key
+        values = self.facet_selection.setdefault(facet, set())
+        if item.checkState(0) == Qt.CheckState.Checked:
+            values.add(value)
+        else:
+            values.discard(value)
+        self.apply_facets()
+    
+    @trace.traced('apply_facets')
+    def apply_facets(self):
+        """Intersect the checked facet values and show the matching photos"""
+        # Facets replace the quick filters
+        self.highlight_filter(None)
+        
+        if any(self.facet_selection.values()):
+            self.filtered_list = self.meta.select(self.image_list,
+                                                  self.facets.mask(self.facet_selection))
+            self.is_filtered = True
+        else:
+            self.filtered_list = []
+            self.is_filtered = False
+        
+        if self.search_box.text().strip():
+            self.on_search_change()
+        else:
+            self.update_listbox(self.filtered_list if self.is_filtered else self.image_list)
+        if self.display_list:
+            self.listbox.setCurrentRow(0)
+        self.schedule_facet_refresh()
+    
+    def clear_facet_selection(self):
+        if any(self.facet_selection.values()):
+            self.facet_selection = {}
+            self.schedule_facet_refresh()
+    
+    def start_place_indexing(self):
+        """Resolve country/region/city for every photo in the background"""
+        if not self.image_list:
+            QMessageBox.information(self, "Thông báo", "Chưa có ảnh nào")
+            return
+        if self.place_indexer and self.place_indexer.isRunning():
+            # Run again when this pass ends; resolved photos and cells come from the store
+            self.places_pending = True
+            return
+        self.places_pending = False
+        try:
+            geocoder = self.get_geocoder()
+        except GeocoderError as e:
+            QMessageBox.warning(self, "Lỗi", str(e))
+            return
+        
+        self.place_indexer = PlaceIndexer(self.image_list, geocoder)
+        self.place_indexer.progress.connect(self.on_place_progress)
+        self.place_indexer.done.connect(self.on_places_ready)
+        self.place_indexer.start()
+    
+    def on_place_progress(self, stage, done, total):
+        label = "Đọc GPS" if stage == 'scan' else "Tra địa chỉ"
+        self.status_right.setText(f"🏙️ {label}: {done}/{total}")
+    
+    def on_places_ready(self, places):
+        known = set(self.image_list)
+        self.places.update((p, place) for p, place in places.items() if p in known)
+        self.status_right.setText(f"🏙️ Đã có địa điểm cho {len(self.places)} ảnh")
+        if self.places_pending and self.image_list:
+            self.place_indexer.wait()  # done is the thread's last act
+            self.start_place_indexing()
+    
+    def find_duplicates(self):
+        """Hash photos in the background to find byte-identical copies"""
+        if not self.image_list:
+            QMessageBox.information(self, "Thông báo", "Chưa có ảnh nào")
+            return
+        if self.duplicate_finder and self.duplicate_finder.isRunning():
+            return
+        self.status_right.setText("🧬 Đang tìm ảnh trùng lặp...")
+        self.duplicate_finder = DuplicateFinder(self.image_list)
+        self.duplicate_finder.progress.connect(self.on_duplicate_progress)
+        self.duplicate_finder.done.connect(self.on_duplicates_ready)
+        self.duplicate_finder.start()
+    
+    def on_duplicate_progress(self, stage, done, total):
+        label = "Kiểm tra nhanh" if stage == 'quick' else "Băm toàn bộ"
+        self.status_right.setText(f"🧬 {label}: {done}/{total}")
+    
+    def on_duplicates_ready(self, groups):
+        """Show duplicate groups next to each other in the list"""
+        groups = [g for g in ([p for p in group if p in self.meta] for group in groups) if len(g) > 1]
+        self.duplicate_groups = groups
+        if not groups:
+            self.status_right.setText("🧬 Không có ảnh trùng lặp")
+            QMessageBox.information(self, "Thông báo", "Không tìm thấy ảnh trùng lặp")
+            return
+        
+        firsts = [group[0] for group in groups]
+        if self.meta.unloaded(firsts, HAS_STAT):
+            self.after_stats(firsts, lambda: self.on_duplicates_ready(groups))
+            return
+        sizes = {p: self.meta.cols['size'][self.meta.row_of[p]] for p in firsts}
+        wasted = wasted_bytes(groups, sizes) / (1024 * 1024)
+        copies = sum(len(group) - 1 for group in groups)
+        self.status_right.setText(f"🧬 {len(groups)} nhóm trùng, {wasted:.1f} MB thừa")
+        
+        self.highlight_filter(None)
+        self.clear_facet_selection()
+        
+        self.filtered_list = [p for group in groups for p in group]
+        self.is_filtered = True
+        self.update_listbox(self.filtered_list)
+        self.listbox.setCurrentRow(0)
+        
+        QMessageBox.information(self, "🧬 Ảnh trùng lặp",
+            f"Tìm thấy {len(groups)} nhóm ảnh trùng lặp ({copies} bản sao thừa, {wasted:.1f} MB).\n\n"
+            f"Các bản sao đang được hiển thị cạnh nhau trong danh sách.")
+    
+    EXPORT_FILTERS = (
+        ("CSV (*.csv)", 'csv'),
+        ("GeoJSON (*.geojson)", 'geojson'),
+        ("GPX (*.gpx)", 'gpx'),
+        ("KML - Google Earth (*.kml)", 'kml'),
+        ("JSON Lines (*.jsonl)", 'jsonl'),
+        ("Parquet (*.parquet)", 'parquet'),
+        ("Arrow (*.arrow)", 'arrow'),
+    )
+    
+    def export_metadata(self):
+        """Write the listed photos' metadata (filtered or all) to a file in the background"""
+        paths = self.filtered_list if self.is_filtered else self.image_list
+        if not paths:
+            QMessageBox.information(self, "Thông báo", "Chưa có ảnh nào")
+            return
+        if self.export_worker and self.export_worker.isRunning():
+            QMessageBox.information(self, "Thông báo", "Đang xuất dữ liệu, vui lòng đợi")
+            return
+        
+        filters = [(label, fmt) for label, fmt in self.EXPORT_FILTERS if fmt not in BINARY or ARROW.available]
+        last = self.settings.value("export/format", 'csv')
+        selected = next((label for label, fmt in filters if fmt == last), filters[0][0])
+        start = os.path.join(self.settings.value("export/dir", ""), f"geosnap.{last}")
+        path, chosen = QFileDialog.getSaveFileName(
+            self, "Xuất dữ liệu ảnh", start, ";;".join(label for label, _ in filters), selected)
+        if not path:
+            return
+        fmt = dict(filters).get(chosen, 'csv')
+        ext = os.path.splitext(path)[1].lower()
+        if not ext:
+            path += '.' + fmt
+        try:
+            # A known extension typed by hand wins over the chosen filter
+            fmt = format_of(path, None if ext in EXTENSIONS else fmt)
+        except ValueError as e:
+            QMessageBox.warning(self, "Lỗi", str(e))
+            return
+        
+        pending = len(self.meta.unloaded(paths))
+        if pending and QMessageBox.question(
+                self, "Xuất dữ liệu",
+                f"{pending} ảnh chưa đọc xong metadata và sẽ được xuất thiếu thông tin.\n\nVẫn xuất?"
+        ) != QMessageBox.StandardButton.Yes:
+            return
+        
+        self.settings.setValue("export/dir", os.path.dirname(path))
+        self.settings.setValue("export/format", fmt)
+        # The worker reads a copy: the library table keeps growing meanwhile
+        snapshot = self.meta.take(self.meta.rows(paths))
+        self.status_right.setText(f"💾 Đang xuất {len(paths)} ảnh...")
+        self.export_worker = ExportWorker(snapshot, path, fmt)
+        self.export_worker.progress.connect(
+            lambda done, total: self.status_right.setText(f"💾 Đang xuất: {done}/{total}"))
+        self.export_worker.done.connect(self.on_export_done)
+        self.export_worker.failed.connect(self.on_export_failed)
+        self.export_worker.start()
+    
+    def on_export_done(self, path, count):
+        name = os.path.basename(path)
+        if self.export_worker and self.export_worker.fmt in GEOGRAPHIC:
+            self.status_right.setText(f"💾 Đã xuất {count} ảnh có GPS → {name}")
+        else:
+            self.status_right.setText(f"💾 Đã xuất {count} ảnh → {name}")
+    
+    def on_export_failed(self, error):
+        self.status_right.setText("❌ Xuất dữ liệu thất bại")
+        QMessageBox.warning(self, "Lỗi", f"Không xuất được dữ liệu:\n{error}")
+    
+    def open_geotag_dialog(self):
+        """Match the listed photos without GPS against a GPS log"""
+        paths = self.filtered_list if self.is_filtered else self.image_list
+        if not paths:
+            QMessageBox.information(self, "Thông báo", "Chưa có ảnh nào")
+            return
+        if self.meta.unloaded(paths):
+            QMessageBox.information(self, "Thông báo", "Đang đọc metadata của ảnh, vui lòng thử lại sau ít phút")
+            return
+        if self.geotag_writer and self.geotag_writer.isRunning():
+            QMessageBox.information(self, "Thông báo", "Đang ghi GPS vào ảnh, vui lòng đợi")
+            return
+        paths = self.meta.select(paths, mask_not(self.meta.mask_has_gps()))
+        if not paths:
+            QMessageBox.information(self, "Thông báo", "Tất cả ảnh trong danh sách đã có GPS")
+            return
+        GeotagDialog(self, paths).exec()
+    
+    def start_geotag_write(self, edits, dry_run=False):
+        if self.geotag_writer and self.geotag_writer.isRunning():
+            return False
+        self.status_right.setText(f"🛰️ Đang ghi GPS vào {len(edits)} ảnh...")
+        self.geotag_writer = GeotagWriter(edits, dry_run)
+        self.geotag_writer.progress.connect(
+            lambda done, total: self.status_right.setText(f"🛰️ Ghi GPS: {done}/{total}"))
+        self.geotag_writer.batch.connect(self.on_geotag_batch)
+        self.geotag_writer.done.connect(self.on_geotag_done)
+        self.geotag_writer.start()
+        return True
+    
+    @trace.traced('on_geotag_batch')
+    def on_geotag_batch(self, written):
+        """Take the re-read metadata of written files (the index is updated by the job)"""
+        meta = self.meta
+        current = self.image_list[self.current_index] if self.current_index >= 0 else None
+        for path, rec, st in written:
+            row = meta.row_of.get(path)
+            if row is None:
+                continue
+            meta.set_stat(row, st)
+            meta.set(row, rec)
+            meta.loaded[row] |= HAS_EXIF
+            # The pixels did not change: keep the decoded image and its hashes
+            self.library.forget(path)
+            self.places.pop(path, None)
+        self.schedule_facet_refresh()
+        if any(path == current for path, _, _ in written):
+            self.update_file_info(current)
+    
+    def on_geotag_done(self, counts):
+        if self.geotag_writer.dry_run:
+            mb = counts['bytes'] / 1e6
+            QMessageBox.information(self, "Chạy thử",
+                                    f"Có thể ghi GPS vào {counts['written']} ảnh ({mb:.1f} MB), "
+                                    f"{counts['failed']} ảnh bị lỗi.\nKhông file nào bị sửa.")
+            self.status_right.setText("🧪 Đã chạy thử gắn GPS")
+            return
+        self.status_right.setText(f"🛰️ Đã gắn GPS cho {counts['written']} ảnh")
+        if counts['failed']:
+            QMessageBox.warning(self, "Lỗi", f"Không ghi được GPS vào {counts['failed']} ảnh (xem log)")
+    
+    def ensure_hashes(self, then):
+        """Run then() once every photo has perceptual hashes"""
+        pending = [p for p in self.image_list if p not in self.phashes]
+        if not pending:
+            then()
+            return
+        self.after_hashing = then
+        if self.similarity_indexer and self.similarity_indexer.isRunning():
+            return
+        self.status_right.setText("🔎 Đang phân tích ảnh...")
+        self.similarity_indexer = SimilarityIndexer(pending)
+        self.similarity_indexer.progress.connect(
+            lambda done, total: self.status_right.setText(f"🔎 Phân tích ảnh: {done}/{total}"))
+        self.similarity_indexer.done.connect(self.on_hashes_ready)
+        self.similarity_indexer.start()
+    
+    def on_hashes_ready(self, hashes):
+        for path, h in hashes.items():
+            if path in self.meta and path not in self.phashes:
+                self.phashes[path] = h
+                self.bk_tree.add(h[2], path)
+        self.status_right.setText("")
+        then, self.after_hashing = self.after_hashing, None
+        if then:
+            then()
+    
+    def find_similar(self):
+        """List photos whose pHash is within SIMILAR_RADIUS of the current one"""
+        if self.current_index < 0:
+            QMessageBox.information(self, "Thông báo", "Chưa chọn ảnh nào")
+            return
+        path = self.image_list[self.current_index]
+        self.ensure_hashes(lambda: self.show_similar(path))
+    
+    def show_similar(self, path):
+        hashes = self.phashes.get(path)
+        if hashes is None or path not in self.meta:
+            QMessageBox.warning(self, "Lỗi", f"Không thể phân tích ảnh:\n{Path(path).name}")
+            return
+        hits = [p for _, p in self.bk_tree.query(hashes[2], SIMILAR_RADIUS) if p in self.meta]
+        if len(hits) < 2:
+            QMessageBox.information(self, "Thông báo", "Không tìm thấy ảnh tương tự")
+            return
+        
+        self.highlight_filter(None)
+        self.clear_facet_selection()
+        
+        # Nearest first, the photo itself on top
+        self.filtered_list = [path] + [p for p in hits if p != path]
+        self.is_filtered = True
+        self.update_listbox(self.filtered_list)
+        if path in self.display_list:
+            self.listbox.setCurrentRow(self.display_list.index(path))
+        self.status_right.setText(f"🔎 {len(hits) - 1} ảnh tương tự")
+    
+    def toggle_bursts(self, checked):
+        if checked:
+            self.ensure_hashes(self.apply_bursts)
+        else:
+            self.burst_hidden = set()
+            self.burst_sizes = {}
+            self.refresh_after_library_change(
+                self.image_list[self.current_index] if self.current_index >= 0 else None)
+    
+    def apply_bursts(self):
+        """Fold each burst of near-identical shots under its first frame"""
+        if not self.burst_action.isChecked():
+            return
+        if self.meta.unloaded(self.image_list, HAS_STAT):
+            self.after_stats(self.image_list, self.apply_bursts)
+            return
+        if self.meta.unloaded(self.image_list):
+            self.after_metadata(self.image_list, self.apply_bursts)
+            return
+        date = self.sorter.key('date')
+        row_of = self.meta.row_of
+        shots = [(p, int(date[row_of[p]]), self.phashes[p][2])
+                 for p in self.image_list if p in self.phashes]
+        bursts = find_bursts(shots)
+        self.burst_sizes = {burst[0]: len(burst) for burst in bursts}
+        self.burst_hidden = {p for burst in bursts for p in burst[1:]}
+        
+        current = self.image_list[self.current_index] if self.current_index >= 0 else None
+        self.refresh_after_library_change(current)
+        folded = len(self.burst_hidden)
+        self.status_right.setText(f"🎞️ {len(bursts)} loạt ảnh, ẩn {folded} khung hình")
+    
+    def filter_by_place(self):
+        """Filter by country / region / city resolved by the place indexer"""
+        if not self.image_list:
+            QMessageBox.information(self, "Thông báo", "Chưa có ảnh nào")
+            return
+        
+        if not self.places:
+            if not (self.place_indexer and self.place_indexer.isRunning()):
+                self.start_place_indexing()
+            QMessageBox.information(self, "Thông báo",
+                "Đang lập chỉ mục địa điểm trong nền.\nVui lòng thử lại sau ít phút.")
+            return
+        
+        counts = place_counts({p: self.places[p] for p in self.image_list if p in self.places})
+        keys = sorted(counts)
+        labels = [f"{'    ' * (len(k) - 1)}{k[-1]} ({counts[k]})" for k in keys]
+        
+        label, ok = QInputDialog.getItem(
+            self, "Lọc theo địa điểm", "Chọn địa điểm:", labels, 0, False
+        )
+        if not (ok and label):
+            return
+        key = keys[labels.index(label)]
+        
+        self.highlight_filter(self.place_btn)
+        self.clear_facet_selection()
+        
+        self.filtered_list = [
+            p for p in self.image_list
+            if p in self.places and
+            tuple(self.places[p][level] or '?' for level in PLACE_LEVELS[:len(key)]) == key
+        ]
+        self.is_filtered = True
+        self.update_listbox(self.filtered_list)
+        
+        if self.filtered_list:
+            self.listbox.setCurrentRow(0)
+    
     def on_select(self, row):
         if 0 <= row < len(self.display_list):
             path = self.display_list[row]
             if path in self.image_list:
                 self.display_image(self.image_list.index(path))
     
+    @trace.traced('display_image')
     def display_image(self, index):
         if not (0 <= index < len(self.image_list)):
             return
@@ -1996,17 +3649,21 @@ QMessageBox QPushButton {
         self.current_index = index
         path = self.image_list[index]
 
-        if not os.path.exists(path):
-            QMessageBox.warning(self, "Lỗi", 
-                f"File không tồn tại hoặc đã bị xóa:\n{Path(path).name}")
-            self.image_list.remove(path)
-            self.update_listbox(self.display_list)
-            return
-        
         if not self.image_viewer.load_image(path):
-            QMessageBox.warning(self, "Lỗi", f"Không thể tải ảnh:\n{Path(path).name}")
+            # Only a failed load is worth a stat to tell "gone" from "unreadable"
+            if not os.path.exists(path):
+                QMessageBox.warning(self, "Lỗi", 
+                    f"File không tồn tại hoặc đã bị xóa:\n{Path(path).name}")
+                self.meta.remove(path)
+                self.forget_path(path)
+                self.image_list.remove(path)
+                self.filtered_list = [p for p in self.filtered_list if p != path]
+                self.update_listbox([p for p in self.display_list if p != path])
+            else:
+                QMessageBox.warning(self, "Lỗi", f"Không thể tải ảnh:\n{Path(path).name}")
             return
         
+        self.watch_file(path)
         self.update_file_info(path)
         
         gps = self.get_gps_data(path)
@@ -2025,26 +3682,41 @@ QMessageBox QPushButton {
         
         self.update_nav()
         self.update_zoom_label()
+        if trace.enabled:
+            QTimer.singleShot(0, self.update_trace_overlay)
     
+    @trace.traced('update_file_info')
     def update_file_info(self, path):
         try:
-            stat = os.stat(path)
+            row = self.meta.row_of.get(path)
+            if row is None or self.meta.loaded[row] & MISSING:
+                raise FileNotFoundError(path)
             self.file_labels['file_name'].setText(Path(path).name)
-            self.file_labels['file_size'].setText(self.format_size(stat.st_size))
             self.file_labels['file_format'].setText(Path(path).suffix.upper().replace('.', ''))
             
             try:
-                img = Image.open(path)
-                self.file_labels['image_dimensions'].setText(f"{img.width} × {img.height} px")
-                img.close()
+                with trace.span('read_dimensions'):
+                    img = Image.open(path)
+                    self.file_labels['image_dimensions'].setText(f"{img.width} × {img.height} px")
+                    img.close()
             except:
                 self.file_labels['image_dimensions'].setText("--")
             
+            if not self.meta.loaded[row] & HAS_STAT:
+                # Not scanned yet: on_stat_batch fills these in
+                for key in ('file_size', 'file_created', 'file_modified'):
+                    self.file_labels[key].setText("⏳")
+                self.request_stats([path])
+                return
+            size = self.meta.cols['size'][row]
+            ctime = self.meta.cols['ctime'][row]
+            mtime = self.meta.cols['mtime'][row]
+            self.file_labels['file_size'].setText(self.format_size(size))
             self.file_labels['file_created'].setText(
-                datetime.fromtimestamp(stat.st_ctime).strftime('%d/%m/%Y %H:%M')
+                datetime.fromtimestamp(ctime).strftime('%d/%m/%Y %H:%M')
             )
             self.file_labels['file_modified'].setText(
-                datetime.fromtimestamp(stat.st_mtime).strftime('%d/%m/%Y %H:%M')
+                datetime.fromtimestamp(mtime).strftime('%d/%m/%Y %H:%M')
             )
         except Exception as e:
             print(f"Error: {e}")
@@ -2057,60 +3729,11 @@ QMessageBox QPushButton {
         return f"{size:.1f} TB"
     
     def get_exif(self, path):
-        cached = self.exif_cache.get(path)
-        if cached is not None:
-            return cached
-        
-        try:
-            if EXIFREAD_AVAILABLE:
-                with open(path, 'rb') as f:
-                    tags = exifread.process_file(f, details=False)
-                self.exif_cache.set(path, tags)
-                return tags
-        except Exception as e:
-            print(f"EXIF read error for {Path(path).name}: {e}")
-        
-        self.exif_cache.set(path, {})
-        return {}
+        return self.library.exif(path)
     
+    @trace.traced('get_gps_data')
     def get_gps_data(self, path):
-        cached = self.gps_cache.get(path)
-        if cached is not None:
-            return cached
-        
-        tags = self.get_exif(path)
-        
-        if 'GPS GPSLatitude' in tags and 'GPS GPSLongitude' in tags:
-            try:
-                def to_deg(val):
-                    d = float(val.values[0].num) / float(val.values[0].den)
-                    m = float(val.values[1].num) / float(val.values[1].den)
-                    s = float(val.values[2].num) / float(val.values[2].den)
-                    return d + m/60 + s/3600
-                
-                lat = to_deg(tags['GPS GPSLatitude'])
-                if str(tags.get('GPS GPSLatitudeRef', '')) == 'S':
-                    lat = -lat
-                
-                lon = to_deg(tags['GPS GPSLongitude'])
-                if str(tags.get('GPS GPSLongitudeRef', '')) == 'W':
-                    lon = -lon
-                
-                alt = 'N/A'
-                if 'GPS GPSAltitude' in tags:
-                    v = tags['GPS GPSAltitude'].values[0]
-                    alt = f"{float(v.num)/float(v.den):.1f} m"
-                
-                dt = str(tags.get('EXIF DateTimeOriginal', 'N/A'))
-                
-                data = {'lat': lat, 'lon': lon, 'alt': alt, 'time': dt}
-                self.gps_cache[path] = data
-                return data
-            except Exception as e:
-                print(f"GPS parsing error for {Path(path).name}: {e}")
-                
-        self.gps_cache[path] = None
-        return None
+        return self.library.gps(path)
     
     def display_gps(self, gps):
         self.gps_labels['lat'].setText(f"{gps['lat']:.6f}°")
@@ -2124,6 +3747,7 @@ QMessageBox QPushButton {
         self.google_btn.setEnabled(False)
         self.html_btn.setEnabled(False)
     
+    @trace.traced('display_camera_info')
     def display_camera_info(self, path):
         tags = self.get_exif(path)
         
@@ -2174,6 +3798,37 @@ QMessageBox QPushButton {
         else:
             self.camera_labels['focal_length'].setText("--")
     
+    @trace.traced('load_address_async')
+    def load_address_async(self, lat, lon):
+        try:
+            geocoder = self.get_geocoder()
+        except GeocoderError as e:
+            self.addr_label.setText(str(e))
+            return
+        
+        key = (geocoder.name, round(lat, 5), round(lon, 5))
+        cached = self.address_cache.get(key)
+        if cached is not None:
+            # A recent failure is shown again rather than retried at once
+            self.addr_label.setText(cached.error if isinstance(cached, Failed) else cached)
+            return
+        
+        self.addr_label.setText("🔄 Đang tải địa chỉ...")
+        
+        # Keep a reference to stopped loaders until their request returns
+        self.stale_loaders = [t for t in self.stale_loaders if t.isRunning()]
+        if self.address_loader and self.address_loader.isRunning():
+            self.address_loader.stop()
+            self.stale_loaders.append(self.address_loader)
+        
+        self.address_loader = AddressLoader(lat, lon, geocoder)
+        self.address_loader.result.connect(lambda text, key=key: self.on_address(key, text))
+        self.address_loader.start()
+    
+    def on_address(self, key, text):
+        self.address_cache[key] = Failed(text) if text.startswith("❌") else text
+        self.addr_label.setText(text)
+    
     def open_google_maps(self):
         if self.current_gps:
             webbrowser.open(
@@ -2216,16 +3871,17 @@ QMessageBox QPushButton {
                 fillOpacity=0.2
             ).add_to(m)
             
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.html', mode='w', encoding='utf-8')
-            m.save(temp_file.name)
-            temp_file.close()
-            
-            self.temp_files.append(temp_file.name)
-            webbrowser.open('file://' + os.path.abspath(temp_file.name))
+            self.open_map(m)
             
         except Exception as e:
             QMessageBox.warning(self, "Lỗi", f"Không thể tạo bản đồ:\n{str(e)}")
 
+    def open_map(self, m):
+        """Show a folium map in the browser (the temp file is removed on exit)"""
+        path = save_map(m)
+        self.temp_files.append(path)
+        webbrowser.open('file://' + path)
+
     def show_all_on_map(self):
         if not FOLIUM_AVAILABLE:
             QMessageBox.warning(self, "Lỗi", "Cần cài folium:\npip install folium")
@@ -2234,80 +3890,17 @@ QMessageBox QPushButton {
         if not self.image_list:
             QMessageBox.information(self, "Thông báo", "Chưa có ảnh nào")
             return
-        
-        gps_images = []
-        for p in self.image_list:
-            gps = self.get_gps_data(p)
-            if gps:
-                gps_images.append((p, gps))
-        
-        if not gps_images:
-            QMessageBox.information(self, "Thông báo", "Không có ảnh nào có GPS")
+        if self.meta.unloaded(self.image_list):
+            self.after_metadata(self.image_list, self.show_all_on_map)
             return
         
         try:
-            lats = [g['lat'] for _, g in gps_images]
-            lons = [g['lon'] for _, g in gps_images]
-            center_lat = sum(lats) / len(lats)
-            center_lon = sum(lons) / len(lons)
-            
-            m = folium.Map(location=[center_lat, center_lon], zoom_start=12)
-            
-            for i, (path, gps) in enumerate(gps_images, 1):
-                popup_html = f"""
-                <div style='font-family: Segoe UI; width: 250px; padding: 10px;'>
-                    <h4 style='margin: 0 0 8px 0; color: #0067C0;'>#{i} - {Path(path).name[:30]}</h4>
-                    <p style='margin: 4px 0;'><b>Tọa độ:</b> {gps['lat']:.6f}, {gps['lon']:.6f}</p>
-                    <p style='margin: 4px 0;'><b>Độ cao:</b> {gps['alt']}</p>
-                    <p style='margin: 4px 0;'><b>Thời gian:</b> {gps['time'][:19]}</p>
-                </div>
-                """
-                
-                color = 'red' if i == 1 else ('green' if i == len(gps_images) else 'blue')
-                
-                folium.Marker(
-                    [gps['lat'], gps['lon']],
-                    popup=folium.Popup(popup_html, max_width=280),
-                    tooltip=f"#{i} - {Path(path).name[:28]}",
-                    icon=folium.Icon(color=color, icon='camera', prefix='fa')
-                ).add_to(m)
-            
-            if len(gps_images) > 1:
-                coordinates = [[g['lat'], g['lon']] for _, g in gps_images]
-                folium.PolyLine(
-                    coordinates,
-                    color='#0067C0',
-                    weight=3,
-                    opacity=0.7,
-                    popup=f"Tuyến đường: {len(gps_images)} ảnh"
-                ).add_to(m)
-            
-            legend_html = f"""
-            <div style="position: fixed; bottom: 50px; left: 50px; width: 240px;
-                        background: linear-gradient(135deg, white 0%, #f8f9fa 100%);
-                        border: 3px solid #0067C0; z-index: 9999;
-                        border-radius: 12px; padding: 20px; font-family: 'Segoe UI';
-                        box-shadow: 0 8px 24px rgba(0,103,192,0.3);">
-                <h3 style="margin: 0 0 14px 0; color: #0067C0; font-size: 18px; font-weight: 600;">
-                    📍 GeoSnap Map
-                </h3>
-                <p style="margin: 8px 0; font-size: 11pt; color: #333;">🔴 Ảnh đầu tiên</p>
-                <p style="margin: 8px 0; font-size: 11pt; color: #333;">🔵 Ảnh ở giữa</p>
-                <p style="margin: 8px 0; font-size: 11pt; color: #333;">🟢 Ảnh cuối cùng</p>
-                <hr style="margin: 14px 0; border: 1px solid #e0e0e0;">
-                <p style="margin: 8px 0; font-weight: 600; font-size: 12pt; color: #0067C0;">
-                    📊 Tổng: {len(gps_images)} ảnh
-                </p>
-            </div>
-            """
-            m.get_root().html.add_child(folium.Element(legend_html))
-            
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.html', mode='w', encoding='utf-8')
-            m.save(temp_file.name)
-            temp_file.close()
+            m = self.library.route_map(self.image_list)
+            if m is None:
+                QMessageBox.information(self, "Thông báo", "Không có ảnh nào có GPS")
+                return
             
-            self.temp_files.append(temp_file.name)
-            webbrowser.open('file://' + os.path.abspath(temp_file.name))
+            self.open_map(m)
             
             # Removed success message dialog
             
@@ -2377,6 +3970,36 @@ QMessageBox QPushButton {
             self.display_list.clear()
             self.gps_cache.clear()
             self.exif_cache.clear()
+            self.image_viewer.pixmap_cache.clear()
+            if self.metadata_indexer and self.metadata_indexer.isRunning():
+                self.metadata_indexer.stop()
+            if self.stat_loader and self.stat_loader.isRunning():
+                self.stat_loader.stop()
+            self.stat_waiters = []
+            self.metadata_waiters = []
+            self.unplaced = set()
+            self.folder_watcher.stop()
+            self.stale_loaders.append(self.folder_watcher)
+            self.start_folder_watcher()
+            self.restoring_roots = set()
+            self.set_metadata_table(MetadataTable())
+            self.facet_selection = {}
+            self.facet_tree.clear()
+            self.places.clear()
+            self.places_pending = False
+            if self.place_indexer and self.place_indexer.isRunning():
+                self.place_indexer.stop()
+            if self.duplicate_finder and self.duplicate_finder.isRunning():
+                self.duplicate_finder.stop()
+            self.duplicate_groups = []
+            if self.similarity_indexer and self.similarity_indexer.isRunning():
+                self.similarity_indexer.stop()
+            self.phashes = {}
+            self.bk_tree = BKTree()
+            self.after_hashing = None
+            self.burst_hidden = set()
+            self.burst_sizes = {}
+            self.burst_action.setChecked(False)
             self.current_index = -1
             self.current_gps = None
             self.is_filtered = False
@@ -2397,10 +4020,130 @@ QMessageBox QPushButton {
             self.update_list_status()
             self.update_nav()
     
+    # The engine's state, under the names the window has always used
+    meta = property(lambda self: self.library.meta)
+    query_engine = property(lambda self: self.library.query_engine)
+    sorter = property(lambda self: self.library.sorter)
+    facets = property(lambda self: self.library.facets)
+    gps_cache = property(lambda self: self.library.gps_cache)
+    exif_cache = property(lambda self: self.library.exif_cache)
+    
+    def set_metadata_table(self, meta):
+        """Swap in a new metadata table and the indexes built on it"""
+        self.library.set_table(meta)
+    
+    def session_state(self):
+        """GUI state saved with the library snapshot"""
+        buttons = {self.gps_btn: 'gps', self.no_gps_btn: 'no_gps',
+                   self.camera_btn: 'camera', self.place_btn: 'place'}
+        return {
+            'sort': self.sort_combo.currentData(),
+            'current': self.current_index,
+            'filter': buttons.get(self.active_filter_btn),
+            'facets': {f: sorted(v) for f, v in self.facet_selection.items() if v},
+            'search': self.search_box.text(),
+            'roots': self.watched_roots,
+            'bursts': self.burst_action.isChecked(),
+        }
+    
+    def save_last_session(self):
+        path = default_session_path()
+        try:
+            if self.image_list and self.session_action.isChecked():
+                with trace.span('save_session', rows=len(self.image_list)):
+                    save_session(path, self.meta, self.image_list, self.session_state(),
+                                 self.filtered_list if self.is_filtered else None)
+            elif os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            print(f"Session save error: {e}")
+    
+    @trace.traced('restore_session')
+    def restore_last_session(self):
+        """Show the library of the last run at once, then check it against the disk"""
+        path = default_session_path()
+        if self.image_list or not os.path.exists(path):
+            return
+        try:
+            meta, library, state, filtered = load_session(path)
+        except (OSError, SessionError) as e:
+            print(f"Session restore error: {e}")
+            return
+        
+        self.set_metadata_table(meta)
+        self.image_list = library
+        self.sort_combo.blockSignals(True)
+        index = self.sort_combo.findData(state.get('sort'))
+        if index >= 0:
+            self.sort_combo.setCurrentIndex(index)
+        self.sort_combo.blockSignals(False)
+        
+        # Filters as they were: the filtered rows, the lit button, facets, search text
+        buttons = {'gps': self.gps_btn, 'no_gps': self.no_gps_btn,
+                   'camera': self.camera_btn, 'place': self.place_btn}
+        self.highlight_filter(buttons.get(state.get('filter')))
+        self.facet_selection = {f: set(v) for f, v in state.get('facets', {}).items()}
+        self.is_filtered = filtered is not None
+        self.filtered_list = filtered or []
+        self.search_box.blockSignals(True)
+        self.search_box.setText(state.get('search', ''))
+        self.search_box.blockSignals(False)
+        
+        self.listbox.blockSignals(True)
+        if self.search_box.text().strip():
+            self.on_search_change()
+        else:
+            self.update_listbox(self.filtered_list if self.is_filtered else self.image_list)
+        current = state.get('current', -1)
+        if 0 <= current < len(library) and os.path.exists(library[current]):
+            if library[current] in self.display_list:
+                self.listbox.setCurrentRow(self.display_list.index(library[current]))
+            self.listbox.blockSignals(False)
+            self.display_image(current)
+        else:
+            self.listbox.blockSignals(False)
+            self.update_nav()
+        self.schedule_facet_refresh()
+        self.status_right.setText(f"🔁 Đã mở lại {len(library)} ảnh của phiên trước")
+        
+        # Revalidate in the background: watched folders are rescanned and
+        # diffed (on_folder_scanned), loose files re-stat'ed (on_stat_batch)
+        roots = {os.path.normpath(r): bool(polled) for r, polled in state.get('roots', {}).items()}
+        for root, polled in roots.items():
+            if root not in self.watched_roots:
+                self.watched_roots[root] = polled
+                self.restoring_roots.add(root)
+                self.folder_watcher.add_root(root, poll=polled)
+        prefixes = tuple(root.rstrip(os.sep) + os.sep for root in roots)
+        self.start_stat_loading([p for p in library if not p.startswith(prefixes)])
+        self.start_metadata_indexing()
+        self.start_name_indexing()
+        if state.get('bursts'):
+            self.burst_action.setChecked(True)
+            self.toggle_bursts(True)
+        if self.settings.value("geocoder/backend", "nominatim") == "offline":
+            self.start_place_indexing()
+    
     def closeEvent(self, event):
+            self.save_last_session()
+            
             if self.address_loader and self.address_loader.isRunning():
                 self.address_loader.stop()
                 self.address_loader.wait(2000)
+            for loader in self.stale_loaders:
+                loader.wait(2000)
+            if self.place_indexer and self.place_indexer.isRunning():
+                self.place_indexer.stop()
+                self.place_indexer.wait(2000)
+            for worker in (self.metadata_indexer, self.stat_loader, self.folder_watcher,
+                           self.duplicate_finder, self.similarity_indexer, self.export_worker,
+                           self.geotag_writer):
+                if worker and worker.isRunning():
+                    worker.stop()
+                    worker.wait(2000)
+            if self.name_indexer:
+                self.name_indexer.wait(2000)
+            self.close_geocoder()
             
             for temp_file in self.temp_files:
                 try:
@@ -2446,28 +4189,7 @@ def main():
     app.setStyle('Fusion')
     
     # Set Light Palette globally
-    light_palette = QPalette()
-    light_palette.setColor(QPalette.ColorRole.Window, QColor(243, 243, 243))
-    light_palette.setColor(QPalette.ColorRole.WindowText, QColor(26, 26, 26))
-    light_palette.setColor(QPalette.ColorRole.Base, QColor(255, 255, 255))
-    light_palette.setColor(QPalette.ColorRole.AlternateBase, QColor(245, 245, 245))
-    light_palette.setColor(QPalette.ColorRole.ToolTipBase, QColor(255, 255, 255))
-    light_palette.setColor(QPalette.ColorRole.ToolTipText, QColor(26, 26, 26))
-    light_palette.setColor(QPalette.ColorRole.Text, QColor(26, 26, 26))
-    light_palette.setColor(QPalette.ColorRole.Button, QColor(243, 243, 243))
-    light_palette.setColor(QPalette.ColorRole.ButtonText, QColor(26, 26, 26))
-    light_palette.setColor(QPalette.ColorRole.BrightText, QColor(255, 255, 255))
-    light_palette.setColor(QPalette.ColorRole.Link, QColor(0, 103, 192))
-    light_palette.setColor(QPalette.ColorRole.Highlight, QColor(0, 103, 192))
-    light_palette.setColor(QPalette.ColorRole.HighlightedText, QColor(255, 255, 255))
-    
-    # Disabled colors
-    light_palette.setColor(QPalette.ColorGroup.Disabled, QPalette.ColorRole.WindowText, QColor(148, 148, 148))
-    light_palette.setColor(QPalette.ColorGroup.Disabled, QPalette.ColorRole.Text, QColor(148, 148, 148))
-    light_palette.setColor(QPalette.ColorGroup.Disabled, QPalette.ColorRole.ButtonText, QColor(148, 148, 148))
-    light_palette.setColor(QPalette.ColorGroup.Disabled, QPalette.ColorRole.Base, QColor(235, 235, 235))
-    
-    app.setPalette(light_palette)
+    app.setPalette(theme_palette(False))
     
     # Set modern font
     font = QFont("Segoe UI Variable", 9)
@@ -2497,13 +4219,11 @@ def main():
     
     # Create and show window
     window = GeoSnap()
-    
-    # Force light theme to apply before showing
-    window.apply_theme()
-    QApplication.processEvents()
-    
     window.show()
     
+    # Import the heavy optional modules in the background once the window is up
+    QTimer.singleShot(500, warm)
+    
     sys.exit(app.exec())
 
 
@@ -9,35 +9,23 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QH
                               QMessageBox, QLineEdit, QRadioButton, QButtonGroup, QScrollArea,
                               QGroupBox, QGridLayout, QSizePolicy, QGraphicsDropShadowEffect, 
                               QComboBox)
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QPoint, QPropertyAnimation, QEasingCurve, QSize
+from PyQt6.QtCore import Qt, QThread, pyqtSignal, QPoint, QPropertyAnimation, QEasingCurve, QSize, QTimer
 from PyQt6.QtGui import QPixmap, QImage, QTransform, QFont, QPainter, QColor, QPalette, QIcon, QAction
 
+from geosnap.lazy import EXIFREAD, HEIF, FOLIUM, GEOPY, ensure_opener, warm
+from geosnap.cache import Cache, Failed
+from geosnap.core import Library, save_map
+
 # Import libraries
-try:
-    import exifread
-    EXIFREAD_AVAILABLE = True
-except ImportError:
-    EXIFREAD_AVAILABLE = False
-
-try:
-    from PIL import Image, ImageOps
-    from pillow_heif import register_heif_opener
-    register_heif_opener()
-    HEIC_SUPPORTED = True
-except ImportError:
-    HEIC_SUPPORTED = False
-
-try:
-    import folium
-    FOLIUM_AVAILABLE = True
-except ImportError:
-    FOLIUM_AVAILABLE = False
-
-try:
-    from geopy.geocoders import Nominatim
-    GEOPY_AVAILABLE = True
-except ImportError:
-    GEOPY_AVAILABLE = False
+from PIL import Image, ImageOps
+
+# Optional modules are only probed here; each is imported on first use
+exifread = EXIFREAD
+folium = FOLIUM
+EXIFREAD_AVAILABLE = EXIFREAD.available
+HEIC_SUPPORTED = HEIF.available
+FOLIUM_AVAILABLE = FOLIUM.available
+GEOPY_AVAILABLE = GEOPY.available
 
 
 # Windows 11 Fluent Design System QSS
@@ -450,7 +438,7 @@ class AddressLoader(QThread):
             self.result.emit("⚠️ Chưa cài thư viện geopy")
             return
         try:
-            geo = Nominatim(user_agent="geosnap_v2", timeout=10)
+            geo = GEOPY.Nominatim(user_agent="geosnap_v2", timeout=10)
             loc = geo.reverse(f"{self.lat}, {self.lon}", language='vi')
             self.result.emit(loc.address if loc else "❌ Không tìm thấy địa chỉ")
         except Exception as e:
@@ -505,6 +493,7 @@ class ImageViewer(QLabel):
     
     def load_image(self, path):
         try:
+            ensure_opener(path)
             img = Image.open(path)
             img = ImageOps.exif_transpose(img)
             
@@ -682,10 +671,10 @@ class GeoSnap(QMainWindow):
         self.filtered_list = []
         self.current_index = -1
         self.is_filtered = False
-        self.gps_cache = {}
-        self.exif_cache = {}
+        self.library = Library()  # metadata, caches, sort/filter engine
         self.current_gps = None
         self.address_loader = None
+        self.address_cache = Cache(max_size=2000)  # (lat, lon) -> address, Failed(message)
         
         # Filter button tracking
         self.active_filter_btn = None
@@ -1708,12 +1697,15 @@ QMessageBox QPushButton {
     
     def load_images(self, paths):
         added = 0
+        known = set(self.image_list)
         for p in paths:
-            if p not in self.image_list:
+            if p not in known:
+                known.add(p)
                 self.image_list.append(p)
                 added += 1
         
         if added > 0:
+            self.library.add(self.image_list[-added:])
             self.sort_images()
             if self.current_index == -1 and self.image_list:
                 self.listbox.setCurrentRow(0)
@@ -1726,18 +1718,11 @@ QMessageBox QPushButton {
         current = self.image_list[self.current_index] if self.current_index >= 0 else None
         sort_value = self.sort_combo.currentData()
         
-        if sort_value == "name":
-            self.image_list.sort(key=lambda x: Path(x).name.lower())
-        elif sort_value in ["date_desc", "date_asc"]:
-            def get_date(p):
-                tags = self.get_exif(p)
-                return str(tags.get('EXIF DateTimeOriginal', os.path.getmtime(p)))
-            self.image_list.sort(key=get_date, reverse=(sort_value == "date_desc"))
-        elif sort_value == "size":
-            self.image_list.sort(key=lambda x: os.path.getsize(x), reverse=True)
+        self.image_list = self.library.sort(self.image_list, sort_value, self.show_progress)
         
         if self.is_filtered:
-            self.filtered_list = [p for p in self.image_list if p in self.filtered_list]
+            keep = set(self.filtered_list)
+            self.filtered_list = [p for p in self.image_list if p in keep]
             self.update_listbox(self.filtered_list)
         else:
             self.update_listbox(self.image_list)
@@ -1768,11 +1753,8 @@ QMessageBox QPushButton {
         self.list_status.setText("⏳ Đang lọc...")
         QApplication.processEvents()
         
-        self.filtered_list = []
-        for p in self.image_list:
-            gps = self.get_gps_data(p)
-            if (filter_type == 'has_gps' and gps) or (filter_type == 'no_gps' and not gps):
-                self.filtered_list.append(p)
+        self.filtered_list = self.library.filter_gps(self.image_list, filter_type == 'has_gps',
+                                                     self.show_progress)
         
         self.is_filtered = True
         self.update_listbox(self.filtered_list)
@@ -1831,11 +1813,8 @@ QMessageBox QPushButton {
         self.list_status.setText("⏳ Đang lọc...")
         QApplication.processEvents()
         
-        self.filtered_list = []
-        for p in self.image_list:
-            gps = self.get_gps_data(p)
-            if (filter_type == 'has_gps' and gps) or (filter_type == 'no_gps' and not gps):
-                self.filtered_list.append(p)
+        self.filtered_list = self.library.filter_gps(self.image_list, filter_type == 'has_gps',
+                                                     self.show_progress)
         
         self.is_filtered = True
         self.update_listbox(self.filtered_list)
@@ -1851,14 +1830,7 @@ QMessageBox QPushButton {
         self.list_status.setText("⏳ Đang quét...")
         QApplication.processEvents()
         
-        cameras = set()
-        for p in self.image_list:
-            tags = self.get_exif(p)
-            make = str(tags.get('Image Make', '')).strip()
-            model = str(tags.get('Image Model', '')).strip()
-            camera = f"{make} {model}".strip()
-            if camera:
-                cameras.add(camera)
+        cameras = self.library.cameras(self.image_list, self.show_progress)
         
         if not cameras:
             QMessageBox.information(self, "Thông báo", "Không tìm thấy thông tin camera")
@@ -1883,13 +1855,7 @@ QMessageBox QPushButton {
             self.camera_btn.setStyleSheet("")
             self.active_filter_btn = self.camera_btn
             
-            self.filtered_list = []
-            for p in self.image_list:
-                tags = self.get_exif(p)
-                make = str(tags.get('Image Make', '')).strip()
-                model = str(tags.get('Image Model', '')).strip()
-                if f"{make} {model}".strip() == camera:
-                    self.filtered_list.append(p)
+            self.filtered_list = self.library.filter_camera(self.image_list, camera)
             
             self.is_filtered = True
             self.update_listbox(self.filtered_list)
@@ -1980,59 +1946,16 @@ QMessageBox QPushButton {
             size /= 1024
         return f"{size:.1f} TB"
     
+    def show_progress(self, done, total):
+        """Progress callback for library calls that read EXIF"""
+        self.list_status.setText(f"⏳ Đang đọc EXIF {done}/{total} ảnh...")
+        QApplication.processEvents()
+    
     def get_exif(self, path):
-        if path in self.exif_cache:
-            return self.exif_cache[path]
-        
-        try:
-            if EXIFREAD_AVAILABLE:
-                with open(path, 'rb') as f:
-                    tags = exifread.process_file(f, details=False)
-                self.exif_cache[path] = tags
-                return tags
-        except:
-            pass
-        
-        self.exif_cache[path] = {}
-        return {}
+        return self.library.exif(path)
     
     def get_gps_data(self, path):
-        if path in self.gps_cache:
-            return self.gps_cache[path]
-        
-        tags = self.get_exif(path)
-        
-        if 'GPS GPSLatitude' in tags and 'GPS GPSLongitude' in tags:
-            try:
-                def to_deg(val):
-                    d = float(val.values[0].num) / float(val.values[0].den)
-                    m = float(val.values[1].num) / float(val.values[1].den)
-                    s = float(val.values[2].num) / float(val.values[2].den)
-                    return d + m/60 + s/3600
-                
-                lat = to_deg(tags['GPS GPSLatitude'])
-                if str(tags.get('GPS GPSLatitudeRef', '')) == 'S':
-                    lat = -lat
-                
-                lon = to_deg(tags['GPS GPSLongitude'])
-                if str(tags.get('GPS GPSLongitudeRef', '')) == 'W':
-                    lon = -lon
-                
-                alt = 'N/A'
-                if 'GPS GPSAltitude' in tags:
-                    v = tags['GPS GPSAltitude'].values[0]
-                    alt = f"{float(v.num)/float(v.den):.1f} m"
-                
-                dt = str(tags.get('EXIF DateTimeOriginal', 'N/A'))
-                
-                data = {'lat': lat, 'lon': lon, 'alt': alt, 'time': dt}
-                self.gps_cache[path] = data
-                return data
-            except Exception as e:
-                print(f"GPS error: {e}")
-        
-        self.gps_cache[path] = None
-        return None
+        return self.library.gps(path)
     
     def display_gps(self, gps):
         self.gps_labels['lat'].setText(f"{gps['lat']:.6f}°")
@@ -2097,15 +2020,25 @@ QMessageBox QPushButton {
             self.camera_labels['focal_length'].setText("--")
     
     def load_address_async(self, lat, lon):
+        key = (round(lat, 5), round(lon, 5))
+        cached = self.address_cache.get(key)
+        if cached is not None:
+            self.addr_label.setText(cached.error if isinstance(cached, Failed) else cached)
+            return
+        
         self.addr_label.setText("🔄 Đang tải địa chỉ...")
         
         if self.address_loader and self.address_loader.isRunning():
             self.address_loader.terminate()
         
         self.address_loader = AddressLoader(lat, lon)
-        self.address_loader.result.connect(self.addr_label.setText)
+        self.address_loader.result.connect(lambda text, key=key: self.on_address(key, text))
         self.address_loader.start()
     
+    def on_address(self, key, text):
+        self.address_cache[key] = Failed(text) if text.startswith("❌") else text
+        self.addr_label.setText(text)
+    
     def open_google_maps(self):
         if self.current_gps:
             webbrowser.open(
@@ -2166,80 +2099,14 @@ QMessageBox QPushButton {
             QMessageBox.information(self, "Thông báo", "Chưa có ảnh nào")
             return
         
-        gps_images = []
-        for p in self.image_list:
-            gps = self.get_gps_data(p)
-            if gps:
-                gps_images.append((p, gps))
-        
-        if not gps_images:
-            QMessageBox.information(self, "Thông báo", "Không có ảnh nào có GPS")
-            return
-        
         try:
-            lats = [g['lat'] for _, g in gps_images]
-            lons = [g['lon'] for _, g in gps_images]
-            center_lat = sum(lats) / len(lats)
-            center_lon = sum(lons) / len(lons)
-            
-            m = folium.Map(location=[center_lat, center_lon], zoom_start=12)
-            
-            for i, (path, gps) in enumerate(gps_images, 1):
-                popup_html = f"""
-                <div style='font-family: Segoe UI; width: 250px; padding: 10px;'>
-                    <h4 style='margin: 0 0 8px 0; color: #0067C0;'>#{i} - {Path(path).name[:30]}</h4>
-                    <p style='margin: 4px 0;'><b>Tọa độ:</b> {gps['lat']:.6f}, {gps['lon']:.6f}</p>
-                    <p style='margin: 4px 0;'><b>Độ cao:</b> {gps['alt']}</p>
-                    <p style='margin: 4px 0;'><b>Thời gian:</b> {gps['time'][:19]}</p>
-                </div>
-                """
-                
-                color = 'red' if i == 1 else ('green' if i == len(gps_images) else 'blue')
-                
-                folium.Marker(
-                    [gps['lat'], gps['lon']],
-                    popup=folium.Popup(popup_html, max_width=280),
-                    tooltip=f"#{i} - {Path(path).name[:28]}",
-                    icon=folium.Icon(color=color, icon='camera', prefix='fa')
-                ).add_to(m)
-            
-            if len(gps_images) > 1:
-                coordinates = [[g['lat'], g['lon']] for _, g in gps_images]
-                folium.PolyLine(
-                    coordinates,
-                    color='#0067C0',
-                    weight=3,
-                    opacity=0.7,
-                    popup=f"Tuyến đường: {len(gps_images)} ảnh"
-                ).add_to(m)
-            
-            legend_html = f"""
-            <div style="position: fixed; bottom: 50px; left: 50px; width: 240px;
-                        background: linear-gradient(135deg, white 0%, #f8f9fa 100%);
-                        border: 3px solid #0067C0; z-index: 9999;
-                        border-radius: 12px; padding: 20px; font-family: 'Segoe UI';
-                        box-shadow: 0 8px 24px rgba(0,103,192,0.3);">
-                <h3 style="margin: 0 0 14px 0; color: #0067C0; font-size: 18px; font-weight: 600;">
-                    📍 GeoSnap Map
-                </h3>
-                <p style="margin: 8px 0; font-size: 11pt; color: #333;">🔴 Ảnh đầu tiên</p>
-                <p style="margin: 8px 0; font-size: 11pt; color: #333;">🔵 Ảnh ở giữa</p>
-                <p style="margin: 8px 0; font-size: 11pt; color: #333;">🟢 Ảnh cuối cùng</p>
-                <hr style="margin: 14px 0; border: 1px solid #e0e0e0;">
-                <p style="margin: 8px 0; font-weight: 600; font-size: 12pt; color: #0067C0;">
-                    📊 Tổng: {len(gps_images)} ảnh
-                </p>
-            </div>
-            """
-            m.get_root().html.add_child(folium.Element(legend_html))
-            
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.html', mode='w', encoding='utf-8')
-            m.save(temp_file.name)
-            temp_file.close()
-            
-            webbrowser.open('file://' + os.path.abspath(temp_file.name))
+            m = self.library.route_map(self.image_list, self.show_progress)
+            self.update_list_status()
+            if m is None:
+                QMessageBox.information(self, "Thông báo", "Không có ảnh nào có GPS")
+                return
             
-            # Removed success message dialog
+            webbrowser.open('file://' + save_map(m))
             
         except Exception as e:
             QMessageBox.warning(self, "Lỗi", f"Không thể tạo bản đồ:\n{str(e)}")
@@ -2305,8 +2172,7 @@ QMessageBox QPushButton {
             self.image_list.clear()
             self.filtered_list.clear()
             self.display_list.clear()
-            self.gps_cache.clear()
-            self.exif_cache.clear()
+            self.library.clear()
             self.current_index = -1
             self.current_gps = None
             self.is_filtered = False
@@ -2420,6 +2286,9 @@ def main():
     
     window.show()
     
+    # Import the heavy optional modules in the background once the window is up
+    QTimer.singleShot(500, warm)
+    
     sys.exit(app.exec())
 
 
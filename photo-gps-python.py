@@ -6,35 +6,29 @@ import os
 import tempfile
 import datetime
 
-# Import thư viện
-try:
-    import exifread
-    EXIFREAD_AVAILABLE = True
-except ImportError:
-    EXIFREAD_AVAILABLE = False
+from geosnap.lazy import EXIFREAD, HEIF, FOLIUM, GEOPY, ensure_opener, warm
+from geosnap.cache import Cache, Failed
+from geosnap.core import Library, save_map
+from geosnap.maps import route_map
+from PIL import Image, ExifTags, ImageTk, ImageOps
+
+# Import thư viện: chỉ kiểm tra ở đây, mỗi thư viện được nạp khi dùng lần đầu
+exifread = EXIFREAD
+folium = FOLIUM
+EXIFREAD_AVAILABLE = EXIFREAD.available
+if not EXIFREAD_AVAILABLE:
     print("⚠️ exifread chưa cài: pip install exifread")
 
-try:
-    from PIL import Image, ExifTags, ImageTk, ImageOps
-    from pillow_heif import register_heif_opener
-    register_heif_opener()
-    HEIC_SUPPORTED = True
-except ImportError:
-    HEIC_SUPPORTED = False
+HEIC_SUPPORTED = HEIF.available
+if not HEIC_SUPPORTED:
     print("⚠️ HEIC chưa hỗ trợ: pip install pillow pillow-heif")
 
-try:
-    import folium
-    FOLIUM_AVAILABLE = True
-except ImportError:
-    FOLIUM_AVAILABLE = False
+FOLIUM_AVAILABLE = FOLIUM.available
+if not FOLIUM_AVAILABLE:
     print("⚠️ folium chưa cài: pip install folium")
 
-try:
-    from geopy.geocoders import Nominatim
-    GEOPY_AVAILABLE = True
-except ImportError:
-    GEOPY_AVAILABLE = False
+GEOPY_AVAILABLE = GEOPY.available
+if not GEOPY_AVAILABLE:
     print("⚠️ geopy chưa cài: pip install geopy")
 
 class ImageViewer:
@@ -92,6 +86,7 @@ class ImageViewer:
     
     def load_image(self, file_path):
         try:
+            ensure_opener(file_path)
             self.original_image = Image.open(file_path)
             self.rotation = 0
             self.flip_h = False
@@ -279,8 +274,8 @@ class PhotoGPSViewer:
         self.current_index = -1
         self.current_image_data = None
         self.map_file = None
-        self.gps_cache = {}
-        self.exif_cache = {}
+        self.library = Library()  # metadata, caches, sort/filter engine
+        self.address_cache = Cache(max_size=2000)  # (lat, lon) -> địa chỉ, Failed(lỗi)
         
         # Advanced features
         self.filtered_list = []  # For search/filter
@@ -558,11 +553,14 @@ class PhotoGPSViewer:
     
     def load_images(self, paths):
         added = 0
+        known = set(self.image_list)
         for p in paths:
-            if p not in self.image_list:
+            if p not in known:
+                known.add(p)
                 self.image_list.append(p)
                 added += 1
         if added > 0:
+            self.library.add(self.image_list[-added:])
             if added > 20:
                 self.list_status.config(text=f"⏳ Đang sắp xếp {added} ảnh...")
                 self.root.update()
@@ -585,36 +583,13 @@ class PhotoGPSViewer:
             self.list_status.config(text="⏳ Đang sắp xếp...")
             self.root.update()
         
-        if sort_by == "name":
-            self.image_list.sort(key=lambda x: os.path.basename(x).lower())
-        elif sort_by in ["date_desc", "date_asc"]:
-            def get_date(p):
-                if p in self.exif_cache:
-                    tags = self.exif_cache[p]
-                else:
-                    try:
-                        if EXIFREAD_AVAILABLE:
-                            with open(p, 'rb') as f:
-                                tags = exifread.process_file(f, details=False, stop_tag='DateTimeOriginal')
-                            self.exif_cache[p] = tags
-                        else:
-                            tags = {}
-                    except:
-                        tags = {}
-                if 'EXIF DateTimeOriginal' in tags:
-                    return str(tags['EXIF DateTimeOriginal'])
-                return str(os.path.getmtime(p))
-            self.image_list.sort(key=get_date, reverse=(sort_by == "date_desc"))
-        elif sort_by == "size":
-            self.image_list.sort(key=lambda x: os.path.getsize(x), reverse=True)
-        elif sort_by == "type":
-            self.image_list.sort(key=lambda x: os.path.splitext(x)[1].lower())
+        self.image_list = self.library.sort(self.image_list, sort_by, self.show_progress)
         
         # Update display based on current state
         if self.is_filtered:
             # Re-apply filter on sorted list
-            temp_filtered = [p for p in self.image_list if p in self.filtered_list]
-            self.filtered_list = temp_filtered
+            keep = set(self.filtered_list)
+            self.filtered_list = [p for p in self.image_list if p in keep]
             
             # Re-apply search if active
             if current_search:
@@ -707,41 +682,13 @@ class PhotoGPSViewer:
             size /= 1024
         return f"{size:.1f} TB"
     
-    def get_gps_data_cached(self, path):
-        if path in self.gps_cache:
-            return self.gps_cache[path]
-        data = self.get_gps_data(path)
-        self.gps_cache[path] = data
-        return data
+    def show_progress(self, done, total):
+        """Tiến độ đọc EXIF cho các thao tác của thư viện"""
+        self.list_status.config(text=f"⏳ Đang đọc EXIF... {done}/{total}", bg='#fef3c7')
+        self.root.update_idletasks()
     
-    def get_gps_data(self, path):
-        if EXIFREAD_AVAILABLE:
-            try:
-                with open(path, 'rb') as f:
-                    tags = exifread.process_file(f, details=False)
-                if 'GPS GPSLatitude' in tags and 'GPS GPSLongitude' in tags:
-                    def to_deg(val):
-                        d = float(val.values[0].num) / float(val.values[0].den)
-                        m = float(val.values[1].num) / float(val.values[1].den)
-                        s = float(val.values[2].num) / float(val.values[2].den)
-                        return d + m/60 + s/3600
-                    lat = to_deg(tags['GPS GPSLatitude'])
-                    if 'GPS GPSLatitudeRef' in tags and str(tags['GPS GPSLatitudeRef']) == 'S':
-                        lat = -lat
-                    lon = to_deg(tags['GPS GPSLongitude'])
-                    if 'GPS GPSLongitudeRef' in tags and str(tags['GPS GPSLongitudeRef']) == 'W':
-                        lon = -lon
-                    alt = 'N/A'
-                    if 'GPS GPSAltitude' in tags:
-                        v = tags['GPS GPSAltitude'].values[0]
-                        alt = f"{float(v.num)/float(v.den):.1f} m"
-                    dt = 'N/A'
-                    if 'EXIF DateTimeOriginal' in tags:
-                        dt = str(tags['EXIF DateTimeOriginal'])
-                    return {'lat': lat, 'lon': lon, 'alt': alt, 'time': dt}
-            except:
-                pass
-        return None
+    def get_gps_data_cached(self, path):
+        return self.library.gps(path)
     
     def display_gps(self):
         if self.current_image_data:
@@ -762,12 +709,7 @@ class PhotoGPSViewer:
         try:
             if not EXIFREAD_AVAILABLE:
                 return
-            if path in self.exif_cache:
-                tags = self.exif_cache[path]
-            else:
-                with open(path, 'rb') as f:
-                    tags = exifread.process_file(f, details=False)
-                self.exif_cache[path] = tags
+            tags = self.library.exif(path)
             
             make = str(tags.get('Image Make', '')).strip()
             model = str(tags.get('Image Model', '')).strip()
@@ -826,15 +768,19 @@ class PhotoGPSViewer:
         if not self.current_image_data or not GEOPY_AVAILABLE:
             self.addr_label.config(text="Không có dịch vụ")
             return
-        try:
-            geo = Nominatim(user_agent="gps_viewer", timeout=10)
-            loc = geo.reverse(f"{self.current_image_data['lat']}, {self.current_image_data['lon']}", language='vi')
-            if loc:
-                self.addr_label.config(text=loc.address)
-            else:
-                self.addr_label.config(text="Không tìm thấy")
-        except Exception as e:
-            self.addr_label.config(text=f"Lỗi: {str(e)[:30]}")
+        lat, lon = self.current_image_data['lat'], self.current_image_data['lon']
+        key = (round(lat, 5), round(lon, 5))
+        address = self.address_cache.get(key)
+        if address is None:
+            try:
+                geo = GEOPY.Nominatim(user_agent="gps_viewer", timeout=10)
+                loc = geo.reverse(f"{lat}, {lon}", language='vi')
+                address = loc.address if loc else "Không tìm thấy"
+            except Exception as e:
+                # Lỗi được nhớ trong chốc lát để không gọi lại dịch vụ liên tục
+                address = Failed(f"Lỗi: {str(e)[:30]}")
+            self.address_cache[key] = address
+        self.addr_label.config(text=address.error if isinstance(address, Failed) else address)
     
     def create_map(self):
         if not FOLIUM_AVAILABLE or not self.current_image_data:
@@ -966,8 +912,7 @@ class PhotoGPSViewer:
             self.listbox.delete(0, tk.END)
             self.current_index = -1
             self.current_image_data = None
-            self.gps_cache.clear()
-            self.exif_cache.clear()
+            self.library.clear()
             self.image_viewer.show_placeholder()
             for lbl in self.file_info_labels.values():
                 lbl.config(text="--")
@@ -1029,20 +974,8 @@ class PhotoGPSViewer:
         self.list_status.config(text="⏳ Đang lọc...", bg='#fef3c7')
         self.root.update_idletasks()
         
-        self.filtered_list = []
-        total = len(self.image_list)
-        
-        for i, p in enumerate(self.image_list):
-            # Progress indicator every 10 items
-            if i % 10 == 0 and total > 50:
-                self.list_status.config(text=f"⏳ Đang lọc... {i}/{total}")
-                self.root.update_idletasks()
-            
-            gps = self.get_gps_data_cached(p)
-            if filter_type == 'has_gps' and gps:
-                self.filtered_list.append(p)
-            elif filter_type == 'no_gps' and not gps:
-                self.filtered_list.append(p)
+        self.filtered_list = self.library.filter_gps(self.image_list, filter_type == 'has_gps',
+                                                     self.show_progress)
         
         filter_name = "có GPS" if filter_type == 'has_gps' else "không có GPS"
         self.is_filtered = True
@@ -1067,30 +1000,7 @@ class PhotoGPSViewer:
         self.list_status.config(text="⏳ Đang tải camera...", bg='#fef3c7')
         self.root.update_idletasks()
 
-        cameras = set()
-        total = len(self.image_list)
-
-        for i, p in enumerate(self.image_list):
-            # Progress every 10 items for large lists
-            if i % 10 == 0 and total > 50:
-                self.list_status.config(text=f"⏳ Đang quét... {i}/{total}")
-                self.root.update_idletasks()
-            # Load EXIF nếu chưa có
-            if p not in self.exif_cache:
-                try:
-                    if EXIFREAD_AVAILABLE:
-                        with open(p, 'rb') as f:
-                            tags = exifread.process_file(f, details=False)
-                        self.exif_cache[p] = tags
-                except:
-                    self.exif_cache[p] = {}
-            if p in self.exif_cache:
-                tags = self.exif_cache[p]
-                make = str(tags.get('Image Make', '')).strip()
-                model = str(tags.get('Image Model', '')).strip()
-                camera = f"{make} {model}".strip()
-                if camera:
-                    cameras.add(camera)
+        cameras = self.library.cameras(self.image_list, self.show_progress)
         
         if not cameras:
             messagebox.showinfo("Thông báo", "Không tìm thấy thông tin camera")
@@ -1116,15 +1026,7 @@ class PhotoGPSViewer:
             if sel:
                 selected_cam = listbox.get(sel[0])
                 self.current_filter_camera = selected_cam
-                self.filtered_list = []
-                for p in self.image_list:
-                    if p in self.exif_cache:
-                        tags = self.exif_cache[p]
-                        make = str(tags.get('Image Make', '')).strip()
-                        model = str(tags.get('Image Model', '')).strip()
-                        camera = f"{make} {model}".strip()
-                        if camera == selected_cam:
-                            self.filtered_list.append(p)
+                self.filtered_list = self.library.filter_camera(self.image_list, selected_cam)
                 
                 self.is_filtered = True
                 self.update_listbox(self.filtered_list)
@@ -1177,79 +1079,15 @@ class PhotoGPSViewer:
         self.list_status.config(text="⏳ Đang tạo bản đồ...")
         self.root.update()
         
-        gps_images = []
-        for p in self.image_list:
-            gps = self.get_gps_data_cached(p)
-            if gps:
-                gps_images.append((p, gps))
-        
-        if not gps_images:
-            messagebox.showinfo("Thông báo", "Không có ảnh nào có GPS")
-            self.update_list_status()
-            return
-        
         try:
-            # Calculate center
-            lats = [g['lat'] for _, g in gps_images]
-            lons = [g['lon'] for _, g in gps_images]
-            center_lat = sum(lats) / len(lats)
-            center_lon = sum(lons) / len(lons)
-            
-            # Create map
-            m = folium.Map(location=[center_lat, center_lon], zoom_start=12)
-            
-            # Add markers
-            for i, (path, gps) in enumerate(gps_images, 1):
-                popup_html = f"""
-                <div style='width:200px'>
-                <b>#{i} - {os.path.basename(path)}</b><br>
-                <b>Tọa độ:</b> {gps['lat']:.6f}, {gps['lon']:.6f}<br>
-                <b>Độ cao:</b> {gps['alt']}<br>
-                <b>Thời gian:</b> {gps['time'][:16] if len(gps['time']) > 16 else gps['time']}
-                </div>
-                """
-                
-                # Use different colors for markers
-                color = 'red' if i == 1 else ('green' if i == len(gps_images) else 'blue')
-                
-                folium.Marker(
-                    [gps['lat'], gps['lon']],
-                    popup=folium.Popup(popup_html, max_width=250),
-                    tooltip=f"#{i} - {os.path.basename(path)[:20]}",
-                    icon=folium.Icon(color=color, icon='camera', prefix='fa')
-                ).add_to(m)
-            
-            # Add polyline if more than 1 point (route)
-            if len(gps_images) > 1:
-                coordinates = [[g['lat'], g['lon']] for _, g in gps_images]
-                folium.PolyLine(
-                    coordinates,
-                    color='red',
-                    weight=2,
-                    opacity=0.7,
-                    popup=f"Route: {len(gps_images)} photos"
-                ).add_to(m)
-            
-            # Add legend
-            legend_html = f"""
-            <div style="position: fixed; bottom: 50px; left: 50px; width: 180px; 
-                        background-color: white; border:2px solid grey; z-index:9999; 
-                        font-size:14px; padding: 10px">
-            <b>📍 Bản đồ tổng quan</b><br>
-            🔴 Ảnh đầu tiên<br>
-            🔵 Ảnh ở giữa<br>
-            🟢 Ảnh cuối cùng<br>
-            📊 Tổng: {len(gps_images)} ảnh
-            </div>
-            """
-            m.get_root().html.add_child(folium.Element(legend_html))
+            gps_images = self.library.gps_photos(self.image_list, self.show_progress)
+            if not gps_images:
+                messagebox.showinfo("Thông báo", "Không có ảnh nào có GPS")
+                self.update_list_status()
+                return
             
             # Save and open
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.html', mode='w', encoding='utf-8')
-            m.save(temp_file.name)
-            temp_file.close()
-            
-            webbrowser.open('file://' + os.path.abspath(temp_file.name))
+            webbrowser.open('file://' + save_map(route_map(gps_images)))
             
             self.update_list_status()
             messagebox.showinfo("Thành công", f"Đã tạo bản đồ với {len(gps_images)} ảnh!")
@@ -1267,6 +1105,8 @@ def main():
     except:
         root = tk.Tk()
     app = PhotoGPSViewer(root)
+    # Nạp các thư viện nặng ở nền sau khi cửa sổ đã hiện
+    root.after(500, warm)
     root.mainloop()
 
 if __name__ == "__main__":